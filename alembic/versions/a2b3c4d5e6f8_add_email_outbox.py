@@ -0,0 +1,51 @@
+"""add email outbox
+
+Revision ID: a2b3c4d5e6f8
+Revises: f7a8b9c0d1e2
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "a2b3c4d5e6f8"
+down_revision = "f7a8b9c0d1e2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "email_outbox",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("recipients", sa.JSON(), nullable=False),
+        sa.Column("subject", sa.String(length=256), nullable=False),
+        sa.Column("body_html", sa.Text(), nullable=False, server_default=""),
+        sa.Column("body_text", sa.Text(), nullable=True),
+        sa.Column("status", sa.String(length=16), nullable=False, server_default="pending"),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column(
+            "next_attempt_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("last_error", sa.String(length=512), nullable=True),
+        sa.Column("source", sa.String(length=64), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("sent_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_email_outbox_status_next_attempt", "email_outbox", ["status", "next_attempt_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_email_outbox_status_next_attempt", table_name="email_outbox")
+    op.drop_table("email_outbox")
@@ -0,0 +1,44 @@
+"""notify hubex_execution_runs on claimable execution runs
+
+Revision ID: a8b9c0d1e2f5
+Revises: f7a8b9c0d1e4
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+
+revision = "a8b9c0d1e2f5"
+down_revision = "f7a8b9c0d1e4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # Payload is the definition id: workers long-polling claim-next for that
+    # definition wake up on new runs and on runs released by another worker.
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION execution_runs_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('hubex_execution_runs', NEW.definition_id::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER execution_runs_notify AFTER INSERT OR UPDATE OF claimed_by ON execution_runs
+        FOR EACH ROW WHEN (NEW.status = 'requested' AND NEW.claimed_by IS NULL)
+        EXECUTE FUNCTION execution_runs_notify()
+        """
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("DROP TRIGGER IF EXISTS execution_runs_notify ON execution_runs")
+    op.execute("DROP FUNCTION IF EXISTS execution_runs_notify()")
@@ -0,0 +1,25 @@
+"""add fencing token to event checkpoints
+
+Revision ID: b3c4d5e6f7a9
+Revises: a2b3c4d5e6f8
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "b3c4d5e6f7a9"
+down_revision = "a2b3c4d5e6f8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "events_v1_checkpoints",
+        sa.Column("fence", sa.BigInteger(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("events_v1_checkpoints", "fence")
@@ -0,0 +1,43 @@
+"""notify hubex_agent_commands on queued agent commands
+
+Revision ID: b9c0d1e2f3a6
+Revises: a8b9c0d1e2f5
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+
+revision = "b9c0d1e2f3a6"
+down_revision = "a8b9c0d1e2f5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # Payload is the device id: long-polling /agent/heartbeat calls of that
+    # device wake up in every process (replaces the Redis wake-up channel).
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION agent_commands_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('hubex_agent_commands', NEW.device_id::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER agent_commands_notify AFTER INSERT ON agent_commands
+        FOR EACH ROW WHEN (NEW.status = 'pending') EXECUTE FUNCTION agent_commands_notify()
+        """
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("DROP TRIGGER IF EXISTS agent_commands_notify ON agent_commands")
+    op.execute("DROP FUNCTION IF EXISTS agent_commands_notify()")
@@ -0,0 +1,23 @@
+"""index devices.last_seen_at for the presence tracker
+
+Revision ID: c0d1e2f3a4b7
+Revises: b9c0d1e2f3a6
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+
+revision = "c0d1e2f3a4b7"
+down_revision = "b9c0d1e2f3a6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Without Redis the presence tracker picks up reports by
+    # last_seen_at >= its previous cycle, so the read is O(reports).
+    op.create_index("ix_devices_last_seen_at", "devices", ["last_seen_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_devices_last_seen_at", table_name="devices")
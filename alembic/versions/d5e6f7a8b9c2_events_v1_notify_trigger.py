@@ -0,0 +1,43 @@
+"""notify hubex_events on events_v1 inserts
+
+Revision ID: d5e6f7a8b9c2
+Revises: c4d5e6f7a8b1
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+
+revision = "d5e6f7a8b9c2"
+down_revision = "c4d5e6f7a8b1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # Payload is the stream name: NOTIFY folds identical payloads of one
+    # transaction, so a batch of events wakes each stream's listeners once.
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION events_v1_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('hubex_events', NEW.stream);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER events_v1_notify AFTER INSERT ON events_v1
+        FOR EACH ROW EXECUTE FUNCTION events_v1_notify()
+        """
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("DROP TRIGGER IF EXISTS events_v1_notify ON events_v1")
+    op.execute("DROP FUNCTION IF EXISTS events_v1_notify()")
@@ -0,0 +1,68 @@
+"""add fleet jobs
+
+Revision ID: e6f7a8b9c0d3
+Revises: d5e6f7a8b9c2
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "e6f7a8b9c0d3"
+down_revision = "d5e6f7a8b9c2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "fleet_jobs",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("name", sa.String(length=128), nullable=False),
+        sa.Column("task_type", sa.String(length=64), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("priority", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("target", sa.JSON(), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False, server_default="running"),
+        sa.Column("max_in_flight", sa.Integer(), nullable=True),
+        sa.Column("rate_per_minute", sa.Integer(), nullable=True),
+        sa.Column("abort_failure_percent", sa.Integer(), nullable=True),
+        sa.Column("total", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("dispatched", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("succeeded", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("failed", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("canceled", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("cursor_device_id", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("exhausted", sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column("window_started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("window_dispatched", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("org_id", sa.Integer(), nullable=True),
+        sa.Column("created_by", sa.Integer(), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("completed_at", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["org_id"], ["organizations.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_fleet_jobs_status", "fleet_jobs", ["status"])
+    op.create_index("ix_fleet_jobs_org_id", "fleet_jobs", ["org_id"])
+
+    op.add_column("tasks", sa.Column("fleet_job_id", sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        "fk_tasks_fleet_job_id", "tasks", "fleet_jobs", ["fleet_job_id"], ["id"], ondelete="SET NULL",
+    )
+    op.create_index("ix_tasks_fleet_job_status", "tasks", ["fleet_job_id", "status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_tasks_fleet_job_status", table_name="tasks")
+    op.drop_constraint("fk_tasks_fleet_job_id", "tasks", type_="foreignkey")
+    op.drop_column("tasks", "fleet_job_id")
+    op.drop_index("ix_fleet_jobs_org_id", table_name="fleet_jobs")
+    op.drop_index("ix_fleet_jobs_status", table_name="fleet_jobs")
+    op.drop_table("fleet_jobs")
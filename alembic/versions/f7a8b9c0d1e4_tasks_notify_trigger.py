@@ -0,0 +1,43 @@
+"""notify hubex_tasks on queued task inserts
+
+Revision ID: f7a8b9c0d1e4
+Revises: e6f7a8b9c0d3
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+
+revision = "f7a8b9c0d1e4"
+down_revision = "e6f7a8b9c0d3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # Payload is the device id: a fleet job batch notifies each device once,
+    # and long-polling /tasks/poll calls of that device wake up.
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION tasks_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('hubex_tasks', NEW.client_id::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER tasks_notify AFTER INSERT ON tasks
+        FOR EACH ROW WHEN (NEW.status = 'queued') EXECUTE FUNCTION tasks_notify()
+        """
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("DROP TRIGGER IF EXISTS tasks_notify ON tasks")
+    op.execute("DROP FUNCTION IF EXISTS tasks_notify()")
@@ -1,8 +1,18 @@
 ﻿from typing import AsyncGenerator
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.session import AsyncSessionLocal
+from app.db.session import AsyncSessionLocal, ReadSessionLocal
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
         yield session
+
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """Session for read-only endpoints; served by the replica when configured.
+
+    Replica data may lag the primary slightly — never use it for a read that
+    must observe the caller's own write.
+    """
+    async with ReadSessionLocal() as session:
+        yield session
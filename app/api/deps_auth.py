@@ -1,9 +1,10 @@
-from fastapi import Depends, HTTPException, Security
+from fastapi import Depends, HTTPException, Request, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, APIKeyHeader
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from app.api.deps import get_db
+from app.core.asgi import set_request_org
 from app.core.security import decode_access_token, AuthTokenError, hash_device_token
 from app.core.token_revoke import is_token_revoked
 from app.db.models.user import User
@@ -46,10 +47,7 @@ async def get_current_user(
 async def get_current_user_id(user: User = Depends(get_current_user)) -> int:
     return user.id
 
-async def get_current_device(
-    device_token: str | None = Security(device_token_header),
-    db: AsyncSession = Depends(get_db),
-) -> Device:
+async def device_from_token(device_token: str | None, db: AsyncSession) -> Device:
     if not device_token:
         _auth_error("missing device token")
 
@@ -66,3 +64,15 @@ async def get_current_device(
         _auth_error("device unclaimed")
 
     return device
+
+
+async def get_current_device(
+    request: Request,
+    device_token: str | None = Security(device_token_header),
+    db: AsyncSession = Depends(get_db),
+) -> Device:
+    device = await device_from_token(device_token, db)
+    # No org claim in device tokens: cached reads of the device's org are
+    # invalidated when this request writes
+    set_request_org(request.scope, device.org_id)
+    return device
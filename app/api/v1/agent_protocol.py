@@ -3,24 +3,33 @@
 Lightweight endpoints for agent devices to:
   - Register/handshake
   - Send heartbeat
-  - Receive pending commands
+  - Receive pending commands (piggy-backed on the heartbeat, optionally
+    long-polled) and acknowledge them
+
+Operators queue commands via /devices/{device_id}/commands (command_router).
+Queue semantics live in app.core.agent_commands.
 
 These complement the telemetry endpoint for agent-specific operations.
 """
 
+import time
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Any, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
-from sqlalchemy import select, update
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+from sqlalchemy import desc, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
-from app.api.deps_auth import get_current_device
+from app.api.deps_auth import get_current_device, get_current_user
+from app.core import agent_commands, presence
+from app.db.models.agent_commands import AgentCommandEntry
 from app.db.models.device import Device
+from app.db.models.user import User
 
 router = APIRouter(prefix="/agent", tags=["agent"])
+command_router = APIRouter(prefix="/devices", tags=["agent"])
 
 
 class AgentHandshakeRequest(BaseModel):
@@ -39,13 +48,24 @@ class AgentHandshakeResponse(BaseModel):
     telemetry_interval: int = 60
 
 
+class AgentCommandAck(BaseModel):
+    id: int
+    ok: bool = True
+    result: Optional[dict[str, Any]] = None
+    error: Optional[str] = Field(default=None, max_length=512)
+    retry: bool = False  # nack only: deliver again after a backoff
+
+
 class AgentHeartbeatRequest(BaseModel):
     uptime: float = 0
     status: str = "alive"
+    # Long-poll: hold the response until a command is queued (capped)
+    wait_seconds: float = Field(default=0, ge=0)
+    acks: list[AgentCommandAck] = Field(default=[], max_length=agent_commands.MAX_COMMANDS_PER_HEARTBEAT * 5)
 
 
 class AgentCommand(BaseModel):
-    id: str
+    id: int
     type: str
     payload: dict = {}
 
@@ -64,10 +84,10 @@ async def agent_handshake(
 ) -> AgentHandshakeResponse:
     """Agent registration handshake. Called once on startup."""
     # Update device metadata
-    device.last_seen_at = datetime.now(timezone.utc)
+    presence.touch(device.id)
     if not device.device_type or device.device_type == "unknown":
         device.device_type = "agent"
-    await db.commit()
+        await db.commit()
 
     return AgentHandshakeResponse(
         status="connected",
@@ -82,13 +102,150 @@ async def agent_heartbeat(
     db: AsyncSession = Depends(get_db),
     device: Device = Depends(get_current_device),
 ) -> AgentHeartbeatResponse:
-    """Agent heartbeat. Called periodically to keep device online."""
-    device.last_seen_at = datetime.now(timezone.utc)
-    await db.commit()
+    """Agent heartbeat. Called periodically to keep device online.
+
+    Applies the piggy-backed acks and returns the commands now due. With
+    wait_seconds > 0 and nothing due, the call is held (without a DB
+    connection) until a command is queued or the wait runs out.
+    """
+    device_id = device.id
+    presence.touch(device_id)
+
+    for ack in body.acks:
+        await agent_commands.complete_command(
+            db, device_id, ack.id, ok=ack.ok, result=ack.result, error=ack.error, retry=ack.retry,
+        )
+
+    deadline = time.monotonic() + min(body.wait_seconds, agent_commands.LONG_POLL_MAX_SECONDS)
+    # Subscribed before the first claim: a command queued in between still wakes us
+    with agent_commands.subscribe(device_id) as wake:
+        while True:
+            commands = await agent_commands.claim_commands(db, device_id)
+            await db.commit()
+            remaining = deadline - time.monotonic()
+            if commands or remaining <= 0:
+                break
+            await wake.wait(min(remaining, agent_commands.recheck_interval()))
 
-    # Future: return pending commands from a queue
     return AgentHeartbeatResponse(
         ack=True,
-        commands=[],
+        commands=[AgentCommand(**cmd) for cmd in commands],
         config={},
     )
+
+
+@router.post("/commands/{command_id}/ack")
+async def agent_command_ack(
+    command_id: int,
+    body: AgentCommandAck,
+    db: AsyncSession = Depends(get_db),
+    device: Device = Depends(get_current_device),
+) -> dict:
+    """Acknowledge (or nack) one command outside the heartbeat."""
+    row = await agent_commands.complete_command(
+        db, device.id, command_id, ok=body.ok, result=body.result, error=body.error, retry=body.retry,
+    )
+    if row is None:
+        raise HTTPException(status_code=404, detail="command not found")
+    status = row.status
+    await db.commit()
+    return {"id": command_id, "status": status}
+
+
+# ---------------------------------------------------------------------------
+# Operator side: queue and inspect commands
+# ---------------------------------------------------------------------------
+
+class AgentCommandCreate(BaseModel):
+    type: str = Field(min_length=1, max_length=64)
+    payload: dict[str, Any] = {}
+    ttl_seconds: Optional[int] = Field(default=None, ge=1, le=30 * 86400)
+    max_attempts: int = Field(default=5, ge=1, le=20)
+
+
+class AgentCommandOut(BaseModel):
+    id: int
+    device_id: int
+    type: str
+    payload: dict
+    status: str
+    attempts: int
+    max_attempts: int
+    result: Optional[dict] = None
+    last_error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    delivered_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+    model_config = {"from_attributes": True}
+
+
+async def _get_owned_device(device_id: int, db: AsyncSession, user: User) -> Device:
+    res = await db.execute(
+        select(Device).where(Device.id == device_id, Device.owner_user_id == user.id)
+    )
+    device = res.scalar_one_or_none()
+    if device is None:
+        raise HTTPException(status_code=404, detail="device not found")
+    return device
+
+
+@command_router.post("/{device_id}/commands", response_model=AgentCommandOut, status_code=201)
+async def create_agent_command(
+    device_id: int,
+    body: AgentCommandCreate,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user),
+) -> AgentCommandOut:
+    """Queue a command; delivered with the device's next heartbeat."""
+    await _get_owned_device(device_id, db, user)
+    row = await agent_commands.enqueue_command(
+        db, device_id, body.type, body.payload,
+        ttl_seconds=body.ttl_seconds, max_attempts=body.max_attempts, created_by=user.id,
+    )
+    await db.commit()
+    await db.refresh(row)
+    return AgentCommandOut.model_validate(row)
+
+
+@command_router.get("/{device_id}/commands", response_model=list[AgentCommandOut])
+async def list_agent_commands(
+    device_id: int,
+    status: Optional[str] = Query(default=None),
+    limit: int = Query(default=50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user),
+) -> list[AgentCommandOut]:
+    await _get_owned_device(device_id, db, user)
+    stmt = select(AgentCommandEntry).where(AgentCommandEntry.device_id == device_id)
+    if status:
+        stmt = stmt.where(AgentCommandEntry.status == status)
+    res = await db.execute(stmt.order_by(desc(AgentCommandEntry.id)).limit(limit))
+    return [AgentCommandOut.model_validate(row) for row in res.scalars().all()]
+
+
+@command_router.post("/{device_id}/commands/{command_id}/cancel", response_model=AgentCommandOut)
+async def cancel_agent_command(
+    device_id: int,
+    command_id: int,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user),
+) -> AgentCommandOut:
+    """Cancel a command that has not been acknowledged yet."""
+    await _get_owned_device(device_id, db, user)
+    res = await db.execute(
+        select(AgentCommandEntry)
+        .where(AgentCommandEntry.id == command_id, AgentCommandEntry.device_id == device_id)
+        .with_for_update()
+    )
+    row = res.scalar_one_or_none()
+    if row is None:
+        raise HTTPException(status_code=404, detail="command not found")
+    if row.status not in agent_commands.OPEN_STATUSES:
+        raise HTTPException(status_code=409, detail=f"command already {row.status}")
+    row.status = "cancelled"
+    row.completed_at = datetime.now(timezone.utc)
+    await db.commit()
+    await db.refresh(row)
+    return AgentCommandOut.model_validate(row)
@@ -5,7 +5,7 @@ from pydantic import BaseModel, ConfigDict, Field
 from sqlalchemy import select, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_db
+from app.api.deps import get_db, get_read_db
 from app.db.models.audit import AuditV1Entry
 
 router = APIRouter(prefix="/audit", tags=["audit"])
@@ -58,7 +58,7 @@ async def get_audit_entry(
 async def export_audit(
     limit: int = Query(1000, le=10000),
     format: str = Query("csv"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """Export audit log as CSV or JSON."""
     import csv
@@ -18,7 +18,7 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_db
+from app.api.deps import get_db, get_read_db
 from app.api.deps_org import get_current_org_id
 from app.db.models.automation import AutomationFireLog, AutomationRule, AutomationStep
 from app.db.models.semantic_type import TriggerTemplate, SemanticType
@@ -245,7 +245,7 @@ async def test_automation(
 @router.get("/automations/{rule_id}/history", response_model=list[AutomationFireLogOut])
 async def get_automation_history(
     rule_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     org_id: int = Depends(get_current_org_id),
 ) -> list[AutomationFireLog]:
     # Verify ownership
@@ -2,7 +2,7 @@ from datetime import datetime, timezone, timedelta
 import secrets
 from typing import Any, Dict, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from pydantic import BaseModel, Field, ConfigDict
 from sqlalchemy import select, desc, update, or_, delete
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -10,6 +10,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.api.deps import get_db
 from app.api.deps_auth import get_current_device, get_current_user
 from app.api.deps_org import get_current_org_id
+from app.core import fleet_jobs, presence
+from app.core.asgi import set_request_org
+from app.core.cache import cache_rule
 from app.core.security import hash_device_token
 from app.core.system_events import emit_system_event
 from app.db.models.device import Device
@@ -41,6 +44,7 @@ from app.api.v1.device_state import (
 from app.schemas.taskcam import CurrentTaskOut, TaskHistoryItemOut
 
 router = APIRouter(prefix="/devices", tags=["devices"])
+cache_rule(router, "devices", ttl=5, invalidates=("metrics",))
 
 
 def _ensure_utc(dt: datetime) -> datetime:
@@ -169,6 +173,7 @@ class UserTaskCancelOut(BaseModel):
 @router.post("/hello", response_model=DeviceHelloOut)
 async def hello(
     data: DeviceHelloIn,
+    request: Request,
     db: AsyncSession = Depends(get_db),
     org_id: int | None = Depends(get_current_org_id),
 ):
@@ -204,6 +209,8 @@ async def hello(
 
     await db.commit()
     await db.refresh(device)
+    presence.touch(device.id, now)
+    set_request_org(request.scope, device.org_id)
 
     claimed = device.owner_user_id is not None
     return DeviceHelloOut(device_id=device.id, claimed=claimed)
@@ -214,8 +221,7 @@ async def whoami(
     device: Device = Depends(get_current_device),
     db: AsyncSession = Depends(get_db),
 ):
-    device.last_seen_at = datetime.now(timezone.utc)
-    await db.commit()
+    presence.touch(device.id)
     return {
         "id": device.id,
         "device_uid": device.device_uid,
@@ -257,7 +263,7 @@ async def list_devices(
     include_unclaimed: bool = Query(False),
 ):
     now = datetime.now(timezone.utc)
-    online_window = timedelta(seconds=300)  # must match health "ok" threshold
+    online_window = timedelta(seconds=300)  # without Redis; matches health "ok"
     if include_unclaimed:
         if not _is_admin(user):
             raise_api_error(403, "DEVICE_LIST_FORBIDDEN", "include_unclaimed requires admin")
@@ -275,6 +281,8 @@ async def list_devices(
     device_ids = [device.id for device in devices]
     active_pairing_uids = await fetch_pairing_active_uids(db, device_uids, now)
     busy_ids = await fetch_busy_device_ids(db, device_ids, now)
+    # The presence tracker's online set; None without Redis
+    online_ids = await presence.online_devices(device_ids)
     out: list[DeviceListItem] = []
     for device in devices:
         last_seen = device.last_seen_at
@@ -287,7 +295,14 @@ async def list_devices(
                 health = "ok"
             elif age_seconds <= 900:
                 health = "stale"
-        online = bool(last_seen and (now - last_seen) <= online_window)
+        if online_ids is None:
+            online = bool(last_seen and (now - last_seen) <= online_window)
+        else:
+            online = device.id in online_ids
+            if online:
+                health = "ok"
+            elif health == "ok":
+                health = "stale"
         pairing_active = device.device_uid in active_pairing_uids
         busy = device.id in busy_ids
         state, claimed = derive_state(device, pairing_active, busy)
@@ -962,5 +977,7 @@ async def cancel_task_for_device(
     task.status = "canceled"
     task.completed_at = now
     task.error = "canceled by owner (force)" if was_in_flight and force else "canceled by owner"
+    if task.fleet_job_id is not None:
+        await fleet_jobs.record_task_result(db, task.fleet_job_id, "canceled")
     await db.commit()
     return UserTaskCancelOut(id=task.id, status=task.status, completed_at=task.completed_at)
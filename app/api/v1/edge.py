@@ -15,6 +15,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
 from app.api.deps_auth import get_current_device
+from app.core import presence
 from app.db.models.device import Device
 from app.db.models.tasks import Task
 from app.db.models.variables import VariableValue
@@ -89,8 +90,8 @@ async def edge_heartbeat(
 ):
     """Update device last_seen_at and optional firmware_version."""
     now = datetime.now(timezone.utc)
-    device.last_seen_at = now
-    if body.firmware_version is not None:
+    presence.touch(device.id, now)
+    if body.firmware_version is not None and body.firmware_version != device.firmware_version:
         device.firmware_version = body.firmware_version
-    await db.commit()
+        await db.commit()
     return HeartbeatOut(device_id=device.id, last_seen_at=now)
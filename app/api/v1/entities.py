@@ -2,19 +2,22 @@ from datetime import datetime, timezone
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel, Field, ConfigDict
-from sqlalchemy import select, delete
+from sqlalchemy import ARRAY, Integer, any_, bindparam, select, delete, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
 from app.api.deps_org import get_current_org_id
+from app.core.cache import cache_rule
+from app.core.health_worker import EntityHealth, entity_health
 from app.core.system_events import emit_system_event
 from app.db.models.device import Device
 from app.db.models.entities import Entity, EntityDeviceBinding
 
 router = APIRouter(prefix="/entities", tags=["entities"])
+cache_rule(router, "entities", ttl=5, invalidates=("metrics",))
 
-ONLINE_WINDOW_SECONDS = 30
-STALE_WINDOW_SECONDS = 120
+BULK_CHUNK = 5000  # bindings per multi-row INSERT (4 binds each, PG allows 32767)
 
 
 # ---------------------------------------------------------------------------
@@ -96,6 +99,14 @@ class BulkUnbindIn(BaseModel):
     model_config = ConfigDict(extra="ignore")
 
 
+class BulkUpdateIn(BaseModel):
+    device_ids: list[int] = Field(min_length=1)
+    priority: int | None = None
+    enabled: bool | None = None
+
+    model_config = ConfigDict(extra="ignore")
+
+
 class BulkOpResult(BaseModel):
     device_id: int
     ok: bool
@@ -127,14 +138,6 @@ async def _get_entity_or_404(entity_id: str, db: AsyncSession) -> Entity:
     return entity
 
 
-async def _get_device_or_404(device_id: int, db: AsyncSession) -> Device:
-    res = await db.execute(select(Device).where(Device.id == device_id))
-    device = res.scalar_one_or_none()
-    if device is None:
-        raise HTTPException(status_code=404, detail=f"device {device_id} not found")
-    return device
-
-
 async def _get_binding(entity_id: str, device_id: int, db: AsyncSession) -> EntityDeviceBinding | None:
     res = await db.execute(
         select(EntityDeviceBinding).where(
@@ -145,20 +148,29 @@ async def _get_binding(entity_id: str, device_id: int, db: AsyncSession) -> Enti
     return res.scalar_one_or_none()
 
 
-def _device_health_status(last_seen_at: datetime | None, now: datetime) -> str:
-    if last_seen_at is None:
-        return "offline"
-    if last_seen_at.tzinfo is None:
-        last_seen_at = last_seen_at.replace(tzinfo=timezone.utc)
-    age = (now - last_seen_at).total_seconds()
-    if age <= ONLINE_WINDOW_SECONDS:
-        return "ok"
-    if age <= STALE_WINDOW_SECONDS:
-        return "stale"
-    return "offline"
+def _id_in(db: AsyncSession, column, ids: list[int]):
+    """column = ANY(:ids) on PostgreSQL — one array bind, so the statement
+    text (and its prepared-statement cache entry) does not depend on the
+    number of ids; IN (...) elsewhere."""
+    if db.get_bind().dialect.name == "postgresql":
+        return column == any_(bindparam(None, ids, type_=ARRAY(Integer)))
+    return column.in_(ids)
 
 
-_HEALTH_RANK = {"offline": 0, "stale": 1, "ok": 2}
+async def _existing_device_ids(db: AsyncSession, device_ids: list[int]) -> set[int]:
+    res = await db.execute(select(Device.id).where(_id_in(db, Device.id, device_ids)))
+    return set(res.scalars().all())
+
+
+def _health_out(entity_id: str, health: EntityHealth) -> "EntityHealthOut":
+    return EntityHealthOut(
+        entity_id=entity_id,
+        device_count=health.device_count,
+        online=health.online,
+        stale=health.stale,
+        offline=health.offline,
+        worst_health=health.status,
+    )
 
 
 # ---------------------------------------------------------------------------
@@ -180,49 +192,34 @@ async def list_entities(
     return list(res.scalars().all())
 
 
+@router.get("/health", response_model=list[EntityHealthOut])
+async def list_entity_health(
+    entity_id: list[str] | None = Query(default=None),
+    db: AsyncSession = Depends(get_db),
+    org_id: int | None = Depends(get_current_org_id),
+):
+    """Health of many entities (all visible ones without entity_id) in one query."""
+    stmt = select(Entity.entity_id)
+    if entity_id:
+        stmt = stmt.where(Entity.entity_id.in_(entity_id))
+    if org_id is not None:
+        stmt = stmt.where(Entity.org_id == org_id)
+    res = await db.execute(stmt.order_by(Entity.entity_id))
+    entity_ids = list(res.scalars().all())
+    if not entity_ids:
+        return []
+    health = await entity_health(db, datetime.now(timezone.utc), entity_ids)
+    return [_health_out(eid, health.get(eid, EntityHealth())) for eid in entity_ids]
+
+
 @router.get("/{entity_id}/health", response_model=EntityHealthOut)
 async def get_entity_health(
     entity_id: str,
     db: AsyncSession = Depends(get_db),
 ):
     await _get_entity_or_404(entity_id, db)
-
-    res = await db.execute(
-        select(Device.last_seen_at)
-        .join(EntityDeviceBinding, EntityDeviceBinding.device_id == Device.id)
-        .where(
-            EntityDeviceBinding.entity_id == entity_id,
-            EntityDeviceBinding.enabled.is_(True),
-        )
-    )
-    last_seen_values = res.scalars().all()
-
-    now = datetime.now(timezone.utc)
-    counts = {"ok": 0, "stale": 0, "offline": 0}
-    for lsa in last_seen_values:
-        status = _device_health_status(lsa, now)
-        counts[status] = counts.get(status, 0) + 1
-
-    device_count = len(last_seen_values)
-    if device_count == 0:
-        worst = "unknown"
-    else:
-        worst = min(counts, key=lambda k: _HEALTH_RANK.get(k, 2) if counts[k] > 0 else 999)
-        # worst = the status with the lowest rank that has at least one device
-        worst = min(
-            (k for k, v in counts.items() if v > 0),
-            key=lambda k: _HEALTH_RANK.get(k, 2),
-            default="unknown",
-        )
-
-    return EntityHealthOut(
-        entity_id=entity_id,
-        device_count=device_count,
-        online=counts["ok"],
-        stale=counts["stale"],
-        offline=counts["offline"],
-        worst_health=worst,
-    )
+    health = await entity_health(db, datetime.now(timezone.utc), [entity_id])
+    return _health_out(entity_id, health.get(entity_id, EntityHealth()))
 
 
 @router.get("/{entity_id}/devices", response_model=list[EntityDeviceBindingOut])
@@ -317,6 +314,33 @@ async def delete_entity(
 # (bulk-* routes must be defined before /{device_id} to avoid path conflicts)
 # ---------------------------------------------------------------------------
 
+async def _insert_bindings(
+    db: AsyncSession, entity_id: str, device_ids: list[int], priority: int, enabled: bool,
+) -> list:
+    """Multi-row INSERT ... ON CONFLICT DO NOTHING; returns the rows created."""
+    created = []
+    for start in range(0, len(device_ids), BULK_CHUNK):
+        res = await db.execute(
+            insert(EntityDeviceBinding)
+            .values([
+                {"entity_id": entity_id, "device_id": device_id, "priority": priority, "enabled": enabled}
+                for device_id in device_ids[start:start + BULK_CHUNK]
+            ])
+            .on_conflict_do_nothing(index_elements=["entity_id", "device_id"])
+            .returning(EntityDeviceBinding.device_id, EntityDeviceBinding.enabled, EntityDeviceBinding.priority)
+        )
+        created.extend(res.all())
+    return created
+
+
+async def _emit_binding_events(db: AsyncSession, event_type: str, entity_id: str, device_ids) -> None:
+    for device_id in device_ids:
+        await emit_system_event(db, event_type, {
+            "entity_id": entity_id,
+            "device_id": device_id,
+        })
+
+
 @router.post("/{entity_id}/devices/bulk-bind", response_model=BulkOpOut)
 async def bulk_bind_devices(
     entity_id: str,
@@ -324,34 +348,25 @@ async def bulk_bind_devices(
     db: AsyncSession = Depends(get_db),
 ):
     await _get_entity_or_404(entity_id, db)
-    results: list[BulkOpResult] = []
+    requested = list(dict.fromkeys(data.device_ids))
+    found = await _existing_device_ids(db, requested)
+    created = await _insert_bindings(
+        db, entity_id, [d for d in requested if d in found], data.priority, data.enabled,
+    )
+    bound = [row.device_id for row in created]
+    await _emit_binding_events(db, "entity.device.bound", entity_id, bound)
+    await db.commit()
 
+    pending_ok = set(bound)
+    results: list[BulkOpResult] = []
     for device_id in data.device_ids:
-        try:
-            async with db.begin_nested():
-                device = await db.get(Device, device_id)
-                if device is None:
-                    results.append(BulkOpResult(device_id=device_id, ok=False, error="device_not_found"))
-                    continue
-                existing = await _get_binding(entity_id, device_id, db)
-                if existing is not None:
-                    results.append(BulkOpResult(device_id=device_id, ok=False, error="already_bound"))
-                    continue
-                db.add(EntityDeviceBinding(
-                    entity_id=entity_id,
-                    device_id=device_id,
-                    priority=data.priority,
-                    enabled=data.enabled,
-                ))
-                await emit_system_event(db, "entity.device.bound", {
-                    "entity_id": entity_id,
-                    "device_id": device_id,
-                })
+        if device_id not in found:
+            results.append(BulkOpResult(device_id=device_id, ok=False, error="device_not_found"))
+        elif device_id in pending_ok:
+            pending_ok.discard(device_id)
             results.append(BulkOpResult(device_id=device_id, ok=True))
-        except Exception as exc:
-            results.append(BulkOpResult(device_id=device_id, ok=False, error=str(exc)))
-
-    await db.commit()
+        else:
+            results.append(BulkOpResult(device_id=device_id, ok=False, error="already_bound"))
     return BulkOpOut(results=results)
 
 
@@ -362,26 +377,60 @@ async def bulk_unbind_devices(
     db: AsyncSession = Depends(get_db),
 ):
     await _get_entity_or_404(entity_id, db)
-    results: list[BulkOpResult] = []
+    requested = list(dict.fromkeys(data.device_ids))
+    res = await db.execute(
+        delete(EntityDeviceBinding)
+        .where(
+            EntityDeviceBinding.entity_id == entity_id,
+            _id_in(db, EntityDeviceBinding.device_id, requested),
+        )
+        .returning(EntityDeviceBinding.device_id)
+        .execution_options(synchronize_session=False)
+    )
+    unbound = list(res.scalars().all())
+    await _emit_binding_events(db, "entity.device.unbound", entity_id, unbound)
+    await db.commit()
 
+    pending_ok = set(unbound)
+    results: list[BulkOpResult] = []
     for device_id in data.device_ids:
-        try:
-            async with db.begin_nested():
-                binding = await _get_binding(entity_id, device_id, db)
-                if binding is None:
-                    results.append(BulkOpResult(device_id=device_id, ok=False, error="not_bound"))
-                    continue
-                await db.delete(binding)
-                await emit_system_event(db, "entity.device.unbound", {
-                    "entity_id": entity_id,
-                    "device_id": device_id,
-                })
+        if device_id in pending_ok:
+            pending_ok.discard(device_id)
             results.append(BulkOpResult(device_id=device_id, ok=True))
-        except Exception as exc:
-            results.append(BulkOpResult(device_id=device_id, ok=False, error=str(exc)))
+        else:
+            results.append(BulkOpResult(device_id=device_id, ok=False, error="not_bound"))
+    return BulkOpOut(results=results)
+
 
+@router.post("/{entity_id}/devices/bulk-update", response_model=BulkOpOut)
+async def bulk_update_bindings(
+    entity_id: str,
+    data: BulkUpdateIn,
+    db: AsyncSession = Depends(get_db),
+):
+    """Set priority and/or enabled on many bindings in one UPDATE."""
+    values = data.model_dump(include={"priority", "enabled"}, exclude_none=True)
+    if not values:
+        raise HTTPException(status_code=422, detail="nothing to update: set priority and/or enabled")
+    await _get_entity_or_404(entity_id, db)
+    requested = list(dict.fromkeys(data.device_ids))
+    res = await db.execute(
+        update(EntityDeviceBinding)
+        .where(
+            EntityDeviceBinding.entity_id == entity_id,
+            _id_in(db, EntityDeviceBinding.device_id, requested),
+        )
+        .values(**values)
+        .returning(EntityDeviceBinding.device_id)
+        .execution_options(synchronize_session=False)
+    )
+    updated = set(res.scalars().all())
     await db.commit()
-    return BulkOpOut(results=results)
+    return BulkOpOut(results=[
+        BulkOpResult(device_id=device_id, ok=True) if device_id in updated
+        else BulkOpResult(device_id=device_id, ok=False, error="not_bound")
+        for device_id in data.device_ids
+    ])
 
 
 @router.post("/{entity_id}/devices", response_model=list[EntityDeviceBindingOut], status_code=201)
@@ -391,31 +440,25 @@ async def bind_devices(
     db: AsyncSession = Depends(get_db),
 ):
     await _get_entity_or_404(entity_id, db)
-    created: list[EntityDeviceBinding] = []
-
-    for device_id in data.device_ids:
-        await _get_device_or_404(device_id, db)
-        existing = await _get_binding(entity_id, device_id, db)
-        if existing is not None:
-            raise HTTPException(status_code=409, detail=f"device {device_id} already bound")
-        binding = EntityDeviceBinding(
-            entity_id=entity_id,
-            device_id=device_id,
-            priority=data.priority,
-            enabled=data.enabled,
-        )
-        db.add(binding)
-        created.append(binding)
-
-    for device_id in data.device_ids:
-        await emit_system_event(db, "entity.device.bound", {
-            "entity_id": entity_id,
-            "device_id": device_id,
-        })
+    requested = list(dict.fromkeys(data.device_ids))
+    found = await _existing_device_ids(db, requested)
+    missing = [d for d in requested if d not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"device {missing[0]} not found")
+
+    created = await _insert_bindings(db, entity_id, requested, data.priority, data.enabled)
+    if len(created) != len(requested):
+        await db.rollback()
+        taken = sorted(set(requested) - {row.device_id for row in created})
+        raise HTTPException(status_code=409, detail=f"device {taken[0]} already bound")
+
+    await _emit_binding_events(db, "entity.device.bound", entity_id, requested)
     await db.commit()
-    for b in created:
-        await db.refresh(b)
-    return [EntityDeviceBindingOut(device_id=b.device_id, enabled=b.enabled, priority=b.priority) for b in created]
+    by_device = {row.device_id: row for row in created}
+    return [
+        EntityDeviceBindingOut(device_id=d, enabled=by_device[d].enabled, priority=by_device[d].priority)
+        for d in requested
+    ]
 
 
 @router.put("/{entity_id}/devices/{device_id}", response_model=EntityDeviceBindingOut)
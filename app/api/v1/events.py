@@ -1,16 +1,25 @@
+import asyncio
 from datetime import datetime, timezone
+from typing import AsyncIterator, Callable
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, ConfigDict
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_db
+from app.api.deps import get_db, get_read_db
 from app.api.deps_auth import get_current_device
+from app.core import event_stream
+from app.core.capabilities import enforcement_enabled
+from app.core.security import decode_access_token
 from app.db.models.device import Device
 from app.db.models.events import EventV1, EventV1Checkpoint
 
 router = APIRouter(prefix="/events", tags=["events"])
+ws_router = APIRouter(prefix="/events", tags=["events"])
+
+STREAM_BATCH = 200  # events per SSE flush / WebSocket message
 
 
 class EventItemOut(BaseModel):
@@ -55,6 +64,104 @@ class EventEmitOut(BaseModel):
     event_id: int
 
 
+def _item(row: EventV1) -> EventItemOut:
+    return EventItemOut(
+        cursor=row.id,
+        ts=row.ts,
+        type=row.type,
+        payload=row.payload,
+        trace_id=row.trace_id,
+    )
+
+
+async def _store_ack(db: AsyncSession, stream: str, subscriber_id: str, cursor: int) -> EventAckOut:
+    res = await db.execute(
+        select(EventV1Checkpoint)
+        .where(
+            EventV1Checkpoint.stream == stream,
+            EventV1Checkpoint.subscriber_id == subscriber_id,
+        )
+    )
+    checkpoint = res.scalar_one_or_none()
+    status = "OK"
+    if checkpoint is None:
+        checkpoint = EventV1Checkpoint(
+            stream=stream, subscriber_id=subscriber_id, cursor=cursor
+        )
+        db.add(checkpoint)
+        await db.commit()
+        await db.refresh(checkpoint)
+        return EventAckOut(ok=True, stored_cursor=checkpoint.cursor, status=status)
+
+    if cursor < checkpoint.cursor:
+        status = "NOOP"
+        return EventAckOut(ok=True, stored_cursor=checkpoint.cursor, status=status)
+    if cursor == checkpoint.cursor:
+        status = "NOOP"
+        return EventAckOut(ok=True, stored_cursor=checkpoint.cursor, status=status)
+
+    checkpoint.cursor = cursor
+    checkpoint.updated_at = datetime.now(timezone.utc)
+    await db.commit()
+    return EventAckOut(ok=True, stored_cursor=checkpoint.cursor, status=status)
+
+
+async def _start_cursor(db: AsyncSession, stream: str, cursor: int | None, subscriber_id: str | None) -> int:
+    """Explicit cursor, else the subscriber's acked checkpoint, else 0."""
+    if cursor is not None:
+        return cursor
+    if subscriber_id:
+        stored = await db.scalar(
+            select(EventV1Checkpoint.cursor).where(
+                EventV1Checkpoint.stream == stream,
+                EventV1Checkpoint.subscriber_id == subscriber_id,
+            )
+        )
+        if stored is not None:
+            return stored
+    return 0
+
+
+def _session_factory(db: AsyncSession) -> Callable[[], AsyncSession]:
+    """Short sessions on the request's engine: a stream holds no connection while idle."""
+    bind = db.bind
+    return lambda: AsyncSession(bind, expire_on_commit=False)
+
+
+async def _follow(
+    open_session: Callable[[], AsyncSession],
+    stream: str,
+    cursor: int,
+    types: list[str] | None,
+) -> AsyncIterator[list[EventItemOut]]:
+    """Yield batches of new events after cursor as they are committed.
+
+    Parks on event_stream wake-ups between reads; yields [] after
+    MAX_WAIT_SECONDS without events so the caller can send a keep-alive.
+    """
+    loop = asyncio.get_running_loop()
+    last_sent = loop.time()
+    with event_stream.subscribe(stream) as wake:
+        while True:
+            stmt = select(EventV1).where(EventV1.stream == stream, EventV1.id > cursor)
+            if types:
+                stmt = stmt.where(EventV1.type.in_(types))
+            async with open_session() as db:
+                res = await db.execute(stmt.order_by(EventV1.id.asc()).limit(STREAM_BATCH))
+                rows = res.scalars().all()
+            if rows:
+                cursor = rows[-1].id
+                last_sent = loop.time()
+                yield [_item(row) for row in rows]
+                continue
+            idle = loop.time() - last_sent
+            if idle >= event_stream.MAX_WAIT_SECONDS:
+                last_sent = loop.time()
+                yield []
+                idle = 0.0
+            await wake.wait(min(event_stream.recheck_interval(), event_stream.MAX_WAIT_SECONDS - idle))
+
+
 @router.get("", response_model=EventReadOut)
 async def read_events(
     stream: str = Query(..., min_length=1, max_length=128),
@@ -69,20 +176,45 @@ async def read_events(
         .limit(limit)
     )
     rows = res.scalars().all()
-    items = [
-        EventItemOut(
-            cursor=row.id,
-            ts=row.ts,
-            type=row.type,
-            payload=row.payload,
-            trace_id=row.trace_id,
-        )
-        for row in rows
-    ]
+    items = [_item(row) for row in rows]
     next_cursor = items[-1].cursor if items else cursor
     return EventReadOut(stream=stream, cursor=cursor, next_cursor=next_cursor, items=items)
 
 
+@router.get("/stream")
+async def stream_events(
+    stream: str = Query(..., min_length=1, max_length=128),
+    cursor: int | None = Query(None, ge=0),
+    subscriber_id: str | None = Query(None, min_length=1, max_length=128),
+    type: list[str] | None = Query(None),
+    last_event_id: int | None = Header(None, alias="Last-Event-ID", ge=0),
+    db: AsyncSession = Depends(get_db),
+):
+    """Server-Sent Events of a stream, pushed as they are committed.
+
+    Starts after Last-Event-ID (browser reconnect), else cursor, else the
+    subscriber's acked checkpoint (POST /events/ack), else the beginning.
+    `type` filters server-side; the SSE `id` of each message is its cursor.
+    """
+    start = last_event_id if last_event_id is not None else await _start_cursor(db, stream, cursor, subscriber_id)
+    open_session = _session_factory(db)
+    await db.close()
+
+    async def body() -> AsyncIterator[str]:
+        yield "retry: 2000\n\n"
+        async for items in _follow(open_session, stream, start, type):
+            if not items:
+                yield ": keep-alive\n\n"
+            for item in items:
+                yield f"id: {item.cursor}\nevent: {item.type}\ndata: {item.model_dump_json()}\n\n"
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/{event_id}", response_model=EventItemOut)
 async def get_event(
     event_id: int,
@@ -92,13 +224,7 @@ async def get_event(
     row = res.scalar_one_or_none()
     if row is None:
         raise HTTPException(status_code=404, detail="event not found")
-    return EventItemOut(
-        cursor=row.id,
-        ts=row.ts,
-        type=row.type,
-        payload=row.payload,
-        trace_id=row.trace_id,
-    )
+    return _item(row)
 
 
 @router.post("/ack", response_model=EventAckOut)
@@ -106,35 +232,7 @@ async def ack_events(
     data: EventAckIn,
     db: AsyncSession = Depends(get_db),
 ):
-    res = await db.execute(
-        select(EventV1Checkpoint)
-        .where(
-            EventV1Checkpoint.stream == data.stream,
-            EventV1Checkpoint.subscriber_id == data.subscriber_id,
-        )
-    )
-    checkpoint = res.scalar_one_or_none()
-    status = "OK"
-    if checkpoint is None:
-        checkpoint = EventV1Checkpoint(
-            stream=data.stream, subscriber_id=data.subscriber_id, cursor=data.cursor
-        )
-        db.add(checkpoint)
-        await db.commit()
-        await db.refresh(checkpoint)
-        return EventAckOut(ok=True, stored_cursor=checkpoint.cursor, status=status)
-
-    if data.cursor < checkpoint.cursor:
-        status = "NOOP"
-        return EventAckOut(ok=True, stored_cursor=checkpoint.cursor, status=status)
-    if data.cursor == checkpoint.cursor:
-        status = "NOOP"
-        return EventAckOut(ok=True, stored_cursor=checkpoint.cursor, status=status)
-
-    checkpoint.cursor = data.cursor
-    checkpoint.updated_at = datetime.now(timezone.utc)
-    await db.commit()
-    return EventAckOut(ok=True, stored_cursor=checkpoint.cursor, status=status)
+    return await _store_ack(db, data.stream, data.subscriber_id, data.cursor)
 
 
 @router.post("/emit", response_model=EventEmitOut)
@@ -156,7 +254,7 @@ async def export_events(
     stream: str = Query("system"),
     limit: int = Query(1000, le=10000),
     format: str = Query("csv"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """Export events as CSV or JSON."""
     import csv
@@ -198,3 +296,70 @@ async def export_events(
         media_type="text/csv",
         headers={"Content-Disposition": f'attachment; filename="events-export.csv"'},
     )
+
+
+@ws_router.websocket("/ws")
+async def events_ws(
+    websocket: WebSocket,
+    token: str = Query(...),
+    stream: str = Query(..., min_length=1, max_length=128),
+    cursor: int | None = Query(None, ge=0),
+    subscriber_id: str | None = Query(None, min_length=1, max_length=128),
+    type: list[str] | None = Query(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """WebSocket variant of GET /events/stream at /api/v1/events/ws?token=JWT.
+
+    Server pushes:
+    - {"type": "events", "items": [...], "next_cursor": int}
+    - {"type": "ping"} after MAX_WAIT_SECONDS without events
+
+    Client may send {"ack": cursor} to store the subscriber_id checkpoint;
+    the reply is {"type": "ack", "stored_cursor": int, "status": str}.
+    """
+    try:
+        claims = decode_access_token(token)
+    except Exception:
+        await websocket.close(code=1008)
+        return
+    if enforcement_enabled() and "events.read" not in (claims.get("caps") or []):
+        await websocket.close(code=1008)
+        return
+
+    start = await _start_cursor(db, stream, cursor, subscriber_id)
+    open_session = _session_factory(db)
+    await db.close()
+    await websocket.accept()
+    send_lock = asyncio.Lock()
+
+    async def push() -> None:
+        async for items in _follow(open_session, stream, start, type):
+            message = (
+                {"type": "events", "items": [i.model_dump(mode="json") for i in items], "next_cursor": items[-1].cursor}
+                if items else {"type": "ping"}
+            )
+            async with send_lock:
+                await websocket.send_json(message)
+
+    async def receive_acks() -> None:
+        while True:
+            message = await websocket.receive_json()
+            ack = message.get("ack") if isinstance(message, dict) else None
+            if not subscriber_id or not isinstance(ack, int) or ack < 0:
+                continue
+            async with open_session() as session:
+                out = await _store_ack(session, stream, subscriber_id, ack)
+            async with send_lock:
+                await websocket.send_json({"type": "ack", "stored_cursor": out.stored_cursor, "status": out.status})
+
+    tasks = [asyncio.create_task(push()), asyncio.create_task(receive_acks())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            exc = task.exception()
+            if exc is not None and not isinstance(exc, WebSocketDisconnect):
+                raise exc
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,3 +1,4 @@
+import time
 from datetime import datetime, timezone
 
 from fastapi import APIRouter, Depends, HTTPException, Query
@@ -6,6 +7,7 @@ from sqlalchemy import and_, func, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
+from app.core import execution_dispatch
 from app.core.execution_workers import (
     WorkerNotFoundError,
     read_definition_workers,
@@ -21,9 +23,9 @@ from app.core.executions import (
     ClaimConflictError,
     ClaimNotFoundError,
     claim_run,
-    claim_next_run,
     claim_next_run_for_definitions,
     extend_lease,
+    extend_leases,
     release_claim,
     create_definition,
     create_run_idempotent,
@@ -91,9 +93,15 @@ class ExecutionDefinitionReadOut(BaseModel):
     next_cursor: int | None
 
 
+MAX_LEASE_BATCH = 1000
+
+
 class ExecutionWorkerIn(BaseModel):
     worker_id: str
     meta_json: dict | None = None
+    # Runs held by the worker whose leases this heartbeat renews
+    run_ids: list[int] | None = None
+    lease_seconds: int | None = 60
 
 
 class ExecutionWorkerOut(BaseModel):
@@ -106,6 +114,16 @@ class ExecutionWorkerOut(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class ExecutionLeaseOut(BaseModel):
+    id: int
+    lease_expires_at: datetime
+
+
+class ExecutionWorkerHeartbeatOut(ExecutionWorkerOut):
+    leases: list[ExecutionLeaseOut] = []
+    lost_run_ids: list[int] = []
+
+
 class ExecutionWorkerReadOut(BaseModel):
     items: list[ExecutionWorkerOut]
     next_cursor: str | None
@@ -153,6 +171,7 @@ class ExecutionClaimNextIn(BaseModel):
     definition_key: str | None = None
     worker_id: str
     lease_seconds: int | None = 60
+    wait_seconds: float | None = 0
 
 
 class ExecutionReleaseIn(BaseModel):
@@ -201,16 +220,38 @@ async def list_execution_definitions(
     return ExecutionDefinitionReadOut(items=items, next_cursor=next_cursor)
 
 
-@router.post("/workers/heartbeat", response_model=ExecutionWorkerOut)
+@router.post("/workers/heartbeat", response_model=ExecutionWorkerHeartbeatOut)
 async def upsert_execution_worker_heartbeat(
     data: ExecutionWorkerIn,
     db: AsyncSession = Depends(get_db),
 ):
+    """Register the worker and renew its leases on run_ids in one UPDATE.
+
+    Runs whose lease could not be renewed (finalized, released, expired or
+    taken over) are listed in lost_run_ids; the worker should stop them.
+    """
     worker_id = data.worker_id.strip()
     if not (1 <= len(worker_id) <= 96):
         raise HTTPException(status_code=400, detail="invalid worker_id")
+    run_ids = data.run_ids or []
+    if len(run_ids) > MAX_LEASE_BATCH:
+        raise HTTPException(status_code=400, detail="too many run_ids")
+    lease_seconds = 60 if data.lease_seconds is None else data.lease_seconds
+    if not (1 <= lease_seconds <= 3600):
+        raise HTTPException(status_code=400, detail="invalid lease_seconds")
+
     worker = await upsert_worker_heartbeat(db, worker_id=worker_id, meta_json=data.meta_json)
-    return ExecutionWorkerOut.model_validate(worker)
+    out = ExecutionWorkerHeartbeatOut.model_validate(worker)
+    if run_ids:
+        renewed, lost = await extend_leases(
+            db,
+            worker_id=worker_id,
+            run_ids=run_ids,
+            lease_seconds=lease_seconds,
+        )
+        out.leases = [ExecutionLeaseOut(id=run_id, lease_expires_at=lease_at) for run_id, lease_at in renewed]
+        out.lost_run_ids = lost
+    return out
 
 
 @router.get("/workers", response_model=ExecutionWorkerReadOut)
@@ -514,6 +555,12 @@ async def claim_next_execution_run(
     data: ExecutionClaimNextIn,
     db: AsyncSession = Depends(get_db),
 ):
+    """Claim the next run of definition_key (or of the worker's subscriptions).
+
+    With wait_seconds > 0 and no run available, the call is held (without a
+    DB connection) until a run is created or released for one of the
+    definitions, or wait_seconds (max 30s) runs out; 404 is returned then.
+    """
     definition_key = data.definition_key.strip() if data.definition_key is not None else None
     if definition_key is not None and not (1 <= len(definition_key) <= 96):
         raise HTTPException(status_code=400, detail="invalid definition_key")
@@ -524,6 +571,9 @@ async def claim_next_execution_run(
     lease_seconds = 60 if data.lease_seconds is None else data.lease_seconds
     if not (1 <= lease_seconds <= 3600):
         raise HTTPException(status_code=400, detail="invalid lease_seconds")
+    wait_seconds = 0 if data.wait_seconds is None else data.wait_seconds
+    if wait_seconds < 0:
+        raise HTTPException(status_code=400, detail="invalid wait_seconds")
 
     try:
         subscribed_ids = await read_worker_definition_ids(db, worker_id=worker_id)
@@ -533,39 +583,37 @@ async def claim_next_execution_run(
     if definition_key is None:
         if not subscribed_ids:
             raise HTTPException(status_code=400, detail="definition_key required")
-        try:
-            run = await claim_next_run_for_definitions(
-                db,
-                definition_ids=subscribed_ids,
-                worker_id=worker_id,
-                lease_seconds=lease_seconds,
-            )
-        except ClaimNotFoundError as exc:
-            detail = str(exc)
-            raise HTTPException(status_code=404, detail=detail)
-        except ClaimConflictError as exc:
-            raise HTTPException(status_code=409, detail=str(exc))
-        return ExecutionRunOut.model_validate(run)
-
-    definition = await db.scalar(select(ExecutionDefinition).where(ExecutionDefinition.key == definition_key))
-    if definition is None:
-        raise HTTPException(status_code=404, detail="definition not found")
-    if subscribed_ids and definition.id not in subscribed_ids:
-        raise HTTPException(status_code=409, detail="worker not subscribed")
-
-    try:
-        run = await claim_next_run(
-            db,
-            definition_id=definition.id,
-            worker_id=worker_id,
-            lease_seconds=lease_seconds,
-        )
-    except ClaimNotFoundError as exc:
-        detail = str(exc)
-        raise HTTPException(status_code=404, detail=detail)
-    except ClaimConflictError as exc:
-        raise HTTPException(status_code=409, detail=str(exc))
-    return ExecutionRunOut.model_validate(run)
+        definition_ids = subscribed_ids
+    else:
+        definition = await db.scalar(select(ExecutionDefinition).where(ExecutionDefinition.key == definition_key))
+        if definition is None:
+            raise HTTPException(status_code=404, detail="definition not found")
+        if subscribed_ids and definition.id not in subscribed_ids:
+            raise HTTPException(status_code=409, detail="worker not subscribed")
+        definition_ids = [definition.id]
+
+    deadline = time.monotonic() + min(wait_seconds, execution_dispatch.LONG_POLL_MAX_SECONDS)
+    # Subscribed before the first claim: a run created in between still wakes us
+    with execution_dispatch.subscribe(definition_ids) as wake:
+        while True:
+            try:
+                run = await claim_next_run_for_definitions(
+                    db,
+                    definition_ids=definition_ids,
+                    worker_id=worker_id,
+                    lease_seconds=lease_seconds,
+                )
+            except ClaimNotFoundError as exc:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise HTTPException(status_code=404, detail=str(exc))
+                # End the read transaction so the parked call holds no connection
+                await db.rollback()
+                await wake.wait(min(remaining, execution_dispatch.recheck_interval()))
+                continue
+            except ClaimConflictError as exc:
+                raise HTTPException(status_code=409, detail=str(exc))
+            return ExecutionRunOut.model_validate(run)
 
 
 @router.post("/runs/{run_id}/release", response_model=ExecutionRunOut)
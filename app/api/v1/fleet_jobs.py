@@ -0,0 +1,192 @@
+"""Fleet jobs API: one task type dispatched to every device of a target.
+
+Create:     POST /fleet-jobs
+Read:       GET  /fleet-jobs, GET /fleet-jobs/{id} (incremental progress counters)
+Lifecycle:  POST /fleet-jobs/{id}/pause|resume|cancel
+"""
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Any
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field, computed_field
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.deps import get_db
+from app.api.deps_org import get_current_org_id, get_jwt_user_id
+from app.api.v1.validators import validate_json_object
+from app.core import fleet_jobs
+from app.core.system_events import emit_system_event
+from app.db.models.fleet_jobs import FleetJob
+
+router = APIRouter(prefix="/fleet-jobs")
+
+
+# ---------------------------------------------------------------------------
+# Schemas
+# ---------------------------------------------------------------------------
+
+class FleetJobTarget(BaseModel):
+    group: str | None = Field(default=None, max_length=64)
+    entity_id: str | None = Field(default=None, max_length=64)
+    tag: str | None = Field(default=None, max_length=128)
+
+
+class FleetJobCreate(BaseModel):
+    name: str = Field(min_length=1, max_length=128)
+    task_type: str = Field(min_length=1, max_length=64)
+    payload: dict[str, Any] = Field(default_factory=dict)
+    priority: int = 0
+    target: FleetJobTarget
+    max_in_flight: int | None = Field(default=None, ge=1)
+    rate_per_minute: int | None = Field(default=None, ge=1)
+    abort_failure_percent: int | None = Field(default=None, ge=0, le=100)
+
+
+class FleetJobOut(BaseModel):
+    id: int
+    name: str
+    task_type: str
+    payload: dict[str, Any]
+    priority: int
+    target: dict[str, Any]
+    status: str
+    max_in_flight: int | None
+    rate_per_minute: int | None
+    abort_failure_percent: int | None
+    total: int
+    dispatched: int
+    succeeded: int
+    failed: int
+    canceled: int
+    error: str | None
+    org_id: int | None
+    created_at: datetime
+    completed_at: datetime | None
+
+    model_config = {"from_attributes": True}
+
+    @computed_field
+    @property
+    def in_flight(self) -> int:
+        return self.dispatched - self.succeeded - self.failed - self.canceled
+
+    @computed_field
+    @property
+    def progress_percent(self) -> int:
+        if self.total <= 0:
+            return 100 if self.status == "completed" else 0
+        return min(100, (self.succeeded + self.failed + self.canceled) * 100 // self.total)
+
+
+async def _get_job_for_update(db: AsyncSession, job_id: int) -> FleetJob:
+    job = await db.scalar(select(FleetJob).where(FleetJob.id == job_id).with_for_update())
+    if job is None:
+        raise HTTPException(404, detail="fleet job not found")
+    return job
+
+
+# ---------------------------------------------------------------------------
+# Routes
+# ---------------------------------------------------------------------------
+
+@router.post("", response_model=FleetJobOut, status_code=201)
+async def create_fleet_job(
+    body: FleetJobCreate,
+    db: AsyncSession = Depends(get_db),
+    org_id: int | None = Depends(get_current_org_id),
+    user_id: int | None = Depends(get_jwt_user_id),
+):
+    validate_json_object(body.payload, "payload")
+    target = body.target.model_dump(exclude_none=True)
+    try:
+        entity_ids = await fleet_jobs.resolve_entity_ids(db, target)
+    except ValueError as exc:
+        raise HTTPException(422, detail=str(exc))
+    if not entity_ids and "tag" not in target:
+        raise HTTPException(404, detail="target not found")
+
+    job = await fleet_jobs.create_job(
+        db,
+        name=body.name,
+        task_type=body.task_type,
+        payload=body.payload,
+        priority=body.priority,
+        target=target,
+        entity_ids=entity_ids,
+        max_in_flight=body.max_in_flight,
+        rate_per_minute=body.rate_per_minute,
+        abort_failure_percent=body.abort_failure_percent,
+        org_id=org_id,
+        created_by=user_id,
+    )
+    await emit_system_event(db, "fleet_job.created", {
+        "job_id": job.id, "name": job.name, "task_type": job.task_type, "total": job.total,
+    })
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+@router.get("", response_model=list[FleetJobOut])
+async def list_fleet_jobs(
+    db: AsyncSession = Depends(get_db),
+    org_id: int | None = Depends(get_current_org_id),
+    status: str | None = None,
+):
+    stmt = select(FleetJob)
+    if org_id is not None:
+        stmt = stmt.where(FleetJob.org_id == org_id)
+    if status:
+        stmt = stmt.where(FleetJob.status == status)
+    res = await db.execute(stmt.order_by(FleetJob.id.desc()).limit(200))
+    return list(res.scalars().all())
+
+
+@router.get("/{job_id}", response_model=FleetJobOut)
+async def get_fleet_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await db.get(FleetJob, job_id)
+    if job is None:
+        raise HTTPException(404, detail="fleet job not found")
+    return job
+
+
+@router.post("/{job_id}/pause", response_model=FleetJobOut)
+async def pause_fleet_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await _get_job_for_update(db, job_id)
+    if job.status != "running":
+        raise HTTPException(409, detail="only running fleet jobs can be paused")
+    job.status = "paused"
+    await emit_system_event(db, "fleet_job.paused", {"job_id": job.id})
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+@router.post("/{job_id}/resume", response_model=FleetJobOut)
+async def resume_fleet_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await _get_job_for_update(db, job_id)
+    if job.status != "paused":
+        raise HTTPException(409, detail="only paused fleet jobs can be resumed")
+    job.status = "running"
+    await emit_system_event(db, "fleet_job.resumed", {"job_id": job.id})
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+@router.post("/{job_id}/cancel", response_model=FleetJobOut)
+async def cancel_fleet_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Stop dispatching and cancel queued tasks; claimed tasks run to completion."""
+    job = await _get_job_for_update(db, job_id)
+    if job.status not in fleet_jobs.ACTIVE_STATUSES:
+        raise HTTPException(409, detail="fleet job already finished")
+    await fleet_jobs.cancel_queued(db, job, "fleet job canceled")
+    job.status = "canceled"
+    job.completed_at = datetime.now(timezone.utc)
+    await emit_system_event(db, "fleet_job.canceled", {"job_id": job.id, "canceled": job.canceled})
+    await db.commit()
+    await db.refresh(job)
+    return job
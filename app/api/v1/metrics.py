@@ -7,8 +7,9 @@ from pydantic import BaseModel
 from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_db
+from app.api.deps import get_read_db
 from app.api.deps_auth import get_current_user
+from app.core.cache import cache_rule
 from app.db.models.alerts import AlertEvent
 from app.db.models.device import Device
 from app.db.models.entities import Entity
@@ -17,6 +18,7 @@ from app.db.models.user import User
 from app.db.models.webhooks import WebhookSubscription
 
 router = APIRouter(tags=["metrics"])
+cache_rule(router, "metrics", path="/metrics", ttl=10)
 
 _START_TIME = time.time()
 
@@ -48,7 +50,7 @@ class MetricsOut(BaseModel):
 
 @router.get("/metrics", response_model=MetricsOut)
 async def get_metrics(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_user),
 ):
     now = datetime.now(timezone.utc)
@@ -7,10 +7,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
 from app.api.v1.error_utils import raise_api_error
+from app.core.cache import cache_rule
 from app.core.modules import get_module, list_modules, set_module_enabled
 from app.core.security import decode_access_token, AuthTokenError
 
 router = APIRouter(prefix="/modules", tags=["modules"])
+cache_rule(router, "modules", ttl=30)
 bearer = HTTPBearer(auto_error=False)
 
 
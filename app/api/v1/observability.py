@@ -1,18 +1,21 @@
-"""Advanced Observability — traces, incidents, support bundle, anomaly hints."""
+"""Advanced Observability — traces, incidents, support bundle, anomaly hints, profiling."""
 
 import io
 import json
 import logging
+from dataclasses import asdict
 from datetime import datetime, timedelta, timezone
 
-from fastapi import APIRouter, Depends, Query
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from sqlalchemy import select, func, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_db
+from app.api.deps import get_read_db
 from app.api.deps_auth import get_current_user
+from app.core import profiling
+from app.core.redis_client import get_redis
 from app.db.models.events import EventV1
 from app.db.models.audit import AuditV1Entry
 from app.db.models.alerts import AlertEvent
@@ -42,7 +45,7 @@ async def get_traces(
     minutes: int = Query(60, le=1440),
     device_uid: str | None = Query(None),
     limit: int = Query(200, le=1000),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: User = Depends(get_current_user),
 ):
     """Timeline view: correlated events, audit entries, alerts, and automations."""
@@ -128,7 +131,7 @@ class IncidentSummary(BaseModel):
 
 @router.get("/incidents", response_model=IncidentSummary)
 async def get_incident_summary(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: User = Depends(get_current_user),
 ):
     now = datetime.now(timezone.utc)
@@ -178,7 +181,7 @@ async def get_incident_summary(
 
 @router.get("/support-bundle")
 async def download_support_bundle(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: User = Depends(get_current_user),
 ):
     """Generate a diagnostics bundle (JSON) for support tickets."""
@@ -250,7 +253,7 @@ class AnomalyHint(BaseModel):
 async def detect_anomalies(
     hours: int = Query(24, le=168),
     threshold: float = Query(2.5),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: User = Depends(get_current_user),
 ):
     """Simple z-score anomaly detection on recent variable history."""
@@ -307,3 +310,110 @@ async def detect_anomalies(
 
     hints.sort(key=lambda h: h.z_score, reverse=True)
     return hints[:20]
+
+
+# ── Profiling ────────────────────────────────────────────────────────────────
+
+class ProfilingStatus(BaseModel):
+    enabled: bool
+    request_threshold_ms: float
+    loop_threshold_ms: float
+    loops: list[str]
+    interval_ms: float
+    shared: bool  # config + profiles shared across processes via Redis
+    stored: int
+
+
+class ProfilingUpdate(BaseModel):
+    enabled: bool | None = None
+    request_threshold_ms: float | None = Field(None, ge=0)
+    loop_threshold_ms: float | None = Field(None, ge=0)
+    loops: list[str] | None = None
+    interval_ms: float | None = Field(None, ge=1, le=1000)
+
+
+class ProfileSummary(BaseModel):
+    id: str
+    kind: str  # request | loop
+    name: str
+    pid: int
+    started_at: str
+    duration_ms: float
+    samples: int
+    interval_ms: float
+
+
+async def _profiling_status() -> ProfilingStatus:
+    cfg = profiling.get_config()
+    return ProfilingStatus(
+        **asdict(cfg),
+        shared=get_redis() is not None,
+        stored=await profiling.count_profiles(),
+    )
+
+
+def _collapsed_download(stacks: dict[str, int], filename: str) -> PlainTextResponse:
+    return PlainTextResponse(
+        profiling.to_collapsed(stacks),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/profiling", response_model=ProfilingStatus)
+async def get_profiling(user: User = Depends(get_current_user)):
+    """Current profiling settings of this process."""
+    return await _profiling_status()
+
+
+@router.put("/profiling", response_model=ProfilingStatus)
+async def update_profiling(body: ProfilingUpdate, user: User = Depends(get_current_user)):
+    """Switch profiling on/off or tune it; reaches all processes when Redis is configured."""
+    changes = body.model_dump(exclude_none=True)
+    cfg = profiling.configure(**changes)
+    await profiling.publish_config(cfg)
+    logger.info("profiling: %s by user_id=%d (%s)", "enabled" if cfg.enabled else "disabled", user.id, changes)
+    return await _profiling_status()
+
+
+@router.get("/profiles", response_model=list[ProfileSummary])
+async def list_profiles(
+    kind: str | None = Query(None, pattern="^(request|loop)$"),
+    name: str | None = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    user: User = Depends(get_current_user),
+):
+    """Stored slow-request / loop-cycle profiles, newest first."""
+    records = [
+        r for r in await profiling.list_profiles()
+        if (kind is None or r["kind"] == kind) and (name is None or r["name"] == name)
+    ]
+    return [ProfileSummary(**{k: v for k, v in r.items() if k != "stacks"}) for r in records[:limit]]
+
+
+@router.get("/profiles/collapsed")
+async def download_merged_profiles(
+    kind: str | None = Query(None, pattern="^(request|loop)$"),
+    name: str | None = Query(None),
+    user: User = Depends(get_current_user),
+):
+    """All matching profiles merged into one collapsed-stack file (flamegraph.pl, speedscope)."""
+    records = [
+        r for r in await profiling.list_profiles()
+        if (kind is None or r["kind"] == kind) and (name is None or r["name"] == name)
+    ]
+    return _collapsed_download(profiling.merge_stacks(records), "hubex-profiles.collapsed")
+
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str, user: User = Depends(get_current_user)):
+    """One profile as collapsed stacks."""
+    for record in await profiling.list_profiles():
+        if record["id"] == profile_id:
+            return _collapsed_download(record["stacks"], f"hubex-profile-{profile_id}.collapsed")
+    raise HTTPException(status_code=404, detail="profile not found")
+
+
+@router.delete("/profiles", status_code=204)
+async def clear_profiles(user: User = Depends(get_current_user)) -> None:
+    """Drop all stored profiles."""
+    await profiling.clear_profiles()
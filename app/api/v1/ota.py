@@ -21,11 +21,14 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.api.deps import get_db
 from app.api.deps_auth import get_current_device
 from app.api.deps_org import get_current_org_id
+from app.core.cache import cache_rule
 from app.core.system_events import emit_system_event
 from app.db.models.device import Device
 from app.db.models.ota import DeviceOtaStatus, FirmwareVersion, OtaRollout
 
 router = APIRouter(prefix="/ota")
+cache_rule(router, "ota", path="/firmware", ttl=60)
+cache_rule(router, "ota")
 
 _SEMVER_RE = re.compile(r"^\d+\.\d+\.\d+")
 _VALID_STRATEGIES = {"immediate", "staged", "canary"}
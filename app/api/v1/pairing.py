@@ -15,6 +15,7 @@ from app.api.deps import get_db
 from app.api.deps_auth import get_current_user
 from app.api.deps_rate_limit import FixedWindowLimiter
 from app.api.v1.error_utils import raise_api_error
+from app.core import presence
 from app.core.security import hash_device_token
 from app.core.system_events import emit_system_event
 from app.core.device_type import detect_device_type
@@ -189,6 +190,7 @@ async def pairing_hello(
     device.is_claimed = device.owner_user_id is not None
     await db.commit()
     await db.refresh(device)
+    presence.touch(device.id, now)
 
     claimed = device.owner_user_id is not None or device.is_claimed
     if claimed:
@@ -10,7 +10,7 @@ from pydantic import BaseModel
 from sqlalchemy import select, func, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_db
+from app.api.deps import get_db, get_read_db
 from app.api.deps_auth import get_current_user
 from app.core.system_events import emit_system_event
 from app.db.models.report import ReportTemplate, GeneratedReport
@@ -184,7 +184,7 @@ async def generate_report(
 @router.get("/history", response_model=list[ReportOut])
 async def list_generated_reports(
     limit: int = 20,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     result = await db.execute(
         select(GeneratedReport).order_by(desc(GeneratedReport.generated_at)).limit(limit)
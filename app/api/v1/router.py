@@ -9,6 +9,7 @@ from .devices import router as devices_router
 from .pairing import router as pairing_router, legacy_router as pairing_legacy_router
 from .telemetry import router as telemetry_router
 from .tasks import router as tasks_router
+from .fleet_jobs import router as fleet_jobs_router
 from .variables import router as variables_router
 from .entities import router as entities_router
 from .events import router as events_router
@@ -31,7 +32,7 @@ from .semantic_types import router as semantic_types_router
 from .notifications import router as notifications_router
 from .dashboards import router as dashboards_router
 from app.mcp.endpoint import router as mcp_router
-from .agent_protocol import router as agent_router
+from .agent_protocol import router as agent_router, command_router as agent_command_router
 from .search import router as search_router
 from .api_keys import router as api_keys_router
 from .sessions import router as sessions_router
@@ -56,6 +57,7 @@ router.include_router(pairing_router)
 router.include_router(pairing_legacy_router)
 router.include_router(telemetry_router, tags=["telemetry"])
 router.include_router(tasks_router, tags=["tasks"])
+router.include_router(fleet_jobs_router, tags=["fleet-jobs"])
 router.include_router(variables_router, tags=["variables"])
 router.include_router(entities_router, tags=["entities"])
 router.include_router(events_router, tags=["events"])
@@ -79,6 +81,7 @@ router.include_router(notifications_router, tags=["notifications"])
 router.include_router(dashboards_router, tags=["dashboards"])
 router.include_router(mcp_router, tags=["mcp"])
 router.include_router(agent_router, tags=["agent"])
+router.include_router(agent_command_router, tags=["agent"])
 router.include_router(search_router, tags=["search"])
 router.include_router(api_keys_router, tags=["api-keys"])
 router.include_router(sessions_router, tags=["sessions"])
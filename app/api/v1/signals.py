@@ -1,11 +1,12 @@
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, Query
-from pydantic import BaseModel, ConfigDict
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, ConfigDict, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
-from app.core.signals import DEFAULT_LIMIT, MAX_LIMIT, read_signals
+from app.core.signals import DEFAULT_LIMIT, MAX_BATCH, MAX_LIMIT, persist_signals, read_signals
+from app.db.models.providers import ProviderInstance
 
 
 router = APIRouter(prefix="/signals", tags=["signals"])
@@ -27,6 +28,33 @@ class SignalReadOut(BaseModel):
     next_cursor: int | None
 
 
+class SignalItemIn(BaseModel):
+    signal_type: str = Field(min_length=1, max_length=128)
+    payload: dict
+    idempotency_key: str = Field(min_length=1, max_length=128)
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class SignalBatchIn(BaseModel):
+    stream: str = Field(min_length=1, max_length=128)
+    provider_instance_id: int | None = None
+    items: list[SignalItemIn] = Field(min_length=1, max_length=MAX_BATCH)
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class SignalItemResultOut(BaseModel):
+    idempotency_key: str
+    created: bool
+    cursor: int
+
+
+class SignalBatchOut(BaseModel):
+    results: list[SignalItemResultOut]
+    cursor: int | None
+
+
 @router.get("", response_model=SignalReadOut)
 async def list_signals(
     stream: str = Query(..., min_length=1, max_length=128),
@@ -38,3 +66,23 @@ async def list_signals(
     items, next_cursor = await read_signals(db, stream=stream, cursor=cursor, limit=eff_limit)
     return SignalReadOut(items=items, next_cursor=next_cursor)
 
+
+@router.post("/batch", response_model=SignalBatchOut)
+async def ingest_signals(
+    data: SignalBatchIn,
+    db: AsyncSession = Depends(get_db),
+):
+    if data.provider_instance_id is not None:
+        if await db.get(ProviderInstance, data.provider_instance_id) is None:
+            raise HTTPException(status_code=404, detail="provider instance not found")
+    batch = await persist_signals(
+        db,
+        stream=data.stream,
+        items=[item.model_dump() for item in data.items],
+        provider_instance_id=data.provider_instance_id,
+    )
+    return SignalBatchOut(
+        results=[SignalItemResultOut(idempotency_key=r.idempotency_key, created=r.created, cursor=r.cursor)
+                 for r in batch.results],
+        cursor=batch.cursor,
+    )
@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, Optional, List, Literal
 import secrets
+import time
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel, Field, ConfigDict
@@ -11,6 +12,7 @@ from sqlalchemy.dialects.postgresql import insert
 from app.api.deps import get_db
 from app.api.deps_auth import get_current_device
 from app.api.v1.validators import validate_json_object
+from app.core import fleet_jobs, presence, task_queue
 from app.core.system_events import emit_system_event
 from app.db.models.device import Device
 from app.db.models.tasks import ExecutionContext, Task
@@ -19,6 +21,7 @@ router = APIRouter(prefix="/tasks", tags=["tasks"])
 
 MIN_LEASE_SECONDS = 5
 MAX_LEASE_SECONDS = 600
+MAX_CLAIM = 100
 TASK_STATUS_QUEUED = "queued"
 TASK_STATUS_IN_FLIGHT = "in_flight"
 TERMINAL_STATUSES = {"done", "failed", "canceled"}
@@ -101,36 +104,22 @@ async def context_heartbeat(
     )
     res = await db.execute(stmt)
     row = res.one()
-    device.last_seen_at = now
+    presence.touch(device.id, now)
     await db.commit()
     return ContextHeartbeatOut(id=row.id, context_key=row.context_key, last_seen_at=row.last_seen_at)
 
 
-@router.post("/poll", response_model=List[TaskPollOut])
-async def poll_tasks(
-    limit: int = Query(1),
-    context_key: Optional[str] = Query(default=None),
-    lease_seconds: int = Query(60),
-    db: AsyncSession = Depends(get_db),
-    device: Device = Depends(get_current_device),
-):
-    limit = max(1, min(50, limit))
-    lease_seconds = max(MIN_LEASE_SECONDS, min(MAX_LEASE_SECONDS, lease_seconds))
+async def _claim(
+    db: AsyncSession,
+    device_id: int,
+    context_id: Optional[int],
+    count: int,
+    lease_seconds: int,
+) -> list[Task]:
+    """Lease up to `count` claimable tasks of the device (one SELECT, one UPDATE batch)."""
     now = _now_utc()
-    context_id = None
-    if context_key:
-        res = await db.execute(
-            select(ExecutionContext.id).where(
-                ExecutionContext.client_id == device.id,
-                ExecutionContext.context_key == context_key,
-            )
-        )
-        context_id = res.scalar_one_or_none()
-        if context_id is None:
-            return []
-
     stmt = select(Task).where(
-        Task.client_id == device.id,
+        Task.client_id == device_id,
         or_(
             Task.status == TASK_STATUS_QUEUED,
             (Task.status == TASK_STATUS_IN_FLIGHT) & (Task.lease_expires_at < now),
@@ -138,7 +127,7 @@ async def poll_tasks(
     )
     if context_id is not None:
         stmt = stmt.where(Task.execution_context_id == context_id)
-    stmt = stmt.order_by(desc(Task.priority), Task.created_at).limit(limit).with_for_update(
+    stmt = stmt.order_by(desc(Task.priority), Task.created_at).limit(count).with_for_update(
         skip_locked=True
     )
     res = await db.execute(stmt)
@@ -149,8 +138,51 @@ async def poll_tasks(
         task.claimed_at = now
         task.lease_expires_at = lease_expires_at
         task.lease_token = secrets.token_urlsafe(16)
-    device.last_seen_at = now
     await db.commit()
+    return tasks
+
+
+@router.post("/poll", response_model=List[TaskPollOut])
+async def poll_tasks(
+    limit: int = Query(1),
+    max_tasks: Optional[int] = Query(default=None),
+    wait_s: float = Query(0, ge=0),
+    context_key: Optional[str] = Query(default=None),
+    lease_seconds: int = Query(60),
+    db: AsyncSession = Depends(get_db),
+    device: Device = Depends(get_current_device),
+):
+    """Claim up to max_tasks (legacy: limit) queued tasks.
+
+    With wait_s > 0 and nothing to claim, the call is held (without a DB
+    connection) until a task is queued for the device, or wait_s (max 30s)
+    runs out; an empty list is returned then.
+    """
+    count = max(1, min(MAX_CLAIM, max_tasks)) if max_tasks is not None else max(1, min(50, limit))
+    lease_seconds = max(MIN_LEASE_SECONDS, min(MAX_LEASE_SECONDS, lease_seconds))
+    device_id = device.id
+    presence.touch(device_id)
+    context_id = None
+    if context_key:
+        res = await db.execute(
+            select(ExecutionContext.id).where(
+                ExecutionContext.client_id == device_id,
+                ExecutionContext.context_key == context_key,
+            )
+        )
+        context_id = res.scalar_one_or_none()
+        if context_id is None:
+            return []
+
+    deadline = time.monotonic() + min(wait_s, task_queue.LONG_POLL_MAX_SECONDS)
+    # Subscribed before the first claim: a task queued in between still wakes us
+    with task_queue.subscribe(device_id) as wake:
+        while True:
+            tasks = await _claim(db, device_id, context_id, count, lease_seconds)
+            remaining = deadline - time.monotonic()
+            if tasks or remaining <= 0:
+                break
+            await wake.wait(min(remaining, task_queue.recheck_interval()))
 
     return [
         TaskPollOut(
@@ -206,6 +238,8 @@ async def complete_task(
         "device_uid": device.device_uid,
         "status": data.status,
     })
+    if task.fleet_job_id is not None:
+        await fleet_jobs.record_task_result(db, task.fleet_job_id, data.status)
     await db.commit()
     return TaskCompleteOut(id=task.id, status=task.status, completed_at=task.completed_at)
 
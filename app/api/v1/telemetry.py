@@ -1,7 +1,6 @@
 from datetime import datetime, timezone
 from typing import Any, Dict, Optional, List
 import asyncio
-import json
 import time
 import logging
 from collections import deque
@@ -13,6 +12,9 @@ from sqlalchemy import select, desc
 
 from app.api.deps import get_db
 from app.api.deps_auth import get_current_device
+from app.core import presence
+from app.core.json_codec import encoded_size
+from app.core.metrics import TELEMETRY_BRIDGE_SECONDS, TELEMETRY_INGESTED, timed
 from app.core.security import decode_access_token
 from app.core.system_events import emit_system_event
 from app.realtime import hub
@@ -68,21 +70,14 @@ def _flatten_payload(payload: dict, prefix: str = "", _depth: int = 0) -> dict[s
 
 
 def _validate_payload(payload: Dict[str, Any]) -> None:
-    def _walk(obj: Any) -> None:
-        if isinstance(obj, dict):
-            for key, value in obj.items():
-                if not isinstance(key, str):
-                    raise HTTPException(status_code=422, detail="payload keys must be strings")
-                if len(key) > MAX_PAYLOAD_KEY_LENGTH:
-                    raise HTTPException(status_code=422, detail="payload key too long")
-                _walk(value)
-        elif isinstance(obj, list):
-            for item in obj:
-                _walk(item)
-
-    _walk(payload)
-    payload_bytes = len(json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
-    if payload_bytes > MAX_PAYLOAD_BYTES:
+    def _check_key(key: Any) -> None:
+        if not isinstance(key, str):
+            raise HTTPException(status_code=422, detail="payload keys must be strings")
+        if len(key) > MAX_PAYLOAD_KEY_LENGTH:
+            raise HTTPException(status_code=422, detail="payload key too long")
+
+    # One walk checks the keys and sums the encoded size (no json.dumps)
+    if encoded_size(payload, limit=MAX_PAYLOAD_BYTES, check_key=_check_key) > MAX_PAYLOAD_BYTES:
         raise HTTPException(status_code=413, detail="payload too large")
 
 
@@ -120,6 +115,7 @@ class TelemetryRecentOut(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+@timed(TELEMETRY_BRIDGE_SECONDS)
 async def _bridge_telemetry_to_variables(
     device_id: int,
     device_uid: str,
@@ -249,7 +245,7 @@ async def ingest_telemetry(
 ):
     await _check_rate_limit(device.id)
     _validate_payload(data.payload)
-    device.last_seen_at = datetime.now(timezone.utc)
+    presence.touch(device.id)
     # Allow device to self-report its reporting interval
     ri = data.payload.get("reporting_interval_seconds")
     if isinstance(ri, (int, float)) and 1 <= ri <= 86400:
@@ -265,10 +261,6 @@ async def ingest_telemetry(
         "device_id": device.id,
         "event_type": data.event_type,
     })
-    await emit_system_event(db, "device.online", {
-        "device_uid": device.device_uid,
-        "device_id": device.id,
-    })
     await db.commit()
     await db.refresh(telemetry)
     await hub.broadcast(device.id, _serialize_telemetry(telemetry))
@@ -281,6 +273,7 @@ async def ingest_telemetry(
         queued = await enqueue_telemetry(
             device.id, device.device_uid, data.event_type, data.payload
         )
+        TELEMETRY_INGESTED.labels("queued" if queued else "direct").inc()
         if not queued:
             # Fallback to direct processing if Redis unavailable
             asyncio.create_task(
@@ -289,6 +282,7 @@ async def ingest_telemetry(
                 )
             )
     else:
+        TELEMETRY_INGESTED.labels("direct").inc()
         asyncio.create_task(
             _bridge_telemetry_to_variables(
                 device.id, device.device_uid, data.event_type, data.payload
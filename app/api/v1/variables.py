@@ -6,17 +6,17 @@ from fastapi.security import HTTPAuthorizationCredentials
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_db
+from app.api.deps import get_db, get_read_db
 from app.api.deps_auth import (
     get_current_user,
-    get_current_device,
+    device_from_token,
     bearer,
     device_token_header,
 )
 from app.api.v1.error_utils import raise_api_error
 from app.core import variables as vars_core
 from app.core.system_events import emit_system_event
-from app.core.variable_effects import run_effects_once
+from app.core.variable_effects import requeue_dead_effect, run_effects_once
 from app.schemas.variables import (
     VariableDefinitionIn,
     VariableDefinitionPatchIn,
@@ -69,7 +69,7 @@ async def _resolve_actor(
     if user_creds and user_creds.credentials:
         user = await get_current_user(creds=user_creds, db=db)
     if device_token:
-        device = await get_current_device(device_token=device_token, db=db)
+        device = await device_from_token(device_token, db)
     if user:
         return user, None
     if device:
@@ -229,7 +229,7 @@ async def get_variable_history(
     to_time: datetime | None = Query(default=None, alias="to"),
     limit: int = Query(default=500, ge=1, le=2000),
     downsample: int | None = Query(default=None, ge=10, le=86400),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user=Depends(get_current_user),
 ):
     """Get time-series history for a variable. Optionally downsample."""
@@ -918,6 +918,30 @@ async def get_effect(
     )
 
 
+@router.post("/effects/{effect_id}/retry", response_model=VariableEffectOut)
+async def retry_effect(
+    effect_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """Re-queue a dead-lettered effect; it runs ahead of newer effects of its device."""
+    res = await db.execute(select(VariableEffect).where(VariableEffect.id == effect_id))
+    item = res.scalar_one_or_none()
+    if item is None:
+        raise_api_error(404, "VAR_EFFECT_NOT_FOUND", "effect not found")
+    if item.device_id is not None:
+        res = await db.execute(select(Device).where(Device.id == item.device_id))
+        device = res.scalar_one_or_none()
+        if device is None or device.owner_user_id != current_user.id:
+            raise_api_error(404, "DEVICE_NOT_OWNED", "Device not owned")
+    if item.status != "dead":
+        raise_api_error(409, "VAR_EFFECT_NOT_DEAD", "only dead effects can be retried")
+    requeue_dead_effect(item)
+    await db.commit()
+    await db.refresh(item)
+    return VariableEffectOut.model_validate(item)
+
+
 @router.post("/effects/run-once", response_model=VariableEffectRunOut)
 async def run_effects(
     data: VariableEffectRunIn = Body(...),
@@ -945,7 +969,7 @@ async def export_variable_history(
     device_uid: str = Query(None),
     limit: int = Query(5000, le=50000),
     format: str = Query("csv"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """Export variable history as CSV or JSON."""
     import csv
@@ -0,0 +1,561 @@
+"""Load-test and benchmark harness: ``python -m app.bench``.
+
+Boots the app in-process (ASGI, no sockets) against a throwaway SQLite file,
+or against Postgres/Redis given on the command line. It seeds a user, N
+claimed devices with tokens, device variables, queued tasks and automation
+rules, then drives every simulated device as an asyncio client through the
+device hot paths:
+
+    ingest        POST /telemetry (+ the telemetry→variable bridge)
+    snapshot      GET  /variables/snapshot
+    edge_config   GET  /edge/config
+    tasks         POST /tasks/poll, then /tasks/{id}/complete
+    automation    rule evaluation over the telemetry events written by ingest
+
+Each operation reports throughput, p50/p95/p99 latency, SQL statements per
+request (X-DB-Queries, see app.db.query_stats) and process memory. Results
+are written as JSON. ``--baseline`` compares a run against an earlier one and
+exits non-zero on a regression, so CI can gate performance changes.
+
+The app reads its settings at import time, so configure_environment() must
+run before anything under app.* other than this package is imported.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import platform
+import secrets
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+try:  # not available on Windows
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore[assignment]
+
+SCENARIOS = ("ingest", "snapshot", "edge_config", "tasks", "automation")
+
+
+@dataclass
+class BenchConfig:
+    devices: int = 50
+    requests: int = 20  # operations per device and scenario
+    concurrency: int = 50  # requests in flight across all devices
+    variables: int = 10  # device-scoped variables per device
+    rules: int = 20  # telemetry_received automation rules
+    scenarios: tuple[str, ...] = SCENARIOS
+    database_url: str = ""  # empty = fresh SQLite file in a temp dir
+    redis_url: str = ""  # empty = run without Redis
+
+
+# ---------------------------------------------------------------------------
+# Environment
+# ---------------------------------------------------------------------------
+
+def configure_environment(config: BenchConfig, workdir: str) -> str:
+    """Point the app at the benchmark database and return its URL.
+
+    Background loops stay off (HUBEX_ROLE=api) so they don't compete with the
+    measured requests; the automation scenario drives rule evaluation itself.
+    """
+    if "app.core.config" in sys.modules:
+        raise RuntimeError("configure_environment() must run before the app is imported")
+    url = config.database_url or f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+    env = {
+        "DATABASE_URL": url,
+        "HUBEX_DATABASE_URL": url,
+        "HUBEX_REDIS_URL": config.redis_url,
+        "HUBEX_ROLE": "api",
+        "HUBEX_DB_QUERY_HEADERS": "true",
+        "HUBEX_RATE_LIMIT_ENABLED": "false",
+        "HUBEX_METRICS_DIR": "",
+        "HUBEX_LOG_LEVEL": "WARNING",
+    }
+    os.environ.update(env)
+    if url.startswith("sqlite"):
+        _sqlite_compat(url)
+    return url
+
+
+def _sqlite_compat(url: str) -> None:
+    """Give the SQLite stand-in enough Postgres semantics to run the hot paths.
+
+    JSONB columns become JSON, BIGINT keys autoincrement, timestamptz columns read back timezone-aware,
+    and every transaction starts with BEGIN IMMEDIATE. Without the last one
+    concurrent requests fail with "database is locked" when two readers
+    both try to upgrade to writers.
+    """
+    import sqlite3
+
+    from sqlalchemy import BigInteger, event
+    from sqlalchemy.dialects.postgresql import JSONB
+    from sqlalchemy.dialects.sqlite import DATETIME
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.ext.compiler import compiles
+    from sqlalchemy.schema import CreateColumn
+
+    @compiles(JSONB, "sqlite")
+    def _jsonb(type_, compiler, **kw):
+        return "JSON"
+
+    @compiles(BigInteger, "sqlite")
+    def _bigint(type_, compiler, **kw):
+        return "INTEGER"  # only INTEGER PRIMARY KEY autoincrements
+
+    @compiles(CreateColumn, "sqlite")
+    def _column(element, compiler, **kw):
+        return compiler.visit_create_column(element, **kw).replace("::jsonb", "")
+
+    naive_processor = DATETIME.result_processor
+
+    def aware_processor(self, dialect, coltype):
+        process = naive_processor(self, dialect, coltype)
+        if not self.timezone:
+            return process
+
+        def to_aware(value):
+            value = process(value) if process else value
+            return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
+        return to_aware
+
+    DATETIME.result_processor = aware_processor
+
+    @event.listens_for(Engine, "connect")
+    def _manual_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA busy_timeout = 60000")  # queue for the lock, don't fail
+        cursor.close()
+
+    @event.listens_for(Engine, "begin")
+    def _begin_immediate(conn):
+        # Raw DBAPI cursor: keeps BEGIN out of the per-request statement counts
+        cursor = conn.connection.dbapi_connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.close()
+
+    path = url.split(":///", 1)[1]
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as fh:
+            pages = int(fh.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of `values` (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), int(-(-q * len(ordered) // 100))))
+    return ordered[rank - 1]
+
+
+class Recorder:
+    """Latencies, statement counts and errors of one operation."""
+
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        self.queries: list[int] = []
+        self.errors = 0
+        self.statuses: dict[str, int] = {}
+
+    def add(self, seconds: float, queries: Optional[int], ok: bool, status: str = "") -> None:
+        self.latencies.append(seconds)
+        if queries is not None:
+            self.queries.append(queries)
+        if not ok:
+            self.errors += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self, elapsed: float, rss_before: Optional[float]) -> dict[str, Any]:
+        ops = len(self.latencies)
+        ms = [s * 1000 for s in self.latencies]
+        rss = _rss_mb()
+        return {
+            "ops": ops,
+            "errors": self.errors,
+            "error_statuses": self.statuses,
+            "seconds": round(elapsed, 3),
+            "throughput_per_s": round(ops / elapsed, 1) if elapsed > 0 else 0.0,
+            "latency_ms": {
+                "mean": round(sum(ms) / ops, 2) if ops else 0.0,
+                "p50": round(percentile(ms, 50), 2),
+                "p95": round(percentile(ms, 95), 2),
+                "p99": round(percentile(ms, 99), 2),
+                "max": round(max(ms), 2) if ms else 0.0,
+            },
+            "db_queries_per_op": round(sum(self.queries) / len(self.queries), 2) if self.queries else None,
+            "db_queries_max": max(self.queries) if self.queries else None,
+            "rss_mb": rss,
+            "rss_delta_mb": round(rss - rss_before, 1) if rss is not None and rss_before is not None else None,
+        }
+
+
+async def _timed_request(client, recorder: Recorder, method: str, url: str, **kwargs):
+    start = time.perf_counter()
+    try:
+        resp = await client.request(method, url, **kwargs)
+    except Exception as exc:
+        recorder.add(time.perf_counter() - start, None, False, type(exc).__name__)
+        return None
+    elapsed = time.perf_counter() - start
+    queries = resp.headers.get("X-DB-Queries")
+    ok = resp.status_code < 400
+    recorder.add(elapsed, int(queries) if queries else None, ok, str(resp.status_code))
+    return resp if ok else None
+
+
+# ---------------------------------------------------------------------------
+# Seeding
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Fleet:
+    run_id: str
+    user_id: int
+    user_token: str  # bearer with the execution-worker caps (tasks.*)
+    devices: list[tuple[int, str, str]]  # (device_id, device_uid, token)
+
+
+async def seed(Session, config: BenchConfig) -> Fleet:
+    """Create the benchmark user, devices, variables, tasks and rules."""
+    from sqlalchemy import select
+
+    from app.core.security import create_access_token, hash_device_token
+    from app.db.models.automation import AutomationRule
+    from app.db.models.device import Device
+    from app.db.models.pairing import DeviceToken
+    from app.db.models.tasks import Task
+    from app.db.models.user import User
+    from app.db.models.variables import VariableDefinition, VariableValue
+
+    run_id = secrets.token_hex(4)
+    keys = [f"bench.v{i}" for i in range(config.variables)]
+    async with Session() as db:
+        user = User(email=f"bench-{run_id}@bench.local", password_hash="!")
+        db.add(user)
+        await db.flush()
+
+        devices = [
+            Device(
+                device_uid=f"bench-{run_id}-{i:05d}", name=f"bench {i}",
+                owner_user_id=user.id, is_claimed=True, device_type="bench",
+            )
+            for i in range(config.devices)
+        ]
+        db.add_all(devices)
+        await db.flush()
+
+        tokens = [secrets.token_urlsafe(24) for _ in devices]
+        db.add_all(
+            DeviceToken(device_id=d.id, token_hash=hash_device_token(t), is_active=True)
+            for d, t in zip(devices, tokens)
+        )
+
+        existing = set((await db.execute(
+            select(VariableDefinition.key).where(VariableDefinition.key.in_(keys))
+        )).scalars())
+        db.add_all(
+            VariableDefinition(key=k, scope="device", value_type="float", default_value=0.0)
+            for k in keys if k not in existing
+        )
+        await db.flush()
+        db.add_all(
+            VariableValue(variable_key=k, scope="device", device_id=d.id, value_json=float(j))
+            for d in devices for j, k in enumerate(keys)
+        )
+
+        if "tasks" in config.scenarios:
+            db.add_all(
+                Task(client_id=d.id, type="bench.noop", payload={"n": n}, status="queued")
+                for d in devices for n in range(config.requests)
+            )
+        if "automation" in config.scenarios and devices:
+            db.add_all(
+                AutomationRule(
+                    name=f"bench {run_id} #{i}",
+                    trigger_type="telemetry_received",
+                    trigger_config={"device_uid": devices[i % len(devices)].device_uid},
+                    action_type="emit_system_event",
+                    action_config={"event_type": "bench.fired"},
+                    cooldown_seconds=0,
+                )
+                for i in range(config.rules)
+            )
+        await db.commit()
+
+    return Fleet(
+        run_id=run_id,
+        user_id=user.id,
+        user_token=create_access_token(str(user.id), caps=["tasks.read", "tasks.write"]),
+        devices=[(d.id, d.device_uid, t) for d, t in zip(devices, tokens)],
+    )
+
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+async def _per_device(fleet: Fleet, config: BenchConfig, op) -> float:
+    """Run `op(device, n)` `requests` times per device; return wall time."""
+    sem = asyncio.Semaphore(max(1, config.concurrency))
+
+    async def device_loop(device):
+        for n in range(config.requests):
+            async with sem:
+                await op(device, n)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(device_loop(d) for d in fleet.devices))
+    return time.perf_counter() - start
+
+
+async def _wait_for_bridge(timeout: float = 60.0) -> float:
+    """Wait for fire-and-forget telemetry→variable bridge tasks to finish."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        pending = [
+            t for t in asyncio.all_tasks()
+            if not t.done() and getattr(t.get_coro(), "__name__", "") == "_bridge_telemetry_to_variables"
+        ]
+        if not pending:
+            break
+        await asyncio.wait(pending, timeout=timeout)
+    return time.perf_counter() - start
+
+
+async def run_ingest(client, fleet: Fleet, config: BenchConfig) -> dict[str, dict]:
+    from app.api.v1 import telemetry as telemetry_api
+
+    # Measure the ingest path, not the per-device abuse limit
+    telemetry_api.RATE_LIMIT_PER_MINUTE = max(telemetry_api.RATE_LIMIT_PER_MINUTE, config.requests + 1)
+    rec, rss = Recorder(), _rss_mb()
+
+    async def op(device, n):
+        _, _, token = device
+        body = {"event_type": "bench", "payload": {"temperature": 20 + n % 10, "humidity": 40 + n % 7}}
+        await _timed_request(client, rec, "POST", "/api/v1/telemetry", json=body,
+                             headers={"X-Device-Token": token})
+
+    elapsed = await _per_device(fleet, config, op)
+    result = rec.summary(elapsed, rss)
+    result["bridge_drain_s"] = round(await _wait_for_bridge(), 3)
+    return {"ingest": result}
+
+
+async def run_snapshot(client, fleet: Fleet, config: BenchConfig) -> dict[str, dict]:
+    rec, rss = Recorder(), _rss_mb()
+
+    async def op(device, n):
+        await _timed_request(client, rec, "GET", "/api/v1/variables/snapshot",
+                             headers={"X-Device-Token": device[2]})
+
+    elapsed = await _per_device(fleet, config, op)
+    return {"snapshot": rec.summary(elapsed, rss)}
+
+
+async def run_edge_config(client, fleet: Fleet, config: BenchConfig) -> dict[str, dict]:
+    rec, rss = Recorder(), _rss_mb()
+
+    async def op(device, n):
+        await _timed_request(client, rec, "GET", "/api/v1/edge/config",
+                             headers={"X-Device-Token": device[2]})
+
+    elapsed = await _per_device(fleet, config, op)
+    return {"edge_config": rec.summary(elapsed, rss)}
+
+
+async def run_tasks(client, fleet: Fleet, config: BenchConfig) -> dict[str, dict]:
+    poll, complete, rss = Recorder(), Recorder(), _rss_mb()
+
+    async def op(device, n):
+        headers = {"X-Device-Token": device[2], "Authorization": f"Bearer {fleet.user_token}"}
+        resp = await _timed_request(client, poll, "POST", "/api/v1/tasks/poll?limit=1", headers=headers)
+        for task in resp.json() if resp is not None else []:
+            await _timed_request(
+                client, complete, "POST", f"/api/v1/tasks/{task['id']}/complete", headers=headers,
+                json={"status": "done", "lease_token": task["lease_token"]},
+            )
+
+    elapsed = await _per_device(fleet, config, op)
+    return {"task_poll": poll.summary(elapsed, rss), "task_complete": complete.summary(elapsed, rss)}
+
+
+async def run_automation(Session, fleet: Fleet, config: BenchConfig, since_event_id: int) -> dict[str, dict]:
+    """Evaluate rules over this run's telemetry events, one event at a time like the engine."""
+    from sqlalchemy import select
+
+    from app.core.automation_engine import EVENT_STREAM, _evaluate_event
+    from app.core.config import settings
+    from app.core.system_events import emit_system_event
+    from app.db.models.events import EventV1
+    from app.db.query_stats import track_queries
+
+    async with Session() as db:
+        if "ingest" not in config.scenarios:
+            for device_id, uid, _ in fleet.devices:
+                for _ in range(config.requests):
+                    await emit_system_event(db, "telemetry.received", {
+                        "device_uid": uid, "device_id": device_id, "event_type": "bench",
+                    })
+            await db.commit()
+        uids = {uid for _, uid, _ in fleet.devices}
+        event_ids = [
+            row.id for row in (await db.execute(
+                select(EventV1.id, EventV1.payload).where(
+                    EventV1.stream == EVENT_STREAM,
+                    EventV1.id > since_event_id,
+                    EventV1.type == "telemetry.received",
+                ).order_by(EventV1.id)
+            )).all()
+            if (row.payload or {}).get("device_uid") in uids
+        ]
+
+    rec, rss = Recorder(), _rss_mb()
+    batch = max(1, settings.automation_batch_size)
+    start = time.perf_counter()
+    for offset in range(0, len(event_ids), batch):
+        async with Session() as db:
+            events = (await db.execute(
+                select(EventV1).where(EventV1.id.in_(event_ids[offset:offset + batch])).order_by(EventV1.id)
+            )).scalars().all()
+            for event in events:
+                t0 = time.perf_counter()
+                with track_queries("bench:automation") as stats:
+                    await _evaluate_event(db, event)
+                rec.add(time.perf_counter() - t0, stats.count, True)
+            await db.commit()
+    return {"automation": rec.summary(time.perf_counter() - start, rss)}
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+async def run(config: BenchConfig) -> dict[str, Any]:
+    """Boot the app, seed the fleet and run the selected scenarios."""
+    import httpx
+    from sqlalchemy import func, select
+
+    from app.db.models.events import EventV1
+    from app.db.session import AsyncSessionLocal, DATABASE_URL
+    from app.main import app
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    results: dict[str, dict] = {}
+    async with app.router.lifespan_context(app):
+        fleet = await seed(AsyncSessionLocal, config)
+        async with AsyncSessionLocal() as db:
+            since_event_id = (await db.execute(select(func.max(EventV1.id)))).scalar() or 0
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            if "ingest" in config.scenarios:
+                results.update(await run_ingest(client, fleet, config))
+            if "snapshot" in config.scenarios:
+                results.update(await run_snapshot(client, fleet, config))
+            if "edge_config" in config.scenarios:
+                results.update(await run_edge_config(client, fleet, config))
+            if "tasks" in config.scenarios:
+                results.update(await run_tasks(client, fleet, config))
+        if "automation" in config.scenarios:
+            results.update(await run_automation(AsyncSessionLocal, fleet, config, since_event_id))
+
+    return {
+        "meta": {
+            "started_at": started_at,
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": DATABASE_URL.split(":", 1)[0],
+            "redis": bool(config.redis_url),
+            "run_id": fleet.run_id,
+            "peak_rss_mb": _peak_rss_mb(),
+            "config": {k: v for k, v in asdict(config).items() if k not in ("database_url", "redis_url")},
+        },
+        "scenarios": results,
+    }
+
+
+def compare(
+    current: dict[str, Any],
+    baseline: dict[str, Any],
+    max_regression: float = 0.25,
+    max_query_regression: float = 0.1,
+) -> list[str]:
+    """Regressions of `current` against `baseline`, as readable lines.
+
+    Throughput and p99 latency may drift by `max_regression` (a fraction)
+    before they count. Statements per operation hardly depend on the machine
+    and get the tighter `max_query_regression`; they still vary a little
+    with how the telemetry bridge interleaves with later scenarios.
+    """
+    problems: list[str] = []
+    for name, cur in current.get("scenarios", {}).items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if base["throughput_per_s"] and cur["throughput_per_s"] < base["throughput_per_s"] * (1 - max_regression):
+            problems.append(
+                f"{name}: throughput {cur['throughput_per_s']}/s < baseline {base['throughput_per_s']}/s"
+            )
+        cur_p99, base_p99 = cur["latency_ms"]["p99"], base["latency_ms"]["p99"]
+        if base_p99 and cur_p99 > base_p99 * (1 + max_regression):
+            problems.append(f"{name}: p99 {cur_p99} ms > baseline {base_p99} ms")
+        cur_q, base_q = cur.get("db_queries_per_op"), base.get("db_queries_per_op")
+        if cur_q is not None and base_q is not None and cur_q > base_q * (1 + max_query_regression) + 1e-9:
+            problems.append(f"{name}: {cur_q} statements/op > baseline {base_q}")
+        if cur["errors"] > base["errors"]:
+            problems.append(f"{name}: {cur['errors']} errors (baseline {base['errors']})")
+    return problems
+
+
+def format_table(result: dict[str, Any]) -> str:
+    lines = [
+        f"{'operation':<14} {'ops':>6} {'err':>4} {'ops/s':>9} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'sql/op':>7} {'rss MB':>7}"
+    ]
+    for name, s in result["scenarios"].items():
+        q = s["db_queries_per_op"]
+        lines.append(
+            f"{name:<14} {s['ops']:>6} {s['errors']:>4} {s['throughput_per_s']:>9} "
+            f"{s['latency_ms']['p50']:>8} {s['latency_ms']['p99']:>8} "
+            f"{q if q is not None else '-':>7} {s['rss_mb'] if s['rss_mb'] is not None else '-':>7}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,209 @@
+"""Agent command queue: persisted, per device, at-least-once.
+
+Operators enqueue commands for a device (POST /devices/{id}/commands). The
+agent receives them piggy-backed on its heartbeat (POST /agent/heartbeat),
+optionally long-polling up to LONG_POLL_MAX_SECONDS when nothing is due.
+
+Lifecycle of an agent_commands row:
+
+  pending ──claim──▶ delivered ──ack──▶ acked
+     ▲                   │ nack(retry) / no ack within ACK_TIMEOUT_SECONDS
+     └───── backoff ─────┘ (redelivered; failed after max_attempts)
+
+  pending/delivered past expires_at ─▶ expired    (operator) ─▶ cancelled
+
+Delivery is at-least-once: a command whose ack is lost is delivered again
+after the ack deadline, so agents should treat command ids as idempotency
+keys. Acks for commands that are already finished are accepted and ignored.
+
+Long-poll wake-ups go through app.core.wakeups on NOTIFY_CHANNEL, keyed by
+device id: committing a new command wakes the device's heartbeats in this
+process, and the agent_commands insert trigger (migration b9c0d1e2f3a6)
+sends NOTIFY hubex_agent_commands for the other processes. Without the
+listener, waiters re-check the queue every LONG_POLL_RECHECK_SECONDS.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import AbstractContextManager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import wakeups
+from app.core.metrics import observe_cycle
+from app.db.models.agent_commands import AgentCommandEntry
+
+logger = logging.getLogger("uvicorn.error")
+
+ACK_TIMEOUT_SECONDS = 60
+RETRY_DELAYS = [5, 30, 120, 600]  # after the 1st, 2nd, ... nack
+MAX_COMMANDS_PER_HEARTBEAT = 20
+LONG_POLL_MAX_SECONDS = 30.0
+LONG_POLL_RECHECK_SECONDS = 5.0  # without the listener
+SWEEP_INTERVAL = 60  # seconds between expiry sweeps
+NOTIFY_CHANNEL = "hubex_agent_commands"
+
+OPEN_STATUSES = ("pending", "delivered")
+
+wakeups.track_inserts(
+    NOTIFY_CHANNEL, AgentCommandEntry, lambda row: row.device_id if row.status == "pending" else None,
+)
+wakeups.follow(NOTIFY_CHANNEL, int)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def enqueue_command(
+    db: AsyncSession,
+    device_id: int,
+    type: str,
+    payload: Optional[dict[str, Any]] = None,
+    ttl_seconds: Optional[int] = None,
+    max_attempts: int = 5,
+    created_by: Optional[int] = None,
+) -> AgentCommandEntry:
+    """Queue a command. Caller commits, which wakes the device's heartbeats."""
+    now = _now()
+    row = AgentCommandEntry(
+        device_id=device_id,
+        type=type,
+        payload=payload or {},
+        status="pending",
+        attempts=0,
+        max_attempts=max_attempts,
+        next_attempt_at=now,
+        expires_at=now + timedelta(seconds=ttl_seconds) if ttl_seconds else None,
+        created_by=created_by,
+    )
+    db.add(row)
+    await db.flush()
+    return row
+
+
+async def claim_commands(
+    db: AsyncSession, device_id: int, limit: int = MAX_COMMANDS_PER_HEARTBEAT,
+) -> list[dict[str, Any]]:
+    """Mark the device's due commands delivered and return them. Caller commits.
+
+    Due means pending and past its backoff, or delivered and past its ack
+    deadline. Rows are locked with SKIP LOCKED so two concurrent heartbeats
+    of one agent never receive the same command.
+    """
+    now = _now()
+    res = await db.execute(
+        select(AgentCommandEntry)
+        .where(
+            AgentCommandEntry.device_id == device_id,
+            AgentCommandEntry.status.in_(OPEN_STATUSES),
+            AgentCommandEntry.next_attempt_at <= now,
+            or_(AgentCommandEntry.expires_at.is_(None), AgentCommandEntry.expires_at > now),
+        )
+        .order_by(AgentCommandEntry.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = []
+    for row in res.scalars().all():
+        if row.attempts >= row.max_attempts:
+            row.status = "failed"
+            row.last_error = row.last_error or f"not acknowledged after {row.attempts} deliveries"
+            row.completed_at = now
+            continue
+        row.status = "delivered"
+        row.attempts += 1
+        row.delivered_at = now
+        row.next_attempt_at = now + timedelta(seconds=ACK_TIMEOUT_SECONDS)
+        claimed.append({"id": row.id, "type": row.type, "payload": dict(row.payload or {})})
+    return claimed
+
+
+async def complete_command(
+    db: AsyncSession,
+    device_id: int,
+    command_id: int,
+    ok: bool,
+    result: Optional[dict[str, Any]] = None,
+    error: Optional[str] = None,
+    retry: bool = False,
+) -> Optional[AgentCommandEntry]:
+    """Record an ack (ok) or nack. Returns None if the device has no such command.
+
+    A nack with retry=True goes back to pending after a backoff while
+    attempts remain; otherwise the command fails. Caller commits.
+    """
+    res = await db.execute(
+        select(AgentCommandEntry)
+        .where(AgentCommandEntry.id == command_id, AgentCommandEntry.device_id == device_id)
+        .with_for_update()
+    )
+    row = res.scalar_one_or_none()
+    if row is None or row.status not in OPEN_STATUSES:
+        return row  # duplicate ack of a finished command: nothing to do
+    now = _now()
+    if ok:
+        row.status = "acked"
+        row.result = result
+        row.completed_at = now
+    elif retry and row.attempts < row.max_attempts:
+        row.status = "pending"
+        row.last_error = (error or "nack")[:512]
+        row.next_attempt_at = now + timedelta(
+            seconds=RETRY_DELAYS[min(max(row.attempts - 1, 0), len(RETRY_DELAYS) - 1)]
+        )
+    else:
+        row.status = "failed"
+        row.result = result
+        row.last_error = (error or "nack")[:512]
+        row.completed_at = now
+    return row
+
+
+async def expire_commands(db: AsyncSession) -> int:
+    """Close open commands past their expiry; returns how many. Caller commits."""
+    now = _now()
+    res = await db.execute(
+        update(AgentCommandEntry)
+        .where(
+            AgentCommandEntry.status.in_(OPEN_STATUSES),
+            and_(AgentCommandEntry.expires_at.is_not(None), AgentCommandEntry.expires_at <= now),
+        )
+        .values(status="expired", completed_at=now)
+    )
+    return res.rowcount or 0
+
+
+async def agent_command_sweeper_loop() -> None:
+    """Background loop: expires commands of devices that never came back."""
+    from app.db.session import WorkerSessionLocal
+
+    while True:
+        try:
+            with observe_cycle("agent_command_sweeper"):
+                async with WorkerSessionLocal() as db:
+                    expired = await expire_commands(db)
+                    await db.commit()
+            if expired:
+                logger.info("agent_commands: expired %d commands", expired)
+        except Exception:
+            logger.exception("agent_commands: unhandled error in sweep cycle")
+        await asyncio.sleep(SWEEP_INTERVAL)
+
+
+# ---------------------------------------------------------------------------
+# Long-poll wake-ups
+# ---------------------------------------------------------------------------
+
+def subscribe(device_id: int) -> AbstractContextManager[wakeups.Subscription]:
+    """Wake-ups for new commands of the device; register *before* claiming."""
+    return wakeups.subscribe(NOTIFY_CHANNEL, (device_id,))
+
+
+def recheck_interval() -> float:
+    """How long a waiter may park before looking at the queue again."""
+    return wakeups.recheck_interval(LONG_POLL_MAX_SECONDS, LONG_POLL_RECHECK_SECONDS)
@@ -7,13 +7,19 @@ condition clears, open events are auto-resolved.
 Supported condition_types and their condition_config keys
 ---------------------------------------------------------
 device_offline:
-    threshold_seconds (int, default 120)
+    threshold_seconds (int, default 120) — silent for this long; devices count
+                      once the presence tracker reported them offline, so
+                      values below HUBEX_PRESENCE_OFFLINE_SECONDS act as it
     device_ids        (list[int] | None) — scope to specific devices; if None,
                       fires when *any* claimed device is offline
 
 entity_health:
     entity_id         (str)
     min_online        (int, default 1) — alert if online count < min_online
+                      (online: not reported offline by the presence tracker)
+
+Both follow the tracker's device.online / device.offline transitions through
+an app.core.presence.OfflineView instead of scanning devices.last_seen_at.
 
 effect_failure_rate:
     kind              (str) — EffectV1.kind to filter
@@ -27,23 +33,29 @@ event_lag:
 import asyncio
 import logging
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 
 from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.metrics import observe_cycle
+from app.core.presence import OfflineView
 from app.core.system_events import emit_system_event
-from app.core.notification_service import create_notification_all_users
+from app.core.notification_service import (
+    PendingPush,
+    create_notification_all_users,
+    dispatch_notifications,
+)
 from app.db.models.alerts import AlertEvent, AlertRule
 from app.db.models.device import Device
 from app.db.models.effects import EffectV1
 from app.db.models.entities import Entity, EntityDeviceBinding
 from app.db.models.events import EventV1
-from app.db.session import AsyncSessionLocal
+from app.db.session import WorkerSessionLocal
 
 logger = logging.getLogger("uvicorn.error")
 
 EVAL_INTERVAL = 30  # seconds between evaluation cycles
-ONLINE_WINDOW_SECONDS = 30
 STALE_WINDOW_SECONDS = 120
 
 
@@ -51,51 +63,59 @@ STALE_WINDOW_SECONDS = 120
 # Condition evaluators — return (should_fire: bool, message: str)
 # ---------------------------------------------------------------------------
 
-async def _eval_device_offline(config: dict, db: AsyncSession, now: datetime) -> tuple[bool, str]:
+async def _eval_device_offline(
+    config: dict, db: AsyncSession, now: datetime, view: OfflineView,
+) -> tuple[bool, str]:
     threshold = config.get("threshold_seconds", STALE_WINDOW_SECONDS)
     device_ids: list[int] | None = config.get("device_ids")
     cutoff = now - timedelta(seconds=threshold)
 
-    stmt = select(func.count()).select_from(Device).where(
-        Device.is_claimed.is_(True),
-        (Device.last_seen_at.is_(None)) | (Device.last_seen_at < cutoff),
-    )
+    candidates = [
+        device_id for device_id, last_seen_at in view.offline.items()
+        if last_seen_at is None or last_seen_at < cutoff
+    ]
     if device_ids:
-        stmt = stmt.where(Device.id.in_(device_ids))
+        scope = set(device_ids)
+        candidates = [device_id for device_id in candidates if device_id in scope]
+    if not candidates:
+        return False, ""
 
-    res = await db.execute(stmt)
+    res = await db.execute(
+        select(func.count()).select_from(Device).where(
+            Device.id.in_(candidates),
+            Device.is_claimed.is_(True),
+        )
+    )
     count = res.scalar_one()
     if count > 0:
         return True, f"{count} device(s) offline for more than {threshold}s"
     return False, ""
 
 
-async def _eval_entity_health(config: dict, db: AsyncSession, now: datetime) -> tuple[bool, str]:
+async def _eval_entity_health(
+    config: dict, db: AsyncSession, now: datetime, view: OfflineView,
+) -> tuple[bool, str]:
     entity_id: str | None = config.get("entity_id")
     min_online: int = config.get("min_online", 1)
 
     if not entity_id:
         return False, ""
 
-    cutoff_online = now - timedelta(seconds=ONLINE_WINDOW_SECONDS)
     res = await db.execute(
-        select(func.count())
-        .select_from(Device)
-        .join(EntityDeviceBinding, EntityDeviceBinding.device_id == Device.id)
-        .where(
+        select(EntityDeviceBinding.device_id).where(
             EntityDeviceBinding.entity_id == entity_id,
             EntityDeviceBinding.enabled.is_(True),
-            Device.last_seen_at.is_not(None),
-            Device.last_seen_at >= cutoff_online,
         )
     )
-    online_count = res.scalar_one()
+    online_count = sum(1 for device_id in res.scalars().all() if not view.is_offline(device_id))
     if online_count < min_online:
         return True, f"entity {entity_id} has {online_count} online device(s), min required {min_online}"
     return False, ""
 
 
-async def _eval_effect_failure_rate(config: dict, db: AsyncSession, now: datetime) -> tuple[bool, str]:
+async def _eval_effect_failure_rate(
+    config: dict, db: AsyncSession, now: datetime, view: OfflineView,
+) -> tuple[bool, str]:
     kind: str | None = config.get("kind")
     threshold: float = config.get("failure_rate_threshold", 0.5)
     window: int = config.get("window_seconds", 300)
@@ -124,7 +144,9 @@ async def _eval_effect_failure_rate(config: dict, db: AsyncSession, now: datetim
     return False, ""
 
 
-async def _eval_event_lag(config: dict, db: AsyncSession, now: datetime) -> tuple[bool, str]:
+async def _eval_event_lag(
+    config: dict, db: AsyncSession, now: datetime, view: OfflineView,
+) -> tuple[bool, str]:
     stream: str | None = config.get("stream")
     max_lag: int = config.get("max_lag_seconds", 300)
 
@@ -145,7 +167,9 @@ async def _eval_event_lag(config: dict, db: AsyncSession, now: datetime) -> tupl
     return False, ""
 
 
-async def _eval_variable_threshold(config: dict, db: AsyncSession, now: datetime) -> tuple[bool, str]:
+async def _eval_variable_threshold(
+    config: dict, db: AsyncSession, now: datetime, view: OfflineView,
+) -> tuple[bool, str]:
     """
     config keys:
       variable_key (str, required)
@@ -209,10 +233,17 @@ _EVALUATORS = {
 # Core evaluation logic (testable — accepts a db session and now)
 # ---------------------------------------------------------------------------
 
-async def run_alert_cycle(db: AsyncSession, now: datetime) -> None:
-    """Evaluate all enabled alert rules and update alert events accordingly."""
+async def run_alert_cycle(db: AsyncSession, now: datetime, view: Optional[OfflineView] = None) -> None:
+    """Evaluate all enabled alert rules and update alert events accordingly.
+
+    view is refreshed first; without one it is seeded from the devices table.
+    """
+    if view is None:
+        view = OfflineView()
+    await view.refresh(db, now)
     res = await db.execute(select(AlertRule).where(AlertRule.enabled.is_(True)))
     rules: list[AlertRule] = list(res.scalars().all())
+    pending_pushes: list[PendingPush] = []
 
     for rule in rules:
         evaluator = _EVALUATORS.get(rule.condition_type)
@@ -221,7 +252,7 @@ async def run_alert_cycle(db: AsyncSession, now: datetime) -> None:
             continue
 
         try:
-            should_fire, message = await evaluator(rule.condition_config or {}, db, now)
+            should_fire, message = await evaluator(rule.condition_config or {}, db, now, view)
         except Exception:
             logger.exception("alert_worker: evaluator error rule_id=%d", rule.id)
             continue
@@ -269,16 +300,19 @@ async def run_alert_cycle(db: AsyncSession, now: datetime) -> None:
                 "message": message,
                 "alert_event_id": event.id,
             })
-            # Push notification to all users
+            # Notify the rule's org (or everyone for org-less rules); the
+            # savepoint keeps a failed fan-out from aborting the alert itself.
             try:
-                await create_notification_all_users(
-                    db,
-                    type="alert_fired",
-                    title=f"Alert: {rule.name}",
-                    message=message,
-                    severity=rule.severity if rule.severity in ("info", "warning", "error", "critical") else "warning",
-                    entity_ref=f"alert_rule:{rule.id}",
-                )
+                async with db.begin_nested():
+                    pending_pushes += await create_notification_all_users(
+                        db,
+                        type="alert_fired",
+                        title=f"Alert: {rule.name}",
+                        message=message,
+                        severity=rule.severity if rule.severity in ("info", "warning", "error", "critical") else "warning",
+                        entity_ref=f"alert_rule:{rule.id}",
+                        org_id=rule.org_id,
+                    )
             except Exception:
                 logger.exception("alert_worker: failed to create notification rule_id=%d", rule.id)
         else:
@@ -293,6 +327,8 @@ async def run_alert_cycle(db: AsyncSession, now: datetime) -> None:
                 })
 
     await db.commit()
+    # WebSocket pushes happen only after the notifications are committed
+    dispatch_notifications(pending_pushes)
 
 
 # ---------------------------------------------------------------------------
@@ -301,10 +337,12 @@ async def run_alert_cycle(db: AsyncSession, now: datetime) -> None:
 
 async def alert_worker_loop() -> None:
     """Background loop: evaluates alert rules every EVAL_INTERVAL seconds."""
+    view = OfflineView()
     while True:
         try:
-            async with AsyncSessionLocal() as db:
-                await run_alert_cycle(db, datetime.now(timezone.utc))
+            with observe_cycle("alert_worker"):
+                async with WorkerSessionLocal() as db:
+                    await run_alert_cycle(db, datetime.now(timezone.utc), view)
         except Exception:
             logger.exception("alert_worker: unhandled error in evaluation cycle")
         await asyncio.sleep(EVAL_INTERVAL)
@@ -0,0 +1,103 @@
+"""Shared plumbing for the raw-ASGI middleware stack.
+
+SecurityMiddleware, RateLimitMiddleware and CacheMiddleware are plain ASGI
+callables — no BaseHTTPMiddleware task + memory stream per layer. Facts that
+several layers need (request id, decoded JWT claims) are computed once per
+request and kept in scope["state"], the same dict Starlette exposes as
+request.state to route handlers.
+"""
+from __future__ import annotations
+
+from typing import Any, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import Message, Scope, Send
+
+from app.core import json_codec
+
+STATE_REQUEST_ID = "request_id"
+_STATE_CLAIMS = "hubex_jwt_claims"
+_STATE_ORG = "hubex_org_id"
+
+
+def scope_state(scope: Scope) -> dict[str, Any]:
+    """Per-request state dict shared by all middleware layers and handlers."""
+    return scope.setdefault("state", {})
+
+
+def get_header(scope: Scope, name: bytes) -> Optional[str]:
+    """Return the first request header called *name* (lower-case bytes)."""
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def client_ip(scope: Scope) -> str:
+    forwarded = get_header(scope, b"x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    client = scope.get("client")
+    if client:
+        return client[0]
+    return "unknown"
+
+
+def jwt_claims(scope: Scope) -> dict[str, Any]:
+    """Decode the Bearer token once per request (signature + issuer checked).
+
+    Returns {} when there is no valid token. The result is memoized in the
+    request state, so rate limiting and caching share one decode.
+    """
+    state = scope_state(scope)
+    claims = state.get(_STATE_CLAIMS)
+    if claims is None:
+        claims = {}
+        auth = get_header(scope, b"authorization") or ""
+        if auth.startswith("Bearer "):
+            try:
+                from jose import jwt as _jwt
+                from app.core.security import SECRET_KEY, ALGORITHM, ISSUER
+
+                claims = _jwt.decode(auth[7:], SECRET_KEY, algorithms=[ALGORITHM], issuer=ISSUER)
+            except Exception:
+                claims = {}
+        state[_STATE_CLAIMS] = claims
+    return claims
+
+
+def set_request_org(scope: Scope, org_id: Optional[int]) -> None:
+    """Record the org whose data the request acts on when no JWT claim says so
+    (device tokens); CacheMiddleware invalidates that org after a write."""
+    if org_id is not None:
+        scope_state(scope)[_STATE_ORG] = str(org_id)
+
+
+def request_org(scope: Scope) -> Optional[str]:
+    """The org recorded by set_request_org(), if any."""
+    return scope_state(scope).get(_STATE_ORG)
+
+
+def add_response_headers(message: Message, headers: dict[str, str]) -> None:
+    """Set (replace) headers on an http.response.start message in place."""
+    mutable = MutableHeaders(scope=message)
+    for name, value in headers.items():
+        mutable[name] = value
+
+
+async def send_json(
+    send: Send,
+    status_code: int,
+    content: Any,
+    headers: Optional[dict[str, str]] = None,
+) -> None:
+    """Send a complete JSON response without building a Response object."""
+    body = json_codec.dumps(content)
+    raw_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode("latin-1"), value.encode("latin-1")))
+    await send({"type": "http.response.start", "status": status_code, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
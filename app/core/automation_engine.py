@@ -1,7 +1,10 @@
 """Automation Engine — background loop that evaluates AutomationRule entries.
 
 Polling pattern mirrors alert_worker.py. Every 5 seconds, we pull new system
-events from events_v1 (stream="system") and evaluate matching rules.
+events from events_v1 (stream="system") and evaluate matching rules. The
+loop runs on every worker: events are sharded by device/org and each process
+evaluates the shards it leases (app.core.coordination), keeping a fenced
+checkpoint per shard. Schedule (cron) rules run on the owner of shard 0.
 
 Trigger types:
   variable_threshold  — fires when config: {variable_key, operator, value}
@@ -21,21 +24,25 @@ import asyncio
 import logging
 import math
 from datetime import datetime, timedelta, timezone
-from typing import Any
+from typing import Any, Callable, Optional
 
-from sqlalchemy import select
+from sqlalchemy import or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.session import AsyncSessionLocal
+from app.db.session import WorkerSessionLocal
 from app.db.models.automation import AutomationFireLog, AutomationRule
 from app.db.models.events import EventV1
 from app.core.system_events import emit_system_event
+from app.core import event_stream
+from app.core.coordination import ShardLeases, event_shard_key, load_cursors, save_cursor, shard_of
+from app.core.metrics import AUTOMATION_EVENT_SECONDS, observe_cycle
 
 from app.core.config import settings as _settings
 
 logger = logging.getLogger("uvicorn.error")
 
-ENGINE_INTERVAL = 5  # seconds between event-poll cycles
+ENGINE_INTERVAL = 5  # max seconds between cycles; new events wake the loop earlier
+EVENT_STREAM = "system"
 
 # Semaphore limits concurrent action execution (webhook calls, DB writes)
 _action_semaphore: asyncio.Semaphore | None = None
@@ -393,9 +400,12 @@ def _evaluate_condition_groups(groups: list[dict], payload: dict[str, Any]) -> b
 async def _action_send_email(
     db: AsyncSession, rule: AutomationRule, cfg: dict[str, Any], context: dict[str, Any]
 ) -> None:
-    """Send an email using an EmailTemplate. Config: {template_id, recipients, extra_data}."""
+    """Queue an email rendered from an EmailTemplate. Config: {template_id, recipients, extra_data}.
+
+    Delivery happens in the email outbox worker; nothing here touches SMTP.
+    """
     from app.db.models.email_template import EmailTemplate
-    from app.core.email import send_email
+    from app.core.email import enqueue_email, render_template
 
     template_id = cfg.get("template_id")
     recipients = cfg.get("recipients", [])
@@ -412,30 +422,158 @@ async def _action_send_email(
     template_vars = {**context, **(cfg.get("extra_data") or {})}
     template_vars["rule_name"] = rule.name
 
-    # Render subject and body
-    subject = tpl.subject
-    body = tpl.body_html or tpl.body_text
-    for key, val in template_vars.items():
-        subject = subject.replace(f"{{{key}}}", str(val))
-        body = body.replace(f"{{{key}}}", str(val))
-
-    for recipient in recipients:
-        try:
-            await send_email(to=recipient, subject=subject, body=body)
-        except Exception as exc:
-            logger.error("send_email: failed to %s: %s", recipient, exc)
+    await enqueue_email(
+        db,
+        recipients=list(recipients),
+        subject=render_template(tpl.subject, template_vars),
+        body_html=render_template(tpl.body_html or tpl.body_text, template_vars),
+        body_text=render_template(tpl.body_text, template_vars) if tpl.body_text else None,
+        source=f"automation:{rule.id}",
+    )
 
 
 # ---------------------------------------------------------------------------
 # Main evaluation cycle
 # ---------------------------------------------------------------------------
 
-async def _process_new_events(db: AsyncSession, last_event_id: int) -> int:
-    """Fetch events newer than last_event_id and evaluate automation rules. Return new max id."""
+async def _claim_cooldown(db: AsyncSession, rule: AutomationRule, now: datetime) -> bool:
+    """Atomically take the rule's cooldown slot.
+
+    Shards on other workers may fire the same rule concurrently; the
+    conditional UPDATE row-locks the rule so only one of them wins.
+    """
+    cutoff = now - timedelta(seconds=rule.cooldown_seconds or 0)
+    res = await db.execute(
+        update(AutomationRule)
+        .where(
+            AutomationRule.id == rule.id,
+            or_(AutomationRule.last_fired_at.is_(None), AutomationRule.last_fired_at <= cutoff),
+        )
+        .values(last_fired_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount == 1
+
+
+async def _evaluate_event(db: AsyncSession, event: EventV1) -> None:
+    """Evaluate the enabled rules that one event can trigger."""
+    event_type: str = event.type or ""
+    payload: dict[str, Any] = event.payload or {}
+
+    # Map event type → trigger types to evaluate
+    if event_type.startswith("variable."):
+        trigger_types = ["variable_threshold", "variable_geofence", "variable_change"]
+    elif event_type == "device.offline":
+        trigger_types = ["device_offline"]
+    elif event_type == "device.online":
+        trigger_types = ["device_online"]
+    elif event_type.startswith("telemetry."):
+        trigger_types = ["telemetry_received"]
+    else:
+        return
+
+    # Load matching enabled rules
+    stmt_rules = select(AutomationRule).where(
+        AutomationRule.enabled.is_(True),
+        AutomationRule.trigger_type.in_(trigger_types),
+    )
+    rules_result = await db.execute(stmt_rules)
+    rules: list[AutomationRule] = list(rules_result.scalars().all())
+
+    now = datetime.now(timezone.utc)
+
+    for rule in rules:
+        try:
+            # Evaluate trigger condition
+            if rule.trigger_type == "variable_threshold":
+                fired = await _check_variable_threshold(rule, payload)
+            elif rule.trigger_type == "variable_geofence":
+                fired = await _check_variable_geofence(rule, payload)
+            elif rule.trigger_type == "device_offline":
+                fired = _check_device_offline(rule, payload)
+            elif rule.trigger_type == "telemetry_received":
+                fired = _check_telemetry_received(rule, payload)
+            elif rule.trigger_type == "variable_change":
+                # Fires on any variable change event
+                fired = event_type.startswith("variable.") if event_type else False
+                if fired:
+                    cfg_key = rule.trigger_config.get("variable_key")
+                    if cfg_key and payload.get("variable_key") != cfg_key:
+                        fired = False
+            elif rule.trigger_type == "device_online":
+                fired = event_type == "device.online" if event_type else False
+                cfg_uid = rule.trigger_config.get("device_uid")
+                if fired and cfg_uid and payload.get("device_uid") != cfg_uid:
+                    fired = False
+            elif rule.trigger_type == "schedule":
+                # Schedule triggers are handled externally (cron), not by event matching
+                fired = False
+            else:
+                fired = False
+
+            if not fired:
+                continue
+
+            # AND/OR condition groups (optional)
+            condition_groups = rule.trigger_config.get("condition_groups")
+            if condition_groups and fired:
+                fired = _evaluate_condition_groups(condition_groups, payload)
+
+            if not fired:
+                continue
+
+            # Cooldown check
+            if rule.last_fired_at is not None:
+                last = rule.last_fired_at
+                if last.tzinfo is None:
+                    last = last.replace(tzinfo=timezone.utc)
+                if (now - last).total_seconds() < rule.cooldown_seconds:
+                    continue
+            if not await _claim_cooldown(db, rule, now):
+                continue
+
+            # Execute action (with concurrency limit)
+            success = True
+            error_msg: str | None = None
+            try:
+                async with _get_action_semaphore():
+                    await execute_action(db, rule, context={"event_type": event_type, **payload})
+            except Exception as exc:
+                success = False
+                error_msg = str(exc)
+                logger.error("automation_engine: action error rule_id=%d: %s", rule.id, exc)
+
+            # Update rule stats
+            rule.last_fired_at = now
+            rule.fire_count = (rule.fire_count or 0) + 1
+
+            # Write log entry
+            log_entry = AutomationFireLog(
+                rule_id=rule.id,
+                fired_at=now,
+                success=success,
+                error_message=error_msg,
+                context_json={"event_type": event_type, **{k: v for k, v in payload.items() if isinstance(v, (str, int, float, bool, type(None)))}},
+            )
+            db.add(log_entry)
+
+        except Exception as exc:
+            logger.exception("automation_engine: rule evaluation error rule_id=%d: %s", rule.id, exc)
+
+
+async def _process_new_events(
+    db: AsyncSession,
+    last_event_id: int,
+    accept: Optional[Callable[[EventV1], bool]] = None,
+) -> int:
+    """Fetch events newer than last_event_id and evaluate automation rules. Return new max id.
+
+    `accept` restricts evaluation to the caller's shards. Does not commit.
+    """
     stmt = (
         select(EventV1)
         .where(
-            EventV1.stream == "system",
+            EventV1.stream == EVENT_STREAM,
             EventV1.id > last_event_id,
         )
         .order_by(EventV1.id.asc())
@@ -451,108 +589,11 @@ async def _process_new_events(db: AsyncSession, last_event_id: int) -> int:
 
     for event in events:
         new_max_id = max(new_max_id, event.id)
-        event_type: str = event.type or ""
-        payload: dict[str, Any] = event.payload or {}
-
-        # Map event type → trigger types to evaluate
-        if event_type.startswith("variable."):
-            trigger_types = ["variable_threshold", "variable_geofence", "variable_change"]
-        elif event_type == "device.offline":
-            trigger_types = ["device_offline"]
-        elif event_type == "device.online":
-            trigger_types = ["device_online"]
-        elif event_type.startswith("telemetry."):
-            trigger_types = ["telemetry_received"]
-        else:
+        if accept is not None and not accept(event):
             continue
+        with AUTOMATION_EVENT_SECONDS.labels(event.type or "").time():
+            await _evaluate_event(db, event)
 
-        # Load matching enabled rules
-        stmt_rules = select(AutomationRule).where(
-            AutomationRule.enabled.is_(True),
-            AutomationRule.trigger_type.in_(trigger_types),
-        )
-        rules_result = await db.execute(stmt_rules)
-        rules: list[AutomationRule] = list(rules_result.scalars().all())
-
-        now = datetime.now(timezone.utc)
-
-        for rule in rules:
-            try:
-                # Evaluate trigger condition
-                if rule.trigger_type == "variable_threshold":
-                    fired = await _check_variable_threshold(rule, payload)
-                elif rule.trigger_type == "variable_geofence":
-                    fired = await _check_variable_geofence(rule, payload)
-                elif rule.trigger_type == "device_offline":
-                    fired = _check_device_offline(rule, payload)
-                elif rule.trigger_type == "telemetry_received":
-                    fired = _check_telemetry_received(rule, payload)
-                elif rule.trigger_type == "variable_change":
-                    # Fires on any variable change event
-                    fired = event_type.startswith("variable.") if event_type else False
-                    if fired:
-                        cfg_key = rule.trigger_config.get("variable_key")
-                        if cfg_key and payload.get("variable_key") != cfg_key:
-                            fired = False
-                elif rule.trigger_type == "device_online":
-                    fired = event_type == "device.online" if event_type else False
-                    cfg_uid = rule.trigger_config.get("device_uid")
-                    if fired and cfg_uid and payload.get("device_uid") != cfg_uid:
-                        fired = False
-                elif rule.trigger_type == "schedule":
-                    # Schedule triggers are handled externally (cron), not by event matching
-                    fired = False
-                else:
-                    fired = False
-
-                if not fired:
-                    continue
-
-                # AND/OR condition groups (optional)
-                condition_groups = rule.trigger_config.get("condition_groups")
-                if condition_groups and fired:
-                    fired = _evaluate_condition_groups(condition_groups, payload)
-
-                if not fired:
-                    continue
-
-                # Cooldown check
-                if rule.last_fired_at is not None:
-                    last = rule.last_fired_at
-                    if last.tzinfo is None:
-                        last = last.replace(tzinfo=timezone.utc)
-                    if (now - last).total_seconds() < rule.cooldown_seconds:
-                        continue
-
-                # Execute action (with concurrency limit)
-                success = True
-                error_msg: str | None = None
-                try:
-                    async with _get_action_semaphore():
-                        await execute_action(db, rule, context={"event_type": event_type, **payload})
-                except Exception as exc:
-                    success = False
-                    error_msg = str(exc)
-                    logger.error("automation_engine: action error rule_id=%d: %s", rule.id, exc)
-
-                # Update rule stats
-                rule.last_fired_at = now
-                rule.fire_count = (rule.fire_count or 0) + 1
-
-                # Write log entry
-                log_entry = AutomationFireLog(
-                    rule_id=rule.id,
-                    fired_at=now,
-                    success=success,
-                    error_message=error_msg,
-                    context_json={"event_type": event_type, **{k: v for k, v in payload.items() if isinstance(v, (str, int, float, bool, type(None)))}},
-                )
-                db.add(log_entry)
-
-            except Exception as exc:
-                logger.exception("automation_engine: rule evaluation error rule_id=%d: %s", rule.id, exc)
-
-    await db.commit()
     return new_max_id
 
 
@@ -586,62 +627,83 @@ def _cron_matches(expr: str, now) -> bool:
     return True
 
 
-async def automation_engine_loop() -> None:
-    """Background loop: process system events for automation rules every ENGINE_INTERVAL seconds."""
-    last_event_id = 0
+async def _run_schedule_rules(db: AsyncSession, now: datetime) -> None:
+    """Fire enabled schedule rules whose cron expression matches `now`."""
+    cron_rules = await db.execute(
+        select(AutomationRule).where(
+            AutomationRule.enabled == True,
+            AutomationRule.trigger_type == "schedule",
+        )
+    )
+    for rule in cron_rules.scalars().all():
+        cron_expr = rule.trigger_config.get("cron", "")
+        if _cron_matches(cron_expr, now):
+            # Cooldown check
+            if rule.last_fired_at:
+                last = rule.last_fired_at
+                if last.tzinfo is None:
+                    last = last.replace(tzinfo=timezone.utc)
+                if (now - last).total_seconds() < rule.cooldown_seconds:
+                    continue
+            # Fire
+            try:
+                await execute_action(db, rule, context={"event_type": "schedule", "cron": cron_expr})
+                rule.fire_count = (rule.fire_count or 0) + 1
+                rule.last_fired_at = now
+                db.add(AutomationFireLog(rule_id=rule.id, success=True, context_json={"cron": cron_expr}))
+            except Exception as exc:
+                db.add(AutomationFireLog(rule_id=rule.id, success=False, error_message=str(exc)[:512]))
+
+
+async def _run_sharded_cycle(shards: ShardLeases) -> dict[int, int]:
+    """Evaluate new events of the shards this process leases; returns them."""
+    owned = await shards.refresh()
+    if not owned:
+        return owned
+    names = {shard: shards.lease_name(shard) for shard in owned}
+    async with WorkerSessionLocal() as db:
+        stored = await load_cursors(db, EVENT_STREAM, list(names.values()))
+        cursors = {shard: stored[name] for shard, name in names.items()}
+
+        def accept(event: EventV1) -> bool:
+            shard = shard_of(event_shard_key(event), shards.count)
+            return shard in cursors and event.id > cursors[shard]
+
+        # One scan from the slowest owned shard serves all of them
+        cursor = await _process_new_events(db, min(cursors.values()), accept)
+        # Cursors commit atomically with the batch's fire logs and actions
+        for shard, token in owned.items():
+            if not await save_cursor(db, EVENT_STREAM, names[shard], max(cursor, cursors[shard]), token):
+                # Another worker took a shard over mid-cycle; it redoes the batch
+                await db.rollback()
+                return owned
+        await db.commit()
+    return owned
 
-    # Initialise last_event_id to current max so we don't replay old events on startup
-    try:
-        async with AsyncSessionLocal() as db:
-            from sqlalchemy import func as sqlfunc
-            res = await db.execute(
-                select(sqlfunc.max(EventV1.id)).where(EventV1.stream == "system")
-            )
-            current_max = res.scalar_one_or_none()
-            if current_max is not None:
-                last_event_id = current_max
-    except Exception:
-        pass
 
+async def automation_engine_loop() -> None:
+    """Background loop: process system events for automation rules as they are
+    committed (event_stream wake-ups), at least every ENGINE_INTERVAL seconds."""
+    shards = ShardLeases("automation_engine")
     _last_cron_minute = -1
 
-    while True:
-        try:
-            async with AsyncSessionLocal() as db:
-                last_event_id = await _process_new_events(db, last_event_id)
-
-                # Schedule trigger: check once per minute
-                from datetime import datetime, timezone, timedelta
-                now = datetime.now(timezone.utc)
-                current_minute = now.hour * 60 + now.minute
-                if current_minute != _last_cron_minute:
-                    _last_cron_minute = current_minute
-                    # Find all enabled schedule rules
-                    cron_rules = await db.execute(
-                        select(AutomationRule).where(
-                            AutomationRule.enabled == True,
-                            AutomationRule.trigger_type == "schedule",
-                        )
-                    )
-                    for rule in cron_rules.scalars().all():
-                        cron_expr = rule.trigger_config.get("cron", "")
-                        if _cron_matches(cron_expr, now):
-                            # Cooldown check
-                            if rule.last_fired_at:
-                                last = rule.last_fired_at
-                                if last.tzinfo is None:
-                                    last = last.replace(tzinfo=timezone.utc)
-                                if (now - last).total_seconds() < rule.cooldown_seconds:
-                                    continue
-                            # Fire
-                            try:
-                                await execute_action(db, rule, context={"event_type": "schedule", "cron": cron_expr})
-                                rule.fire_count = (rule.fire_count or 0) + 1
-                                rule.last_fired_at = now
-                                db.add(AutomationFireLog(rule_id=rule.id, success=True, context_json={"cron": cron_expr}))
-                            except Exception as exc:
-                                db.add(AutomationFireLog(rule_id=rule.id, success=False, error_message=str(exc)[:512]))
-                    await db.commit()
-        except Exception:
-            logger.exception("automation_engine: unhandled error in evaluation cycle")
-        await asyncio.sleep(ENGINE_INTERVAL)
+    try:
+        with event_stream.subscribe(EVENT_STREAM) as wake:
+            while True:
+                try:
+                    with observe_cycle("automation_engine"):
+                        owned = await _run_sharded_cycle(shards)
+
+                    # Schedule trigger: check once per minute, on one worker only
+                    now = datetime.now(timezone.utc)
+                    current_minute = now.hour * 60 + now.minute
+                    if 0 in owned and current_minute != _last_cron_minute:
+                        _last_cron_minute = current_minute
+                        async with WorkerSessionLocal() as db:
+                            await _run_schedule_rules(db, now)
+                            await db.commit()
+                except Exception:
+                    logger.exception("automation_engine: unhandled error in evaluation cycle")
+                await wake.wait(ENGINE_INTERVAL)
+    finally:
+        await shards.release_all()
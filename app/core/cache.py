@@ -1,85 +1,118 @@
 """Redis-based response-cache middleware.
 
-Cached endpoints and TTLs:
-  GET /api/v1/devices          5 s
+Routers declare what is cached next to their own definition:
+
+    router = APIRouter(prefix="/devices")
+    cache_rule(router, "devices", ttl=5, invalidates=("metrics",))
+
+Declared today:
+  GET /api/v1/devices          5 s   (writes also invalidate metrics)
   GET /api/v1/entities         5 s
   GET /api/v1/modules         30 s
   GET /api/v1/metrics         10 s
-  GET /api/v1/ota/firmware    60 s
+  GET /api/v1/ota/firmware    60 s   (any /ota write invalidates)
 
 Cache key  : hubex:cache:{org_id}:{path}:{query_hash}
+Generation : hubex:cache:gen:{org_id}:{resource} — an INCR counter per
+             (org, resource). Entries remember the generation they were
+             written under; a GET fetches entry + generation with one MGET and
+             treats a mismatch as a miss.
+Entry      : binary, "HXC1\r\n{gen}\r\n{fresh_until}\r\n{status}\r\n{name: value}...\r\n\r\n{body}"
+             — raw headers + raw body, read through the bytes Redis client.
 ETag       : MD5 of response body; If-None-Match → 304 Not Modified
-Invalidation: POST / PUT / PATCH / DELETE on the same resource prefix
-              flushes matching cache keys.
+Invalidation: POST / PUT / PATCH / DELETE under a declared prefix bumps the
+              generation of its resource (and of `invalidates`) for one org,
+              after the handler ran — O(1), no keyspace scans. That org is
+              the one the handler recorded with set_request_org() (device
+              tokens carry no org claim), else the caller's org claim.
+
+Misses are streamed to the client as the handler produces them; the chunks
+are kept once and joined for the Redis write after the last one was sent.
+
+Single-flight: concurrent misses for the same key (and generation) wait on
+one in-flight handler run per process; with cache_single_flight_distributed a
+Redis SET NX lock extends that across processes (peers poll for the entry).
+Entries live cache_stale_seconds past their TTL: while one request refreshes
+an expired entry, the others are answered from the stale copy (X-Cache:
+STALE). Entries invalidated by a write are never served stale.
 
 Degrades gracefully when Redis is unavailable (no-cache / pass-through).
 """
 from __future__ import annotations
 
+import asyncio
 import hashlib
-import json
 import logging
-from typing import Callable, Optional
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Iterable, NamedTuple, Optional
 
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
-from starlette.types import ASGIApp
+from fastapi import APIRouter
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.core.asgi import get_header, jwt_claims, request_org
 from app.core.config import settings
-from app.core.redis_client import get_redis
+from app.core.redis_client import get_redis_binary
 
 logger = logging.getLogger("uvicorn.error")
 
-# (path_prefix, ttl_seconds)
-_CACHE_RULES: list[tuple[str, int]] = [
-    ("/api/v1/devices", 5),
-    ("/api/v1/entities", 5),
-    ("/api/v1/modules", 30),
-    ("/api/v1/metrics", 10),
-    ("/api/v1/ota/firmware", 60),
-]
+API_PREFIX = "/api/v1"
+
+# Generation counters outlive any entry TTL by far; they are refreshed on INCR.
+_GENERATION_TTL = 24 * 3600
+
+
+@dataclass(frozen=True)
+class CacheRule:
+    prefix: str  # full path prefix, e.g. "/api/v1/devices"
+    resource: str  # generation counter this prefix belongs to
+    ttl: Optional[int] = None  # GET cache TTL in seconds; None = never cached
+    invalidates: tuple[str, ...] = ()  # extra resources bumped on writes
+
+
+_CACHE_RULES: list[CacheRule] = []
 
-_INVALIDATE_PREFIXES = [
-    "/api/v1/devices",
-    "/api/v1/entities",
-    "/api/v1/modules",
-    "/api/v1/metrics",
-    "/api/v1/ota",
-]
+
+def cache_rule(
+    router: APIRouter,
+    resource: str,
+    path: str = "",
+    ttl: Optional[int] = None,
+    invalidates: tuple[str, ...] = (),
+) -> CacheRule:
+    """Declare a cached / invalidating path below *router*'s prefix.
+
+    Writes under the path bump the (org, resource) generation; with a ttl,
+    GETs under the path are served from the cache.
+    """
+    rule = CacheRule(
+        prefix=f"{API_PREFIX}{router.prefix}{path}",
+        resource=resource,
+        ttl=ttl,
+        invalidates=tuple(invalidates),
+    )
+    if rule not in _CACHE_RULES:
+        _CACHE_RULES.append(rule)
+        # Longest prefix wins
+        _CACHE_RULES.sort(key=lambda r: len(r.prefix), reverse=True)
+    return rule
 
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
 
-def _org_id_from_request(request: Request) -> str:
-    """Extract org_id claim from Bearer token for scoped cache keys."""
-    try:
-        from jose import jwt as _jwt
-        from app.core.security import SECRET_KEY, ALGORITHM, ISSUER
-
-        auth = request.headers.get("Authorization", "")
-        if not auth.startswith("Bearer "):
-            return "anon"
-        token = auth[7:]
-        payload = _jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], issuer=ISSUER)
-        return str(payload.get("org_id", "anon"))
-    except Exception:
-        return "anon"
-
-
-def _cache_ttl(path: str) -> Optional[int]:
-    for prefix, ttl in _CACHE_RULES:
-        if path.startswith(prefix):
-            return ttl
-    return None
+def _org_id_from_request(scope: Scope) -> str:
+    """org_id claim from the Bearer token (decoded once per request) for scoped keys."""
+    return str(jwt_claims(scope).get("org_id", "anon"))
 
 
-def _invalidation_prefix(path: str) -> Optional[str]:
-    for prefix in _INVALIDATE_PREFIXES:
-        if path.startswith(prefix):
-            return prefix
+def _match_rule(path: str) -> Optional[CacheRule]:
+    for rule in _CACHE_RULES:
+        if path == rule.prefix or path.startswith(rule.prefix + "/"):
+            return rule
     return None
 
 
@@ -88,97 +121,307 @@ def _build_key(org_id: str, path: str, query: str) -> str:
     return f"hubex:cache:{org_id}:{path}:{qhash}"
 
 
+def _generation_key(org_id: str, resource: str) -> str:
+    return f"hubex:cache:gen:{org_id}:{resource}"
+
+
+async def invalidate(redis, org_id: str, resources: Iterable[str]) -> None:
+    """Bump the generation of each resource for one org (single round trip)."""
+    pipe = redis.pipeline(transaction=False)
+    for resource in resources:
+        key = _generation_key(org_id, resource)
+        pipe.incr(key)
+        pipe.expire(key, _GENERATION_TTL)
+    await pipe.execute()
+
+
 def _etag(body: bytes) -> str:
     return '"' + hashlib.md5(body).hexdigest() + '"'
 
 
-async def _consume_body(response: Response) -> bytes:
-    """Drain a streaming response body into bytes."""
-    body = b""
-    async for chunk in response.body_iterator:  # type: ignore[attr-defined]
-        body += chunk if isinstance(chunk, bytes) else chunk.encode("latin-1")
-    return body
+_ENTRY_MAGIC = b"HXC1"
+_SKIP_STORED_HEADERS = frozenset({b"x-cache", b"etag"})
+
+# Single-flight tuning
+_LOCK_TTL_MS = 10_000  # cross-process fill lock; bounds a crashed leader
+_FOLLOWER_TIMEOUT = 10.0  # max wait for an in-process leader
+_PEER_WAIT = 5.0  # max wait for another process to fill the entry
+_PEER_POLL = 0.05
+
+# Compare-and-delete so a leader never releases a lock it no longer owns
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class CacheEntry(NamedTuple):
+    generation: bytes
+    fresh_until: float  # unix time; afterwards served only as stale
+    status: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+
+# flight key (cache key + generation) -> future resolved with the filled entry,
+# or None when the leader could not produce a cacheable response.
+_inflight: dict[str, asyncio.Future] = {}
+
+
+def _encode_entry(entry: CacheEntry) -> bytes:
+    head = [
+        _ENTRY_MAGIC,
+        entry.generation,
+        b"%.3f" % entry.fresh_until,
+        str(entry.status).encode(),
+    ]
+    head.extend(name + b": " + value for name, value in entry.headers)
+    return b"\r\n".join(head) + b"\r\n\r\n" + entry.body
+
+
+def _decode_entry(raw: Optional[bytes]) -> Optional[CacheEntry]:
+    if not raw:
+        return None
+    head, _, body = raw.partition(b"\r\n\r\n")
+    lines = head.split(b"\r\n")
+    if len(lines) < 4 or lines[0] != _ENTRY_MAGIC:
+        return None
+    headers = [tuple(line.split(b": ", 1)) for line in lines[4:]]
+    return CacheEntry(lines[1], float(lines[2]), int(lines[3]), headers, body)  # type: ignore[arg-type]
+
+
+async def _acquire_fill_lock(redis, cache_key: str) -> Optional[str]:
+    """Cross-process single-flight lock. Returns the owner token, or None."""
+    token = uuid.uuid4().hex
+    if await redis.set(f"{cache_key}:lock", token, nx=True, px=_LOCK_TTL_MS):
+        return token
+    return None
+
+
+async def _release_fill_lock(redis, cache_key: str, token: str) -> None:
+    try:
+        await redis.eval(_RELEASE_LUA, 1, f"{cache_key}:lock", token)
+    except Exception as exc:
+        logger.warning("cache: lock release error (%s)", exc)
+
+
+async def _wait_for_peer(redis, cache_key: str, generation: bytes) -> Optional[CacheEntry]:
+    """Poll for the entry another process is filling (bounded by _PEER_WAIT)."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + _PEER_WAIT
+    while loop.time() < deadline:
+        await asyncio.sleep(_PEER_POLL)
+        entry = _decode_entry(await redis.get(cache_key))
+        if entry is not None and entry.generation == generation and entry.fresh_until > time.time():
+            return entry
+    return None
 
 
 # ---------------------------------------------------------------------------
 # Middleware
 # ---------------------------------------------------------------------------
 
-class CacheMiddleware(BaseHTTPMiddleware):
+class CacheMiddleware:
     def __init__(self, app: ASGIApp) -> None:
-        super().__init__(app)
+        self.app = app
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        if not settings.cache_enabled:
-            return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.cache_enabled:
+            await self.app(scope, receive, send)
+            return
 
-        redis = get_redis()
-        path = request.url.path
-        method = request.method.upper()
+        redis = get_redis_binary()
+        path = scope["path"]
+        method = scope["method"].upper()
 
-        # --- Invalidation on write methods ---
-        if method in ("POST", "PUT", "PATCH", "DELETE") and redis:
-            prefix = _invalidation_prefix(path)
-            if prefix:
-                try:
-                    pattern = f"hubex:cache:*{prefix}*"
-                    keys = await redis.keys(pattern)
-                    if keys:
-                        await redis.delete(*keys)
-                except Exception as exc:
-                    logger.warning("cache: invalidation error (%s)", exc)
+        rule = _match_rule(path)
+        if rule is None or redis is None:
+            await self.app(scope, receive, send)
+            return
 
-        # Only cache GET requests when Redis is available
-        if method != "GET" or redis is None:
-            return await call_next(request)
+        org_id = _org_id_from_request(scope)
 
-        ttl = _cache_ttl(path)
-        if ttl is None:
-            return await call_next(request)
+        # --- Invalidation on write methods ---
+        # Bumped after the handler has committed: a concurrent GET that read
+        # the old data also read the old generation, so its entry is ignored.
+        if method in ("POST", "PUT", "PATCH", "DELETE"):
+            await self.app(scope, receive, send)
+            try:
+                await invalidate(redis, request_org(scope) or org_id, (rule.resource, *rule.invalidates))
+            except Exception as exc:
+                logger.warning("cache: invalidation error (%s)", exc)
+            return
+
+        # Only cache GET requests on paths with a TTL
+        if method != "GET" or rule.ttl is None:
+            await self.app(scope, receive, send)
+            return
 
-        org_id = _org_id_from_request(request)
-        cache_key = _build_key(org_id, path, str(request.url.query))
+        query = scope.get("query_string", b"").decode("latin-1")
+        cache_key = _build_key(org_id, path, query)
 
-        # --- Cache read ---
+        # --- Cache read: entry + current generation in one round trip ---
         try:
-            cached_raw = await redis.get(cache_key)
-            if cached_raw:
-                data = json.loads(cached_raw)
-                body = data["body"].encode("latin-1")
-                etag = _etag(body)
-                if_none_match = request.headers.get("If-None-Match", "")
-                if if_none_match and if_none_match == etag:
-                    return Response(status_code=304, headers={"ETag": etag})
-                return Response(
-                    content=body,
-                    status_code=data["status_code"],
-                    headers={**data["headers"], "ETag": etag, "X-Cache": "HIT"},
-                    media_type=data.get("media_type", "application/json"),
-                )
+            cached_raw, current_gen = await redis.mget(
+                cache_key, _generation_key(org_id, rule.resource)
+            )
         except Exception as exc:
             logger.warning("cache: read error (%s)", exc)
-
-        # --- Cache miss: call handler ---
-        response = await call_next(request)
-
-        if response.status_code == 200:
+            await self.app(scope, receive, send)
+            return
+
+        generation = current_gen or b"0"
+        flight_key = f"{cache_key}:{generation.decode()}"
+        entry = _decode_entry(cached_raw)
+        if entry is not None and entry.generation != generation:
+            entry = None  # invalidated by a write — never served, not even stale
+
+        if entry is not None and entry.fresh_until > time.time():
+            await _send_entry(scope, send, entry, b"HIT")
+            return
+
+        # --- Stale-while-revalidate: one refresher, everyone else gets stale ---
+        if entry is not None:
+            if flight_key in _inflight:
+                await _send_entry(scope, send, entry, b"STALE")
+                return
+            await self._lead(scope, receive, send, redis, rule, cache_key, flight_key, generation, entry)
+            return
+
+        # --- Miss: coalesce onto an in-process leader if there is one ---
+        flight = _inflight.get(flight_key)
+        if flight is not None:
             try:
-                body = await _consume_body(response)
-                etag = _etag(body)
-                cache_data = json.dumps({
-                    "body": body.decode("latin-1"),
-                    "status_code": response.status_code,
-                    "headers": dict(response.headers),
-                    "media_type": response.media_type,
-                })
-                await redis.setex(cache_key, ttl, cache_data)
-                return Response(
-                    content=body,
-                    status_code=response.status_code,
-                    headers={**dict(response.headers), "ETag": etag, "X-Cache": "MISS"},
-                    media_type=response.media_type,
+                filled = await asyncio.wait_for(asyncio.shield(flight), _FOLLOWER_TIMEOUT)
+            except asyncio.TimeoutError:
+                filled = None
+            if filled is not None:
+                await _send_entry(scope, send, filled, b"COALESCED")
+            else:
+                await self.app(scope, receive, send)
+            return
+
+        await self._lead(scope, receive, send, redis, rule, cache_key, flight_key, generation, None)
+
+    async def _lead(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        redis,
+        rule: CacheRule,
+        cache_key: str,
+        flight_key: str,
+        generation: bytes,
+        stale: Optional[CacheEntry],
+    ) -> None:
+        """Become the single in-process (and optionally cross-process) filler."""
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        _inflight[flight_key] = future
+        filled: Optional[CacheEntry] = None
+        token: Optional[str] = None
+        try:
+            if settings.cache_single_flight_distributed:
+                try:
+                    token = await _acquire_fill_lock(redis, cache_key)
+                except Exception as exc:
+                    logger.warning("cache: lock error (%s)", exc)
+                    token = ""  # Redis trouble — fill locally
+                if token is None:
+                    # Another process is filling this key
+                    if stale is not None:
+                        await _send_entry(scope, send, stale, b"STALE")
+                        return
+                    filled = await _wait_for_peer(redis, cache_key, generation)
+                    if filled is not None:
+                        await _send_entry(scope, send, filled, b"COALESCED")
+                        return
+            filled = await self._fill(scope, receive, send, redis, rule, cache_key, generation)
+        finally:
+            if not future.done():
+                future.set_result(filled)
+            _inflight.pop(flight_key, None)
+            if token:
+                await _release_fill_lock(redis, cache_key, token)
+
+    async def _fill(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        redis,
+        rule: CacheRule,
+        cache_key: str,
+        generation: bytes,
+    ) -> Optional[CacheEntry]:
+        """Run the handler, streaming to the client while keeping one copy."""
+        held_start: Optional[Message] = None
+        stored_headers: list[tuple[bytes, bytes]] = []
+        chunks: list[bytes] = []
+        start_sent = False
+        complete = False
+
+        async def send_and_capture(message: Message) -> None:
+            nonlocal held_start, start_sent, complete
+            if message["type"] == "http.response.start":
+                if message["status"] != 200:
+                    await send(message)
+                    return
+                # Hold the start until the first body chunk: a single-chunk
+                # body (the common JSONResponse case) still gets its ETag.
+                held_start = message
+                stored_headers.extend(
+                    (k, v) for k, v in message.get("headers", ()) if k not in _SKIP_STORED_HEADERS
                 )
-            except Exception as exc:
-                logger.warning("cache: write error (%s)", exc)
-
-        return response
+                return
+
+            if message["type"] != "http.response.body" or held_start is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if not start_sent:
+                headers = MutableHeaders(scope=held_start)
+                headers["X-Cache"] = "MISS"
+                if not more_body:
+                    headers["ETag"] = _etag(body)
+                await send(held_start)
+                start_sent = True
+            chunks.append(body)
+            complete = not more_body
+            await send(message)
+
+        await self.app(scope, receive, send_and_capture)
+
+        if not complete:
+            return None
+        body = b"".join(chunks)
+        entry = CacheEntry(
+            generation=generation,
+            fresh_until=time.time() + rule.ttl,
+            status=200,
+            headers=stored_headers + [(b"etag", _etag(body).encode())],
+            body=body,
+        )
+        try:
+            # Kept past its TTL so it can be served stale while refreshing
+            await redis.setex(cache_key, rule.ttl + settings.cache_stale_seconds, _encode_entry(entry))
+        except Exception as exc:
+            logger.warning("cache: write error (%s)", exc)
+        return entry
+
+
+async def _send_entry(scope: Scope, send: Send, entry: CacheEntry, source: bytes) -> None:
+    etag = next((v for k, v in entry.headers if k == b"etag"), b"")
+    if_none_match = get_header(scope, b"if-none-match")
+    if if_none_match and if_none_match.encode("latin-1") == etag:
+        await send({"type": "http.response.start", "status": 304, "headers": [(b"etag", etag)]})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await send({
+        "type": "http.response.start",
+        "status": entry.status,
+        "headers": [*entry.headers, (b"x-cache", source)],
+    })
+    await send({"type": "http.response.body", "body": entry.body})
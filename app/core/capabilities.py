@@ -97,6 +97,9 @@ CAPABILITY_MAP: dict[tuple[str, str], list[str]] = {
     ("GET", "/api/v1/devices/{device_id}/current-task"): ["tasks.read"],
     ("GET", "/api/v1/devices/{device_id}/task-history"): ["tasks.read"],
     ("POST", "/api/v1/devices/{device_id}/tasks/{task_id}/cancel"): ["tasks.write"],
+    ("POST", "/api/v1/devices/{device_id}/commands"): ["devices.write"],
+    ("GET", "/api/v1/devices/{device_id}/commands"): ["devices.read"],
+    ("POST", "/api/v1/devices/{device_id}/commands/{command_id}/cancel"): ["devices.write"],
     ("PATCH", "/api/v1/devices/{device_id}/type"): ["devices.write"],
     ("PATCH", "/api/v1/devices/{device_id}"): ["devices.write"],
     ("POST", "/api/v1/devices/{device_id}/token/reissue"): ["devices.token.reissue"],
@@ -125,6 +128,12 @@ CAPABILITY_MAP: dict[tuple[str, str], list[str]] = {
     ("POST", "/api/v1/tasks/poll"): ["tasks.read"],
     ("POST", "/api/v1/tasks/{task_id}/complete"): ["tasks.write"],
     ("POST", "/api/v1/tasks/{task_id}/renew"): ["tasks.write"],
+    ("POST", "/api/v1/fleet-jobs"): ["tasks.write"],
+    ("GET", "/api/v1/fleet-jobs"): ["tasks.read"],
+    ("GET", "/api/v1/fleet-jobs/{job_id}"): ["tasks.read"],
+    ("POST", "/api/v1/fleet-jobs/{job_id}/pause"): ["tasks.write"],
+    ("POST", "/api/v1/fleet-jobs/{job_id}/resume"): ["tasks.write"],
+    ("POST", "/api/v1/fleet-jobs/{job_id}/cancel"): ["tasks.write"],
     ("GET", "/api/v1/variables/definitions"): ["vars.read"],
     ("GET", "/api/v1/variables/defs"): ["vars.read"],
     ("POST", "/api/v1/variables/definitions"): ["vars.write"],
@@ -145,11 +154,14 @@ CAPABILITY_MAP: dict[tuple[str, str], list[str]] = {
     ("GET", "/api/v1/variables/effects"): ["vars.read"],
     ("GET", "/api/v1/variables/effects/{effect_id}"): ["vars.read"],
     ("GET", "/api/v1/variables/history/export"): ["vars.read"],
+    ("POST", "/api/v1/variables/effects/{effect_id}/retry"): ["vars.write"],
     ("POST", "/api/v1/variables/effects/run-once"): ["vars.write"],
     ("GET", "/api/v1/entities"): ["entities.read"],
+    ("GET", "/api/v1/entities/health"): ["entities.read"],
     ("GET", "/api/v1/entities/{entity_id}"): ["entities.read"],
     ("GET", "/api/v1/entities/{entity_id}/devices"): ["entities.read"],
     ("GET", "/api/v1/events"): ["events.read"],
+    ("GET", "/api/v1/events/stream"): ["events.read"],
     ("GET", "/api/v1/events/{event_id}"): ["events.read"],
     ("POST", "/api/v1/events/ack"): ["events.ack"],
     ("POST", "/api/v1/events/emit"): ["events.emit"],
@@ -164,6 +176,7 @@ CAPABILITY_MAP: dict[tuple[str, str], list[str]] = {
     ("GET", "/api/v1/effects"): ["effects.read"],
     ("GET", "/api/v1/effects/{effect_id}"): ["effects.read"],
     ("GET", "/api/v1/signals"): ["signals.read"],
+    ("POST", "/api/v1/signals/batch"): ["signals.ingest"],
     ("GET", "/api/v1/executions/runs"): ["executions.read"],
     ("POST", "/api/v1/executions/definitions"): ["executions.write"],
     ("POST", "/api/v1/executions/runs"): ["executions.write"],
@@ -193,6 +206,7 @@ CAPABILITY_MAP: dict[tuple[str, str], list[str]] = {
     ("PUT", "/api/v1/entities/{entity_id}/devices/{device_id}"): ["entities.write"],
     ("POST", "/api/v1/entities/{entity_id}/devices/bulk-bind"): ["entities.write"],
     ("POST", "/api/v1/entities/{entity_id}/devices/bulk-unbind"): ["entities.write"],
+    ("POST", "/api/v1/entities/{entity_id}/devices/bulk-update"): ["entities.write"],
     ("GET", "/api/v1/entities/{entity_id}/health"): ["entities.read"],
     ("GET", "/api/v1/groups"): ["groups.read"],
     ("POST", "/api/v1/groups"): ["groups.write"],
@@ -244,6 +258,12 @@ CAPABILITY_MAP: dict[tuple[str, str], list[str]] = {
     ("GET", "/api/v1/observability/incidents"): ["alerts.read"],
     ("GET", "/api/v1/observability/support-bundle"): ["config.read"],
     ("GET", "/api/v1/observability/anomalies"): ["vars.read"],
+    ("GET", "/api/v1/observability/profiling"): ["config.write"],
+    ("PUT", "/api/v1/observability/profiling"): ["config.write"],
+    ("GET", "/api/v1/observability/profiles"): ["config.write"],
+    ("GET", "/api/v1/observability/profiles/collapsed"): ["config.write"],
+    ("GET", "/api/v1/observability/profiles/{profile_id}"): ["config.write"],
+    ("DELETE", "/api/v1/observability/profiles"): ["config.write"],
     # Reports
     ("GET", "/api/v1/reports/templates"): ["config.read"],
     ("POST", "/api/v1/reports/templates"): ["config.write"],
@@ -306,6 +326,10 @@ CAPABILITY_MAP: dict[tuple[str, str], list[str]] = {
     # Edge
     ("GET", "/api/v1/edge/config"): ["edge.config"],
     ("POST", "/api/v1/edge/heartbeat"): ["edge.config"],
+    # Agent protocol (device-facing)
+    ("POST", "/api/v1/agent/handshake"): ["edge.config"],
+    ("POST", "/api/v1/agent/heartbeat"): ["edge.config"],
+    ("POST", "/api/v1/agent/commands/{command_id}/ack"): ["edge.config"],
     # Automations
     ("GET", "/api/v1/automations"): ["automations.read"],
     ("POST", "/api/v1/automations"): ["automations.write"],
@@ -31,9 +31,48 @@ class Settings(BaseSettings):
 
     # Phase 7 — Rate-Limiting
     rate_limit_enabled: bool = True
+    rate_limit_local_batch: int = 0  # tokens leased per Redis call (0/1 = off)
 
     # Phase 7 — Response Caching
     cache_enabled: bool = True
+    cache_stale_seconds: int = 30  # serve-stale window while one request refreshes
+    cache_single_flight_distributed: bool = True  # Redis lock across processes
+
+    # Response compression (app.core.content_encoding); request bodies in
+    # gzip/zstd and CBOR/MessagePack are always accepted
+    compression_enabled: bool = True
+    compression_min_bytes: int = 1024  # smaller responses are sent as-is
+    compression_gzip_level: int = 6
+    compression_zstd_level: int = 3
+
+    # Device presence (app.core.presence): last-seen writes are coalesced and
+    # flushed in batches; no report for presence_offline_seconds = offline
+    presence_flush_seconds: float = 5.0
+    presence_offline_seconds: int = 120
+
+    # Write-behind of append-only rows (app.core.write_behind): variable
+    # history and audit from hot paths are inserted in batches
+    write_behind_enabled: bool = True
+    write_behind_flush_ms: int = 200
+    write_behind_batch: int = 1000  # rows per flush; a full batch flushes at once
+    write_behind_max_pending: int = 50000  # beyond this, callers write inline
+
+    # Variable effects runner (app.core.variable_effects): effects of one
+    # device apply in order, different devices in parallel
+    effects_concurrency: int = 8  # devices processed at once
+    effects_batch: int = 200  # effects claimed per cycle
+    effects_max_attempts: int = 5  # failed attempts before an effect is dead
+
+    # Process role: "api" serves HTTP only, "worker" only runs background
+    # loops (python -m app.workers), "all" does both in one process
+    role: str = "all"
+    worker_disabled_loops: str = ""  # comma-separated loop names not to run here
+    worker_drain_seconds: float = 10.0  # grace period for loops on shutdown
+    # Leases for singleton/sharded loops: "auto" | "postgres" | "redis" | "local"
+    coordination_backend: str = "auto"
+    # Shards of partitionable loops (automation, webhooks, telemetry bridge);
+    # change only with all workers stopped — it remaps every device
+    worker_shard_count: int = 16
 
     # Phase 7 — Structured Logging
     log_level: str = "INFO"
@@ -53,6 +92,33 @@ class Settings(BaseSettings):
     automation_batch_size: int = 200  # max events per engine cycle
     db_pool_size: int = 5  # SQLAlchemy pool_size
     db_max_overflow: int = 20  # SQLAlchemy max_overflow
+    db_pool_recycle_seconds: int = 1800  # replace connections older than this
+    db_pool_pre_ping: bool = False  # SELECT 1 on every checkout (flaky networks only)
+    db_statement_cache_size: int = 100  # asyncpg prepared statements per connection (0 for PgBouncer)
+    db_statement_timeout_ms: int = 30000  # API requests
+    db_read_statement_timeout_ms: int = 120000  # read replica (history, exports)
+    db_worker_statement_timeout_ms: int = 0  # background workers (0 = no limit)
+    database_read_url: str = ""  # optional read replica for get_read_db
+
+    # Prometheus exposition (GET /metrics)
+    metrics_enabled: bool = True
+    metrics_token: str = ""  # if set, /metrics requires "Authorization: Bearer <token>"
+    # Without a token only loopback and these clients (IPs/CIDRs, comma-separated) may scrape
+    metrics_allowed_ips: str = ""
+    metrics_dir: str = ""  # shared snapshot dir for multi-process aggregation
+    metrics_flush_seconds: float = 5.0  # snapshot interval with metrics_dir
+    # Same statement shape this often in one request/loop cycle = likely N+1 (0 = off)
+    db_n_plus_one_threshold: int = 10
+    db_query_headers: bool = False  # X-DB-Queries / X-DB-Time-ms; exposes query counts to clients
+
+    # Wall-clock profiling of slow requests / loop cycles (app.core.profiling);
+    # runtime-adjustable via /api/v1/observability/profiling
+    profiling_enabled: bool = False
+    profiling_request_threshold_ms: float = 500.0
+    profiling_loop_threshold_ms: float = 100.0
+    profiling_loops: str = ""  # comma-separated loop names (empty = all)
+    profiling_interval_ms: float = 10.0
+    profiling_buffer_size: int = 200  # profiles kept (per process, or shared in Redis)
 
 
 settings = Settings()
@@ -0,0 +1,265 @@
+"""Content negotiation for device transport: compressed and binary bodies.
+
+Cellular devices pay per byte, so besides plain JSON the API accepts:
+
+  - Content-Encoding: gzip | zstd request bodies, decompressed before
+    routing. The decoded body is held to MAX_BODY_BYTES as well (a 1 KB
+    gzip bomb must not expand into memory), so SecurityMiddleware's
+    Content-Length check only has to look at the wire size.
+  - Content-Type: application/cbor | application/msgpack bodies, transcoded
+    to JSON so routes keep their pydantic models (telemetry, heartbeat, ...).
+
+and compresses responses (zstd preferred over gzip, per Accept-Encoding)
+once they reach HUBEX_COMPRESSION_MIN_BYTES. Only single-chunk responses
+are compressed; streaming responses (SSE, downloads) pass through as-is.
+ETags stay those of the uncompressed body, so If-None-Match keeps working
+across encodings; responses carry Vary: Accept-Encoding.
+
+zstd, CBOR and MessagePack use the zstandard, cbor2 and msgpack packages
+(requirements.txt); where one is missing those requests get 415 and zstd
+is not offered.
+
+Raw ASGI middleware (see app.core.asgi), placed inside SecurityMiddleware so
+the request id and access log cover rejected bodies too.
+"""
+from __future__ import annotations
+
+import gzip
+import zlib
+from typing import Any, Callable, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core import json_codec
+from app.core.asgi import get_header, send_json
+from app.core.config import settings
+from app.core.middleware import MAX_BODY_BYTES
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd bodies/responses
+    zstandard = None  # type: ignore[assignment]
+
+try:
+    import cbor2
+except ImportError:  # optional: application/cbor
+    cbor2 = None  # type: ignore[assignment]
+
+try:
+    import msgpack
+except ImportError:  # optional: application/msgpack
+    msgpack = None  # type: ignore[assignment]
+
+ZSTD_MAX_WINDOW = 8 * 1024 * 1024  # refuse frames needing more decoder memory
+
+_COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml", "image/svg+xml")
+_STREAMING_TYPES = ("text/event-stream",)
+_BINARY_TYPES = ("application/cbor", "application/msgpack", "application/x-msgpack")
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Codecs
+# ---------------------------------------------------------------------------
+
+def _gunzip(data: bytes, limit: int) -> bytes:
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    body = decoder.decompress(data, limit + 1)
+    if len(body) > limit:
+        raise BodyTooLarge()
+    if not decoder.eof:
+        raise ValueError("truncated gzip body")
+    return body
+
+
+def _unzstd(data: bytes, limit: int) -> bytes:
+    decoder = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW)
+    chunks: list[bytes] = []
+    size = 0
+    with decoder.stream_reader(data) as reader:
+        while True:
+            chunk = reader.read(64 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise BodyTooLarge()
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _decoders() -> dict[str, Callable[[bytes, int], bytes]]:
+    decoders: dict[str, Callable[[bytes, int], bytes]] = {"gzip": _gunzip, "x-gzip": _gunzip}
+    if zstandard is not None:
+        decoders["zstd"] = _unzstd
+    return decoders
+
+
+def _binary_loaders() -> dict[str, Callable[[bytes], Any]]:
+    loaders: dict[str, Callable[[bytes], Any]] = {}
+    if cbor2 is not None:
+        loaders["application/cbor"] = cbor2.loads
+    if msgpack is not None:
+        loaders["application/msgpack"] = lambda data: msgpack.unpackb(data, raw=False)
+        loaders["application/x-msgpack"] = loaders["application/msgpack"]
+    return loaders
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=settings.compression_zstd_level).compress(body)
+    return gzip.compress(body, compresslevel=settings.compression_gzip_level, mtime=0)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Best response encoding the client accepts (zstd > gzip), or None."""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    if "zstd" in accepted and zstandard is not None:
+        return "zstd"
+    if "gzip" in accepted or "x-gzip" in accepted:
+        return "gzip"
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Middleware
+# ---------------------------------------------------------------------------
+
+async def _read_body(receive: Receive, limit: int) -> bytes:
+    chunks: list[bytes] = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+class ContentEncodingMiddleware:
+    """Decodes gzip/zstd/CBOR/MessagePack request bodies and compresses responses."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = (get_header(scope, b"content-encoding") or "identity").strip().lower()
+        content_type = (get_header(scope, b"content-type") or "").partition(";")[0].strip().lower()
+        if encoding != "identity" or content_type in _BINARY_TYPES:
+            receive = await self._decode_request(scope, receive, send, encoding, content_type)
+            if receive is None:
+                return
+
+        response_encoding = None
+        if settings.compression_enabled:
+            response_encoding = choose_encoding(get_header(scope, b"accept-encoding") or "")
+        if response_encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        held_start: Optional[Message] = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal held_start
+            if message["type"] == "http.response.start":
+                held_start = message
+                return
+            if message["type"] != "http.response.body" or held_start is None:
+                await send(message)
+                return
+            start, held_start = held_start, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(scope=start)
+            media_type = headers.get("content-type", "")
+            if (
+                not message.get("more_body", False)
+                and len(body) >= settings.compression_min_bytes
+                and "content-encoding" not in headers
+                and media_type.startswith(_COMPRESSIBLE_TYPES)
+                and not media_type.startswith(_STREAMING_TYPES)
+            ):
+                body = compress(body, response_encoding)
+                headers["content-encoding"] = response_encoding
+                headers["content-length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                message = {**message, "body": body}
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+    async def _decode_request(
+        self, scope: Scope, receive: Receive, send: Send, encoding: str, content_type: str,
+    ) -> Optional[Receive]:
+        """Buffer and decode the body; on failure answer and return None."""
+        decoder = _decoders().get(encoding) if encoding != "identity" else None
+        loader = _binary_loaders().get(content_type) if content_type in _BINARY_TYPES else None
+        if encoding != "identity" and decoder is None:
+            await send_json(send, 415, {"detail": "unsupported_content_encoding", "supported": sorted(_decoders())})
+            return None
+        if content_type in _BINARY_TYPES and loader is None:
+            await send_json(send, 415, {"detail": "unsupported_media_type"})
+            return None
+
+        try:
+            body = await _read_body(receive, MAX_BODY_BYTES)
+            if decoder is not None and body:
+                body = decoder(body, MAX_BODY_BYTES)
+        except BodyTooLarge:
+            await send_json(send, 413, {"detail": "request_entity_too_large"})
+            return None
+        except Exception:
+            await send_json(send, 400, {"detail": "invalid_body_encoding"})
+            return None
+        if loader is not None:
+            try:
+                body = json_codec.dumps(loader(body))
+            except Exception:
+                await send_json(send, 400, {"detail": "invalid_body"})
+                return None
+
+        headers = [
+            (name, value)
+            for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+            and not (loader is not None and name == b"content-type")
+        ]
+        headers.append((b"content-length", str(len(body)).encode()))
+        if loader is not None:
+            headers.append((b"content-type", b"application/json"))
+        scope["headers"] = headers
+
+        delivered = False
+
+        async def receive_decoded() -> Message:
+            nonlocal delivered
+            if delivered:
+                return await receive()
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return receive_decoded
@@ -0,0 +1,559 @@
+"""Coordination between processes that run background loops.
+
+Singleton loops (partition manager, token cleanup, OTA worker, ...) run only
+on the process holding their lease. Partitionable loops (automation engine,
+webhook dispatcher, telemetry bridge) split their work into
+HUBEX_WORKER_SHARD_COUNT shards keyed by hash(device) / org; every live
+process owns the shards that rendezvous hashing assigns to it, and each shard
+is itself a lease, so ownership stays exclusive while membership changes.
+
+Every lease acquisition yields a fencing token that only grows. Loops that
+persist progress (per-shard event cursors) write it with the token and the
+write is refused if a newer owner has already written — a paused process
+whose lease expired cannot move a cursor backwards or double-commit.
+
+Backends (HUBEX_COORDINATION_BACKEND):
+  postgres — session advisory locks on one dedicated connection; members are
+             found via pg_locks, tokens come from txid_current()
+  redis    — SET NX PX leases renewed in the background, INCR fencing
+             counters, a heartbeat ZSET for membership
+  local    — single-process stand-in (SQLite dev setups, tests)
+  auto     — postgres on PostgreSQL, local otherwise (default)
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import socket
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from sqlalchemy import func, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from app.core.config import settings
+from app.db.models.events import EventV1, EventV1Checkpoint
+
+logger = logging.getLogger("uvicorn.error")
+
+LOCK_NAMESPACE = "hubex:loop:"
+# Advisory lock class (first key of the two-int form) marking live members
+MEMBER_LOCK_CLASS = 0x48425831  # "HBX1"
+
+
+def _digest(value: str, size: int = 8) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=size).digest(), "big")
+
+
+def lock_key(name: str) -> int:
+    """Stable signed 64-bit advisory lock key for a lease name."""
+    return int.from_bytes(
+        hashlib.blake2b((LOCK_NAMESPACE + name).encode(), digest_size=8).digest(),
+        "big",
+        signed=True,
+    )
+
+
+def shard_of(key: Any, count: int) -> int:
+    """Stable shard index for a device id/uid, org id, ... (same on every node)."""
+    return _digest(str(key)) % max(1, count)
+
+
+def event_shard_key(event: EventV1) -> Any:
+    """Shard key of an event: its device, else its org, else the event itself."""
+    payload = event.payload or {}
+    for field in ("device_uid", "device_id", "org_id"):
+        if payload.get(field) not in (None, ""):
+            return payload[field]
+    return event.id
+
+
+def shard_owner(lease_name: str, members: list[str]) -> Optional[str]:
+    """Rendezvous hashing: the member with the highest score owns the lease.
+
+    Adding or removing a member only moves the shards that member wins/held.
+    """
+    if not members:
+        return None
+    return max(members, key=lambda member: _digest(f"{member}/{lease_name}"))
+
+
+def _default_node_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class LocalCoordinator:
+    """Single-process stand-in: leases are plain in-memory flags."""
+
+    def __init__(self, node_id: Optional[str] = None) -> None:
+        self.node_id = node_id or _default_node_id()
+        self._tokens = itertools.count(1)
+        self._held: dict[str, tuple[int, asyncio.Event]] = {}
+
+    async def try_acquire(self, name: str) -> Optional[int]:
+        if name in self._held:
+            return None
+        token = next(self._tokens)
+        self._held[name] = (token, asyncio.Event())
+        return token
+
+    async def acquire(self, name: str) -> int:
+        while True:
+            token = await self.try_acquire(name)
+            if token is not None:
+                return token
+            await asyncio.sleep(1.0)
+
+    def holds(self, name: str) -> bool:
+        return name in self._held
+
+    async def wait_lost(self, name: str) -> None:
+        await self._held[name][1].wait()
+
+    async def release(self, name: str) -> None:
+        self._held.pop(name, None)
+
+    async def members(self) -> list[str]:
+        return [self.node_id]
+
+    async def close(self) -> None:
+        held, self._held = self._held, {}
+        for _, lost in held.values():
+            lost.set()
+
+
+class PostgresCoordinator:
+    """pg_try_advisory_lock leases on one dedicated autocommit connection.
+
+    The server releases every lock when the session ends, so a crashed
+    process frees its leases immediately. A watchdog pings the connection
+    every check_interval; if the ping fails all held leases are reported lost
+    and the connection is re-established on the next call. Membership is a
+    two-key advisory lock (MEMBER_LOCK_CLASS, member id) visible in pg_locks.
+    """
+
+    def __init__(self, engine: AsyncEngine, check_interval: float = 5.0) -> None:
+        self.engine = engine
+        self.check_interval = check_interval
+        self.member_id = _digest(_default_node_id(), 4) & 0x7FFFFFFF
+        self.node_id = str(self.member_id)
+        self._conn: Optional[AsyncConnection] = None
+        self._io = asyncio.Lock()  # one statement at a time on the connection
+        self._held: dict[str, tuple[int, asyncio.Event]] = {}
+        self._watchdog: Optional[asyncio.Task] = None
+
+    async def _connection(self) -> AsyncConnection:
+        """Return the lock connection (caller holds self._io)."""
+        if self._conn is None:
+            conn = await self.engine.connect()
+            # Autocommit: advisory locks are session-scoped, no open transaction
+            await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(
+                text("SELECT pg_advisory_lock(:cls, :member)"),
+                {"cls": MEMBER_LOCK_CLASS, "member": self.member_id},
+            )
+            self._conn = conn
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.create_task(self._watch())
+        return self._conn
+
+    async def try_acquire(self, name: str) -> Optional[int]:
+        if name in self._held:
+            return None
+        try:
+            async with self._io:
+                conn = await self._connection()
+                res = await conn.execute(
+                    text("SELECT pg_try_advisory_lock(:k)"), {"k": lock_key(name)}
+                )
+                if not res.scalar():
+                    return None
+                # Each autocommit statement is its own transaction, so this
+                # draws a fresh, cluster-wide increasing id
+                token = (await conn.execute(text("SELECT txid_current()"))).scalar()
+        except Exception as exc:
+            logger.warning("coordination: lock attempt for %s failed: %s", name, exc)
+            await self._drop_connection()
+            return None
+        self._held[name] = (int(token), asyncio.Event())
+        return int(token)
+
+    async def acquire(self, name: str) -> int:
+        while True:
+            token = await self.try_acquire(name)
+            if token is not None:
+                logger.info("coordination: acquired %s (token %d)", name, token)
+                return token
+            await asyncio.sleep(self.check_interval)
+
+    def holds(self, name: str) -> bool:
+        return name in self._held
+
+    async def wait_lost(self, name: str) -> None:
+        await self._held[name][1].wait()
+
+    async def release(self, name: str) -> None:
+        if self._held.pop(name, None) is None or self._conn is None:
+            return
+        try:
+            async with self._io:
+                await self._conn.execute(
+                    text("SELECT pg_advisory_unlock(:k)"), {"k": lock_key(name)}
+                )
+        except Exception:
+            await self._drop_connection()
+
+    async def members(self) -> list[str]:
+        try:
+            async with self._io:
+                conn = await self._connection()
+                res = await conn.execute(
+                    text(
+                        "SELECT objid FROM pg_locks "
+                        "WHERE locktype = 'advisory' AND granted AND objsubid = 2 "
+                        "AND classid = :cls "
+                        "AND database = (SELECT oid FROM pg_database WHERE datname = current_database())"
+                    ),
+                    {"cls": MEMBER_LOCK_CLASS},
+                )
+                return sorted(str(row[0]) for row in res.all())
+        except Exception as exc:
+            logger.warning("coordination: membership query failed: %s", exc)
+            await self._drop_connection()
+            return []
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if not self._held or self._conn is None:
+                continue
+            try:
+                async with self._io:
+                    await self._conn.execute(text("SELECT 1"))
+            except Exception as exc:
+                logger.warning("coordination: lock connection lost (%s)", exc)
+                await self._drop_connection()
+
+    async def _drop_connection(self) -> None:
+        held, self._held = self._held, {}
+        for name, (_, lost) in held.items():
+            logger.warning("coordination: lost %s", name)
+            lost.set()
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                await conn.invalidate()
+            except Exception:
+                pass
+
+    async def close(self) -> None:
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+        held, self._held = self._held, {}
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                # Closing the session releases every advisory lock it holds
+                await conn.close()
+            except Exception:
+                pass
+        for _, lost in held.values():
+            lost.set()
+
+
+# KEYS[1] lease, KEYS[2] fencing counter; ARGV[1] owner, ARGV[2] ttl ms
+_ACQUIRE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local token = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], ARGV[1] .. '/' .. token, 'PX', ARGV[2])
+return token
+"""
+
+# KEYS[1] lease; ARGV[1] expected value, ARGV[2] ttl ms (renew) or '' (release)
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == '' then
+    return redis.call('DEL', KEYS[1])
+end
+return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+"""
+
+# KEYS[1] member zset; ARGV[1] node id ('' = query only), ARGV[2] ttl ms
+_MEMBERS_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if ARGV[1] ~= '' then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+end
+return redis.call('ZRANGE', KEYS[1], 0, -1)
+"""
+
+
+class RedisCoordinator:
+    """Redis leases with fencing tokens.
+
+    A lease is `hubex:lease:<name>` = "<node>/<token>" with a TTL; the token
+    comes from INCR on `hubex:fence:<name>`, so it grows with every new
+    owner. A background task renews held leases and the membership heartbeat
+    every ttl/3; a lease that could not be renewed is reported lost.
+    """
+
+    def __init__(self, redis, ttl: float = 15.0, node_id: Optional[str] = None) -> None:
+        self.redis = redis
+        self.ttl_ms = int(ttl * 1000)
+        self.node_id = node_id or _default_node_id()
+        self._acquire = redis.register_script(_ACQUIRE_LUA)
+        self._renew = redis.register_script(_RENEW_LUA)
+        self._members = redis.register_script(_MEMBERS_LUA)
+        self._held: dict[str, tuple[int, asyncio.Event]] = {}
+        self._renewer: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _keys(name: str) -> list[str]:
+        return [f"hubex:lease:{name}", f"hubex:fence:{name}"]
+
+    def _value(self, name: str) -> str:
+        return f"{self.node_id}/{self._held[name][0]}"
+
+    def _ensure_renewer(self) -> None:
+        if self._renewer is None or self._renewer.done():
+            self._renewer = asyncio.create_task(self._renew_loop())
+
+    async def try_acquire(self, name: str) -> Optional[int]:
+        if name in self._held:
+            return None
+        self._ensure_renewer()
+        try:
+            token = int(await self._acquire(keys=self._keys(name), args=[self.node_id, self.ttl_ms]))
+        except Exception as exc:
+            logger.warning("coordination: lease attempt for %s failed: %s", name, exc)
+            return None
+        if not token:
+            return None
+        self._held[name] = (token, asyncio.Event())
+        return token
+
+    async def acquire(self, name: str) -> int:
+        while True:
+            token = await self.try_acquire(name)
+            if token is not None:
+                logger.info("coordination: acquired %s (token %d)", name, token)
+                return token
+            await asyncio.sleep(self.ttl_ms / 3000)
+
+    def holds(self, name: str) -> bool:
+        return name in self._held
+
+    async def wait_lost(self, name: str) -> None:
+        await self._held[name][1].wait()
+
+    async def release(self, name: str) -> None:
+        if name not in self._held:
+            return
+        value = self._value(name)
+        self._held.pop(name)
+        try:
+            await self._renew(keys=self._keys(name)[:1], args=[value, ""])
+        except Exception:
+            pass  # the TTL will free it
+
+    async def members(self) -> list[str]:
+        self._ensure_renewer()
+        try:
+            return sorted(await self._members(keys=["hubex:members"], args=[self.node_id, self.ttl_ms]))
+        except Exception as exc:
+            logger.warning("coordination: membership query failed: %s", exc)
+            return []
+
+    async def _renew_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl_ms / 3000)
+            try:
+                await self._members(keys=["hubex:members"], args=[self.node_id, self.ttl_ms])
+            except Exception as exc:
+                logger.warning("coordination: membership heartbeat failed: %s", exc)
+            for name in list(self._held):
+                try:
+                    ok = await self._renew(keys=self._keys(name)[:1], args=[self._value(name), self.ttl_ms])
+                except Exception as exc:
+                    logger.warning("coordination: renewing %s failed: %s", name, exc)
+                    ok = 0
+                if not ok and name in self._held:
+                    logger.warning("coordination: lost %s", name)
+                    self._held.pop(name)[1].set()
+
+    async def close(self) -> None:
+        if self._renewer is not None:
+            self._renewer.cancel()
+            self._renewer = None
+        for name in list(self._held):
+            lost = self._held[name][1]
+            await self.release(name)
+            lost.set()
+        try:
+            await self.redis.zrem("hubex:members", self.node_id)
+        except Exception:
+            pass
+
+
+Coordinator = LocalCoordinator | PostgresCoordinator | RedisCoordinator
+
+_coordinator: Optional[Coordinator] = None
+
+
+def make_coordinator(engine: AsyncEngine) -> Coordinator:
+    """Build the coordinator selected by HUBEX_COORDINATION_BACKEND."""
+    backend = settings.coordination_backend
+    if backend == "redis":
+        from app.core.redis_client import get_redis
+
+        redis = get_redis()
+        if redis is not None:
+            return RedisCoordinator(redis)
+        logger.warning("coordination: HUBEX_COORDINATION_BACKEND=redis but Redis is unavailable")
+    if backend in ("postgres", "redis", "auto") and engine.dialect.name == "postgresql":
+        return PostgresCoordinator(engine)
+    if backend != "local" and backend != "auto":
+        logger.warning("coordination: backend %r unavailable, using local", backend)
+    return LocalCoordinator()
+
+
+def get_coordinator() -> Coordinator:
+    """The process-wide coordinator (a LocalCoordinator until one is set)."""
+    global _coordinator
+    if _coordinator is None:
+        _coordinator = LocalCoordinator()
+    return _coordinator
+
+
+def set_coordinator(coordinator: Optional[Coordinator]) -> None:
+    global _coordinator
+    _coordinator = coordinator
+
+
+# ---------------------------------------------------------------------------
+# Sharded ownership
+# ---------------------------------------------------------------------------
+
+class ShardLeases:
+    """The shards of one partitionable loop that this process currently owns.
+
+    Call refresh() once per cycle: it reads live membership, releases shards
+    that rendezvous hashing now assigns elsewhere and tries to lease the ones
+    assigned here. A shard still leased by its previous owner is picked up on
+    a later refresh once that owner lets go (or its lease expires).
+    """
+
+    def __init__(self, loop_name: str, count: Optional[int] = None, coordinator=None) -> None:
+        self.loop_name = loop_name
+        self.count = count or settings.worker_shard_count
+        self._coordinator = coordinator
+        self.owned: dict[int, int] = {}  # shard -> fencing token
+
+    @property
+    def coordinator(self) -> Coordinator:
+        return self._coordinator or get_coordinator()
+
+    def lease_name(self, shard: int) -> str:
+        return f"{self.loop_name}#{shard}"
+
+    async def refresh(self) -> dict[int, int]:
+        coord = self.coordinator
+        members = await coord.members()
+        wanted = {
+            shard for shard in range(self.count)
+            if shard_owner(self.lease_name(shard), members) == coord.node_id
+        }
+        for shard in list(self.owned):
+            if shard not in wanted or not coord.holds(self.lease_name(shard)):
+                self.owned.pop(shard)
+                await coord.release(self.lease_name(shard))
+        for shard in sorted(wanted - self.owned.keys()):
+            token = await coord.try_acquire(self.lease_name(shard))
+            if token is not None:
+                self.owned[shard] = token
+        return dict(self.owned)
+
+    async def release_all(self) -> None:
+        coord = self.coordinator
+        owned, self.owned = self.owned, {}
+        for shard in owned:
+            await coord.release(self.lease_name(shard))
+
+
+# ---------------------------------------------------------------------------
+# Fenced event cursors
+# ---------------------------------------------------------------------------
+
+async def load_cursors(db: AsyncSession, stream: str, subscribers: list[str]) -> dict[str, int]:
+    """Per-subscriber cursors from events_v1_checkpoints.
+
+    Subscribers without a checkpoint start at the current head of the stream
+    (events that predate them are not replayed).
+    """
+    res = await db.execute(
+        select(EventV1Checkpoint.subscriber_id, EventV1Checkpoint.cursor).where(
+            EventV1Checkpoint.stream == stream,
+            EventV1Checkpoint.subscriber_id.in_(subscribers),
+        )
+    )
+    cursors = {subscriber: cursor for subscriber, cursor in res.all()}
+    missing = [s for s in subscribers if s not in cursors]
+    if missing:
+        head_stmt = select(func.max(EventV1.id))
+        if stream != "*":
+            head_stmt = head_stmt.where(EventV1.stream == stream)
+        head = (await db.execute(head_stmt)).scalar_one_or_none() or 0
+        for subscriber in missing:
+            cursors[subscriber] = head
+    return cursors
+
+
+async def save_cursor(
+    db: AsyncSession, stream: str, subscriber: str, cursor: int, token: int
+) -> bool:
+    """Advance a checkpoint, fenced by the caller's lease token.
+
+    Returns False (and writes nothing) when a newer lease owner has already
+    written this checkpoint; the caller should roll back its transaction.
+    Does not commit.
+    """
+    now = datetime.now(timezone.utc)
+    res = await db.execute(
+        update(EventV1Checkpoint)
+        .where(
+            EventV1Checkpoint.stream == stream,
+            EventV1Checkpoint.subscriber_id == subscriber,
+            EventV1Checkpoint.fence <= token,
+        )
+        .values(cursor=cursor, fence=token, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if res.rowcount:
+        return True
+    exists = (await db.execute(
+        select(EventV1Checkpoint.id).where(
+            EventV1Checkpoint.stream == stream,
+            EventV1Checkpoint.subscriber_id == subscriber,
+        )
+    )).first()
+    if exists:
+        logger.warning("coordination: checkpoint %s fenced off (token %d is stale)", subscriber, token)
+        return False
+    db.add(EventV1Checkpoint(
+        stream=stream, subscriber_id=subscriber, cursor=cursor, fence=token, updated_at=now,
+    ))
+    return True
@@ -1,4 +1,13 @@
-"""Email service — sends emails via SMTP or logs them in dev mode.
+"""Email service — queued delivery through a persisted outbox and an SMTP pool.
+
+Producers (automation send_email actions) only call enqueue_email(), which
+adds rows to the email_outbox table inside the caller's transaction.
+email_outbox_loop() claims due rows in batches and hands them to SmtpPool,
+which keeps a few authenticated SMTP connections open and reuses them across
+messages. Failed deliveries are retried with backoff; permanent (5xx)
+rejections are not.
+
+If SMTP is not configured, queued emails are logged instead of sent.
 
 Configure via environment:
   HUBEX_SMTP_HOST=smtp.gmail.com
@@ -7,12 +16,26 @@ Configure via environment:
   HUBEX_SMTP_PASSWORD=your_password
   HUBEX_SMTP_FROM=noreply@hubex.io
   HUBEX_SMTP_TLS=true
+  HUBEX_SMTP_POOL_SIZE=2         # concurrent SMTP connections per process
+  HUBEX_EMAIL_BATCH_SIZE=50      # outbox rows claimed per cycle
 """
+from __future__ import annotations
+
+import asyncio
 import logging
 import os
 import smtplib
-from email.mime.text import MIMEText
+import time
+from datetime import datetime, timedelta, timezone
 from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Any, Callable, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.metrics import observe_cycle
+from app.db.models.email_outbox import EmailOutbox
 
 logger = logging.getLogger("uvicorn.error")
 
@@ -22,6 +45,19 @@ SMTP_USER = os.getenv("HUBEX_SMTP_USER", "")
 SMTP_PASSWORD = os.getenv("HUBEX_SMTP_PASSWORD", "")
 SMTP_FROM = os.getenv("HUBEX_SMTP_FROM", "noreply@hubex.io")
 SMTP_TLS = os.getenv("HUBEX_SMTP_TLS", "true").lower() == "true"
+SMTP_POOL_SIZE = int(os.getenv("HUBEX_SMTP_POOL_SIZE", "2"))
+EMAIL_BATCH_SIZE = int(os.getenv("HUBEX_EMAIL_BATCH_SIZE", "50"))
+
+SMTP_TIMEOUT = 30.0
+# Pooled connections idle longer than this are dropped (servers time them out)
+SMTP_IDLE_TIMEOUT = 60.0
+# Recipients per outbox row — one SMTP transaction each
+MAX_RECIPIENTS_PER_MESSAGE = 50
+# Delays (seconds) before each retry; after the last one a message is failed
+RETRY_DELAYS = [30, 120, 600, 1800, 7200]
+# A claimed ("sending") row becomes claimable again after this many seconds
+SEND_LEASE_SECONDS = 300
+POLL_INTERVAL = 5  # seconds between outbox cycles when idle
 
 
 def is_configured() -> bool:
@@ -29,37 +65,333 @@ def is_configured() -> bool:
     return bool(SMTP_HOST and SMTP_USER)
 
 
-def send_email(to: str, subject: str, body_html: str, body_text: str | None = None) -> bool:
-    """Send an email. Returns True on success, False on failure.
+def render_template(text: str, variables: dict[str, Any]) -> str:
+    """Substitute {name} placeholders the same way the template preview does."""
+    for key, val in variables.items():
+        text = text.replace(f"{{{key}}}", str(val))
+    return text
+
 
-    If SMTP is not configured, logs the email instead of sending.
+def build_message(
+    outbox_id: int,
+    recipients: list[str],
+    subject: str,
+    body_html: str,
+    body_text: Optional[str] = None,
+    sender: str = SMTP_FROM,
+) -> bytes:
+    """Render an outbox row as an RFC 5322 message.
+
+    Multi-recipient messages go out with an undisclosed To header so
+    recipients of one batch do not see each other. The Message-ID is derived
+    from the outbox id so a retried delivery is recognisable as the same mail.
     """
-    if not is_configured():
-        logger.info(
-            "email (dev mode): to=%s subject=%s body=%s",
-            to, subject, (body_text or body_html)[:100],
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = subject
+    msg["From"] = sender
+    msg["To"] = recipients[0] if len(recipients) == 1 else "undisclosed-recipients:;"
+    domain = sender.rpartition("@")[2] or "hubex.io"
+    msg["Message-ID"] = f"<outbox-{outbox_id}@{domain}>"
+
+    if body_text:
+        msg.attach(MIMEText(body_text, "plain"))
+    msg.attach(MIMEText(body_html, "html"))
+    return msg.as_bytes()
+
+
+async def enqueue_email(
+    db: AsyncSession,
+    recipients: list[str],
+    subject: str,
+    body_html: str,
+    body_text: Optional[str] = None,
+    source: Optional[str] = None,
+) -> list[EmailOutbox]:
+    """Queue an email for delivery. No network I/O; caller must commit.
+
+    Recipients are de-duplicated and split into messages of at most
+    MAX_RECIPIENTS_PER_MESSAGE, each delivered in one SMTP transaction.
+    """
+    unique = list(dict.fromkeys(r.strip() for r in recipients if r and r.strip()))
+    rows = [
+        EmailOutbox(
+            recipients=unique[i:i + MAX_RECIPIENTS_PER_MESSAGE],
+            subject=subject[:256],
+            body_html=body_html,
+            body_text=body_text or None,
+            status="pending",
+            attempts=0,
+            next_attempt_at=datetime.now(timezone.utc),
+            source=source,
         )
-        return True
+        for i in range(0, len(unique), MAX_RECIPIENTS_PER_MESSAGE)
+    ]
+    db.add_all(rows)
+    await db.flush()
+    return rows
 
-    try:
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = subject
-        msg["From"] = SMTP_FROM
-        msg["To"] = to
-
-        if body_text:
-            msg.attach(MIMEText(body_text, "plain"))
-        msg.attach(MIMEText(body_html, "html"))
-
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            if SMTP_TLS:
-                server.starttls()
-            if SMTP_USER and SMTP_PASSWORD:
-                server.login(SMTP_USER, SMTP_PASSWORD)
-            server.sendmail(SMTP_FROM, [to], msg.as_string())
-
-        logger.info("email sent: to=%s subject=%s", to, subject)
-        return True
-    except Exception as e:
-        logger.error("email failed: to=%s error=%s", to, e)
+
+# ---------------------------------------------------------------------------
+# SMTP connection pool
+# ---------------------------------------------------------------------------
+
+class SmtpPool:
+    """Bounded pool of authenticated SMTP connections.
+
+    smtplib is blocking, so each SMTP conversation runs in a worker thread and
+    the event loop only awaits it. At most `size` deliveries run at once; an
+    idle connection is reused for the next message instead of reconnecting,
+    re-negotiating TLS and logging in again.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: str = "",
+        password: str = "",
+        use_tls: bool = True,
+        size: int = 2,
+        timeout: float = SMTP_TIMEOUT,
+        idle_timeout: float = SMTP_IDLE_TIMEOUT,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._slots = asyncio.Semaphore(max(1, size))
+        self._idle: list[tuple[smtplib.SMTP, float]] = []
+        self.connects = 0  # connections opened so far (observability / tests)
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                conn.starttls()
+            if self.user and self.password:
+                conn.login(self.user, self.password)
+        except BaseException:
+            conn.close()
+            raise
+        self.connects += 1
+        return conn
+
+    def _deliver(
+        self, conn: Optional[smtplib.SMTP], sender: str, recipients: list[str], raw: bytes
+    ) -> tuple[smtplib.SMTP, dict]:
+        """Send one message (worker thread). Returns (connection, refused)."""
+        if conn is not None:
+            try:
+                return conn, conn.sendmail(sender, recipients, raw)
+            except smtplib.SMTPServerDisconnected:
+                # Server dropped the pooled connection — retry once on a fresh one
+                conn.close()
+            except BaseException:
+                conn.close()
+                raise
+        conn = self._connect()
+        try:
+            return conn, conn.sendmail(sender, recipients, raw)
+        except BaseException:
+            # Never pool a connection left mid-transaction
+            conn.close()
+            raise
+
+    def _checkout(self) -> Optional[smtplib.SMTP]:
+        now = time.monotonic()
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            if now - last_used < self.idle_timeout and conn.sock is not None:
+                return conn
+            conn.close()
+        return None
+
+    async def send(self, sender: str, recipients: list[str], raw: bytes) -> dict:
+        """Deliver one message; returns the per-recipient refusals (if any).
+
+        Raises the smtplib exception when the whole transaction fails.
+        """
+        async with self._slots:
+            conn = self._checkout()
+            conn, refused = await asyncio.to_thread(self._deliver, conn, sender, recipients, raw)
+            if conn.sock is not None:
+                self._idle.append((conn, time.monotonic()))
+            return refused
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+
+        def _quit_all() -> None:
+            for conn, _ in idle:
+                try:
+                    conn.quit()
+                except Exception:
+                    conn.close()
+
+        if idle:
+            await asyncio.to_thread(_quit_all)
+
+
+def _is_permanent(exc: BaseException) -> bool:
+    """5xx rejections will not succeed on retry (auth errors are config issues)."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPAuthenticationError):
         return False
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code >= 500
+    return False
+
+
+# ---------------------------------------------------------------------------
+# Outbox worker
+# ---------------------------------------------------------------------------
+
+async def _claim_batch(db: AsyncSession, limit: int) -> list[dict[str, Any]]:
+    """Lease up to `limit` due messages to this worker and return snapshots.
+
+    Rows are locked with SKIP LOCKED so concurrent workers claim disjoint
+    batches; a worker that dies mid-send releases its rows when the lease
+    (next_attempt_at) runs out.
+    """
+    now = datetime.now(timezone.utc)
+    res = await db.execute(
+        select(EmailOutbox)
+        .where(
+            EmailOutbox.status.in_(("pending", "sending")),
+            EmailOutbox.next_attempt_at <= now,
+        )
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = list(res.scalars().all())
+    claimed = []
+    for row in rows:
+        row.status = "sending"
+        row.attempts += 1
+        row.next_attempt_at = now + timedelta(seconds=SEND_LEASE_SECONDS)
+        claimed.append({
+            "id": row.id,
+            "recipients": list(row.recipients or []),
+            "subject": row.subject,
+            "body_html": row.body_html,
+            "body_text": row.body_text,
+            "attempts": row.attempts,
+        })
+    await db.commit()
+    return claimed
+
+
+def _outcome(msg: dict[str, Any], result: Any) -> dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    if not isinstance(result, BaseException):
+        refused = ", ".join(sorted(result)) if result else None
+        return {
+            "id": msg["id"],
+            "status": "sent",
+            "sent_at": now,
+            "last_error": f"refused: {refused}"[:512] if refused else None,
+        }
+
+    error = f"{type(result).__name__}: {result}"[:512]
+    retry = msg["attempts"] - 1
+    if _is_permanent(result) or retry >= len(RETRY_DELAYS):
+        logger.warning("email failed permanently: outbox=%d error=%s", msg["id"], error)
+        return {"id": msg["id"], "status": "failed", "last_error": error}
+    return {
+        "id": msg["id"],
+        "status": "pending",
+        "next_attempt_at": now + timedelta(seconds=RETRY_DELAYS[retry]),
+        "last_error": error,
+    }
+
+
+async def process_outbox_once(
+    pool: Optional[SmtpPool],
+    session_factory: Optional[Callable[[], AsyncSession]] = None,
+    batch_size: int = EMAIL_BATCH_SIZE,
+    sender: str = SMTP_FROM,
+) -> int:
+    """Claim one batch of due messages, deliver it, record the outcomes.
+
+    With pool=None (SMTP not configured) messages are logged and marked sent.
+    Returns the number of messages claimed.
+    """
+    if session_factory is None:
+        from app.db.session import WorkerSessionLocal
+
+        session_factory = WorkerSessionLocal
+
+    async with session_factory() as db:
+        batch = await _claim_batch(db, batch_size)
+    if not batch:
+        return 0
+
+    if pool is None:
+        for msg in batch:
+            logger.info(
+                "email (dev mode): to=%s subject=%s body=%s",
+                ",".join(msg["recipients"]), msg["subject"],
+                (msg["body_text"] or msg["body_html"])[:100],
+            )
+        results: list[Any] = [{} for _ in batch]
+    else:
+        results = await asyncio.gather(
+            *(
+                pool.send(
+                    sender,
+                    msg["recipients"],
+                    build_message(
+                        msg["id"], msg["recipients"], msg["subject"],
+                        msg["body_html"], msg["body_text"], sender=sender,
+                    ),
+                )
+                for msg in batch
+            ),
+            return_exceptions=True,
+        )
+
+    outcomes = [_outcome(msg, result) for msg, result in zip(batch, results)]
+    async with session_factory() as db:
+        # ORM bulk UPDATE by primary key, grouped by the columns each outcome sets
+        groups: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+        for outcome in outcomes:
+            groups.setdefault(tuple(sorted(outcome)), []).append(outcome)
+        for rows in groups.values():
+            await db.execute(update(EmailOutbox), rows)
+        await db.commit()
+
+    sent = sum(1 for o in outcomes if o["status"] == "sent")
+    if sent:
+        logger.info("email: delivered %d/%d queued messages", sent, len(outcomes))
+    return len(batch)
+
+
+async def email_outbox_loop() -> None:
+    """Background loop: drains the email outbox through a shared SMTP pool."""
+    pool = (
+        SmtpPool(
+            SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD,
+            use_tls=SMTP_TLS, size=SMTP_POOL_SIZE,
+        )
+        if is_configured()
+        else None
+    )
+    try:
+        while True:
+            claimed = 0
+            try:
+                with observe_cycle("email_outbox"):
+                    claimed = await process_outbox_once(pool)
+            except Exception:
+                logger.exception("email_outbox: unhandled error in delivery cycle")
+            # A full batch means there is likely more due — go again right away
+            if claimed < EMAIL_BATCH_SIZE:
+                await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        if pool is not None:
+            await pool.close()
@@ -0,0 +1,45 @@
+"""Push wake-ups for events_v1 consumers.
+
+Streaming readers (GET /events/stream, WS /events/ws) and the automation
+engine park on a subscribe() subscription instead of polling `id > cursor`
+on a timer; a wake-up only tells them that a stream has new rows, they then
+read from their cursor as before. Wake-ups go through app.core.wakeups on
+NOTIFY_CHANNEL, keyed by stream name:
+
+- in-process: a session that inserted EventV1 rows wakes local waiters of
+  those streams when it commits;
+- PostgreSQL: the events_v1 insert trigger sends NOTIFY hubex_events with the
+  stream name, so events written by any process (or by raw SQL) wake
+  waiters here.
+
+Without the listener (SQLite, listener down) waiters also re-check every
+RECHECK_SECONDS, so a missed wake-up only costs latency.
+"""
+from __future__ import annotations
+
+from contextlib import AbstractContextManager
+
+from app.core import wakeups
+from app.db.models.events import EventV1
+
+NOTIFY_CHANNEL = "hubex_events"
+MAX_WAIT_SECONDS = 25.0  # with the listener; also the SSE/WS keep-alive period
+RECHECK_SECONDS = 2.0  # without the listener
+
+wakeups.track_inserts(NOTIFY_CHANNEL, EventV1, lambda row: row.stream)
+wakeups.follow(NOTIFY_CHANNEL)
+
+
+def subscribe(stream: str) -> AbstractContextManager[wakeups.Subscription]:
+    """Wake-ups for new events of the stream; register *before* reading."""
+    return wakeups.subscribe(NOTIFY_CHANNEL, (stream,))
+
+
+def recheck_interval() -> float:
+    """How long a waiter may park before reading its stream again."""
+    return wakeups.recheck_interval(MAX_WAIT_SECONDS, RECHECK_SECONDS)
+
+
+def waiter_count() -> int:
+    return wakeups.waiter_count(NOTIFY_CHANNEL)
+
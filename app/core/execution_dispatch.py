@@ -0,0 +1,57 @@
+"""Per-definition wake-ups for long-polling execution workers.
+
+POST /executions/runs/claim-next with wait_seconds > 0 subscribes to the
+definitions it would claim from before the first claim and, finding no run,
+parks on that subscription; it claims again as soon as one of them gets a
+claimable run, instead of the worker re-polling on a fixed interval. Wake-ups go through app.core.wakeups
+on NOTIFY_CHANNEL, keyed by definition id:
+
+- in-process: a session that inserted requested ExecutionRun rows wakes the
+  definitions' waiters when it commits. Core updates that make a run
+  claimable again (release_claim) register the definition with
+  stage_wake();
+- PostgreSQL: the execution_runs trigger (migration a8b9c0d1e2f5) sends
+  NOTIFY hubex_execution_runs with the definition id for inserted and
+  released runs, so runs created by any process wake waiters here.
+
+Leases that simply expire send no wake-up; waiters re-check every
+recheck_interval() and pick those runs up then.
+"""
+from __future__ import annotations
+
+from contextlib import AbstractContextManager
+from typing import Iterable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import wakeups
+from app.db.models.executions import RUN_STATUS_REQUESTED, ExecutionRun
+
+NOTIFY_CHANNEL = "hubex_execution_runs"
+LONG_POLL_MAX_SECONDS = 30.0
+RECHECK_SECONDS = 5.0  # without the listener
+
+wakeups.track_inserts(
+    NOTIFY_CHANNEL, ExecutionRun,
+    lambda row: row.definition_id if row.status == RUN_STATUS_REQUESTED else None,
+)
+wakeups.follow(NOTIFY_CHANNEL, int)
+
+
+def stage_wake(db: AsyncSession, definition_ids: Iterable[int]) -> None:
+    """Wake the definitions' workers once `db` commits (for Core updates)."""
+    wakeups.stage(db, NOTIFY_CHANNEL, definition_ids)
+
+
+def subscribe(definition_ids: Iterable[int]) -> AbstractContextManager[wakeups.Subscription]:
+    """Wake-ups for claimable runs of the definitions; register *before* claiming."""
+    return wakeups.subscribe(NOTIFY_CHANNEL, definition_ids)
+
+
+def recheck_interval() -> float:
+    """How long a worker may park before trying to claim again."""
+    return wakeups.recheck_interval(LONG_POLL_MAX_SECONDS, RECHECK_SECONDS)
+
+
+def waiter_count() -> int:
+    return wakeups.waiter_count(NOTIFY_CHANNEL)
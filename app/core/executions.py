@@ -6,6 +6,7 @@ from sqlalchemy import or_, select, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core import execution_dispatch
 from app.db.models.executions import (
     ExecutionDefinition,
     ExecutionRun,
@@ -140,20 +141,13 @@ async def claim_run(
             lease_expires_at=lease_expires_at,
         )
         .returning(ExecutionRun)
-        .execution_options(synchronize_session=False)
+        .execution_options(synchronize_session=False, populate_existing=True)
     )
     res = await db.execute(stmt)
     updated = res.scalar_one_or_none()
     if updated is not None:
         await db.commit()
-        refreshed = await db.scalar(
-            select(ExecutionRun)
-            .where(ExecutionRun.id == run_id)
-            .execution_options(populate_existing=True)
-        )
-        if refreshed is None:
-            return updated
-        return refreshed
+        return updated
 
     run = await db.scalar(select(ExecutionRun).where(ExecutionRun.id == run_id))
     if run is None:
@@ -190,6 +184,17 @@ def _as_aware(dt: datetime | None) -> datetime | None:
     return dt
 
 
+def _claimable(now: datetime) -> tuple:
+    return (
+        ExecutionRun.status == RUN_STATUS_REQUESTED,
+        or_(
+            ExecutionRun.claimed_by.is_(None),
+            ExecutionRun.lease_expires_at.is_(None),
+            ExecutionRun.lease_expires_at < now,
+        ),
+    )
+
+
 async def extend_lease(
     db: AsyncSession,
     *,
@@ -235,6 +240,44 @@ async def extend_lease(
     raise ClaimConflictError("lease expired or not owned")
 
 
+async def extend_leases(
+    db: AsyncSession,
+    *,
+    worker_id: str,
+    run_ids: list[int],
+    lease_seconds: int,
+) -> tuple[list[tuple[int, datetime]], list[int]]:
+    """Extend the worker's live leases on all of run_ids in one UPDATE.
+
+    Returns (id, lease_expires_at) of the renewed runs and the ids that were
+    not renewed: finalized, released, expired or claimed by another worker.
+    """
+    ids = sorted(set(run_ids))
+    if not ids:
+        return [], []
+    now = datetime.now(timezone.utc)
+    res = await db.execute(
+        update(ExecutionRun)
+        .where(
+            ExecutionRun.id.in_(ids),
+            ExecutionRun.status == RUN_STATUS_REQUESTED,
+            ExecutionRun.claimed_by == worker_id,
+            ExecutionRun.lease_expires_at.is_not(None),
+            ExecutionRun.lease_expires_at > now,
+        )
+        .values(
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            updated_at=now,
+        )
+        .returning(ExecutionRun.id, ExecutionRun.lease_expires_at)
+        .execution_options(synchronize_session=False)
+    )
+    renewed = sorted((run_id, lease_at) for run_id, lease_at in res.all())
+    await db.commit()
+    renewed_ids = {run_id for run_id, _ in renewed}
+    return renewed, [run_id for run_id in ids if run_id not in renewed_ids]
+
+
 async def release_claim(
     db: AsyncSession,
     *,
@@ -261,6 +304,8 @@ async def release_claim(
     res = await db.execute(stmt)
     updated = res.scalar_one_or_none()
     if updated is not None:
+        # The run is claimable again: wake workers long-polling its definition
+        execution_dispatch.stage_wake(db, (updated.definition_id,))
         await db.commit()
         return updated
 
@@ -276,96 +321,65 @@ async def release_claim(
     raise ClaimConflictError("run not releasable")
 
 
-async def claim_next_run(
-    db: AsyncSession,
-    *,
-    definition_id: int,
-    worker_id: str,
-    lease_seconds: int,
-    max_attempts: int = 5,
-) -> ExecutionRun:
-    return await claim_next_run_for_definition(
-        db,
-        definition_id=definition_id,
-        worker_id=worker_id,
-        lease_seconds=lease_seconds,
-        max_attempts=max_attempts,
-    )
-
-
-async def claim_next_run_for_definition(
-    db: AsyncSession,
-    *,
-    definition_id: int,
-    worker_id: str,
-    lease_seconds: int,
-    max_attempts: int = 5,
-) -> ExecutionRun:
-    return await claim_next_run_for_definitions(
-        db,
-        definition_ids=[definition_id],
-        worker_id=worker_id,
-        lease_seconds=lease_seconds,
-        max_attempts=max_attempts,
-    )
-
-
 async def claim_next_run_for_definitions(
     db: AsyncSession,
     *,
     definition_ids: list[int],
     worker_id: str,
     lease_seconds: int,
-    max_attempts: int = 5,
 ) -> ExecutionRun:
+    """Claim the oldest claimable run of the definitions.
+
+    The candidate is picked and leased by one UPDATE ... WHERE id =
+    (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING, so concurrent workers skip
+    each other's rows instead of conflicting and retrying, and the full run
+    comes back without a refetch. A worker already holding a live lease on
+    one of the definitions' runs gets that run back.
+    """
     if not definition_ids:
         raise ClaimNotFoundError("no run available")
 
     ids = sorted(set(definition_ids))
-    attempts = max(1, max_attempts)
-    for _ in range(attempts):
-        now = datetime.now(timezone.utc)
-        res = await db.execute(
-            select(ExecutionRun.id)
-            .where(
-                ExecutionRun.definition_id.in_(ids),
-                ExecutionRun.status == RUN_STATUS_REQUESTED,
-                or_(
-                    ExecutionRun.claimed_by.is_(None),
-                    ExecutionRun.lease_expires_at.is_(None),
-                    ExecutionRun.lease_expires_at < now,
-                ),
-            )
-            .order_by(ExecutionRun.definition_id.asc(), ExecutionRun.id.asc())
-            .limit(1)
+    now = datetime.now(timezone.utc)
+    lease_expires_at = now + timedelta(seconds=lease_seconds)
+    candidate = (
+        select(ExecutionRun.id)
+        .where(ExecutionRun.definition_id.in_(ids), *_claimable(now))
+        .order_by(ExecutionRun.definition_id.asc(), ExecutionRun.id.asc())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    res = await db.execute(
+        update(ExecutionRun)
+        .where(ExecutionRun.id == candidate, *_claimable(now))
+        .values(
+            claimed_by=worker_id,
+            claimed_at=now,
+            lease_expires_at=lease_expires_at,
         )
-        candidate_id = res.scalar_one_or_none()
-        if candidate_id is None:
-            res_same = await db.execute(
-                select(ExecutionRun.id)
-                .where(
-                    ExecutionRun.definition_id.in_(ids),
-                    ExecutionRun.status == RUN_STATUS_REQUESTED,
-                    ExecutionRun.claimed_by == worker_id,
-                    ExecutionRun.lease_expires_at > now,
-                )
-                .order_by(ExecutionRun.definition_id.asc(), ExecutionRun.id.asc())
-                .limit(1)
-            )
-            candidate_id = res_same.scalar_one_or_none()
-        if candidate_id is None:
-            raise ClaimNotFoundError("no run available")
-        try:
-            return await claim_run(
-                db,
-                run_id=candidate_id,
-                worker_id=worker_id,
-                lease_seconds=lease_seconds,
-            )
-        except ClaimConflictError:
-            continue
+        .returning(ExecutionRun)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    run = res.scalar_one_or_none()
+    if run is not None:
+        await db.commit()
+        return run
 
-    raise ClaimConflictError("no run available")
+    held = await db.scalar(
+        select(ExecutionRun)
+        .where(
+            ExecutionRun.definition_id.in_(ids),
+            ExecutionRun.status == RUN_STATUS_REQUESTED,
+            ExecutionRun.claimed_by == worker_id,
+            ExecutionRun.lease_expires_at > now,
+        )
+        .order_by(ExecutionRun.definition_id.asc(), ExecutionRun.id.asc())
+        .limit(1)
+    )
+    if held is None:
+        raise ClaimNotFoundError("no run available")
+    return held
 
 
 async def read_definitions(
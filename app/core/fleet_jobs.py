@@ -0,0 +1,304 @@
+"""Fleet jobs: fan one task out to every device of a group, entity or tag.
+
+A job targets the devices bound (enabled) to one group or entity, or to all
+entities carrying a tag; the entity set is resolved when the job is created.
+The fleet_dispatcher loop materializes per-device `tasks` rows in batches,
+each batch one `INSERT INTO tasks ... SELECT` over the bindings in device-id
+order from the job's cursor, so a job over thousands of devices costs a few
+statements rather than an API call per device.
+
+Each cycle dispatches at most DISPATCH_BATCH tasks per job and respects
+- max_in_flight: dispatched tasks not yet finished (queued or claimed);
+- rate_per_minute: tasks dispatched per fixed one-minute window;
+- abort_failure_percent: once at least ABORT_MIN_FINISHED tasks finished
+  (or all of a smaller job), a failure share above the threshold aborts the
+  job and cancels its still-queued tasks.
+
+Progress counters on the job row (dispatched / succeeded / failed /
+canceled) are bumped as tasks are dispatched and finish
+(record_task_result), so reading progress never scans `tasks`.
+
+  running ──▶ completed   (all targets dispatched and finished)
+     │ ▲ pause/resume
+     ▼ │
+  paused       running/paused ──▶ aborted (threshold) | canceled (operator)
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from sqlalchemy import func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import task_queue
+from app.core.metrics import observe_cycle
+from app.core.system_events import emit_system_event
+from app.db.models.device import Device
+from app.db.models.entities import Entity, EntityDeviceBinding
+from app.db.models.fleet_jobs import FleetJob
+from app.db.models.tasks import Task
+
+logger = logging.getLogger("uvicorn.error")
+
+DISPATCH_BATCH = 1000  # tasks per job and cycle
+DISPATCH_INTERVAL = 5  # seconds between dispatcher cycles
+RATE_WINDOW = timedelta(minutes=1)
+ABORT_MIN_FINISHED = 10
+
+GROUP_TYPE = "group"
+ACTIVE_STATUSES = ("running", "paused")
+_RESULT_COUNTERS = {"done": "succeeded", "failed": "failed", "canceled": "canceled"}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _aware(ts: datetime) -> datetime:
+    return ts if ts.tzinfo is not None else ts.replace(tzinfo=timezone.utc)
+
+
+def _has_tag(tags: Any, tag: str) -> bool:
+    if isinstance(tags, list):
+        return tag in tags
+    if isinstance(tags, dict):
+        key, _, value = tag.partition("=")
+        return key in tags and (not value or str(tags[key]) == value)
+    return False
+
+
+async def resolve_entity_ids(db: AsyncSession, target: dict[str, Any]) -> list[str]:
+    """Entity ids selected by a target ({"group"|"entity_id"|"tag": ...}).
+
+    Tags match entries of list tags, or keys ("key" / "key=value") of dict
+    tags. Raises ValueError for a malformed selector.
+    """
+    selectors = [key for key in ("group", "entity_id", "tag") if target.get(key)]
+    if len(selectors) != 1:
+        raise ValueError("target needs exactly one of group, entity_id, tag")
+    key = selectors[0]
+    value = str(target[key])
+    if key == "tag":
+        res = await db.execute(select(Entity.entity_id, Entity.tags).where(Entity.tags.is_not(None)))
+        return sorted(entity_id for entity_id, tags in res.all() if _has_tag(tags, value))
+    stmt = select(Entity.entity_id).where(Entity.entity_id == value)
+    if key == "group":
+        stmt = stmt.where(Entity.type == GROUP_TYPE)
+    return list((await db.execute(stmt)).scalars().all())
+
+
+def _target_devices(job: FleetJob):
+    stmt = select(EntityDeviceBinding.device_id).where(
+        EntityDeviceBinding.entity_id.in_(job.target.get("entity_ids") or []),
+        EntityDeviceBinding.enabled.is_(True),
+    )
+    if job.org_id is not None:
+        stmt = stmt.join(Device, Device.id == EntityDeviceBinding.device_id).where(
+            Device.org_id == job.org_id
+        )
+    return stmt
+
+
+async def create_job(
+    db: AsyncSession,
+    *,
+    name: str,
+    task_type: str,
+    target: dict[str, Any],
+    entity_ids: list[str],
+    payload: Optional[dict[str, Any]] = None,
+    priority: int = 0,
+    max_in_flight: Optional[int] = None,
+    rate_per_minute: Optional[int] = None,
+    abort_failure_percent: Optional[int] = None,
+    org_id: Optional[int] = None,
+    created_by: Optional[int] = None,
+) -> FleetJob:
+    """Create a running job; the dispatcher picks it up. Caller must commit."""
+    job = FleetJob(
+        name=name,
+        task_type=task_type,
+        payload=payload or {},
+        priority=priority,
+        target={**target, "entity_ids": entity_ids},
+        status="running",
+        max_in_flight=max_in_flight,
+        rate_per_minute=rate_per_minute,
+        abort_failure_percent=abort_failure_percent,
+        total=0,
+        dispatched=0,
+        succeeded=0,
+        failed=0,
+        canceled=0,
+        cursor_device_id=0,
+        exhausted=False,
+        window_dispatched=0,
+        org_id=org_id,
+        created_by=created_by,
+    )
+    # Estimate for progress display; exact once the targets are exhausted
+    targets = _target_devices(job).distinct().subquery()
+    job.total = await db.scalar(select(func.count()).select_from(targets)) or 0
+    db.add(job)
+    await db.flush()
+    return job
+
+
+async def record_task_result(db: AsyncSession, fleet_job_id: int, status: str) -> None:
+    """Count a finished task of a job (done / failed / canceled). Caller commits."""
+    column = _RESULT_COUNTERS.get(status)
+    if column is None:
+        return
+    counter = getattr(FleetJob, column)
+    await db.execute(update(FleetJob).where(FleetJob.id == fleet_job_id).values({counter: counter + 1}))
+
+
+def in_flight(job: FleetJob) -> int:
+    return job.dispatched - job.succeeded - job.failed - job.canceled
+
+
+def _should_abort(job: FleetJob) -> bool:
+    if job.abort_failure_percent is None:
+        return False
+    finished = job.succeeded + job.failed
+    if finished == 0 or finished < min(ABORT_MIN_FINISHED, max(job.total, 1)):
+        return False
+    return job.failed * 100 > job.abort_failure_percent * finished
+
+
+async def cancel_queued(db: AsyncSession, job: FleetJob, reason: str) -> int:
+    """Cancel the job's tasks no device has claimed yet; returns how many."""
+    res = await db.execute(
+        update(Task)
+        .where(Task.fleet_job_id == job.id, Task.status == "queued")
+        .values(status="canceled", completed_at=_now(), error=reason)
+    )
+    count = res.rowcount or 0
+    job.canceled += count
+    return count
+
+
+def _allowance(job: FleetJob, now: datetime) -> int:
+    allowance = DISPATCH_BATCH
+    if job.max_in_flight is not None:
+        allowance = min(allowance, job.max_in_flight - in_flight(job))
+    if job.rate_per_minute is not None:
+        if job.window_started_at is None or now - _aware(job.window_started_at) >= RATE_WINDOW:
+            job.window_started_at = now
+            job.window_dispatched = 0
+        allowance = min(allowance, job.rate_per_minute - job.window_dispatched)
+    return max(0, allowance)
+
+
+async def dispatch_batch(db: AsyncSession, job: FleetJob, now: Optional[datetime] = None) -> int:
+    """Materialize the next batch of the job's tasks; returns how many."""
+    now = now or _now()
+    limit = _allowance(job, now)
+    if limit == 0 or job.exhausted:
+        return 0
+    devices = (
+        _target_devices(job)
+        .where(EntityDeviceBinding.device_id > job.cursor_device_id)
+        .distinct()
+        .order_by(EntityDeviceBinding.device_id)
+        .limit(limit)
+        .subquery()
+    )
+    rows = select(
+        devices.c.device_id,
+        literal(job.task_type),
+        literal(job.payload, Task.payload.type),
+        literal("queued"),
+        literal(job.priority),
+        literal(f"fleet-job:{job.id}"),
+        literal(job.id),
+    )
+    res = await db.execute(
+        insert(Task)
+        .from_select(
+            ["client_id", "type", "payload", "status", "priority", "idempotency_key", "fleet_job_id"],
+            rows,
+        )
+        .returning(Task.client_id)
+    )
+    device_ids = list(res.scalars().all())
+    count = len(device_ids)
+    if count:
+        task_queue.stage_wake(db, device_ids)
+        job.cursor_device_id = max(device_ids)
+        job.dispatched += count
+        job.window_dispatched += count
+    if count < limit:
+        job.exhausted = True
+        job.total = job.dispatched
+    return count
+
+
+async def _finish(db: AsyncSession, job: FleetJob, status: str, event_type: str) -> None:
+    job.status = status
+    job.completed_at = _now()
+    await emit_system_event(db, event_type, {
+        "job_id": job.id,
+        "name": job.name,
+        "dispatched": job.dispatched,
+        "succeeded": job.succeeded,
+        "failed": job.failed,
+        "canceled": job.canceled,
+    })
+
+
+async def process_job(db: AsyncSession, job: FleetJob, now: Optional[datetime] = None) -> int:
+    """One dispatcher step for a running job; returns tasks dispatched."""
+    if _should_abort(job):
+        job.error = (
+            f"{job.failed} of {job.succeeded + job.failed} finished tasks failed "
+            f"(threshold {job.abort_failure_percent}%)"
+        )
+        await cancel_queued(db, job, "fleet job aborted")
+        await _finish(db, job, "aborted", "fleet_job.aborted")
+        return 0
+    count = await dispatch_batch(db, job, now)
+    if count:
+        await emit_system_event(db, "fleet_job.dispatched", {"job_id": job.id, "count": count})
+    if job.exhausted and in_flight(job) == 0:
+        await _finish(db, job, "completed", "fleet_job.completed")
+    return count
+
+
+async def run_fleet_cycle(db: AsyncSession) -> int:
+    """Advance every running job by one step; returns tasks dispatched."""
+    res = await db.execute(select(FleetJob.id).where(FleetJob.status == "running").order_by(FleetJob.id))
+    total = 0
+    for job_id in res.scalars().all():
+        job = await db.scalar(
+            select(FleetJob)
+            .where(FleetJob.id == job_id, FleetJob.status == "running")
+            .with_for_update(skip_locked=True)
+        )
+        if job is None:
+            continue
+        try:
+            total += await process_job(db, job)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logger.exception("fleet_jobs: error processing job_id=%d", job_id)
+    return total
+
+
+async def fleet_dispatcher_loop() -> None:
+    """Background loop: dispatches fleet job tasks within their windows."""
+    from app.db.session import WorkerSessionLocal
+
+    while True:
+        try:
+            with observe_cycle("fleet_dispatcher"):
+                async with WorkerSessionLocal() as db:
+                    await run_fleet_cycle(db)
+        except Exception:
+            logger.exception("fleet_jobs: unhandled error in dispatch cycle")
+        await asyncio.sleep(DISPATCH_INTERVAL)
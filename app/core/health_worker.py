@@ -1,82 +1,200 @@
 """Entity health background worker.
 
-Runs every 30 seconds, updates Entity.health_status and Entity.health_last_seen_at
-based on the last_seen_at of its bound, enabled devices.
+Follows the presence tracker's device.online / device.offline transitions
+(app.core.presence.OfflineView) and updates Entity.health_status and
+Entity.health_last_seen_at of the entities bound to devices that changed:
+offline if any enabled bound device is offline, else ok. Every
+RECONCILE_INTERVAL it updates all entities, which picks up binding changes.
+
+entity_health() is the live aggregate for GET /entities/health: one grouped
+query buckets the devices of any number of entities by last_seen_at.
 """
 import asyncio
 import logging
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
 
-from sqlalchemy import select
+from sqlalchemy import bindparam, case, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.metrics import observe_cycle
+from app.core.presence import OfflineView
 from app.db.models.device import Device
 from app.db.models.entities import Entity, EntityDeviceBinding
-from app.db.session import AsyncSessionLocal
+from app.db.session import WorkerSessionLocal
 
 logger = logging.getLogger("uvicorn.error")
 
 UPDATE_INTERVAL = 30  # seconds
+RECONCILE_INTERVAL = 600  # seconds between full passes over all entities
 ONLINE_WINDOW_SECONDS = 30
 STALE_WINDOW_SECONDS = 120
 
 
-def _compute_health(last_seen_values: list[datetime | None], now: datetime) -> tuple[str, datetime | None]:
-    """Return (status, most_recent_last_seen_at) from a list of device last_seen_at values."""
-    if not last_seen_values:
-        return "unknown", None
-
-    worst = "ok"
-    most_recent: datetime | None = None
-
-    for lsa in last_seen_values:
-        if lsa is None:
-            worst = "offline"
-            continue
-        if lsa.tzinfo is None:
-            lsa = lsa.replace(tzinfo=timezone.utc)
-        if most_recent is None or lsa > most_recent:
-            most_recent = lsa
-        age = (now - lsa).total_seconds()
-        if age > STALE_WINDOW_SECONDS:
-            if worst != "offline":
-                worst = "offline"
-        elif age > ONLINE_WINDOW_SECONDS:
-            if worst == "ok":
-                worst = "stale"
-
-    return worst, most_recent
-
-
-async def run_health_cycle(db: AsyncSession, now: datetime) -> None:
-    """Update health_status for all entities."""
-    res = await db.execute(select(Entity))
-    entities: list[Entity] = list(res.scalars().all())
-
-    for entity in entities:
-        res_dev = await db.execute(
-            select(Device.last_seen_at)
-            .join(EntityDeviceBinding, EntityDeviceBinding.device_id == Device.id)
-            .where(
-                EntityDeviceBinding.entity_id == entity.entity_id,
-                EntityDeviceBinding.enabled.is_(True),
-            )
+@dataclass(frozen=True)
+class EntityHealth:
+    device_count: int = 0
+    online: int = 0
+    stale: int = 0
+    offline: int = 0
+    last_seen_at: Optional[datetime] = None  # most recent of the bound devices
+
+    @property
+    def status(self) -> str:
+        """Worst device health: offline > stale > ok; unknown without devices."""
+        if self.device_count == 0:
+            return "unknown"
+        if self.offline:
+            return "offline"
+        if self.stale:
+            return "stale"
+        return "ok"
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+async def entity_health(
+    db: AsyncSession, now: datetime, entity_ids: Optional[Iterable[str]] = None,
+) -> dict[str, EntityHealth]:
+    """Health of the given entities (all if None) in one grouped query.
+
+    Entities without enabled bindings are absent from the result.
+    """
+    online_since = now - timedelta(seconds=ONLINE_WINDOW_SECONDS)
+    stale_since = now - timedelta(seconds=STALE_WINDOW_SECONDS)
+    seen = Device.last_seen_at
+    stmt = (
+        select(
+            EntityDeviceBinding.entity_id,
+            func.count(),
+            func.count(case((seen >= online_since, 1))),
+            func.count(case(((seen < online_since) & (seen >= stale_since), 1))),
+            func.count(case(((seen.is_(None)) | (seen < stale_since), 1))),
+            func.max(seen),
         )
-        last_seen_values = list(res_dev.scalars().all())
-        status, most_recent = _compute_health(last_seen_values, now)
-        entity.health_status = status
-        if most_recent is not None:
-            entity.health_last_seen_at = most_recent
+        .join(Device, Device.id == EntityDeviceBinding.device_id)
+        .where(EntityDeviceBinding.enabled.is_(True))
+        .group_by(EntityDeviceBinding.entity_id)
+    )
+    if entity_ids is not None:
+        stmt = stmt.where(EntityDeviceBinding.entity_id.in_(list(entity_ids)))
+    res = await db.execute(stmt)
+    return {
+        entity_id: EntityHealth(
+            device_count=total, online=online, stale=stale, offline=offline,
+            last_seen_at=_as_utc(most_recent),
+        )
+        for entity_id, total, online, stale, offline, most_recent in res.all()
+    }
+
+
+async def presence_health(
+    db: AsyncSession, view: OfflineView, entity_ids: Optional[Iterable[str]] = None,
+) -> dict[str, EntityHealth]:
+    """Health of the given entities (all if None) from the tracker's view.
+
+    Entities without enabled bindings are absent from the result.
+    """
+    stmt = (
+        select(EntityDeviceBinding.entity_id, Device.id, Device.last_seen_at)
+        .join(Device, Device.id == EntityDeviceBinding.device_id)
+        .where(EntityDeviceBinding.enabled.is_(True))
+    )
+    if entity_ids is not None:
+        stmt = stmt.where(EntityDeviceBinding.entity_id.in_(list(entity_ids)))
+    counts: dict[str, tuple[int, int, Optional[datetime]]] = {}
+    for entity_id, device_id, last_seen_at in (await db.execute(stmt)).all():
+        total, offline, most_recent = counts.get(entity_id, (0, 0, None))
+        last_seen_at = _as_utc(last_seen_at)
+        if last_seen_at is not None and (most_recent is None or last_seen_at > most_recent):
+            most_recent = last_seen_at
+        counts[entity_id] = (total + 1, offline + int(view.is_offline(device_id)), most_recent)
+    return {
+        entity_id: EntityHealth(
+            device_count=total, online=total - offline, offline=offline, last_seen_at=most_recent,
+        )
+        for entity_id, (total, offline, most_recent) in counts.items()
+    }
+
 
+async def entities_of_devices(db: AsyncSession, device_ids: Iterable[int]) -> set[str]:
+    """Entities with an enabled binding to any of the devices."""
+    res = await db.execute(
+        select(EntityDeviceBinding.entity_id).distinct().where(
+            EntityDeviceBinding.device_id.in_(list(device_ids)),
+            EntityDeviceBinding.enabled.is_(True),
+        )
+    )
+    return set(res.scalars().all())
+
+
+async def run_health_cycle(
+    db: AsyncSession,
+    now: datetime,
+    view: Optional[OfflineView] = None,
+    entity_ids: Optional[Iterable[str]] = None,
+) -> None:
+    """Update health_status of the entities, all if None (only rows whose health changed).
+
+    Without a view one is seeded from the devices table.
+    """
+    if view is None:
+        view = OfflineView()
+        await view.refresh(db, now)
+    if entity_ids is not None:
+        entity_ids = list(entity_ids)
+        if not entity_ids:
+            return
+    health = await presence_health(db, view, entity_ids)
+    stmt = select(Entity.entity_id, Entity.health_status, Entity.health_last_seen_at)
+    if entity_ids is not None:
+        stmt = stmt.where(Entity.entity_id.in_(entity_ids))
+    res = await db.execute(stmt)
+    changes = []
+    for entity_id, status, last_seen_at in res.all():
+        last_seen_at = _as_utc(last_seen_at)
+        current = health.get(entity_id, EntityHealth())
+        new_last_seen = current.last_seen_at or last_seen_at
+        if status != current.status or new_last_seen != last_seen_at:
+            changes.append({
+                "b_entity_id": entity_id,
+                "b_status": current.status,
+                "b_last_seen": new_last_seen,
+            })
+
+    if changes:
+        entities = Entity.__table__
+        await db.execute(
+            update(entities)
+            .where(entities.c.entity_id == bindparam("b_entity_id"))
+            .values(health_status=bindparam("b_status"), health_last_seen_at=bindparam("b_last_seen")),
+            changes,
+        )
     await db.commit()
 
 
 async def health_worker_loop() -> None:
-    """Background loop: updates entity health every UPDATE_INTERVAL seconds."""
+    """Background loop: every UPDATE_INTERVAL seconds, updates the entities
+    whose devices went online or offline (all of them every RECONCILE_INTERVAL)."""
+    view = OfflineView()
+    reconciled_at: Optional[datetime] = None
     while True:
         try:
-            async with AsyncSessionLocal() as db:
-                await run_health_cycle(db, datetime.now(timezone.utc))
+            with observe_cycle("health_worker"):
+                async with WorkerSessionLocal() as db:
+                    now = datetime.now(timezone.utc)
+                    changed = await view.refresh(db, now)
+                    if reconciled_at is None or now - reconciled_at >= timedelta(seconds=RECONCILE_INTERVAL):
+                        await run_health_cycle(db, now, view)
+                        reconciled_at = now
+                    elif changed:
+                        await run_health_cycle(db, now, view, await entities_of_devices(db, changed))
         except Exception:
+            reconciled_at = None  # the failed cycle's transitions are in the view only
             logger.exception("health_worker: unhandled error in health cycle")
         await asyncio.sleep(UPDATE_INTERVAL)
@@ -9,8 +9,9 @@ from datetime import datetime, timedelta, timezone
 
 from sqlalchemy import delete
 
+from app.core.metrics import observe_cycle
 from app.db.models.variables import VariableHistory
-from app.db.session import AsyncSessionLocal
+from app.db.session import WorkerSessionLocal
 
 logger = logging.getLogger("uvicorn.error")
 
@@ -30,7 +31,7 @@ async def _prune_once() -> int:
     """Delete entries older than retention window. Returns count deleted."""
     days = _get_retention_days()
     cutoff = datetime.now(timezone.utc) - timedelta(days=days)
-    async with AsyncSessionLocal() as db:
+    async with WorkerSessionLocal() as db:
         result = await db.execute(
             delete(VariableHistory).where(VariableHistory.recorded_at < cutoff)
         )
@@ -46,7 +47,8 @@ async def history_retention_loop() -> None:
     logger.info("history_retention: started (retention=%sd)", _get_retention_days())
     while True:
         try:
-            await _prune_once()
+            with observe_cycle("history_retention"):
+                await _prune_once()
         except asyncio.CancelledError:
             raise
         except Exception as exc:
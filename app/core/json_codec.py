@@ -0,0 +1,135 @@
+"""Shared JSON encode/decode for the hot paths (orjson).
+
+Telemetry ingestion, the Redis telemetry stream, webhook delivery, JSONB
+columns and API responses all go through here instead of the stdlib `json`
+module. Encoding returns compact UTF-8 bytes, which Redis, httpx and ASGI
+take as-is, so there is no str -> bytes round trip per message.
+
+Output matches `json.dumps(obj, separators=(",", ":"), ensure_ascii=False)`
+for JSON-native values. Non-string dict keys are stringified like the
+stdlib does; datetimes become ISO 8601 strings. Values orjson cannot encode
+but json can (integers beyond 64 bits) fall back to the stdlib encoder.
+
+encoded_size() measures a value's encoded length without encoding it, so
+size limits can be checked in the same walk that validates the keys.
+"""
+from __future__ import annotations
+
+import json
+import re
+from datetime import date, datetime, time
+from typing import Any, Callable, Optional, Union
+
+import orjson
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+# Characters json escapes even with ensure_ascii=False
+_NEEDS_ESCAPE = re.compile(r'[\x00-\x1f\\"]')
+_SHORT_ESCAPES = frozenset('\\"\b\f\n\r\t')  # two bytes ("\n"); the rest are "\u00XX"
+
+
+def _stdlib_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj: Any, sort_keys: bool, default: Optional[Callable[[Any], Any]]) -> str:
+    return json.dumps(
+        obj,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        sort_keys=sort_keys,
+        default=default or _stdlib_default,
+    )
+
+
+def dumps(obj: Any, *, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """Encode to compact UTF-8 JSON bytes."""
+    option = _OPTIONS | orjson.OPT_SORT_KEYS if sort_keys else _OPTIONS
+    try:
+        return orjson.dumps(obj, default=default, option=option)
+    except TypeError:
+        # orjson rejects what json accepts, e.g. integers beyond 64 bits
+        return _stdlib_dumps(obj, sort_keys, default).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    """Encode to a JSON str (SQLAlchemy's json_serializer contract)."""
+    try:
+        return orjson.dumps(obj, option=_OPTIONS).decode()
+    except TypeError:
+        return _stdlib_dumps(obj, False, None)
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    # json.loads raises TypeError for other input (SQLite hands back numeric
+    # JSON values as int/float); SQLAlchemy's result processor relies on it
+    if not isinstance(data, (bytes, bytearray, memoryview, str)):
+        raise TypeError(f"the JSON object must be str, bytes or bytearray, not {type(data).__name__}")
+    return orjson.loads(data)
+
+
+def _string_size(value: str) -> int:
+    size = len(value) + 2 if value.isascii() else len(value.encode("utf-8", "surrogatepass")) + 2
+    if value.isprintable() and '"' not in value and "\\" not in value:
+        return size
+    for char in _NEEDS_ESCAPE.findall(value):
+        size += 1 if char in _SHORT_ESCAPES else 5
+    return size
+
+
+def encoded_size(
+    obj: Any,
+    limit: Optional[int] = None,
+    check_key: Optional[Callable[[Any], None]] = None,
+) -> int:
+    """Byte length of `obj` as compact JSON, computed in one walk.
+
+    Stops early once the running total exceeds `limit` (the returned value
+    is then only known to be larger than `limit`). `check_key`, if given,
+    is called for every dict key and may raise to reject the value.
+    """
+    total = 0
+    stack = [obj]
+    pop, push, extend = stack.pop, stack.append, stack.extend
+    while stack:
+        value = pop()
+        kind = type(value)
+        if kind is str:
+            total += _string_size(value)
+        elif kind is dict:
+            # braces + one colon per item + commas between items
+            total += 2 * len(value) + 1 if value else 2
+            for key, item in value.items():
+                if check_key is not None:
+                    check_key(key)
+                total += _string_size(key if type(key) is str else str(key))
+                kind = type(item)
+                if kind is dict or kind is list or kind is str:
+                    push(item)
+                else:
+                    total += _scalar_size(item)
+        elif kind is list or kind is tuple:
+            total += len(value) + 1 if value else 2
+            extend(value)
+        else:
+            total += _scalar_size(value)
+        if limit is not None and total > limit:
+            break
+    return total
+
+
+def _scalar_size(value: Any) -> int:
+    if value is None or value is True:
+        return 4
+    if value is False:
+        return 5
+    if isinstance(value, (int, float)):
+        return len(repr(value))
+    if isinstance(value, str):
+        return _string_size(value)
+    if isinstance(value, (dict, list, tuple)):
+        return encoded_size(value)
+    return len(dumps(value, default=str))
@@ -0,0 +1,487 @@
+"""In-process Prometheus metrics, rendered by GET /metrics.
+
+Counters, gauges and histograms live in a module-level registry and are
+updated on hot paths with plain dict/float arithmetic — no locks, no I/O.
+The exposition is the Prometheus text format (version 0.0.4).
+
+Several processes on one host (``uvicorn --workers N`` plus
+``python -m app.workers``) are aggregated through HUBEX_METRICS_DIR: each
+process writes a JSON snapshot of its samples there every
+HUBEX_METRICS_FLUSH_SECONDS (and at shutdown), and whichever process serves
+/metrics merges all snapshots. Counters and histograms are summed; gauges are
+summed or max'ed per metric, and gauges of exited processes are dropped.
+Empty the directory when the container starts, as with prometheus_client's
+multiprocess mode.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger("uvicorn.error")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; tuned for API handlers and single DB/Redis round trips
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Background loop cycles and webhook deliveries run longer
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], Any] = {}
+        REGISTRY.register(self)
+
+    def labels(self, *values: Any):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {key}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def remove(self, *values: Any) -> None:
+        self._children.pop(tuple(str(v) for v in values), None)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> dict[tuple[str, ...], Any]:
+        """label values -> value (float, or [bucket counts..., sum, count])."""
+        return {key: child.snapshot() for key, child in self._children.items()}
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    """Gauge; `mode` says how processes combine ("sum" or "max")."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 mode: str = "sum") -> None:
+        super().__init__(name, documentation, labelnames)
+        self.mode = mode
+        self._function: Optional[Callable[[], Any]] = None
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, fn: Callable[[], Any]) -> None:
+        """Compute the value at collection time: fn returns a number, or a
+        dict mapping label-value tuples to numbers."""
+        self._function = fn
+
+    def samples(self) -> dict[tuple[str, ...], Any]:
+        if self._function is None:
+            return super().samples()
+        try:
+            value = self._function()
+        except Exception as exc:
+            logger.warning("metrics: collecting %s failed: %s", self.name, exc)
+            return {}
+        if isinstance(value, dict):
+            return {tuple(str(v) for v in key): float(v) for key, v in value.items()}
+        return {(): float(value)}
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot: +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> list:
+        return [*self.counts, self.sum, self.count]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def snapshot(self) -> dict[str, dict]:
+        out = {}
+        for metric in self._metrics.values():
+            entry = {
+                "type": metric.type,
+                "help": metric.documentation,
+                "labelnames": list(metric.labelnames),
+                "samples": [[list(key), value] for key, value in metric.samples().items()],
+            }
+            if isinstance(metric, Histogram):
+                entry["buckets"] = list(metric.buckets)
+            if isinstance(metric, Gauge):
+                entry["mode"] = metric.mode
+            out[metric.name] = entry
+        return out
+
+
+REGISTRY = Registry()
+
+
+# ---------------------------------------------------------------------------
+# Multi-process snapshots
+# ---------------------------------------------------------------------------
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def write_snapshot(directory: Optional[str] = None) -> None:
+    """Write this process's samples to <dir>/<pid>.json (atomic rename)."""
+    directory = directory or settings.metrics_dir
+    if not directory:
+        return
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(REGISTRY.snapshot(), fh)
+    os.replace(tmp, path)
+
+
+def _read_snapshots(directory: str) -> list[tuple[bool, dict]]:
+    """(process alive, snapshot) for every snapshot file except our own."""
+    own = f"{os.getpid()}.json"
+    result = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".json") or filename == own:
+            continue
+        try:
+            with open(os.path.join(directory, filename), encoding="utf-8") as fh:
+                snapshot = json.load(fh)
+        except (OSError, ValueError):
+            continue  # being replaced, or garbage
+        pid = filename[:-5]
+        result.append((_pid_alive(int(pid)) if pid.isdigit() else False, snapshot))
+    return result
+
+
+def merge_snapshots(snapshots: list[tuple[bool, dict]]) -> dict[str, dict]:
+    """Combine per-process snapshots into one (see module docstring)."""
+    merged: dict[str, dict] = {}
+    for alive, snapshot in snapshots:
+        for name, entry in snapshot.items():
+            if entry["type"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {**entry, "samples": {}})
+            samples = target["samples"]
+            for labels, value in entry["samples"]:
+                key = tuple(labels)
+                if key not in samples:
+                    samples[key] = list(value) if isinstance(value, list) else value
+                elif entry["type"] == "histogram":
+                    if len(samples[key]) == len(value):
+                        samples[key] = [a + b for a, b in zip(samples[key], value)]
+                elif entry["type"] == "gauge" and entry.get("mode") == "max":
+                    samples[key] = max(samples[key], value)
+                else:
+                    samples[key] += value
+    for entry in merged.values():
+        entry["samples"] = [[list(key), value] for key, value in entry["samples"].items()]
+    return merged
+
+
+def collect() -> dict[str, dict]:
+    """Samples of this process, merged with its siblings when HUBEX_METRICS_DIR is set."""
+    own = REGISTRY.snapshot()
+    directory = settings.metrics_dir
+    if not directory or not os.path.isdir(directory):
+        return own
+    return merge_snapshots([(True, own), *_read_snapshots(directory)])
+
+
+# ---------------------------------------------------------------------------
+# Exposition
+# ---------------------------------------------------------------------------
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: list[str], values: list[str], extra: Optional[tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(snapshot: Optional[dict[str, dict]] = None) -> str:
+    """Prometheus text exposition of `snapshot` (default: collect())."""
+    snapshot = collect() if snapshot is None else snapshot
+    lines: list[str] = []
+    for name in sorted(snapshot):
+        entry = snapshot[name]
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['type']}")
+        names = entry["labelnames"]
+        for values, value in sorted(entry["samples"], key=lambda s: s[0]):
+            if entry["type"] != "histogram":
+                lines.append(f"{name}{_labels(names, values)} {_number(value)}")
+                continue
+            *counts, total, count = value
+            cumulative = 0
+            for bound, n in zip([*entry["buckets"], math.inf], counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(names, values, ('le', _number(bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, values)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(names, values)} {_number(count)}")
+    return "\n".join(lines) + "\n"
+
+
+_flusher: Optional[asyncio.Task] = None
+
+
+async def _flush_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.metrics_flush_seconds)
+        try:
+            write_snapshot()
+        except OSError as exc:
+            logger.warning("metrics: writing snapshot failed: %s", exc)
+
+
+def start_flusher() -> None:
+    """Start periodic snapshot writes (no-op without HUBEX_METRICS_DIR)."""
+    global _flusher
+    if settings.metrics_dir and (_flusher is None or _flusher.done()):
+        os.makedirs(settings.metrics_dir, exist_ok=True)
+        _flusher = asyncio.create_task(_flush_loop())
+
+
+async def stop_flusher() -> None:
+    """Stop the flusher and write a final snapshot so counters survive exit."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        await asyncio.gather(_flusher, return_exceptions=True)
+        _flusher = None
+    if settings.metrics_dir:
+        try:
+            write_snapshot()
+        except OSError as exc:
+            logger.warning("metrics: writing snapshot failed: %s", exc)
+
+
+# ---------------------------------------------------------------------------
+# HUBEX metrics
+# ---------------------------------------------------------------------------
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "hubex_http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route", "status"),
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "hubex_db_queries_per_request", "SQL statements executed per HTTP request",
+    ("route",), buckets=COUNT_BUCKETS,
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "hubex_db_time_per_request_seconds", "Time spent in SQL statements per HTTP request",
+    ("route",),
+)
+DB_QUERY_SECONDS = Histogram(
+    "hubex_db_query_duration_seconds", "SQL statement latency by engine and statement kind",
+    ("engine", "kind"),
+)
+DB_N_PLUS_ONE = Counter(
+    "hubex_db_n_plus_one_total",
+    "Requests/loop cycles that repeated one statement shape >= HUBEX_DB_N_PLUS_ONE_THRESHOLD times",
+    ("scope",),
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "hubex_db_pool_checkout_wait_seconds", "Time waiting for a pooled DB connection",
+    ("engine",),
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "hubex_db_pool_checked_out", "DB connections currently checked out", ("engine",),
+)
+REDIS_COMMAND_SECONDS = Histogram(
+    "hubex_redis_command_duration_seconds", "Redis command latency", ("command",),
+)
+TELEMETRY_INGESTED = Counter(
+    "hubex_telemetry_ingested_total", "Telemetry messages accepted by the API", ("path",),
+)
+TELEMETRY_BRIDGE_SECONDS = Histogram(
+    "hubex_telemetry_bridge_duration_seconds", "Telemetry-to-variables bridge latency per message",
+)
+TELEMETRY_STREAM_LAG = Gauge(
+    "hubex_telemetry_stream_lag", "Entries not yet delivered to the consumer group, per shard stream",
+    ("stream",), mode="max",
+)
+TELEMETRY_STREAM_PENDING = Gauge(
+    "hubex_telemetry_stream_pending", "Delivered but unacknowledged entries, per shard stream",
+    ("stream",), mode="max",
+)
+AUTOMATION_EVENT_SECONDS = Histogram(
+    "hubex_automation_event_duration_seconds", "Automation rule evaluation time per event",
+    ("event_type",),
+)
+WEBHOOK_DELIVERY_SECONDS = Histogram(
+    "hubex_webhook_delivery_duration_seconds", "Webhook HTTP attempt latency", ("outcome",),
+    buckets=SLOW_BUCKETS,
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    "hubex_websocket_connections", "Open WebSocket connections", ("hub",),
+)
+DEVICE_PRESENCE_TRANSITIONS = Counter(
+    "hubex_device_presence_transitions_total", "Device online/offline transitions", ("state",),
+)
+DEVICES_ONLINE = Gauge(
+    "hubex_devices_online", "Devices the presence tracker considers online", mode="max",
+)
+WRITE_BEHIND_PENDING = Gauge(
+    "hubex_write_behind_pending", "Committed rows waiting in the write-behind buffer",
+)
+WRITE_BEHIND_WRITTEN = Counter(
+    "hubex_write_behind_written_total", "Rows written by the write-behind flusher", ("table",),
+)
+WRITE_BEHIND_FALLBACK = Counter(
+    "hubex_write_behind_fallback_total",
+    "Rows not buffered (full: written inline) or dropped after repeated flush failures", ("reason",),
+)
+VARIABLE_EFFECT_ATTEMPTS = Counter(
+    "hubex_variable_effect_attempts_total", "Variable effect attempts (done, failed or dead)",
+    ("kind", "outcome"),
+)
+VARIABLE_EFFECT_LAG_SECONDS = Histogram(
+    "hubex_variable_effect_lag_seconds", "Time from a variable effect being due to its attempt",
+    buckets=SLOW_BUCKETS,
+)
+VARIABLE_EFFECT_BACKLOG_AGE = Gauge(
+    "hubex_variable_effect_backlog_age_seconds", "How long the oldest due variable effect has waited",
+    mode="max",
+)
+LOOP_CYCLE_SECONDS = Histogram(
+    "hubex_loop_cycle_duration_seconds", "Background loop cycle duration", ("loop",),
+    buckets=SLOW_BUCKETS,
+)
+LOOP_RESTARTS = Counter(
+    "hubex_loop_restarts_total", "Background loop restarts after a crash or lost lease", ("loop",),
+)
+
+
+@contextmanager
+def observe_cycle(loop: str) -> Iterator[None]:
+    """Time one cycle of a background loop, check its SQL for N+1 patterns
+    and profile it when profiling is on."""
+    from app.core.profiling import profile
+    from app.db.query_stats import report_n_plus_one, track_queries
+
+    with LOOP_CYCLE_SECONDS.labels(loop).time(), track_queries(f"loop:{loop}") as stats, profile("loop", loop):
+        yield
+    report_n_plus_one(stats)
+
+
+def timed(histogram: Histogram) -> Callable:
+    """Decorator: observe the duration of each call of a coroutine function."""
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with histogram.time():
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -5,26 +5,40 @@ Applies in a single pass:
   - Security headers (X-Content-Type-Options, X-Frame-Options, HSTS, etc.)
   - X-API-Version: v1 header
   - Access log (method, path, status, duration_ms)
+  - Prometheus request metrics by route template (latency, SQL count/time)
+  - SQL statement accounting: likely N+1 patterns are logged, and the
+    X-DB-Queries / X-DB-Time-ms headers report the handler's statements
+    when HUBEX_DB_QUERY_HEADERS is set
+  - Wall-clock profile of slow requests when profiling is on (app.core.profiling)
   - Max request body size (default 1 MB) — rejects oversized bodies with 413
+    (compressed bodies are held to it again once decoded, see
+    app.core.content_encoding)
   - Max URL length (default 2048 chars) — rejects with 414
+
+Implemented as a raw ASGI middleware (see app.core.asgi); the request id is
+also stored in the shared per-request scope state.
 """
 from __future__ import annotations
 
 import logging
 import time
 import uuid
-from typing import Callable
 
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import JSONResponse, Response
-from starlette.types import ASGIApp
+from starlette.datastructures import URL
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.core.asgi import STATE_REQUEST_ID, add_response_headers, get_header, scope_state, send_json
 from app.core.logging_config import set_request_context, clear_request_context
+from app.core.config import settings
+from app.core.metrics import DB_QUERIES_PER_REQUEST, DB_TIME_PER_REQUEST, HTTP_REQUEST_SECONDS
+from app.core.profiling import profile
+from app.db.query_stats import report_n_plus_one, track_queries
 
 logger = logging.getLogger("hubex.access")
 
-_MAX_BODY_BYTES = 1 * 1024 * 1024  # 1 MB
+_QUERY_HEADERS = settings.db_query_headers
+
+MAX_BODY_BYTES = 1 * 1024 * 1024  # 1 MB
 _MAX_URL_LENGTH = 2048
 
 _SECURITY_HEADERS = {
@@ -37,61 +51,81 @@ _SECURITY_HEADERS = {
 }
 
 
-class SecurityMiddleware(BaseHTTPMiddleware):
+class SecurityMiddleware:
     """Applies security headers, request-ID, access log, and input limits."""
 
     def __init__(self, app: ASGIApp) -> None:
-        super().__init__(app)
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
         # --- URL length guard ---
-        if len(str(request.url)) > _MAX_URL_LENGTH:
-            return JSONResponse(
-                status_code=414,
-                content={"detail": "request_uri_too_long"},
-            )
+        if len(str(URL(scope=scope))) > _MAX_URL_LENGTH:
+            await send_json(send, 414, {"detail": "request_uri_too_long"})
+            return
 
         # --- Body size guard (via Content-Length header) ---
-        content_length = request.headers.get("content-length")
-        if content_length and int(content_length) > _MAX_BODY_BYTES:
-            return JSONResponse(
-                status_code=413,
-                content={"detail": "request_entity_too_large"},
-            )
+        content_length = get_header(scope, b"content-length")
+        if content_length and int(content_length) > MAX_BODY_BYTES:
+            await send_json(send, 413, {"detail": "request_entity_too_large"})
+            return
 
         # --- Request-ID ---
-        request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        request_id = get_header(scope, b"x-request-id") or uuid.uuid4().hex
+        scope_state(scope)[STATE_REQUEST_ID] = request_id
+        path = scope["path"]
+        method = scope["method"]
 
         # --- Set logging context ---
-        set_request_context(
-            request_id=request_id,
-            path=request.url.path,
-            method=request.method,
-        )
+        set_request_context(request_id=request_id, path=path, method=method)
+
+        response_headers = {**_SECURITY_HEADERS, "X-Request-ID": request_id}
+        status_code = 500
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if _QUERY_HEADERS:
+                    # Statements up to the first response byte (the handler's)
+                    response_headers["X-DB-Queries"] = str(db_stats.count)
+                    response_headers["X-DB-Time-ms"] = f"{db_stats.seconds * 1000:.1f}"
+                add_response_headers(message, response_headers)
+            await send(message)
 
         start = time.perf_counter()
-        try:
-            response = await call_next(request)
-        finally:
-            clear_request_context()
-
-        duration_ms = int((time.perf_counter() - start) * 1000)
+        with track_queries(path) as db_stats, profile("request", f"{method} {path}") as prof:
+            try:
+                await self.app(scope, receive, send_with_headers)
+            finally:
+                clear_request_context()
+                if prof is not None:
+                    prof.name = f"{method} {getattr(scope.get('route'), 'path', None) or path}"
+
+        elapsed = time.perf_counter() - start
+        duration_ms = int(elapsed * 1000)
+
+        # --- Metrics (route template, not raw path, to bound cardinality) ---
+        route = getattr(scope.get("route"), "path", None) or "unmatched"
+        HTTP_REQUEST_SECONDS.labels(method, route, status_code).observe(elapsed)
+        DB_QUERIES_PER_REQUEST.labels(route).observe(db_stats.count)
+        DB_TIME_PER_REQUEST.labels(route).observe(db_stats.seconds)
+        db_stats.scope = f"{method} {route}"
+        report_n_plus_one(db_stats)
 
         # --- Access log ---
         logger.info(
             "access",
             extra={
                 "request_id": request_id,
-                "method": request.method,
-                "path": request.url.path,
-                "status_code": response.status_code,
+                "method": method,
+                "path": path,
+                "status_code": status_code,
                 "duration_ms": duration_ms,
+                "db_queries": db_stats.count,
+                "db_time_ms": round(db_stats.seconds * 1000, 1),
             },
         )
-
-        # --- Add headers to response ---
-        for header, value in _SECURITY_HEADERS.items():
-            response.headers[header] = value
-        response.headers["X-Request-ID"] = request_id
-
-        return response
@@ -1,16 +1,45 @@
 """Notification service — creates DB records and pushes via WebSocket."""
+import asyncio
 import logging
 from datetime import datetime, timezone
 from typing import Optional
 
-from sqlalchemy import select
+from sqlalchemy import insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.models.notifications import Notification
+from app.db.models.orgs import OrganizationUser
 from app.db.models.user import User
 
 logger = logging.getLogger("uvicorn.error")
 
+# (user_id, notification payload) pairs waiting to be pushed after commit
+PendingPush = tuple[int, dict]
+
+# Strong references to in-flight push tasks so they are not garbage-collected
+_push_tasks: set[asyncio.Task] = set()
+
+
+def _notification_payload(
+    notif_id: int,
+    type: str,
+    severity: str,
+    title: str,
+    message: str,
+    entity_ref: Optional[str],
+    created_at: datetime,
+) -> dict:
+    return {
+        "id": notif_id,
+        "type": type,
+        "severity": severity,
+        "title": title,
+        "message": message,
+        "entity_ref": entity_ref,
+        "created_at": created_at.isoformat(),
+        "read_at": None,
+    }
+
 
 async def create_notification(
     db: AsyncSession,
@@ -40,16 +69,15 @@ async def create_notification(
 
         await user_hub.push_notification(
             user_id,
-            {
-                "id": notif.id,
-                "type": notif.type,
-                "severity": notif.severity,
-                "title": notif.title,
-                "message": notif.message,
-                "entity_ref": notif.entity_ref,
-                "created_at": notif.created_at.isoformat(),
-                "read_at": None,
-            },
+            _notification_payload(
+                notif.id,
+                notif.type,
+                notif.severity,
+                notif.title,
+                notif.message,
+                notif.entity_ref,
+                notif.created_at,
+            ),
         )
     except Exception:
         logger.exception("notification_service: failed to push WS notification user_id=%s", user_id)
@@ -57,24 +85,108 @@ async def create_notification(
     return notif
 
 
-async def create_notification_all_users(
+async def resolve_recipients(db: AsyncSession, org_id: Optional[int] = None) -> list[int]:
+    """Return the user ids a broadcast notification should reach.
+
+    With an org_id only members of that organization are returned; without one
+    (legacy, org-less rules) every user in the system is a recipient.
+    """
+    if org_id is not None:
+        stmt = select(OrganizationUser.user_id).where(OrganizationUser.org_id == org_id)
+    else:
+        stmt = select(User.id)
+    res = await db.execute(stmt)
+    return sorted(set(res.scalars().all()))
+
+
+async def create_notifications_bulk(
     db: AsyncSession,
+    user_ids: list[int],
     type: str,
     title: str,
     message: str = "",
     severity: str = "info",
     entity_ref: Optional[str] = None,
-) -> None:
-    """Create the same notification for every user in the system."""
-    res = await db.execute(select(User))
-    users = list(res.scalars().all())
-    for user in users:
-        await create_notification(
-            db,
-            user_id=user.id,
-            type=type,
-            title=title,
-            message=message,
-            severity=severity,
-            entity_ref=entity_ref,
+) -> list[PendingPush]:
+    """Insert one notification per user with a single multi-row INSERT ... RETURNING.
+
+    Nothing is pushed here: the returned pending pushes must be handed to
+    dispatch_notifications() once the caller has committed, so WebSocket I/O
+    never runs inside the database transaction. Caller must commit.
+    """
+    if not user_ids:
+        return []
+
+    created_at = datetime.now(timezone.utc)
+    rows = [
+        {
+            "user_id": user_id,
+            "type": type,
+            "severity": severity,
+            "title": title,
+            "message": message,
+            "entity_ref": entity_ref,
+            "created_at": created_at,
+        }
+        for user_id in user_ids
+    ]
+    res = await db.execute(
+        insert(Notification).returning(
+            Notification.id, Notification.user_id, sort_by_parameter_order=True
+        ),
+        rows,
+    )
+    return [
+        (
+            user_id,
+            _notification_payload(notif_id, type, severity, title, message, entity_ref, created_at),
         )
+        for notif_id, user_id in res.all()
+    ]
+
+
+async def create_notification_all_users(
+    db: AsyncSession,
+    type: str,
+    title: str,
+    message: str = "",
+    severity: str = "info",
+    entity_ref: Optional[str] = None,
+    org_id: Optional[int] = None,
+) -> list[PendingPush]:
+    """Create the same notification for every user of an org (or of the system).
+
+    Returns the pending WebSocket pushes; see create_notifications_bulk().
+    """
+    user_ids = await resolve_recipients(db, org_id)
+    return await create_notifications_bulk(
+        db,
+        user_ids,
+        type=type,
+        title=title,
+        message=message,
+        severity=severity,
+        entity_ref=entity_ref,
+    )
+
+
+async def push_notifications(pending: list[PendingPush]) -> None:
+    """Push already-committed notifications to connected users."""
+    from app.realtime import user_hub  # avoid circular at module level
+
+    for user_id, payload in pending:
+        if user_id not in user_hub.clients:
+            continue
+        try:
+            await user_hub.push_notification(user_id, payload)
+        except Exception:
+            logger.exception("notification_service: failed to push WS notification user_id=%s", user_id)
+
+
+def dispatch_notifications(pending: list[PendingPush]) -> None:
+    """Schedule WebSocket delivery of committed notifications in the background."""
+    if not pending:
+        return
+    task = asyncio.create_task(push_notifications(pending))
+    _push_tasks.add(task)
+    task.add_done_callback(_push_tasks.discard)
@@ -19,11 +19,12 @@ from datetime import datetime, timezone
 from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.metrics import observe_cycle
 from app.core.system_events import emit_system_event
 from app.db.models.device import Device
 from app.db.models.entities import EntityDeviceBinding
 from app.db.models.ota import DeviceOtaStatus, OtaRollout
-from app.db.session import AsyncSessionLocal
+from app.db.session import WorkerSessionLocal
 
 logger = logging.getLogger("uvicorn.error")
 
@@ -159,8 +160,9 @@ async def run_ota_cycle(db: AsyncSession) -> None:
 async def ota_worker_loop() -> None:
     while True:
         try:
-            async with AsyncSessionLocal() as db:
-                await run_ota_cycle(db)
+            with observe_cycle("ota_worker"):
+                async with WorkerSessionLocal() as db:
+                    await run_ota_cycle(db)
         except Exception:
             logger.exception("ota_worker: unhandled error")
         await asyncio.sleep(WORKER_INTERVAL)
@@ -15,6 +15,7 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
+from app.core.metrics import observe_cycle
 
 logger = logging.getLogger("uvicorn.error")
 
@@ -139,7 +140,7 @@ async def partition_maintenance_loop() -> None:
 
     Runs every 24 hours.
     """
-    from app.db.session import async_session_factory
+    from app.db.session import WorkerSessionLocal
 
     logger.info("partition_manager: started (history=%dd, audit=%dd)",
                 settings.history_retention_days, settings.audit_retention_days)
@@ -148,11 +149,12 @@ async def partition_maintenance_loop() -> None:
         try:
             await asyncio.sleep(PARTITION_CHECK_INTERVAL)
 
-            async with async_session_factory() as db:
-                await _ensure_future_partitions(db)
-                await _drop_expired_partitions(db)
-                await _prune_variable_history(db)
-                await _prune_variable_audit(db)
+            with observe_cycle("partition_maintenance"):
+                async with WorkerSessionLocal() as db:
+                    await _ensure_future_partitions(db)
+                    await _drop_expired_partitions(db)
+                    await _prune_variable_history(db)
+                    await _prune_variable_audit(db)
 
         except asyncio.CancelledError:
             logger.info("partition_manager: shutting down")
@@ -0,0 +1,529 @@
+"""Device presence: coalesced last-seen writes and online/offline transitions.
+
+Every device call (telemetry, heartbeats, task polls, hello) used to UPDATE
+devices.last_seen_at and commit. Now:
+
+  touch(device_id)      Request path: records the time in this process.
+                        No DB write, no row lock.
+  flusher               Every HUBEX_PRESENCE_FLUSH_SECONDS each process hands
+                        its buffer on — max-merged into the Redis hash
+                        PENDING_KEY, or without Redis written straight to
+                        devices.last_seen_at in one batched UPDATE.
+  presence_tracker      Singleton loop: drains PENDING_KEY, writes all times
+                        in one UPDATE ... FROM (VALUES ...) and keeps a timer
+                        wheel of offline deadlines. A device with no report
+                        for HUBEX_PRESENCE_OFFLINE_SECONDS drops out of the
+                        wheel. Without Redis the table is the pending store:
+                        the tracker reads the devices whose last_seen_at
+                        moved since its previous cycle (indexed).
+
+Transitions are emitted as device.online / device.offline system events
+(consumed by the automation engine and the event stream), so the work per
+cycle is O(reports + transitions), never O(devices). last_seen_at lags by
+up to two flush intervals.
+
+Consumers follow the transitions instead of bucketing last_seen_at:
+OfflineView keeps the offline devices of another process (entity health,
+the alert worker) current from the events, and the device list asks
+ONLINE_KEY.
+
+The tracker keeps the online set in Redis (ONLINE_KEY) so a new lease owner
+seeds from the devices table and still reports devices that went offline
+during the handover. Either way only the tracker emits transitions, so API
+and worker processes may run apart with or without Redis.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Hashable, Optional
+
+from sqlalchemy import DateTime, Integer, bindparam, column, func, or_, select, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.metrics import DEVICE_PRESENCE_TRANSITIONS, DEVICES_ONLINE, observe_cycle
+from app.core.system_events import SYSTEM_STREAM, emit_system_event
+from app.db.models.device import Device
+from app.db.models.events import EventV1
+
+logger = logging.getLogger("uvicorn.error")
+
+FLUSH_INTERVAL_SECONDS = settings.presence_flush_seconds
+PENDING_KEY = "hubex:presence:pending"  # device id -> epoch seconds, drained by the tracker
+ONLINE_KEY = "hubex:presence:online"  # device ids the tracker considers online
+UPDATE_CHUNK = 1000  # rows per UPDATE ... FROM (VALUES ...)
+# Without Redis: how far before its previous cycle the tracker re-reads the
+# table, covering touches that were still buffered in some process then
+SCAN_OVERLAP_SECONDS = 2 * FLUSH_INTERVAL_SECONDS
+
+# HSET that keeps the newer time per device: processes flush independently,
+# so an older report must not overwrite a newer one from another process
+_MERGE_MAX_LUA = """
+for i = 1, #ARGV, 2 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if not current or tonumber(current) < tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return #ARGV / 2
+"""
+
+_pending: dict[int, datetime] = {}
+_flusher: Optional[asyncio.Task] = None
+
+
+def touch(device_id: int, at: Optional[datetime] = None) -> None:
+    """Record that the device was seen (written on the next flush)."""
+    at = at or datetime.now(timezone.utc)
+    current = _pending.get(device_id)
+    if current is None or at > current:
+        _pending[device_id] = at
+
+
+def pending_count() -> int:
+    return len(_pending)
+
+
+# ---------------------------------------------------------------------------
+# Timer wheel
+# ---------------------------------------------------------------------------
+
+class TimerWheel:
+    """Hashed timer wheel of per-key deadlines (epoch seconds).
+
+    A key sits in the slot of its deadline's tick. Re-scheduling only adds
+    the key to its new slot; the old entry is dropped when its slot comes
+    up, so schedule() is O(1) and advance() only visits the slots of the
+    ticks that passed since the previous call.
+    """
+
+    def __init__(self, now: float, tick_seconds: float = 1.0, slots: int = 512) -> None:
+        self.tick = tick_seconds
+        self._slots: list[set[Hashable]] = [set() for _ in range(slots)]
+        self._deadlines: dict[Hashable, float] = {}
+        self._cursor = math.floor(now / tick_seconds)  # last tick processed
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+    def keys(self) -> set[Hashable]:
+        return set(self._deadlines)
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        return self._deadlines.get(key)
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        self._deadlines[key] = deadline
+        tick = max(math.ceil(deadline / self.tick), self._cursor + 1)
+        self._slots[tick % len(self._slots)].add(key)
+
+    def cancel(self, key: Hashable) -> None:
+        self._deadlines.pop(key, None)
+
+    def advance(self, now: float) -> list[Hashable]:
+        """Remove and return the keys whose deadline is <= now."""
+        current = math.floor(now / self.tick)
+        n = len(self._slots)
+        first = max(self._cursor + 1, current - n + 1)  # a long gap visits each slot once
+        expired: list[Hashable] = []
+        for tick in range(first, current + 1):
+            index = tick % n
+            slot = self._slots[index]
+            if not slot:
+                continue
+            keep: set[Hashable] = set()
+            for key in slot:
+                deadline = self._deadlines.get(key)
+                if deadline is None:
+                    continue  # cancelled
+                if deadline <= now:
+                    del self._deadlines[key]
+                    expired.append(key)
+                elif math.ceil(deadline / self.tick) % n == index:
+                    keep.add(key)  # due in a later revolution
+                # else: re-scheduled into another slot, stale entry
+            self._slots[index] = keep
+        self._cursor = max(self._cursor, current)
+        return expired
+
+
+# ---------------------------------------------------------------------------
+# Tracker
+# ---------------------------------------------------------------------------
+
+_wheel: Optional[TimerWheel] = None
+_scanned_at: Optional[datetime] = None  # previous table read (no Redis)
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def is_online(device_id: int) -> Optional[bool]:
+    """Tracker view of the device, or None if this process runs no tracker."""
+    return None if _wheel is None else device_id in _wheel
+
+
+def reset() -> None:
+    """Forget tracker state (tests, lease loss)."""
+    global _wheel, _scanned_at
+    _wheel = None
+    _scanned_at = None
+    _pending.clear()
+
+
+async def write_last_seen(db: AsyncSession, batch: dict[int, datetime]) -> None:
+    """Write the batch to devices.last_seen_at, never moving it backwards."""
+    devices = Device.__table__
+    rows = list(batch.items())
+    if db.get_bind().dialect.name == "postgresql":
+        for start in range(0, len(rows), UPDATE_CHUNK):
+            v = values(
+                column("id", Integer), column("at", DateTime(timezone=True)), name="v",
+            ).data(rows[start:start + UPDATE_CHUNK])
+            await db.execute(
+                update(devices)
+                .where(
+                    devices.c.id == v.c.id,
+                    or_(devices.c.last_seen_at.is_(None), devices.c.last_seen_at < v.c.at),
+                )
+                .values(last_seen_at=v.c.at)
+            )
+        return
+    # SQLite has no column list on a VALUES alias: one executemany instead
+    await db.execute(
+        update(devices)
+        .where(
+            devices.c.id == bindparam("b_id"),
+            or_(devices.c.last_seen_at.is_(None), devices.c.last_seen_at < bindparam("b_at")),
+        )
+        .values(last_seen_at=bindparam("b_at")),
+        [{"b_id": device_id, "b_at": at} for device_id, at in rows],
+    )
+
+
+async def _emit(db: AsyncSession, event_type: str, device_ids: list[int], **extra) -> None:
+    if not device_ids:
+        return
+    res = await db.execute(
+        select(Device.id, Device.device_uid).where(Device.id.in_(device_ids))
+    )
+    for device_id, device_uid in res.all():
+        await emit_system_event(db, event_type, {
+            "device_uid": device_uid, "device_id": device_id, **extra,
+        })
+    DEVICE_PRESENCE_TRANSITIONS.labels(event_type.rpartition(".")[2]).inc(len(device_ids))
+
+
+async def _tracker(db: AsyncSession, now: datetime) -> TimerWheel:
+    """The timer wheel, seeded from the devices table on first use."""
+    global _wheel
+    if _wheel is not None:
+        return _wheel
+    from app.core.redis_client import get_redis
+
+    offline_after = settings.presence_offline_seconds
+    wheel = TimerWheel(now.timestamp())
+    res = await db.execute(
+        select(Device.id, Device.last_seen_at).where(
+            Device.last_seen_at >= now - timedelta(seconds=offline_after)
+        )
+    )
+    for device_id, last_seen_at in res.all():
+        wheel.schedule(device_id, _as_utc(last_seen_at).timestamp() + offline_after)
+
+    redis = get_redis()
+    if redis is not None:
+        try:
+            # Online under the previous tracker, silent since: report them now
+            previous = {int(m) for m in await redis.smembers(ONLINE_KEY)}
+            gone = sorted(previous - wheel.keys())
+            await _emit(db, "device.offline", gone)
+            if gone:
+                await redis.srem(ONLINE_KEY, *gone)
+            if len(wheel):
+                await redis.sadd(ONLINE_KEY, *wheel.keys())
+        except Exception as exc:
+            logger.warning("presence: online set unavailable while seeding: %s", exc)
+    _wheel = wheel
+    return wheel
+
+
+async def apply_batch(db: AsyncSession, batch: dict[int, datetime], now: Optional[datetime] = None) -> list[int]:
+    """Write a batch of reports and schedule their deadlines.
+
+    Returns the devices that came online. Caller commits.
+    """
+    now = now or datetime.now(timezone.utc)
+    wheel = await _tracker(db, now)  # seed before the batch lands in the table
+    await write_last_seen(db, batch)
+    return await _schedule(db, wheel, batch, now)
+
+
+async def _schedule(db: AsyncSession, wheel: TimerWheel, batch: dict[int, datetime], now: datetime) -> list[int]:
+    offline_after = settings.presence_offline_seconds
+    came_online: list[int] = []
+    for device_id, at in batch.items():
+        deadline = _as_utc(at).timestamp() + offline_after
+        current = wheel.deadline(device_id)
+        if current is not None and current >= deadline:
+            continue
+        if deadline <= now.timestamp():
+            continue  # report too old to count as online
+        if current is None:
+            came_online.append(device_id)
+        wheel.schedule(device_id, deadline)
+    await _emit(db, "device.online", came_online)
+    return came_online
+
+
+async def expire(db: AsyncSession, now: Optional[datetime] = None) -> list[int]:
+    """Devices whose deadline passed: emit device.offline. Caller commits."""
+    now = now or datetime.now(timezone.utc)
+    wheel = await _tracker(db, now)
+    went_offline = sorted(wheel.advance(now.timestamp()))
+    await _emit(db, "device.offline", went_offline,
+                offline_after_seconds=settings.presence_offline_seconds)
+    return went_offline
+
+
+async def _drain_pending_hash(redis) -> dict[int, datetime]:
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hgetall(PENDING_KEY)
+        pipe.delete(PENDING_KEY)
+        raw, _ = await pipe.execute()
+    return {
+        int(device_id): datetime.fromtimestamp(float(ts), timezone.utc)
+        for device_id, ts in raw.items()
+    }
+
+
+async def _read_recent_reports(db: AsyncSession, now: datetime) -> dict[int, datetime]:
+    """Reports the flushers wrote to the table since the previous read."""
+    global _scanned_at
+    since = (_scanned_at or now) - timedelta(seconds=SCAN_OVERLAP_SECONDS)
+    res = await db.execute(
+        select(Device.id, Device.last_seen_at).where(Device.last_seen_at >= since)
+    )
+    _scanned_at = now
+    return {device_id: _as_utc(at) for device_id, at in res.all()}
+
+
+async def run_tracker_cycle(db: AsyncSession, now: Optional[datetime] = None) -> tuple[list[int], list[int]]:
+    """One tracker cycle: apply new reports, expire deadlines, commit.
+
+    Reports come from PENDING_KEY, or from the devices table when Redis is
+    not configured or unavailable. Returns (came_online, went_offline).
+    """
+    from app.core.redis_client import get_redis
+
+    global _scanned_at
+    now = now or datetime.now(timezone.utc)
+    redis = get_redis()
+    came_online: list[int] = []
+    batch: Optional[dict[int, datetime]] = None
+    if redis is not None:
+        try:
+            batch = await _drain_pending_hash(redis)
+        except Exception as exc:
+            logger.warning("presence: Redis unavailable, reading reports from the table: %s", exc)
+    if batch is None:
+        wheel = await _tracker(db, now)
+        reports = await _read_recent_reports(db, now)
+        if reports:
+            came_online = await _schedule(db, wheel, reports, now)
+    else:
+        _scanned_at = now  # a later fallback reads from here on
+        if batch:
+            came_online = await apply_batch(db, batch, now)
+    went_offline = await expire(db, now)
+    await db.commit()
+
+    if redis is not None and (came_online or went_offline):
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                if came_online:
+                    pipe.sadd(ONLINE_KEY, *came_online)
+                if went_offline:
+                    pipe.srem(ONLINE_KEY, *went_offline)
+                await pipe.execute()
+        except Exception as exc:
+            logger.warning("presence: updating the online set failed: %s", exc)
+    DEVICES_ONLINE.set(len(_wheel) if _wheel is not None else 0)
+    return came_online, went_offline
+
+
+async def presence_tracker_loop() -> None:
+    """Background loop: last-seen batches in, online/offline transitions out."""
+    from app.db.session import WorkerSessionLocal
+
+    global _wheel, _scanned_at
+    _wheel = None  # a new lease owner re-seeds from the table
+    _scanned_at = None
+    while True:
+        try:
+            with observe_cycle("presence_tracker"):
+                async with WorkerSessionLocal() as db:
+                    await run_tracker_cycle(db)
+        except Exception:
+            logger.exception("presence: unhandled error in tracker cycle")
+        await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+
+
+# ---------------------------------------------------------------------------
+# Consumers
+# ---------------------------------------------------------------------------
+
+class OfflineView:
+    """Devices the tracker considers offline, as seen from any process.
+
+    The first refresh() seeds from devices.last_seen_at with the tracker's
+    threshold; later ones only read the device.online / device.offline
+    events since the previous call, i.e. O(transitions).
+    """
+
+    def __init__(self) -> None:
+        # offline device id -> last report (None: never reported)
+        self.offline: dict[int, Optional[datetime]] = {}
+        self._cursor: Optional[int] = None
+
+    def is_offline(self, device_id: int) -> bool:
+        return device_id in self.offline
+
+    async def refresh(self, db: AsyncSession, now: Optional[datetime] = None) -> set[int]:
+        """Apply new transitions; returns the devices whose state changed."""
+        now = now or datetime.now(timezone.utc)
+        offline_after = settings.presence_offline_seconds
+        if self._cursor is None:
+            # Cursor first: a transition committed while seeding is applied again
+            self._cursor = await db.scalar(
+                select(func.coalesce(func.max(EventV1.id), 0)).where(EventV1.stream == SYSTEM_STREAM)
+            )
+            res = await db.execute(
+                select(Device.id, Device.last_seen_at).where(
+                    or_(
+                        Device.last_seen_at.is_(None),
+                        Device.last_seen_at < now - timedelta(seconds=offline_after),
+                    )
+                )
+            )
+            self.offline = {
+                device_id: _as_utc(at) if at is not None else None for device_id, at in res.all()
+            }
+            return set(self.offline)
+
+        res = await db.execute(
+            select(EventV1.id, EventV1.ts, EventV1.type, EventV1.payload)
+            .where(
+                EventV1.stream == SYSTEM_STREAM,
+                EventV1.id > self._cursor,
+                EventV1.type.in_(("device.online", "device.offline")),
+            )
+            .order_by(EventV1.id)
+        )
+        changed: set[int] = set()
+        for event_id, ts, event_type, payload in res.all():
+            self._cursor = event_id
+            device_id = payload.get("device_id")
+            if device_id is None:
+                continue
+            if event_type == "device.online":
+                if device_id in self.offline:
+                    del self.offline[device_id]
+                    changed.add(device_id)
+            elif device_id not in self.offline:
+                silent = payload.get("offline_after_seconds", offline_after)
+                self.offline[device_id] = _as_utc(ts) - timedelta(seconds=silent)
+                changed.add(device_id)
+        return changed
+
+
+async def online_devices(device_ids: list[int]) -> Optional[set[int]]:
+    """Which of the devices the tracker reports online, or None without Redis."""
+    from app.core.redis_client import get_redis
+
+    redis = get_redis()
+    if redis is None:
+        return None
+    if not device_ids:
+        return set()
+    try:
+        flags = await redis.smismember(ONLINE_KEY, [str(device_id) for device_id in device_ids])
+    except Exception as exc:
+        logger.warning("presence: online set unavailable: %s", exc)
+        return None
+    return {device_id for device_id, flag in zip(device_ids, flags) if flag}
+
+
+# ---------------------------------------------------------------------------
+# Per-process flusher
+# ---------------------------------------------------------------------------
+
+async def flush(session_factory: Optional[Callable[[], AsyncSession]] = None) -> int:
+    """Hand the buffered reports on; returns how many devices they cover."""
+    if not _pending:
+        return 0
+    from app.core.redis_client import get_redis
+
+    batch = dict(_pending)
+    _pending.clear()
+    redis = get_redis()
+    if redis is not None:
+        try:
+            args: list[str] = []
+            for device_id, at in batch.items():
+                args += (str(device_id), f"{at.timestamp():.3f}")
+            await redis.eval(_MERGE_MAX_LUA, 1, PENDING_KEY, *args)
+            return len(batch)
+        except Exception as exc:
+            logger.warning("presence: Redis unavailable, writing last_seen_at directly: %s", exc)
+
+    if session_factory is None:
+        from app.db.session import AsyncSessionLocal
+
+        session_factory = AsyncSessionLocal
+    try:
+        # The tracker picks these up from the table and owns the transitions
+        async with session_factory() as db:
+            await write_last_seen(db, batch)
+            await db.commit()
+    except Exception:
+        # Keep the times for the next attempt (newer touches win)
+        for device_id, at in batch.items():
+            touch(device_id, at)
+        raise
+    return len(batch)
+
+
+async def _flush_loop() -> None:
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush()
+        except Exception as exc:
+            logger.warning("presence: flush failed (%d devices kept): %s", len(_pending), exc)
+
+
+def start_flusher() -> None:
+    global _flusher
+    if _flusher is None or _flusher.done():
+        _flusher = asyncio.create_task(_flush_loop())
+
+
+async def stop_flusher() -> None:
+    """Stop the periodic flush and hand on what is still buffered."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        await asyncio.gather(_flusher, return_exceptions=True)
+        _flusher = None
+    try:
+        await flush()
+    except Exception as exc:
+        logger.warning("presence: final flush failed: %s", exc)
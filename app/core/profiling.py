@@ -0,0 +1,378 @@
+"""Opt-in wall-clock profiling of slow requests and background loop cycles.
+
+While enabled, a sampler thread looks at every profiled unit every
+HUBEX_PROFILING_INTERVAL_MS. A unit is an HTTP request (SecurityMiddleware)
+or a loop cycle (observe_cycle). When the unit's task is the one running on
+the event loop, the sampler records the live thread stack. Otherwise it
+records the coroutine await chain, with a "(waiting)" leaf, so time spent
+awaiting the database or Redis shows up as well.
+
+Units that end below the request/loop threshold are dropped. The rest are
+kept as flamegraph collapsed stacks ("frame;frame;frame count"). They go
+into a bounded ring buffer; with Redis that buffer is the shared
+`hubex:profiles` list, so profiles taken in worker processes can be
+downloaded from any API process.
+
+cProfile is deliberately not used. It profiles a whole thread, so with many
+coroutines interleaved on the event loop it would charge a request for its
+neighbours' work.
+
+Disabled (the default), profile() costs one attribute check per unit.
+Admins switch it on at runtime via PUT /api/v1/observability/profiling;
+with Redis the change reaches every process within PROFILING_SYNC_SECONDS.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Iterator, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger("uvicorn.error")
+
+PROFILES_KEY = "hubex:profiles"
+CONFIG_KEY = "hubex:profiling"
+PROFILING_SYNC_SECONDS = 5.0
+MAX_STACK_DEPTH = 64
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_STDLIB = sysconfig.get_paths()["stdlib"]
+
+
+@dataclass
+class ProfilingConfig:
+    enabled: bool = False
+    request_threshold_ms: float = 500.0  # keep requests slower than this
+    loop_threshold_ms: float = 100.0  # keep loop cycles slower than this
+    loops: list[str] = field(default_factory=list)  # empty = every loop
+    interval_ms: float = 10.0  # sampling period
+
+
+def _config_from_settings() -> ProfilingConfig:
+    return ProfilingConfig(
+        enabled=settings.profiling_enabled,
+        request_threshold_ms=settings.profiling_request_threshold_ms,
+        loop_threshold_ms=settings.profiling_loop_threshold_ms,
+        loops=[name.strip() for name in settings.profiling_loops.split(",") if name.strip()],
+        interval_ms=settings.profiling_interval_ms,
+    )
+
+
+_config = _config_from_settings()
+_buffer: deque[dict[str, Any]] = deque(maxlen=max(1, settings.profiling_buffer_size))
+_unpublished: deque[dict[str, Any]] = deque(maxlen=max(1, settings.profiling_buffer_size))
+_ids = itertools.count(1)
+
+
+def get_config() -> ProfilingConfig:
+    return _config
+
+
+def configure(**changes: Any) -> ProfilingConfig:
+    """Apply config changes in this process (see publish_config for all)."""
+    global _config
+    unknown = set(changes) - set(ProfilingConfig.__dataclass_fields__)
+    if unknown:
+        raise ValueError(f"unknown profiling option(s): {', '.join(sorted(unknown))}")
+    _config = ProfilingConfig(**{**asdict(_config), **changes})
+    if not _config.enabled:
+        _sampler.stop()
+    return _config
+
+
+# ---------------------------------------------------------------------------
+# Stacks
+# ---------------------------------------------------------------------------
+
+def _label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_ROOT):
+        filename = os.path.relpath(filename, _ROOT)
+    elif "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    elif filename.startswith(_STDLIB):
+        filename = os.path.relpath(filename, _STDLIB)
+    name = getattr(code, "co_qualname", code.co_name)
+    # ';' separates frames in the collapsed format
+    return f"{name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _running_stack(frame, root) -> list[str]:
+    """Thread stack from the task's coroutine frame (`root`) down to `frame`."""
+    stack: list[str] = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        stack.append(_label(frame))
+        if frame is root:
+            break
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _awaiting_stack(coro) -> list[str]:
+    """Await chain of a suspended coroutine, outermost first."""
+    stack: list[str] = []
+    while coro is not None and len(stack) < MAX_STACK_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    stack.append("(waiting)")
+    return stack
+
+
+class _Unit:
+    """One profiled request or loop cycle."""
+
+    __slots__ = ("kind", "name", "task", "loop", "thread_id", "started_at", "start", "stacks", "samples")
+
+    def __init__(self, kind: str, name: str, task: asyncio.Task) -> None:
+        self.kind = kind
+        self.name = name
+        self.task = task
+        self.loop = task.get_loop()
+        self.thread_id = threading.get_ident()
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+
+    def sample(self, frames: dict[int, Any]) -> None:
+        coro = self.task.get_coro()
+        if asyncio.current_task(self.loop) is self.task and self.thread_id in frames:
+            stack = _running_stack(frames[self.thread_id], getattr(coro, "cr_frame", None))
+        else:
+            stack = _awaiting_stack(coro)
+        if stack:
+            self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def record(self, duration_ms: float) -> dict[str, Any]:
+        return {
+            "id": f"{os.getpid()}-{next(_ids)}",
+            "kind": self.kind,
+            "name": self.name,
+            "pid": os.getpid(),
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(duration_ms, 1),
+            "samples": self.samples,
+            "interval_ms": _config.interval_ms,
+            "stacks": dict(self.stacks),
+        }
+
+
+class _Sampler:
+    """Background thread sampling all active units; runs only while needed."""
+
+    def __init__(self) -> None:
+        self._units: set[_Unit] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def add(self, unit: _Unit) -> None:
+        with self._lock:
+            self._units.add(unit)
+            self._stop.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="hubex-profiler", daemon=True)
+                self._thread.start()
+
+    def discard(self, unit: _Unit) -> None:
+        with self._lock:
+            self._units.discard(unit)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while True:
+            stopping = self._stop.wait(max(0.001, _config.interval_ms / 1000))
+            with self._lock:
+                if stopping and self._stop.is_set():
+                    self._thread = None
+                    return
+                units = list(self._units)
+            if not units:
+                continue
+            frames = sys._current_frames()
+            for unit in units:
+                try:
+                    unit.sample(frames)
+                except Exception:  # a racing task state change; skip the sample
+                    continue
+
+
+_sampler = _Sampler()
+
+
+# ---------------------------------------------------------------------------
+# Profiling units
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def profile(kind: str, name: str) -> Iterator[Optional[_Unit]]:
+    """Profile the current task for the duration of the block.
+
+    `kind` is "request" or "loop". The yielded unit's `name` may be updated
+    before the block ends (requests only know their route afterwards).
+    """
+    config = _config
+    task = asyncio.current_task() if config.enabled else None
+    if task is None or (kind == "loop" and config.loops and name not in config.loops):
+        yield None
+        return
+    unit = _Unit(kind, name, task)
+    _sampler.add(unit)
+    try:
+        yield unit
+    finally:
+        _sampler.discard(unit)
+        duration_ms = (time.perf_counter() - unit.start) * 1000
+        threshold = config.request_threshold_ms if kind == "request" else config.loop_threshold_ms
+        if duration_ms >= threshold and unit.samples:
+            _store(unit.record(duration_ms))
+
+
+def _store(record: dict[str, Any]) -> None:
+    _buffer.append(record)
+    _unpublished.append(record)
+
+
+def to_collapsed(stacks: dict[str, int]) -> str:
+    """Render stacks in the collapsed format read by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+def merge_stacks(records: list[dict[str, Any]]) -> dict[str, int]:
+    merged: Counter[str] = Counter()
+    for record in records:
+        merged.update(record.get("stacks") or {})
+    return dict(merged)
+
+
+async def list_profiles() -> list[dict[str, Any]]:
+    """Stored profiles, newest first (all processes when Redis is available)."""
+    from app.core.redis_client import get_redis
+
+    redis = get_redis()
+    if redis is not None:
+        await _publish_pending(redis)
+        try:
+            raw = await redis.lrange(PROFILES_KEY, 0, -1)
+            return [json.loads(item) for item in raw]
+        except Exception as exc:
+            logger.warning("profiling: reading shared profiles failed: %s", exc)
+    return list(reversed(_buffer))
+
+
+async def count_profiles() -> int:
+    from app.core.redis_client import get_redis
+
+    redis = get_redis()
+    if redis is not None:
+        await _publish_pending(redis)
+        try:
+            return int(await redis.llen(PROFILES_KEY))
+        except Exception as exc:
+            logger.warning("profiling: counting shared profiles failed: %s", exc)
+    return len(_buffer)
+
+
+async def clear_profiles() -> None:
+    from app.core.redis_client import get_redis
+
+    _buffer.clear()
+    _unpublished.clear()
+    redis = get_redis()
+    if redis is not None:
+        try:
+            await redis.delete(PROFILES_KEY)
+        except Exception as exc:
+            logger.warning("profiling: clearing shared profiles failed: %s", exc)
+
+
+# ---------------------------------------------------------------------------
+# Cross-process sync (Redis)
+# ---------------------------------------------------------------------------
+
+async def publish_config(config: ProfilingConfig) -> None:
+    """Share the config with every process (they pick it up within a sync period)."""
+    from app.core.redis_client import get_redis
+
+    redis = get_redis()
+    if redis is not None:
+        await redis.set(CONFIG_KEY, json.dumps(asdict(config)))
+
+
+async def _publish_pending(redis) -> None:
+    if not _unpublished:
+        return
+    records = [json.dumps(_unpublished.popleft()) for _ in range(len(_unpublished))]
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.lpush(PROFILES_KEY, *records)
+            pipe.ltrim(PROFILES_KEY, 0, max(1, settings.profiling_buffer_size) - 1)
+            await pipe.execute()
+    except Exception as exc:
+        logger.warning("profiling: publishing profiles failed: %s", exc)
+
+
+async def _sync_once() -> None:
+    from app.core.redis_client import get_redis
+
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        raw = await redis.get(CONFIG_KEY)
+    except Exception as exc:
+        logger.warning("profiling: reading shared config failed: %s", exc)
+        return
+    if raw:
+        try:
+            configure(**json.loads(raw))
+        except (TypeError, ValueError) as exc:
+            logger.warning("profiling: ignoring bad shared config: %s", exc)
+    await _publish_pending(redis)
+
+
+_syncer: Optional[asyncio.Task] = None
+
+
+async def _sync_loop() -> None:
+    while True:
+        await _sync_once()
+        await asyncio.sleep(PROFILING_SYNC_SECONDS)
+
+
+def start_sync() -> None:
+    """Follow the shared config and publish profiles (no-op without Redis)."""
+    from app.core.redis_client import get_redis
+
+    global _syncer
+    if get_redis() is not None and (_syncer is None or _syncer.done()):
+        _syncer = asyncio.create_task(_sync_loop())
+
+
+async def stop_sync() -> None:
+    global _syncer
+    _sampler.stop()
+    if _syncer is not None:
+        _syncer.cancel()
+        await asyncio.gather(_syncer, return_exceptions=True)
+        _syncer = None
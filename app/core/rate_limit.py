@@ -1,4 +1,4 @@
-"""Redis-based sliding-window rate-limiter middleware.
+"""Redis-based GCRA rate-limiter middleware.
 
 Route groups and limits (requests per 60-second window):
   - Auth (login / register / refresh):  10 req/min  keyed by client IP
@@ -8,6 +8,11 @@ Route groups and limits (requests per 60-second window):
 
 Routes listed in _WHITELIST_PREFIXES bypass rate-limiting completely.
 
+Each check is a single EVALSHA of an atomic GCRA script (one round trip, one
+key per client). Optionally (HUBEX_RATE_LIMIT_LOCAL_BATCH > 1) small batches
+of tokens are leased into the process so bursts from busy clients skip Redis.
+Responses carry RateLimit-Limit / -Remaining / -Reset / -Policy headers.
+
 When Redis is unavailable the middleware degrades gracefully and allows all
 requests through (fail-open).
 """
@@ -15,14 +20,14 @@ from __future__ import annotations
 
 import hashlib
 import logging
+import math
 import time
-from typing import Callable, Optional, Tuple
+from dataclasses import dataclass
+from typing import Optional, Tuple
 
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import JSONResponse, Response
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.core.asgi import add_response_headers, client_ip, get_header, jwt_claims, send_json
 from app.core.config import settings
 from app.core.redis_client import get_redis
 
@@ -31,6 +36,7 @@ logger = logging.getLogger("uvicorn.error")
 _WHITELIST_PREFIXES = (
     "/health",
     "/ready",
+    "/metrics",
     "/docs",
     "/redoc",
     "/openapi",
@@ -54,90 +60,188 @@ _DEFAULT_LIMIT = 120
 # Helpers
 # ---------------------------------------------------------------------------
 
-def _client_ip(request: Request) -> str:
-    forwarded = request.headers.get("X-Forwarded-For")
-    if forwarded:
-        return forwarded.split(",")[0].strip()
-    if request.client:
-        return request.client.host
-    return "unknown"
-
-
-def _jwt_sub(request: Request) -> Optional[str]:
-    """Extract 'sub' from Bearer token without full DB validation."""
-    try:
-        from jose import jwt as _jwt
-        from app.core.security import SECRET_KEY, ALGORITHM, ISSUER
-
-        auth = request.headers.get("Authorization", "")
-        if not auth.startswith("Bearer "):
-            return None
-        token = auth[7:]
-        payload = _jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], issuer=ISSUER)
-        return payload.get("sub")
-    except Exception:
-        return None
+def _jwt_sub(scope: Scope) -> Optional[str]:
+    """'sub' from the Bearer token without DB validation (decoded once per request)."""
+    return jwt_claims(scope).get("sub")
 
 
-def _device_fingerprint(request: Request) -> Optional[str]:
+def _device_fingerprint(scope: Scope) -> Optional[str]:
     """Return a short fingerprint of the device token (for rate-limit key only)."""
-    token = request.headers.get("X-Device-Token")
+    token = get_header(scope, b"x-device-token")
     if not token:
         return None
     return hashlib.sha256(token.encode()).hexdigest()[:16]
 
 
-async def _sliding_window(
+# GCRA (generic cell rate algorithm) in a single atomic script. The key holds
+# one number — the theoretical arrival time (TAT) in ms — so state is O(1) per
+# client regardless of traffic. ARGV[3] asks for up to N tokens at once; the
+# script grants as many as are available (at least 1 or the call is denied),
+# which lets the in-process pre-filter lease small batches.
+#
+# Returns {granted, remaining, retry_after_ms, reset_after_ms}.
+_GCRA_LUA = """
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local want = tonumber(ARGV[3])
+local interval = window / limit
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then tat = now end
+local available = math.floor((now + window - tat) / interval)
+if available < 1 then
+  return {0, 0, math.ceil(tat - window + interval - now), math.ceil(tat - now)}
+end
+local granted = math.min(want, available)
+local new_tat = tat + granted * interval
+local ttl = math.ceil(new_tat - now)
+redis.call('SET', KEYS[1], string.format('%.3f', new_tat), 'PX', ttl)
+return {granted, available - granted, 0, ttl}
+"""
+
+_script = None
+_script_client = None
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float  # seconds until the full quota is available again
+    retry_after: int = 0  # seconds, only set when denied
+
+
+@dataclass
+class _Lease:
+    tokens: int
+    remaining: int
+    expires_at: float
+    reset_at: float
+
+
+# key -> tokens leased from Redis that this process may hand out locally
+_leases: dict[str, _Lease] = {}
+_MAX_LEASES = 10_000
+
+
+def _gcra_script(redis):
+    """Return the registered GCRA script (EVALSHA with automatic SCRIPT LOAD)."""
+    global _script, _script_client
+    if _script is None or _script_client is not redis:
+        _script = redis.register_script(_GCRA_LUA)
+        _script_client = redis
+    return _script
+
+
+async def _gcra(
+    redis,
+    key: str,
+    limit: int,
+    window: int = 60,
+    want: int = 1,
+) -> Tuple[int, RateLimitResult]:
+    """Run the GCRA script once. Returns (granted_tokens, result)."""
+    granted, remaining, retry_ms, reset_ms = await _gcra_script(redis)(
+        keys=[key], args=[limit, window * 1000, want]
+    )
+    granted = int(granted)
+    result = RateLimitResult(
+        allowed=granted > 0,
+        limit=limit,
+        remaining=int(remaining),
+        reset_after=int(reset_ms) / 1000,
+        retry_after=max(1, math.ceil(int(retry_ms) / 1000)) if granted == 0 else 0,
+    )
+    return granted, result
+
+
+def _take_local(key: str, limit: int) -> Optional[RateLimitResult]:
+    """Serve a request from a previously leased batch, if one is still valid."""
+    lease = _leases.get(key)
+    if lease is None:
+        return None
+    now = time.monotonic()
+    if lease.tokens <= 0 or now >= lease.expires_at:
+        del _leases[key]
+        return None
+    lease.tokens -= 1
+    return RateLimitResult(
+        allowed=True,
+        limit=limit,
+        remaining=lease.remaining + lease.tokens,
+        reset_after=max(0.0, lease.reset_at - now),
+    )
+
+
+async def check_rate_limit(
     redis,
     key: str,
     limit: int,
     window: int = 60,
-) -> Tuple[bool, int]:
-    """Sliding-window counter via sorted set.
+) -> RateLimitResult:
+    """Check (and consume) one request against the limit for *key*.
 
-    Returns (allowed, retry_after_seconds).
-    If the request would exceed the limit the entry is NOT added to the set.
+    Costs at most one Redis round trip. With rate_limit_local_batch > 0 the
+    process leases up to that many tokens per call and serves the following
+    requests locally; leased tokens expire after the time they represent
+    (batch × window / limit), so the global limit is never exceeded.
     """
-    now = time.time()
-    cutoff = now - window
-    pipe = redis.pipeline()
-    # Remove timestamps outside the window
-    pipe.zremrangebyscore(key, "-inf", cutoff)
-    # Count current window entries
-    pipe.zcard(key)
-    # Set TTL so keys don't linger forever
-    pipe.expire(key, window + 1)
-    results = await pipe.execute()
-    current_count = results[1]
-
-    if current_count >= limit:
-        retry_after = int(window - (now - cutoff)) + 1
-        return False, max(1, retry_after)
-
-    # Add current request timestamp (unique score = timestamp, member = timestamp str)
-    await redis.zadd(key, {f"{now:.6f}": now})
-    return True, 0
+    local_batch = min(settings.rate_limit_local_batch, limit)
+    if local_batch > 1:
+        local = _take_local(key, limit)
+        if local is not None:
+            return local
+
+    granted, result = await _gcra(redis, key, limit, window, want=max(1, local_batch))
+    if granted > 1:
+        if len(_leases) >= _MAX_LEASES:
+            _leases.clear()
+        now = time.monotonic()
+        _leases[key] = _Lease(
+            tokens=granted - 1,
+            remaining=result.remaining,
+            expires_at=now + granted * window / limit,
+            reset_at=now + result.reset_after,
+        )
+        result.remaining += granted - 1
+    return result
+
+
+def _rate_limit_headers(result: RateLimitResult, window: int = 60) -> dict[str, str]:
+    """IETF draft RateLimit-* headers (delta-seconds for Reset)."""
+    return {
+        "RateLimit-Limit": str(result.limit),
+        "RateLimit-Remaining": str(max(0, result.remaining)),
+        "RateLimit-Reset": str(math.ceil(result.reset_after)),
+        "RateLimit-Policy": f"{result.limit};w={window}",
+    }
 
 
 # ---------------------------------------------------------------------------
 # Middleware
 # ---------------------------------------------------------------------------
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
+class RateLimitMiddleware:
     def __init__(self, app: ASGIApp) -> None:
-        super().__init__(app)
+        self.app = app
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        if not settings.rate_limit_enabled:
-            return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.rate_limit_enabled:
+            await self.app(scope, receive, send)
+            return
 
-        path = request.url.path
+        path = scope["path"]
         if any(path.startswith(p) for p in _WHITELIST_PREFIXES):
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
 
         redis = get_redis()
         if redis is None:
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
 
         # Determine limit and key type for this route
         limit = _DEFAULT_LIMIT
@@ -149,25 +253,34 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
 
         # Resolve identifier
         if key_type == "ip":
-            identifier: str = _client_ip(request)
+            identifier: str = client_ip(scope)
         elif key_type == "device_uid":
-            identifier = _device_fingerprint(request) or _client_ip(request)
+            identifier = _device_fingerprint(scope) or client_ip(scope)
         else:
-            identifier = _jwt_sub(request) or _client_ip(request)
+            identifier = _jwt_sub(scope) or client_ip(scope)
 
         redis_key = f"hubex:rl:{key_type}:{identifier}"
 
         try:
-            allowed, retry_after = await _sliding_window(redis, redis_key, limit)
+            result = await check_rate_limit(redis, redis_key, limit)
         except Exception as exc:
             logger.warning("rate_limit: Redis error (%s), allowing request", exc)
-            return await call_next(request)
-
-        if not allowed:
-            return JSONResponse(
-                status_code=429,
-                content={"detail": "rate_limited"},
-                headers={"Retry-After": str(retry_after)},
+            await self.app(scope, receive, send)
+            return
+
+        headers = _rate_limit_headers(result)
+        if not result.allowed:
+            await send_json(
+                send,
+                429,
+                {"detail": "rate_limited"},
+                headers={**headers, "Retry-After": str(result.retry_after)},
             )
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                add_response_headers(message, headers)
+            await send(message)
 
-        return await call_next(request)
+        await self.app(scope, receive, send_with_headers)
@@ -6,15 +6,29 @@ handle None gracefully (rate-limiting and caching degrade to allow-all/no-cache)
 from __future__ import annotations
 
 import logging
+import time
 from typing import Optional
 
 import redis.asyncio as aioredis
 
 from app.core.config import settings
+from app.core.metrics import REDIS_COMMAND_SECONDS
 
 logger = logging.getLogger("uvicorn.error")
 
+class _InstrumentedRedis(aioredis.Redis):
+    """Records per-command latency (pipelines are not covered)."""
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_SECONDS.labels(str(args[0]).upper()).observe(time.perf_counter() - start)
+
+
 _redis: Optional[aioredis.Redis] = None
+_redis_binary: Optional[aioredis.Redis] = None
 
 
 def get_redis() -> Optional[aioredis.Redis]:
@@ -22,15 +36,23 @@ def get_redis() -> Optional[aioredis.Redis]:
     return _redis
 
 
+def get_redis_binary() -> Optional[aioredis.Redis]:
+    """Return the shared bytes-in/bytes-out Redis client (no response decoding).
+
+    Used where values are opaque binary blobs, e.g. the response cache.
+    """
+    return _redis_binary
+
+
 async def init_redis() -> None:
     """Initialize the Redis connection pool. Called from lifespan startup."""
-    global _redis
+    global _redis, _redis_binary
     url = settings.redis_url
     if not url:
         logger.warning("redis_client: HUBEX_REDIS_URL not set — Redis features disabled")
         return
     try:
-        client = aioredis.from_url(
+        client = _InstrumentedRedis.from_url(
             url,
             decode_responses=True,
             socket_timeout=2,
@@ -38,15 +60,25 @@ async def init_redis() -> None:
         )
         await client.ping()
         _redis = client
+        _redis_binary = _InstrumentedRedis.from_url(
+            url,
+            decode_responses=False,
+            socket_timeout=2,
+            socket_connect_timeout=2,
+        )
         logger.info("redis_client: connected to Redis")
     except Exception as exc:
         logger.warning("redis_client: could not connect (%s) — Redis features disabled", exc)
         _redis = None
+        _redis_binary = None
 
 
 async def close_redis() -> None:
     """Close the Redis connection pool. Called from lifespan shutdown."""
-    global _redis
+    global _redis, _redis_binary
     if _redis is not None:
         await _redis.aclose()
         _redis = None
+    if _redis_binary is not None:
+        await _redis_binary.aclose()
+        _redis_binary = None
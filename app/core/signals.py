@@ -1,6 +1,8 @@
 from dataclasses import dataclass
+from typing import Sequence
 
 from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -9,6 +11,8 @@ from app.db.models.signals import SignalV1
 
 DEFAULT_LIMIT = 50
 MAX_LIMIT = 200
+MAX_BATCH = 5000
+INSERT_CHUNK = 1000  # rows per INSERT statement (5 binds each)
 
 
 @dataclass(slots=True)
@@ -62,6 +66,80 @@ async def persist_signal(
     return SignalPersistResult(created=True, cursor=signal.id, signal=signal)
 
 
+@dataclass(slots=True)
+class SignalItemResult:
+    idempotency_key: str
+    created: bool
+    cursor: int
+
+
+@dataclass(slots=True)
+class SignalBatchResult:
+    results: list[SignalItemResult]
+    cursor: int | None  # highest signal id among the items
+
+
+async def persist_signals(
+    db: AsyncSession,
+    *,
+    stream: str,
+    items: Sequence[dict],
+    provider_instance_id: int | None = None,
+) -> SignalBatchResult:
+    """Insert many signals of one stream, deduplicated by idempotency key.
+
+    Each item is a dict with ``signal_type``, ``payload`` and
+    ``idempotency_key``. New rows go in with INSERT ... ON CONFLICT DO NOTHING
+    RETURNING; keys that already existed are resolved with one follow-up
+    SELECT. A key repeated within the batch is created once and reported as a
+    duplicate afterwards. Results are in item order.
+    """
+    first: dict[str, dict] = {}
+    for item in items:
+        first.setdefault(item["idempotency_key"], item)
+
+    cursors: dict[str, int] = {}
+    created: set[str] = set()
+    rows = [
+        {
+            "stream": stream,
+            "signal_type": item["signal_type"],
+            "payload": item["payload"],
+            "idempotency_key": key,
+            "provider_instance_id": provider_instance_id,
+        }
+        for key, item in first.items()
+    ]
+    for start in range(0, len(rows), INSERT_CHUNK):
+        res = await db.execute(
+            insert(SignalV1)
+            .values(rows[start:start + INSERT_CHUNK])
+            .on_conflict_do_nothing(index_elements=["stream", "idempotency_key"])
+            .returning(SignalV1.idempotency_key, SignalV1.id)
+        )
+        for key, signal_id in res.all():
+            cursors[key] = signal_id
+            created.add(key)
+
+    existing = [key for key in first if key not in cursors]
+    if existing:
+        res = await db.execute(
+            select(SignalV1.idempotency_key, SignalV1.id).where(
+                SignalV1.stream == stream,
+                SignalV1.idempotency_key.in_(existing),
+            )
+        )
+        cursors.update(res.all())
+    await db.commit()
+
+    results: list[SignalItemResult] = []
+    for item in items:
+        key = item["idempotency_key"]
+        results.append(SignalItemResult(idempotency_key=key, created=key in created, cursor=cursors[key]))
+        created.discard(key)
+    return SignalBatchResult(results=results, cursor=max(cursors.values(), default=None))
+
+
 async def read_signals(
     db: AsyncSession,
     *,
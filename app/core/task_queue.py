@@ -0,0 +1,54 @@
+"""Per-device wake-ups for long-polling task claims (POST /tasks/poll).
+
+A poll with wait_s > 0 subscribes to its device before the first claim and,
+finding nothing, parks on that subscription instead of returning; it claims
+again as soon as a task is queued for the device. Wake-ups go through app.core.wakeups on NOTIFY_CHANNEL, keyed by
+device id:
+
+- in-process: a session that inserted queued Task rows wakes the devices'
+  waiters when it commits. Writers that insert tasks with Core statements
+  (fleet jobs' INSERT ... SELECT) register the device ids with
+  stage_wake() so they are woken on commit as well;
+- PostgreSQL: the tasks insert trigger (migration f7a8b9c0d1e4) sends
+  NOTIFY hubex_tasks with the device id, so tasks queued by any process
+  wake waiters here.
+
+Without the listener waiters re-check every RECHECK_SECONDS. Waiters are
+keyed by device; a poll restricted to one execution context re-parks when
+the woken task belongs to another context.
+"""
+from __future__ import annotations
+
+from contextlib import AbstractContextManager
+from typing import Iterable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import wakeups
+from app.db.models.tasks import Task
+
+NOTIFY_CHANNEL = "hubex_tasks"
+LONG_POLL_MAX_SECONDS = 30.0
+RECHECK_SECONDS = 5.0  # without the listener
+
+wakeups.track_inserts(NOTIFY_CHANNEL, Task, lambda row: row.client_id if row.status == "queued" else None)
+wakeups.follow(NOTIFY_CHANNEL, int)
+
+
+def stage_wake(db: AsyncSession, device_ids: Iterable[int]) -> None:
+    """Wake the devices' pollers once `db` commits (for Core inserts)."""
+    wakeups.stage(db, NOTIFY_CHANNEL, device_ids)
+
+
+def subscribe(device_id: int) -> AbstractContextManager[wakeups.Subscription]:
+    """Wake-ups for tasks queued for the device; register *before* claiming."""
+    return wakeups.subscribe(NOTIFY_CHANNEL, (device_id,))
+
+
+def recheck_interval() -> float:
+    """How long a poller may park before trying to claim again."""
+    return wakeups.recheck_interval(LONG_POLL_MAX_SECONDS, RECHECK_SECONDS)
+
+
+def waiter_count() -> int:
+    return wakeups.waiter_count(NOTIFY_CHANNEL)
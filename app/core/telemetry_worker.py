@@ -5,24 +5,39 @@ enqueues messages to a Redis Stream instead of writing directly to the DB.
 This worker consumes from the stream and performs the bridge + history write
 in batches.
 
+The stream is split into HUBEX_WORKER_SHARD_COUNT streams by hash(device_id),
+so a device's messages stay ordered. Every worker consumes the shards it
+leases (app.core.coordination). All owners read as the same consumer name,
+so when a shard moves, the new owner first drains the entries its
+predecessor read but never acknowledged.
+
 When disabled (default), the telemetry endpoint writes directly as before.
 """
 
 import asyncio
-import json
 import logging
+import time
 from datetime import datetime, timezone
 
 from app.core.config import settings
+from app.core.coordination import ShardLeases, shard_of
+from app.core import json_codec
+from app.core.metrics import TELEMETRY_STREAM_LAG, TELEMETRY_STREAM_PENDING, observe_cycle
 from app.core.redis_client import get_redis
 
 logger = logging.getLogger("uvicorn.error")
 
 STREAM_KEY = "hubex:telemetry:ingest"
 CONSUMER_GROUP = "hubex-workers"
-CONSUMER_NAME = "worker-1"
+# One consumer per shard stream; the shard lease makes its owner exclusive
+CONSUMER_NAME = "shard-owner"
 BATCH_SIZE = 50
 POLL_INTERVAL = 0.5  # seconds
+LAG_SAMPLE_INTERVAL = 10.0  # seconds between XINFO GROUPS samples
+
+
+def stream_key(shard: int) -> str:
+    return f"{STREAM_KEY}:{shard}"
 
 
 async def enqueue_telemetry(
@@ -45,71 +60,72 @@ async def enqueue_telemetry(
             "device_id": str(device_id),
             "device_uid": device_uid,
             "event_type": event_type,
-            "payload": json.dumps(payload),
+            "payload": json_codec.dumps(payload),
             "user_id": str(user_id) if user_id else "",
             "enqueued_at": datetime.now(timezone.utc).isoformat(),
         }
-        await redis.xadd(STREAM_KEY, msg, maxlen=100_000)
+        shard = shard_of(device_id, settings.worker_shard_count)
+        await redis.xadd(stream_key(shard), msg, maxlen=100_000, approximate=True)
         return True
     except Exception as exc:
         logger.warning("telemetry_worker: enqueue failed: %s", exc)
         return False
 
 
-async def _ensure_consumer_group() -> bool:
+async def _ensure_consumer_group(stream: str) -> bool:
     """Create the consumer group if it doesn't exist."""
     redis = get_redis()
     if redis is None:
         return False
     try:
-        await redis.xgroup_create(STREAM_KEY, CONSUMER_GROUP, id="0", mkstream=True)
+        await redis.xgroup_create(stream, CONSUMER_GROUP, id="0", mkstream=True)
     except Exception:
         pass  # Group already exists
     return True
 
 
-async def _process_batch(messages: list) -> int:
-    """Process a batch of telemetry messages from the stream."""
-    from app.db.session import async_session_factory
+async def _process_batch(stream: str, messages: list) -> int:
+    """Process a batch of telemetry messages from one shard stream, then ACK it."""
     from app.api.v1.telemetry import _bridge_telemetry_to_variables
 
     processed = 0
-    async with async_session_factory() as db:
-        for msg_id, fields in messages:
-            try:
-                device_id = int(fields.get(b"device_id", fields.get("device_id", 0)))
-                device_uid = (fields.get(b"device_uid") or fields.get("device_uid", b"")).decode() if isinstance(fields.get(b"device_uid", fields.get("device_uid", "")), bytes) else str(fields.get("device_uid", ""))
-                event_type = (fields.get(b"event_type") or fields.get("event_type", b"")).decode() if isinstance(fields.get(b"event_type", fields.get("event_type", "")), bytes) else str(fields.get("event_type", ""))
-                payload_raw = fields.get(b"payload") or fields.get("payload", b"{}")
-                if isinstance(payload_raw, bytes):
-                    payload_raw = payload_raw.decode()
-                payload = json.loads(payload_raw)
-
-                # Bridge telemetry to variables (the expensive part)
-                await _bridge_telemetry_to_variables(
-                    db=db,
-                    device_id=device_id,
-                    device_uid=device_uid,
-                    payload=payload,
-                )
-                processed += 1
-
-            except Exception as exc:
-                logger.warning("telemetry_worker: failed to process message %s: %s", msg_id, exc)
-
-        await db.commit()
+    for msg_id, fields in messages:
+        try:
+            # In order: per-device ordering is what sharding preserves
+            await _bridge_telemetry_to_variables(
+                int(fields.get("device_id") or 0),
+                fields.get("device_uid", ""),
+                fields.get("event_type") or None,
+                json_codec.loads(fields.get("payload") or "{}"),
+            )
+            processed += 1
+        except Exception as exc:
+            logger.warning("telemetry_worker: failed to process message %s: %s", msg_id, exc)
 
-    # ACK all processed messages
     redis = get_redis()
     if redis and messages:
-        msg_ids = [msg_id for msg_id, _ in messages]
-        await redis.xack(STREAM_KEY, CONSUMER_GROUP, *msg_ids)
-
+        await redis.xack(stream, CONSUMER_GROUP, *[msg_id for msg_id, _ in messages])
     return processed
 
 
+async def _sample_lag(redis, shards: set[int]) -> None:
+    """Export consumer-group lag/pending of the owned shard streams."""
+    for shard in shards:
+        stream = stream_key(shard)
+        try:
+            groups = await redis.xinfo_groups(stream)
+        except Exception:
+            continue
+        for group in groups:
+            if group.get("name") != CONSUMER_GROUP:
+                continue
+            TELEMETRY_STREAM_PENDING.labels(stream).set(group.get("pending") or 0)
+            if group.get("lag") is not None:  # Redis >= 7
+                TELEMETRY_STREAM_LAG.labels(stream).set(group["lag"])
+
+
 async def telemetry_worker_loop() -> None:
-    """Background loop that consumes from the telemetry Redis Stream.
+    """Background loop that consumes the telemetry shard streams this worker leases.
 
     Only runs when HUBEX_TELEMETRY_QUEUE_ENABLED=true.
     """
@@ -118,39 +134,62 @@ async def telemetry_worker_loop() -> None:
         return
 
     logger.info("telemetry_worker: starting (batch_size=%d)", BATCH_SIZE)
+    shards = ShardLeases("telemetry_worker")
+    # Streams read from "0" (own pending entries) until their backlog is empty
+    recovering: set[str] = set()
+    known: set[int] = set()
+    next_lag_sample = 0.0
 
-    if not await _ensure_consumer_group():
-        logger.warning("telemetry_worker: Redis unavailable, exiting")
-        return
-
-    while True:
-        try:
-            redis = get_redis()
-            if redis is None:
-                await asyncio.sleep(5)
-                continue
-
-            # Read batch from stream
-            results = await redis.xreadgroup(
-                CONSUMER_GROUP,
-                CONSUMER_NAME,
-                {STREAM_KEY: ">"},
-                count=BATCH_SIZE,
-                block=int(POLL_INTERVAL * 1000),
-            )
-
-            if not results:
-                continue
+    try:
+        while True:
+            try:
+                redis = get_redis()
+                if redis is None:
+                    await asyncio.sleep(5)
+                    continue
+
+                owned = await shards.refresh()
+                for shard in owned.keys() - known:
+                    await _ensure_consumer_group(stream_key(shard))
+                    recovering.add(stream_key(shard))
+                for shard in known - owned.keys():
+                    # The new owner reports this stream from now on
+                    TELEMETRY_STREAM_LAG.remove(stream_key(shard))
+                    TELEMETRY_STREAM_PENDING.remove(stream_key(shard))
+                known = set(owned)
+                if owned and time.monotonic() >= next_lag_sample:
+                    next_lag_sample = time.monotonic() + LAG_SAMPLE_INTERVAL
+                    await _sample_lag(redis, known)
+                if not owned:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+
+                streams = {
+                    stream_key(shard): "0" if stream_key(shard) in recovering else ">"
+                    for shard in sorted(owned)
+                }
+                results = await redis.xreadgroup(
+                    CONSUMER_GROUP,
+                    CONSUMER_NAME,
+                    streams,
+                    count=BATCH_SIZE,
+                    block=int(POLL_INTERVAL * 1000),
+                )
 
-            for stream_name, messages in results:
-                if messages:
-                    count = await _process_batch(messages)
+                for stream_name, messages in results or []:
+                    if not messages:
+                        recovering.discard(stream_name)
+                        continue
+                    with observe_cycle("telemetry_worker"):
+                        count = await _process_batch(stream_name, messages)
                     if count:
                         logger.debug("telemetry_worker: processed %d messages", count)
 
-        except asyncio.CancelledError:
-            logger.info("telemetry_worker: shutting down")
-            break
-        except Exception as exc:
-            logger.error("telemetry_worker: unexpected error: %s", exc)
-            await asyncio.sleep(2)
+            except asyncio.CancelledError:
+                logger.info("telemetry_worker: shutting down")
+                raise
+            except Exception as exc:
+                logger.error("telemetry_worker: unexpected error: %s", exc)
+                await asyncio.sleep(2)
+    finally:
+        await shards.release_all()
@@ -1,22 +1,58 @@
+"""Side effects of variable changes (device runtime settings, labels).
+
+Changes enqueue variable_effects rows (enqueue_effects). The
+variable_effects loop applies them with run_effects_concurrently: effects
+of one device apply in creation order, one device after another in its
+lane, while up to HUBEX_EFFECTS_CONCURRENCY devices proceed in parallel.
+
+A failed effect is retried with exponential backoff (2s .. 300s) and blocks
+the later effects of its device until it succeeds; after
+HUBEX_EFFECTS_MAX_ATTEMPTS attempts it is dead-lettered (status "dead",
+variable_effect.dead system event) and the device's lane moves on. Dead
+effects can be re-queued with POST /variables/effects/{id}/retry.
+"""
 from __future__ import annotations
 
+import asyncio
+import logging
+import os
+import socket
 from datetime import datetime, timedelta, timezone
 from typing import Any
 from uuid import uuid4
 
-from sqlalchemy import select
+from sqlalchemy import and_, case, exists, func, not_, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
 from app.api.v1.error_utils import raise_api_error
+from app.core.config import settings
+from app.core.metrics import (
+    VARIABLE_EFFECT_ATTEMPTS,
+    VARIABLE_EFFECT_BACKLOG_AGE,
+    VARIABLE_EFFECT_LAG_SECONDS,
+    observe_cycle,
+)
+from app.core.system_events import emit_system_event
 from app.db.models.device import Device
 from app.db.models.device_runtime import DeviceRuntimeSetting
 from app.db.models.variables import VariableAudit, VariableDefinition, VariableEffect
 
+logger = logging.getLogger("uvicorn.error")
+
+EFFECT_LOCK_SECONDS = 300  # claim lease; in_flight effects past it are re-run
+EFFECTS_INTERVAL = 1.0  # seconds between cycles that found less than a batch
+_UNFINISHED = ("pending", "failed", "in_flight")
+
 
 def _now_utc() -> datetime:
     return datetime.now(timezone.utc)
 
 
+def _as_aware(ts: datetime) -> datetime:
+    return ts if ts.tzinfo is not None else ts.replace(tzinfo=timezone.utc)
+
+
 def _backoff_seconds(attempts: int) -> int:
     return min(300, 2 ** min(attempts, 6))
 
@@ -120,21 +156,72 @@ async def _apply_label_sync(
     device.name = str(label)
 
 
-async def run_effects_once(
+async def _apply_effect(db: AsyncSession, effect: VariableEffect) -> None:
+    if effect.kind == "telemetry.reschedule":
+        await _apply_telemetry_reschedule(db, device_id=effect.device_id, payload=effect.payload)
+    elif effect.kind == "device.label.sync":
+        await _apply_label_sync(db, device_id=effect.device_id, payload=effect.payload)
+    else:
+        raise_api_error(422, "EFFECT_UNKNOWN_KIND", "unknown effect kind")
+
+
+def _mark_done(effect: VariableEffect) -> None:
+    effect.status = "done"
+    effect.error = None
+    effect.locked_until = None
+
+
+def _mark_failed(effect: VariableEffect, exc: Exception, now: datetime) -> str:
+    """Schedule a retry with backoff, or dead-letter after effects_max_attempts."""
+    effect.status = "failed"
+    effect.error = {"message": str(exc)}
+    effect.locked_until = None
+    effect.next_attempt_at = now + timedelta(seconds=_backoff_seconds(effect.attempts or 1))
+    if (effect.attempts or 0) >= settings.effects_max_attempts:
+        effect.status = "dead"
+    return effect.status
+
+
+def _due(model, now: datetime):
+    """Effects that may be attempted now; in_flight past its lock means a crashed runner."""
+    return or_(
+        and_(
+            model.status.in_(("pending", "failed")),
+            or_(model.next_attempt_at.is_(None), model.next_attempt_at <= now),
+            or_(model.locked_until.is_(None), model.locked_until <= now),
+        ),
+        and_(
+            model.status == "in_flight",
+            or_(model.locked_until.is_(None), model.locked_until <= now),
+        ),
+    )
+
+
+async def claim_effects(
     db: AsyncSession,
     *,
     limit: int,
     locked_by: str,
-) -> dict[str, int]:
-    now = _now_utc()
+    now: datetime | None = None,
+) -> list[VariableEffect]:
+    """Lock up to `limit` due effects, oldest first. Caller commits.
+
+    An effect is not claimed while an older unfinished effect of the same
+    device is not due (in flight or backing off), so a device's effects
+    apply in creation order across retries and cycles.
+    """
+    now = now or _now_utc()
+    older = aliased(VariableEffect)
+    blocked = exists().where(
+        older.device_id == VariableEffect.device_id,
+        older.created_at < VariableEffect.created_at,
+        older.status.in_(_UNFINISHED),
+        not_(_due(older, now)),
+    )
     res = await db.execute(
         select(VariableEffect)
-        .where(
-            VariableEffect.status.in_(["pending", "failed"]),
-            (VariableEffect.next_attempt_at.is_(None) | (VariableEffect.next_attempt_at <= now)),
-            (VariableEffect.locked_until.is_(None) | (VariableEffect.locked_until <= now)),
-        )
-        .order_by(VariableEffect.created_at.asc())
+        .where(_due(VariableEffect, now), not_(blocked))
+        .order_by(VariableEffect.created_at.asc(), VariableEffect.id.asc())
         .with_for_update(skip_locked=True)
         .limit(limit)
     )
@@ -142,38 +229,197 @@ async def run_effects_once(
     for effect in effects:
         effect.status = "in_flight"
         effect.locked_by = locked_by
-        effect.locked_until = now + timedelta(seconds=30)
-        effect.attempts = (effect.attempts or 0) + 1
+        effect.locked_until = now + timedelta(seconds=EFFECT_LOCK_SECONDS)
     await db.flush()
+    return effects
+
+
+def requeue_dead_effect(effect: VariableEffect) -> None:
+    """Give a dead-lettered effect a fresh set of attempts. Caller commits."""
+    effect.status = "pending"
+    effect.attempts = 0
+    effect.error = None
+    effect.next_attempt_at = _now_utc()
+    effect.locked_by = None
+    effect.locked_until = None
+
+
+def _unclaim(effect: VariableEffect) -> None:
+    effect.status = "failed" if effect.attempts else "pending"
+    effect.locked_by = None
+    effect.locked_until = None
+
+
+async def run_effects_once(
+    db: AsyncSession,
+    *,
+    limit: int,
+    locked_by: str,
+) -> dict[str, int]:
+    """Claim and apply due effects one by one in the caller's transaction."""
+    now = _now_utc()
+    effects = await claim_effects(db, limit=limit, locked_by=locked_by, now=now)
 
     processed = 0
     done = 0
     failed = 0
+    stopped: set[int] = set()  # devices whose earlier effect failed
     for effect in effects:
+        if effect.device_id in stopped:
+            _unclaim(effect)
+            continue
         processed += 1
+        effect.attempts = (effect.attempts or 0) + 1
         try:
-            if effect.kind == "telemetry.reschedule":
-                await _apply_telemetry_reschedule(
-                    db, device_id=effect.device_id, payload=effect.payload
-                )
-            elif effect.kind == "device.label.sync":
-                await _apply_label_sync(
-                    db, device_id=effect.device_id, payload=effect.payload
-                )
-            else:
-                raise_api_error(422, "EFFECT_UNKNOWN_KIND", "unknown effect kind")
-            effect.status = "done"
-            effect.error = None
-            effect.locked_until = None
+            await _apply_effect(db, effect)
+            _mark_done(effect)
             done += 1
         except Exception as exc:
-            effect.status = "failed"
-            effect.error = {"message": str(exc)}
-            effect.locked_until = None
-            backoff = _backoff_seconds(effect.attempts or 1)
-            effect.next_attempt_at = now + timedelta(seconds=backoff)
             failed += 1
-            if effect.attempts and effect.attempts >= 5:
-                effect.status = "dead"
+            if _mark_failed(effect, exc, now) == "failed" and effect.device_id is not None:
+                stopped.add(effect.device_id)
     await db.flush()
     return {"processed": processed, "done": done, "failed": failed}
+
+
+# ---------------------------------------------------------------------------
+# Concurrent runner: one ordered lane per device
+# ---------------------------------------------------------------------------
+
+def _lanes(effects: list[VariableEffect]) -> list[list[str]]:
+    """Effect ids per device in claim (creation) order; device-less effects run alone."""
+    lanes: dict[tuple[str, Any], list[str]] = {}
+    for effect in effects:
+        key = ("device", effect.device_id) if effect.device_id is not None else ("effect", effect.id)
+        lanes.setdefault(key, []).append(effect.id)
+    return list(lanes.values())
+
+
+async def _attempt(session_factory, effect_id: str) -> str:
+    """Apply one claimed effect in its own transaction; returns the outcome."""
+    async with session_factory() as db:
+        effect = await db.get(VariableEffect, effect_id)
+        if effect is None or effect.status != "in_flight":
+            return "skipped"
+        now = _now_utc()
+        due = _as_aware(effect.next_attempt_at or effect.created_at)
+        VARIABLE_EFFECT_LAG_SECONDS.observe(max(0.0, (now - due).total_seconds()))
+        kind = effect.kind
+        try:
+            effect.attempts = (effect.attempts or 0) + 1
+            await _apply_effect(db, effect)
+            _mark_done(effect)
+            await db.commit()
+            outcome = "done"
+        except Exception as exc:
+            await db.rollback()
+            effect = await db.get(VariableEffect, effect_id, populate_existing=True)
+            if effect is None:
+                return "skipped"
+            effect.attempts = (effect.attempts or 0) + 1
+            outcome = _mark_failed(effect, exc, _now_utc())
+            if outcome == "dead":
+                await emit_system_event(db, "variable_effect.dead", {
+                    "effect_id": effect.id,
+                    "kind": effect.kind,
+                    "device_uid": effect.device_uid,
+                    "attempts": effect.attempts,
+                    "error": effect.error,
+                })
+            await db.commit()
+    VARIABLE_EFFECT_ATTEMPTS.labels(kind, outcome).inc()
+    return outcome
+
+
+async def _release(session_factory, effect_ids: list[str]) -> None:
+    """Hand back unattempted effects of a lane whose earlier effect failed."""
+    if not effect_ids:
+        return
+    async with session_factory() as db:
+        await db.execute(
+            update(VariableEffect)
+            .where(VariableEffect.id.in_(effect_ids), VariableEffect.status == "in_flight")
+            .values(
+                status=case((VariableEffect.attempts > 0, "failed"), else_="pending"),
+                locked_by=None,
+                locked_until=None,
+            )
+        )
+        await db.commit()
+
+
+async def _observe_backlog(db: AsyncSession, now: datetime) -> None:
+    oldest = await db.scalar(
+        select(func.min(VariableEffect.next_attempt_at)).where(
+            VariableEffect.status.in_(("pending", "failed"))
+        )
+    )
+    age = 0.0 if oldest is None else (now - _as_aware(oldest)).total_seconds()
+    VARIABLE_EFFECT_BACKLOG_AGE.set(max(0.0, age))
+
+
+async def run_effects_concurrently(
+    session_factory,
+    *,
+    limit: int,
+    locked_by: str,
+    concurrency: int,
+) -> dict[str, int]:
+    """Claim due effects and apply them with up to `concurrency` devices at once.
+
+    A device's effects form a lane applied in order, one transaction per
+    effect, so a slow effect only holds up its own device. A failed effect
+    ends its lane for this cycle: the later effects are released and wait
+    (see claim_effects) until the retry succeeds or the effect is dead.
+    """
+    async with session_factory() as db:
+        now = _now_utc()
+        await _observe_backlog(db, now)
+        effects = await claim_effects(db, limit=limit, locked_by=locked_by, now=now)
+        lanes = _lanes(effects)
+        await db.commit()
+
+    counts = {"processed": 0, "done": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_lane(effect_ids: list[str]) -> None:
+        async with semaphore:
+            for index, effect_id in enumerate(effect_ids):
+                outcome = await _attempt(session_factory, effect_id)
+                if outcome == "skipped":
+                    continue
+                counts["processed"] += 1
+                counts["done" if outcome == "done" else "failed"] += 1
+                if outcome == "failed":
+                    await _release(session_factory, effect_ids[index + 1:])
+                    return
+
+    results = await asyncio.gather(*(run_lane(lane) for lane in lanes), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            # The lane's remaining effects are re-claimed once their lock expires
+            logger.error("variable_effects: lane failed: %r", result)
+    return counts
+
+
+async def variable_effects_loop() -> None:
+    """Background loop: applies due variable effects (run_effects_concurrently)."""
+    from app.db.session import WorkerSessionLocal
+
+    locked_by = f"effects:{socket.gethostname()}:{os.getpid()}"[:64]
+    while True:
+        processed = 0
+        try:
+            with observe_cycle("variable_effects"):
+                result = await run_effects_concurrently(
+                    WorkerSessionLocal,
+                    limit=settings.effects_batch,
+                    locked_by=locked_by,
+                    concurrency=settings.effects_concurrency,
+                )
+                processed = result["processed"]
+        except Exception:
+            logger.exception("variable_effects: unhandled error in cycle")
+        # A full batch means more are due: go again right away
+        if processed < settings.effects_batch:
+            await asyncio.sleep(EFFECTS_INTERVAL)
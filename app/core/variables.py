@@ -26,6 +26,7 @@ from app.db.models.variables import (
 )
 from app.db.models.device_runtime import DeviceRuntimeSetting
 from app.core.variable_effects import derive_effects_from_change, enqueue_effects
+from app.core import write_behind
 from app.core.system_events import emit_system_event
 
 logger = logging.getLogger("uvicorn.error")
@@ -347,21 +348,22 @@ async def record_history(
     device_id: int | None,
     source: str = "system",
 ) -> None:
-    """Record a history point for visualization time-series."""
+    """Record a history point for visualization time-series (write-behind)."""
     numeric = None
     if definition.value_type in ("int", "float") and value is not None:
         try:
             numeric = float(value)
         except (TypeError, ValueError):
             pass
-    db.add(VariableHistory(
-        variable_key=definition.key,
-        scope=definition.scope,
-        device_id=device_id,
-        value_json=value,
-        numeric_value=numeric,
-        source=source,
-    ))
+    write_behind.stage(db, VariableHistory, {
+        "variable_key": definition.key,
+        "scope": definition.scope,
+        "device_id": device_id,
+        "value_json": value,
+        "numeric_value": numeric,
+        "recorded_at": _now_utc(),
+        "source": source,
+    })
 
 
 async def create_or_update_value(
@@ -606,20 +608,20 @@ async def create_or_update_value_v2(
 
     masked_old = mask_if_secret(definition, old_value)
     masked_new = mask_if_secret(definition, coerced)
-    audit = VariableAudit(
-        variable_key=definition.key,
-        scope=scope,
-        device_id=device_id,
-        old_value_json=masked_old,
-        new_value_json=masked_new,
-        old_version=old_version,
-        new_version=current.version,
-        actor_type="user" if actor_user_id else "device",
-        actor_user_id=actor_user_id,
-        actor_device_id=actor_device_id,
-        created_at=now,
-    )
-    db.add(audit)
+    # No effects hang off this audit row, so it can be written behind
+    write_behind.stage(db, VariableAudit, {
+        "variable_key": definition.key,
+        "scope": scope,
+        "device_id": device_id,
+        "old_value_json": masked_old,
+        "new_value_json": masked_new,
+        "old_version": old_version,
+        "new_version": current.version,
+        "actor_type": "user" if actor_user_id else "device",
+        "actor_user_id": actor_user_id,
+        "actor_device_id": actor_device_id,
+        "created_at": now,
+    })
     # Record history point for visualization
     v2_source = "user" if actor_user_id else "device"
     await record_history(db, definition=definition, value=coerced, device_id=device_id, source=v2_source)
@@ -0,0 +1,218 @@
+"""Keyed wake-ups for long-polling readers.
+
+Readers that would otherwise poll a table on a timer (events_v1 streams,
+/tasks/poll, execution claim-next, agent heartbeats) park on a
+Subscription to (channel, key) pairs and read again once woken. A wake-up
+only says "look again": readers still query as before, so a missed or
+spurious one costs latency, never correctness.
+
+Channels are PostgreSQL NOTIFY channel names and keys are what the
+channel's payload carries (stream name, device id, definition id).
+Wake-ups come from:
+
+- in-process: keys staged on a session, by track_inserts() for new ORM
+  rows or by stage() for Core statements, are woken when it commits and
+  dropped when it rolls back;
+- PostgreSQL: start_listener() LISTENs to every follow()ed channel on one
+  dedicated connection, so the NOTIFYs that table triggers send for rows
+  written by any process wake waiters here.
+
+Without the listener (SQLite, connection down) readers re-check every
+recheck_interval() instead.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Hashable, Iterable, Iterator, Optional, Union
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("uvicorn.error")
+
+LISTENER_PING_SECONDS = 30.0
+LISTENER_RETRY_SECONDS = 5.0
+
+_INFO_KEY = "wakeups.staged"  # session.info: channel -> keys to wake on commit
+
+_waiters: dict[tuple[str, Hashable], set[asyncio.Event]] = {}
+_trackers: list[tuple[str, type, Callable[[Any], Optional[Hashable]]]] = []
+_channels: dict[str, Callable[[str], Hashable]] = {}  # followed channel -> payload parser
+_listener: Optional[asyncio.Task] = None
+_listening = False
+
+
+def wake(channel: str, keys: Iterable[Hashable]) -> None:
+    """Wake local waiters of the keys (for writers that bypass the session)."""
+    for key in keys:
+        for waiter in _waiters.get((channel, key), ()):
+            waiter.set()
+
+
+def _wake_all() -> None:
+    for waiters in list(_waiters.values()):
+        for waiter in waiters:
+            waiter.set()
+
+
+class Subscription:
+    """Wake-ups for some keys of a channel; register *before* reading so none is missed."""
+
+    def __init__(self) -> None:
+        self._event = asyncio.Event()
+
+    async def wait(self, timeout: float) -> bool:
+        """Park until one of the keys is woken or the timeout; True if woken.
+
+        Wake-ups that arrived since the last wait() return immediately.
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
+
+
+@contextmanager
+def subscribe(channel: str, keys: Iterable[Hashable]) -> Iterator[Subscription]:
+    sub = Subscription()
+    slots = [(channel, key) for key in set(keys)]
+    for slot in slots:
+        _waiters.setdefault(slot, set()).add(sub._event)
+    try:
+        yield sub
+    finally:
+        for slot in slots:
+            waiters = _waiters.get(slot)
+            if waiters is not None:
+                waiters.discard(sub._event)
+                if not waiters:
+                    del _waiters[slot]
+
+
+def stage(db: Union[AsyncSession, Session], channel: str, keys: Iterable[Hashable]) -> None:
+    """Wake the keys once `db` commits (for Core inserts and updates)."""
+    db.info.setdefault(_INFO_KEY, {}).setdefault(channel, set()).update(keys)
+
+
+def track_inserts(channel: str, model: type, key: Callable[[Any], Optional[Hashable]]) -> None:
+    """Stage key(row) for every new `model` row a session flushes; None skips the row."""
+    _trackers.append((channel, model, key))
+
+
+def follow(channel: str, parse: Callable[[str], Hashable] = str) -> None:
+    """Wake (channel, parse(payload)) on NOTIFY; register before start_listener() runs."""
+    _channels[channel] = parse
+
+
+def listening() -> bool:
+    """True while NOTIFYs from all processes are being received."""
+    return _listening
+
+
+def recheck_interval(max_seconds: float, fallback_seconds: float) -> float:
+    """How long a reader may park: max_seconds with the listener, else the fallback."""
+    return max_seconds if _listening else fallback_seconds
+
+
+def waiter_count(channel: Optional[str] = None) -> int:
+    """Parked subscriptions (of one channel); one subscription counts once."""
+    return len({
+        id(waiter)
+        for (slot_channel, _), waiters in _waiters.items()
+        if channel is None or slot_channel == channel
+        for waiter in waiters
+    })
+
+
+# ---------------------------------------------------------------------------
+# In-process wake-ups: sessions that committed tracked rows
+# ---------------------------------------------------------------------------
+
+@event.listens_for(Session, "after_flush")
+def _collect_inserts(session: Session, flush_context) -> None:
+    if not _trackers:
+        return
+    # session.new still lists the objects that were just inserted
+    for obj in session.new:
+        for channel, model, key in _trackers:
+            if isinstance(obj, model):
+                value = key(obj)
+                if value is not None:
+                    session.info.setdefault(_INFO_KEY, {}).setdefault(channel, set()).add(value)
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_committed(session: Session) -> None:
+    staged = session.info.pop(_INFO_KEY, None)
+    if staged:
+        for channel, keys in staged.items():
+            wake(channel, keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back(session: Session) -> None:
+    session.info.pop(_INFO_KEY, None)
+
+
+# ---------------------------------------------------------------------------
+# PostgreSQL LISTEN
+# ---------------------------------------------------------------------------
+
+def _on_notify(connection, pid, channel, payload) -> None:
+    parse = _channels.get(channel)
+    if parse is None:
+        return
+    try:
+        key = parse(payload)
+    except ValueError:
+        return
+    wake(channel, (key,))
+
+
+async def _listen(engine: AsyncEngine) -> None:
+    global _listening
+    while True:
+        try:
+            async with engine.connect() as conn:
+                await conn.execution_options(isolation_level="AUTOCOMMIT")
+                raw = await conn.get_raw_connection()
+                for channel in _channels:
+                    await raw.driver_connection.add_listener(channel, _on_notify)
+                _listening = True
+                # Rows may have been written while (re)connecting
+                _wake_all()
+                while True:
+                    await asyncio.sleep(LISTENER_PING_SECONDS)
+                    await conn.execute(text("SELECT 1"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning("wakeups: LISTEN %s failed: %s", ", ".join(_channels), exc)
+        finally:
+            _listening = False
+        await asyncio.sleep(LISTENER_RETRY_SECONDS)
+
+
+def start_listener(engine: Optional[AsyncEngine] = None) -> None:
+    """LISTEN to the followed channels (no-op unless the database is PostgreSQL)."""
+    global _listener
+    if engine is None:
+        from app.db.session import engine
+    if engine.dialect.name != "postgresql":
+        return
+    if _listener is None or _listener.done():
+        _listener = asyncio.create_task(_listen(engine))
+
+
+async def stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        await asyncio.gather(_listener, return_exceptions=True)
+        _listener = None
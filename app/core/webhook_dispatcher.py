@@ -1,4 +1,9 @@
-"""Webhook dispatcher — background worker that delivers events to registered webhooks."""
+"""Webhook dispatcher — background worker that delivers events to registered webhooks.
+
+Runs on every worker: events are sharded by device/org (app.core.coordination)
+and each process delivers the shards it leases, advancing one fenced
+checkpoint per shard so restarts resume instead of replaying.
+"""
 import asyncio
 import hashlib
 import hmac
@@ -6,19 +11,24 @@ import json
 import logging
 import time
 from datetime import datetime, timezone
+from typing import Callable, Optional
 
 import httpx
 from sqlalchemy import select
 
+from app.core.coordination import ShardLeases, event_shard_key, load_cursors, save_cursor, shard_of
+from app.core.metrics import WEBHOOK_DELIVERY_SECONDS, observe_cycle
 from app.db.models.events import EventV1
 from app.db.models.webhooks import WebhookDelivery, WebhookSubscription
-from app.db.session import AsyncSessionLocal
+from app.db.session import WorkerSessionLocal
 
 logger = logging.getLogger("uvicorn.error")
 
 # 3 retries with delays before each retry attempt
 RETRY_DELAYS = [1, 5, 25]
 POLL_INTERVAL = 5  # seconds between dispatch cycles
+# Checkpoint stream for the per-shard cursors (the dispatcher reads all streams)
+CHECKPOINT_STREAM = "*"
 
 
 def _compute_signature(secret: str, body: bytes) -> str:
@@ -46,11 +56,13 @@ async def _dispatch_with_retry(
     client: httpx.AsyncClient,
 ) -> None:
     payload_dict = _build_payload(event)
-    # Compute signature over the core payload (without hubex_signature field)
+    # Compute signature over the core payload (without hubex_signature field).
+    # This canonical form (stdlib json, sort_keys, default separators) is what
+    # receivers rebuild to verify X-Hubex-Signature, so it must not change.
     body_for_sig = json.dumps(payload_dict, default=str, sort_keys=True).encode()
     signature = _compute_signature(webhook.secret, body_for_sig)
-    payload_dict["hubex_signature"] = signature
-    body = json.dumps(payload_dict, default=str).encode()
+    # Append the signature to the signed bytes instead of encoding again
+    body = body_for_sig[:-1] + b', "hubex_signature": "' + signature.encode() + b'"}'
 
     headers = {
         "Content-Type": "application/json",
@@ -78,8 +90,10 @@ async def _dispatch_with_retry(
             )
 
         elapsed_ms = (time.monotonic() - start) * 1000
+        outcome = "success" if success else ("http_error" if status_code is not None else "error")
+        WEBHOOK_DELIVERY_SECONDS.labels(outcome).observe(elapsed_ms / 1000)
 
-        async with AsyncSessionLocal() as db:
+        async with WorkerSessionLocal() as db:
             db.add(
                 WebhookDelivery(
                     webhook_id=webhook.id,
@@ -103,8 +117,15 @@ async def _dispatch_with_retry(
     )
 
 
-async def _run_dispatch_cycle(cursor: int) -> int:
-    async with AsyncSessionLocal() as db:
+async def _run_dispatch_cycle(
+    cursor: int, accept: Optional[Callable[[EventV1], bool]] = None
+) -> int:
+    """Deliver up to 100 events after `cursor`; returns the new cursor.
+
+    `accept` restricts delivery to a subset of events (the caller's shards);
+    the cursor still advances past the others.
+    """
+    async with WorkerSessionLocal() as db:
         res = await db.execute(
             select(EventV1)
             .where(EventV1.id > cursor)
@@ -126,6 +147,8 @@ async def _run_dispatch_cycle(cursor: int) -> int:
     async with httpx.AsyncClient() as client:
         for event in events:
             cursor = event.id
+            if accept is not None and not accept(event):
+                continue
             for webhook in webhooks:
                 filter_list = webhook.event_filter or []
                 if not filter_list or event.type in filter_list:
@@ -134,12 +157,39 @@ async def _run_dispatch_cycle(cursor: int) -> int:
     return cursor
 
 
+async def _run_sharded_cycle(shards: ShardLeases) -> None:
+    """One dispatch cycle over the shards this process currently leases."""
+    owned = await shards.refresh()
+    if not owned:
+        return
+    names = {shard: shards.lease_name(shard) for shard in owned}
+    async with WorkerSessionLocal() as db:
+        stored = await load_cursors(db, CHECKPOINT_STREAM, list(names.values()))
+    cursors = {shard: stored[name] for shard, name in names.items()}
+
+    def accept(event: EventV1) -> bool:
+        shard = shard_of(event_shard_key(event), shards.count)
+        return shard in cursors and event.id > cursors[shard]
+
+    # One scan from the slowest owned shard serves all of them
+    cursor = await _run_dispatch_cycle(min(cursors.values()), accept)
+
+    async with WorkerSessionLocal() as db:
+        for shard, token in owned.items():
+            await save_cursor(db, CHECKPOINT_STREAM, names[shard], max(cursor, cursors[shard]), token)
+        await db.commit()
+
+
 async def webhook_dispatcher_loop() -> None:
     """Background loop: polls events_v1 and dispatches to registered webhooks."""
-    cursor = 0
-    while True:
-        try:
-            cursor = await _run_dispatch_cycle(cursor)
-        except Exception:
-            logger.exception("webhook_dispatcher: unhandled error in dispatch cycle")
-        await asyncio.sleep(POLL_INTERVAL)
+    shards = ShardLeases("webhook_dispatcher")
+    try:
+        while True:
+            try:
+                with observe_cycle("webhook_dispatcher"):
+                    await _run_sharded_cycle(shards)
+            except Exception:
+                logger.exception("webhook_dispatcher: unhandled error in dispatch cycle")
+            await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        await shards.release_all()
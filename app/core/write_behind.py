@@ -0,0 +1,191 @@
+"""Write-behind buffer for append-only rows (variable history/audit).
+
+Hot paths stage rows on their session with stage(). When that session
+commits, the rows move into a bounded per-process buffer; a rolled-back
+transaction drops them. The flusher writes the buffer every
+HUBEX_WRITE_BEHIND_FLUSH_MS, or as soon as HUBEX_WRITE_BEHIND_BATCH rows are
+waiting, with one multi-row INSERT per table in a single transaction.
+
+stage() adds the row to the caller's transaction instead (synchronous
+fallback) when:
+- the flusher does not run in this process (tests, scripts, disabled);
+- the buffer holds HUBEX_WRITE_BEHIND_MAX_PENDING rows, i.e. the database
+  is not keeping up. This is the backpressure: callers pay for their own
+  writes again until the flusher catches up.
+
+Only stage rows nobody reads by id order. events_v1 rows are never staged:
+cursor readers rely on event ids following commit order, and an id
+assigned at flush time would put a row behind events committed after it.
+Rows are buffered in the order their transactions committed and keep
+their own timestamps (recorded_at / created_at). Staged rows not yet
+flushed are lost if the process dies; stop_flusher() drains the buffer on
+shutdown.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Optional
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.metrics import WRITE_BEHIND_FALLBACK, WRITE_BEHIND_PENDING, WRITE_BEHIND_WRITTEN
+
+logger = logging.getLogger("uvicorn.error")
+
+MAX_BIND_PARAMS = 32767  # per statement (PostgreSQL wire protocol limit)
+POISON_ATTEMPTS = 3  # failed batch flushes before falling back to row by row
+
+_INFO_KEY = "write_behind.staged"
+
+_buffer: deque[tuple[type, dict[str, Any]]] = deque()
+_wake: Optional[asyncio.Event] = None
+_flusher: Optional[asyncio.Task] = None
+_session_factory = None  # None: app.db.session.AsyncSessionLocal
+_failures = 0
+
+WRITE_BEHIND_PENDING.set_function(lambda: len(_buffer))
+
+
+def running() -> bool:
+    return _flusher is not None and not _flusher.done()
+
+
+def pending_count() -> int:
+    return len(_buffer)
+
+
+def stage(db: AsyncSession, model: type, values: dict[str, Any]) -> None:
+    """Write one row of `model` after the caller's transaction commits.
+
+    `values` must be complete (no reliance on server defaults evaluated at
+    insert time, such as now()), since the INSERT may happen later.
+    """
+    if not running():
+        db.add(model(**values))
+        return
+    if len(_buffer) >= settings.write_behind_max_pending:
+        WRITE_BEHIND_FALLBACK.labels("full").inc()
+        db.add(model(**values))
+        return
+    db.info.setdefault(_INFO_KEY, []).append((model, values))
+
+
+@event.listens_for(Session, "after_commit")
+def _enqueue_committed(session: Session) -> None:
+    staged = session.info.pop(_INFO_KEY, None)
+    if not staged:
+        return
+    _buffer.extend(staged)
+    if _wake is not None and len(_buffer) >= settings.write_behind_batch:
+        _wake.set()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back(session: Session) -> None:
+    session.info.pop(_INFO_KEY, None)
+
+
+def _group(batch: list[tuple[type, dict[str, Any]]]) -> dict[tuple[type, tuple[str, ...]], list[dict[str, Any]]]:
+    """Rows per (model, column set), each group in buffer order."""
+    groups: dict[tuple[type, tuple[str, ...]], list[dict[str, Any]]] = {}
+    for model, values in batch:
+        groups.setdefault((model, tuple(values)), []).append(values)
+    return groups
+
+
+async def _write(db: AsyncSession, batch: list[tuple[type, dict[str, Any]]]) -> None:
+    for (model, columns), rows in _group(batch).items():
+        chunk = max(1, MAX_BIND_PARAMS // max(1, len(columns)))
+        for start in range(0, len(rows), chunk):
+            await db.execute(insert(model).values(rows[start:start + chunk]))
+
+
+async def _write_one_by_one(session_factory, batch: list[tuple[type, dict[str, Any]]]) -> None:
+    """Last resort for a batch that keeps failing: isolate the bad rows."""
+    for model, values in batch:
+        try:
+            async with session_factory() as db:
+                await db.execute(insert(model).values(values))
+                await db.commit()
+            WRITE_BEHIND_WRITTEN.labels(model.__tablename__).inc()
+        except Exception as exc:
+            WRITE_BEHIND_FALLBACK.labels("dropped").inc()
+            logger.error("write_behind: dropping %s row %r: %s", model.__tablename__, values, exc)
+
+
+async def flush(session_factory=None) -> int:
+    """Write up to HUBEX_WRITE_BEHIND_BATCH buffered rows; returns how many.
+
+    On failure the rows go back to the front of the buffer (order kept);
+    after POISON_ATTEMPTS failures in a row they are written one by one and
+    rows the database rejects are dropped.
+    """
+    global _failures
+    if session_factory is None:
+        from app.db.session import AsyncSessionLocal as session_factory
+    if not _buffer:
+        return 0
+    batch = [_buffer.popleft() for _ in range(min(len(_buffer), settings.write_behind_batch))]
+    if _failures >= POISON_ATTEMPTS:
+        _failures = 0
+        await _write_one_by_one(session_factory, batch)
+    else:
+        try:
+            async with session_factory() as db:
+                await _write(db, batch)
+                await db.commit()
+        except BaseException:
+            _buffer.extendleft(reversed(batch))
+            _failures += 1
+            raise
+        _failures = 0
+        for model, _ in batch:
+            WRITE_BEHIND_WRITTEN.labels(model.__tablename__).inc()
+    return len(batch)
+
+
+async def _flush_loop(session_factory) -> None:
+    interval = settings.write_behind_flush_ms / 1000.0
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+        try:
+            while await flush(session_factory) >= settings.write_behind_batch:
+                pass
+        except Exception as exc:
+            logger.warning("write_behind: flush failed (%d rows pending): %s", len(_buffer), exc)
+            await asyncio.sleep(min(5.0, interval * 10))
+
+
+def start_flusher(session_factory=None) -> None:
+    """Buffer staged rows in this process (no-op if disabled)."""
+    global _flusher, _wake, _session_factory
+    if not settings.write_behind_enabled:
+        return
+    if _flusher is None or _flusher.done():
+        _session_factory = session_factory
+        _wake = asyncio.Event()
+        _flusher = asyncio.create_task(_flush_loop(session_factory))
+
+
+async def stop_flusher() -> None:
+    """Stop buffering and write what is still buffered."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        await asyncio.gather(_flusher, return_exceptions=True)
+        _flusher = None
+    try:
+        while await flush(_session_factory):
+            pass
+    except Exception as exc:
+        logger.warning("write_behind: final flush failed, %d rows lost: %s", len(_buffer), exc)
+        _buffer.clear()
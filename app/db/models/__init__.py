@@ -36,6 +36,9 @@ from .dashboard import Dashboard, DashboardWidget
 from .api_key import ApiKey
 from .mfa import UserTotpSecret
 from .email_template import EmailTemplate
+from .email_outbox import EmailOutbox
+from .agent_commands import AgentCommandEntry
+from .fleet_jobs import FleetJob
 from .custom_endpoint import CustomEndpoint
 from .report import ReportTemplate, GeneratedReport
 from .plugin import Plugin
@@ -100,6 +103,9 @@ __all__ = [
     "ApiKey",
     "UserTotpSecret",
     "EmailTemplate",
+    "EmailOutbox",
+    "AgentCommandEntry",
+    "FleetJob",
     "CustomEndpoint",
     "ReportTemplate",
     "GeneratedReport",
@@ -22,8 +22,8 @@ class Device(Base):
     firmware_version: Mapped[str | None] = mapped_column(String(64), nullable=True)
     capabilities: Mapped[dict | None] = mapped_column(JSON, nullable=True)
 
-    # Last-seen
-    last_seen_at: Mapped[DateTime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Last-seen (indexed: the presence tracker reads recent reports from it without Redis)
+    last_seen_at: Mapped[DateTime | None] = mapped_column(DateTime(timezone=True), nullable=True, index=True)
 
     owner_user_id: Mapped[int | None] = mapped_column(ForeignKey("users.id"), nullable=True, index=True)
 
@@ -34,6 +34,10 @@ class EventV1Checkpoint(Base):
     cursor: Mapped[int] = mapped_column(
         BigInteger().with_variant(Integer, "sqlite"), nullable=False
     )
+    # Lease fencing token of the last writer (app.core.coordination.save_cursor)
+    fence: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"), nullable=False, default=0, server_default="0"
+    )
     updated_at: Mapped[DateTime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), nullable=False
     )
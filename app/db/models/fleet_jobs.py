@@ -0,0 +1,49 @@
+"""Fleet jobs: one task type fanned out to every device of a target selector."""
+
+from datetime import datetime
+
+from sqlalchemy import DateTime, ForeignKey, Integer, JSON, String, Text, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.base import Base
+
+
+class FleetJob(Base):
+    __tablename__ = "fleet_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(128), nullable=False)
+    task_type: Mapped[str] = mapped_column(String(64), nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+    priority: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # {"group": id} | {"entity_id": id} | {"tag": tag}
+    target: Mapped[dict] = mapped_column(JSON, nullable=False)
+    # running | paused | completed | aborted | canceled
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="running", index=True)
+
+    # Dispatch windows (None = unlimited)
+    max_in_flight: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    rate_per_minute: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # Abort once this share of finished tasks failed (None = never)
+    abort_failure_percent: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+    # Progress counters, maintained incrementally (never COUNTed)
+    total: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    dispatched: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    succeeded: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    failed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    canceled: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    # Materialization state: devices are dispatched in device-id order
+    cursor_device_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    exhausted: Mapped[bool] = mapped_column(nullable=False, default=False)
+    window_started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    window_dispatched: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    org_id: Mapped[int | None] = mapped_column(ForeignKey("organizations.id"), nullable=True, index=True)
+    created_by: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    completed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
@@ -46,6 +46,7 @@ class Task(Base):
     __table_args__ = (
         Index("ix_tasks_client_status_priority_created", "client_id", "status", "priority", "created_at"),
         Index("ix_tasks_lease_expires_at", "lease_expires_at"),
+        Index("ix_tasks_fleet_job_status", "fleet_job_id", "status"),
     )
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -67,3 +68,7 @@ class Task(Base):
     completed_at: Mapped[DateTime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     result: Mapped[dict | None] = mapped_column(_JSON_TYPE, nullable=True)
     error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Set on tasks materialized by a fleet job (app.core.fleet_jobs)
+    fleet_job_id: Mapped[int | None] = mapped_column(
+        ForeignKey("fleet_jobs.id", ondelete="SET NULL"), nullable=True
+    )
@@ -0,0 +1,142 @@
+"""Per-request / per-cycle SQL statement accounting and N+1 detection.
+
+before/after_cursor_execute hooks on every Engine time each statement into
+hubex_db_query_duration_seconds. Inside track_queries() — opened by
+SecurityMiddleware for each HTTP request and by observe_cycle() for each
+background loop cycle — statements are also counted per *shape*: the SQL
+text with whitespace normalised and IN-lists collapsed. A handler that runs
+the same SELECT once per row shows up as one shape with a high count; once a
+shape reaches HUBEX_DB_N_PLUS_ONE_THRESHOLD the worst offenders are logged.
+
+Tests can assert statement budgets the same way:
+
+    with track_queries("export") as stats:
+        await export_config(...)
+    assert stats.count <= 5 and not stats.repeated()
+"""
+from __future__ import annotations
+
+import contextvars
+import logging
+import re
+import time
+import weakref
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.core.metrics import DB_N_PLUS_ONE, DB_QUERY_SECONDS
+
+logger = logging.getLogger("uvicorn.error")
+
+_KINDS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+_PARAM = r"(?:\?|\$\d+|%\(\w+\)s|%s|:\w+)"
+_IN_LIST = re.compile(rf"\(\s*{_PARAM}(?:\s*,\s*{_PARAM})+\s*\)")
+
+# Engine -> workload label ("api", "read", "worker", ...) for the histogram
+_engine_labels: "weakref.WeakKeyDictionary[Engine, str]" = weakref.WeakKeyDictionary()
+
+
+@lru_cache(maxsize=4096)
+def statement_shape(statement: str) -> str:
+    """Normalised statement text: one line, IN-lists collapsed to (?…)."""
+    return _IN_LIST.sub("(?…)", " ".join(statement.split()))
+
+
+class QueryStats:
+    """Statements executed within one request or background cycle."""
+
+    __slots__ = ("scope", "count", "seconds", "shapes")
+
+    def __init__(self, scope: str) -> None:
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: dict[str, list] = {}  # raw statement -> [count, seconds]
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        entry = self.shapes.get(statement)
+        if entry is None:
+            self.shapes[statement] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def repeated(self, threshold: Optional[int] = None) -> list[tuple[str, int, float]]:
+        """(shape, count, seconds) of shapes run at least `threshold` times, worst first."""
+        threshold = settings.db_n_plus_one_threshold if threshold is None else threshold
+        if threshold <= 0:
+            return []
+        merged: dict[str, list] = {}
+        for statement, (count, seconds) in self.shapes.items():
+            entry = merged.setdefault(statement_shape(statement), [0, 0.0])
+            entry[0] += count
+            entry[1] += seconds
+        return sorted(
+            ((shape, count, seconds) for shape, (count, seconds) in merged.items() if count >= threshold),
+            key=lambda item: (item[1], item[2]),
+            reverse=True,
+        )
+
+
+_current: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar(
+    "hubex_query_stats", default=None
+)
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _current.get()
+
+
+@contextmanager
+def track_queries(scope: str) -> Iterator[QueryStats]:
+    """Count statements issued in this context (and tasks it spawns)."""
+    stats = QueryStats(scope)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def report_n_plus_one(stats: QueryStats, limit: int = 3) -> None:
+    """Log the worst repeated shapes of a finished request/cycle."""
+    offenders = stats.repeated()
+    if not offenders:
+        return
+    DB_N_PLUS_ONE.labels(stats.scope).inc()
+    for shape, count, seconds in offenders[:limit]:
+        logger.warning(
+            "db: likely N+1 in %s — %d× (%.1f ms) %s",
+            stats.scope, count, seconds * 1000, shape[:300],
+        )
+
+
+def label_engine(engine: Engine, label: str) -> None:
+    _engine_labels[engine] = label
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["hubex_query_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("hubex_query_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    kind = statement.lstrip()[:6].upper()
+    DB_QUERY_SECONDS.labels(
+        _engine_labels.get(conn.engine, "other"), kind if kind in _KINDS else "OTHER"
+    ).observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
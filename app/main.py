@@ -1,34 +1,31 @@
 # app/main.py
-import asyncio
+import hmac
+import ipaddress
 import logging
-import signal
 from contextlib import asynccontextmanager
-from typing import Any
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from sqlalchemy import text
 
 from app.api.v1.router import router as v1_router
+from app.api.v1.events import ws_router as events_ws_router
 from app.api.v1.telemetry import ws_router as telemetry_ws_router
 from app.api.v1.ws_user import ws_router as user_ws_router
+from app.core import presence, wakeups, write_behind
 from app.core.cache import CacheMiddleware
+from app.core.content_encoding import ContentEncodingMiddleware
 from app.core.config import settings
 from app.core.logging_config import configure_logging, is_test_env
+from app.core.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render as render_metrics, start_flusher, stop_flusher
 from app.core.middleware import SecurityMiddleware
+from app.core.profiling import start_sync as start_profiling_sync, stop_sync as stop_profiling_sync
 from app.core.modules import sync_module_registry
 from app.core.rate_limit import RateLimitMiddleware
 from app.core.redis_client import close_redis, init_redis
-from app.core.token_revoke import cleanup_expired_revocations
-from app.core.webhook_dispatcher import webhook_dispatcher_loop
-from app.core.alert_worker import alert_worker_loop
-from app.core.health_worker import health_worker_loop
-from app.core.ota_worker import ota_worker_loop
-from app.core.history_retention import history_retention_loop
-from app.core.automation_engine import automation_engine_loop
-from app.core.partition_manager import partition_maintenance_loop
-from app.core.telemetry_worker import telemetry_worker_loop
-from app.db.session import AsyncSessionLocal, engine
+from app.db.session import AsyncSessionLocal, engine, worker_engine
+from app.workers import ROLES, make_supervisor
 
 logger = logging.getLogger("uvicorn.error")
 
@@ -37,121 +34,6 @@ if not is_test_env():
     configure_logging(log_level=settings.log_level, log_format=settings.log_format)
 
 
-async def _demo_heartbeat_loop() -> None:
-    """Keep demo devices online by refreshing last_seen_at every 60s."""
-    from sqlalchemy import text
-    while True:
-        await asyncio.sleep(60)
-        try:
-            async with AsyncSessionLocal() as db:
-                await db.execute(text(
-                    "UPDATE devices SET last_seen_at = NOW() WHERE device_uid LIKE 'demo-%'"
-                ))
-                await db.commit()
-        except Exception:
-            logger.debug("demo_heartbeat: error updating demo devices")
-
-
-async def _computed_variables_loop() -> None:
-    """Recompute computed variables every 30 seconds."""
-    from app.core.computed_variables import compute_all
-    while True:
-        await asyncio.sleep(30)
-        try:
-            async with AsyncSessionLocal() as db:
-                count = await compute_all(db)
-                if count:
-                    logger.debug("computed_variables: updated %d values", count)
-        except Exception:
-            logger.debug("computed_variables: error in compute cycle")
-
-
-async def _api_poll_worker_loop() -> None:
-    """Poll configured API endpoints for service-type devices and write values as telemetry."""
-    import httpx
-    from sqlalchemy import select
-    from app.db.models.device import Device
-    from datetime import datetime, timezone
-
-    while True:
-        await asyncio.sleep(30)  # Check every 30s
-        try:
-            async with AsyncSessionLocal() as db:
-                # Find service devices with endpoint_url configured
-                res = await db.execute(
-                    select(Device).where(
-                        Device.category == "service",
-                        Device.config.isnot(None),
-                        Device.is_claimed == True,
-                    )
-                )
-                devices = res.scalars().all()
-
-                for device in devices:
-                    cfg = device.config or {}
-                    url = cfg.get("endpoint_url")
-                    if not url:
-                        continue
-
-                    interval = cfg.get("poll_interval_seconds", 60)
-                    # Check if enough time passed since last_seen
-                    if device.last_seen_at:
-                        age = (datetime.now(timezone.utc) - device.last_seen_at.replace(tzinfo=timezone.utc)).total_seconds()
-                        if age < interval * 0.8:  # 80% of interval = not yet due
-                            continue
-
-                    try:
-                        method = cfg.get("method", "GET").upper()
-                        headers = cfg.get("headers") or {}
-                        auth_type = cfg.get("auth_type", "none")
-                        if auth_type == "bearer" and cfg.get("auth_credentials"):
-                            headers["Authorization"] = f"Bearer {cfg['auth_credentials']}"
-                        elif auth_type == "api_key" and cfg.get("auth_credentials"):
-                            headers["X-API-Key"] = cfg["auth_credentials"]
-
-                        async with httpx.AsyncClient(timeout=15) as client:
-                            resp = await client.request(method, url, headers=headers)
-                            if resp.status_code == 200:
-                                data = resp.json()
-                                # Extract numeric fields
-                                payload = {}
-                                def _extract(obj, prefix=""):
-                                    if isinstance(obj, dict):
-                                        for k, v in obj.items():
-                                            full = f"{prefix}{k}" if not prefix else f"{prefix}.{k}"
-                                            if isinstance(v, (int, float)) and not isinstance(v, bool):
-                                                payload[k] = float(v)
-                                            elif isinstance(v, dict):
-                                                _extract(v, full)
-                                _extract(data)
-
-                                if payload:
-                                    # Write as telemetry via internal bridge
-                                    from app.api.v1.telemetry import _bridge_telemetry_to_variables
-                                    device.last_seen_at = datetime.now(timezone.utc)
-                                    await _bridge_telemetry_to_variables(device.id, device.device_uid, "api_poll", payload)
-                                    logger.debug("api_poll: %s → %d fields", device.device_uid, len(payload))
-                    except Exception as e:
-                        logger.debug("api_poll: %s failed: %s", device.device_uid, e)
-
-                await db.commit()
-        except Exception:
-            logger.debug("api_poll_worker: error in poll cycle")
-
-
-async def _token_cleanup_loop() -> None:
-    """Periodic cleanup of expired revoked-token entries (every 6h)."""
-    while True:
-        await asyncio.sleep(6 * 3600)
-        try:
-            async with AsyncSessionLocal() as db:
-                deleted = await cleanup_expired_revocations(db)
-                if deleted:
-                    logger.info("token_cleanup: purged %d expired revocations", deleted)
-        except Exception:
-            logger.exception("token_cleanup: error during cleanup")
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # ---- Startup ----
@@ -162,52 +44,40 @@ async def lifespan(app: FastAPI):
     logger.info("startup: database tables ensured")
 
     await init_redis()
+    start_flusher()
+    start_profiling_sync()
+    presence.start_flusher()
+    write_behind.start_flusher()
+    wakeups.start_listener(engine)
 
     async with AsyncSessionLocal() as db:
         await sync_module_registry(db)
 
-    cleanup_task = asyncio.create_task(_token_cleanup_loop())
-    dispatcher_task = asyncio.create_task(webhook_dispatcher_loop())
-    alert_task = asyncio.create_task(alert_worker_loop())
-    health_task = asyncio.create_task(health_worker_loop())
-    ota_task = asyncio.create_task(ota_worker_loop())
-    retention_task = asyncio.create_task(history_retention_loop())
-    automation_task = asyncio.create_task(automation_engine_loop())
-    demo_heartbeat_task = asyncio.create_task(_demo_heartbeat_loop())
-    api_poll_task = asyncio.create_task(_api_poll_worker_loop())
-    computed_task = asyncio.create_task(_computed_variables_loop())
-    partition_task = asyncio.create_task(partition_maintenance_loop())
-    telemetry_task = asyncio.create_task(telemetry_worker_loop())
-
-    background_tasks = (cleanup_task, dispatcher_task, alert_task, health_task, ota_task, retention_task, automation_task, demo_heartbeat_task, api_poll_task, computed_task)
-
-    # ---- SIGTERM handler for graceful shutdown ----
-    loop = asyncio.get_event_loop()
-
-    def _on_sigterm(*_: Any) -> None:
-        logger.info("lifespan: received SIGTERM, initiating graceful shutdown")
-        for task in background_tasks:
-            task.cancel()
-
-    try:
-        loop.add_signal_handler(signal.SIGTERM, _on_sigterm)
-    except (NotImplementedError, RuntimeError):
-        # Windows does not support add_signal_handler
-        pass
+    # Background loops run here unless this is an API-only process
+    # (HUBEX_ROLE=api); see app.workers and `python -m app.workers`.
+    if settings.role not in ROLES:
+        logger.warning("startup: unknown HUBEX_ROLE=%r, treating as 'all'", settings.role)
+    supervisor = make_supervisor(worker_engine) if settings.role != "api" else None
+    if supervisor is not None:
+        supervisor.start()
+    else:
+        logger.info("startup: HUBEX_ROLE=api — background loops disabled in this process")
 
     yield
 
     # ---- Shutdown ----
-    for task in background_tasks:
-        task.cancel()
-    for task in background_tasks:
-        try:
-            await task
-        except asyncio.CancelledError:
-            pass
-
+    if supervisor is not None:
+        await supervisor.drain()
+
+    await wakeups.stop_listener()
+    await write_behind.stop_flusher()
+    await presence.stop_flusher()
+    await stop_profiling_sync()
+    await stop_flusher()
     await close_redis()
     await engine.dispose()
+    if worker_engine is not engine:
+        await worker_engine.dispose()
 
 
 # ---------------------------------------------------------------------------
@@ -216,6 +86,7 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     title="HUBEX API",
     version="0.1.0",
     description="HUBEX device-management platform API",
@@ -228,8 +99,10 @@ app = FastAPI(
 # see the request, last to touch the response).
 #
 # Execution order for a request:
-#   SecurityMiddleware → RateLimitMiddleware → CacheMiddleware → CORS → routes
-# Response flows in reverse.
+#   SecurityMiddleware → ContentEncodingMiddleware → RateLimitMiddleware →
+#   CacheMiddleware → CORS → routes
+# Response flows in reverse. The four HUBEX layers are raw ASGI middlewares
+# sharing per-request state via scope["state"] (see app.core.asgi).
 
 # CORS — konfigurierbar via HUBEX_CORS_ORIGINS env var (kommasepariert)
 _cors_env = settings.cors_origins if hasattr(settings, 'cors_origins') and settings.cors_origins else ""
@@ -251,11 +124,13 @@ app.add_middleware(
 
 app.add_middleware(CacheMiddleware)
 app.add_middleware(RateLimitMiddleware)
+app.add_middleware(ContentEncodingMiddleware)
 app.add_middleware(SecurityMiddleware)
 
 app.include_router(v1_router, prefix="/api/v1")
 app.include_router(telemetry_ws_router, prefix="/api/v1")
 app.include_router(user_ws_router, prefix="/api/v1")
+app.include_router(events_ws_router, prefix="/api/v1")
 
 
 # ---------------------------------------------------------------------------
@@ -268,6 +143,44 @@ async def health() -> dict:
     return {"status": "ok", "version": "0.1.0"}
 
 
+def _metrics_client_allowed(request: Request) -> bool:
+    """Loopback or HUBEX_METRICS_ALLOWED_IPS: who may scrape /metrics without a token."""
+    try:
+        addr = ipaddress.ip_address(request.client.host if request.client else "")
+    except ValueError:
+        return False
+    if addr.is_loopback:
+        return True
+    for entry in settings.metrics_allowed_ips.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            if addr in ipaddress.ip_network(entry, strict=False):
+                return True
+        except ValueError:
+            logger.warning("metrics: ignoring invalid HUBEX_METRICS_ALLOWED_IPS entry %r", entry)
+    return False
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request) -> Response:
+    """Prometheus exposition of the in-process metrics (app.core.metrics).
+
+    Scrapes need HUBEX_METRICS_TOKEN as a bearer token when one is set, and
+    otherwise must come from loopback or HUBEX_METRICS_ALLOWED_IPS.
+    """
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if settings.metrics_token:
+        expected = f"Bearer {settings.metrics_token}"
+        if not hmac.compare_digest(request.headers.get("authorization", ""), expected):
+            raise HTTPException(status_code=401, detail="invalid_metrics_token")
+    elif not _metrics_client_allowed(request):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/ready", tags=["health"])
 async def ready() -> dict:
     """Readiness probe — checks DB and Redis connectivity."""
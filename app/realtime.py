@@ -1,6 +1,8 @@
 from typing import Dict, Set
 from fastapi import WebSocket
 
+from app.core.metrics import WEBSOCKET_CONNECTIONS
+
 
 class Hub:
     """Per-device telemetry WebSocket hub (existing)."""
@@ -26,6 +28,10 @@ class Hub:
             except Exception:
                 self.remove(device_id, ws)
 
+    @property
+    def connection_count(self) -> int:
+        return sum(len(s) for s in self.clients.values())
+
 
 class UserHub:
     """User-level WebSocket hub — notifications + channel events."""
@@ -73,3 +79,8 @@ class UserHub:
 
 hub = Hub()
 user_hub = UserHub()
+
+WEBSOCKET_CONNECTIONS.set_function(lambda: {
+    ("telemetry",): hub.connection_count,
+    ("user",): user_hub.connection_count,
+})
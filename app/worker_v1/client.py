@@ -25,11 +25,12 @@ async def post_json(
     url: str,
     token: str,
     payload: dict[str, Any],
+    timeout: float = 10,
 ) -> ApiResponse:
     resp = await client.post(
         url,
         json=payload,
         headers={"Authorization": f"Bearer {token}"},
-        timeout=10,
+        timeout=timeout,
     )
     return ApiResponse(status_code=resp.status_code, json=_extract_json(resp), text=resp.text)
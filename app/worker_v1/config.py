@@ -14,6 +14,7 @@ class WorkerConfig:
     poll_delay: float
     definition_key: str | None
     max_runs: int | None
+    claim_wait: float = 25.0  # claim-next long-poll; 0 polls every poll_delay
 
 
 def _env(name: str, default: str | None = None) -> str:
@@ -44,6 +45,7 @@ def load_config_from_env() -> WorkerConfig:
     lease_seconds = _env_int("LEASE_SECONDS", 60)
     heartbeat_every = _env_int("HEARTBEAT_EVERY", 20)
     poll_delay = _env_float("POLL_DELAY", 2.0)
+    claim_wait = _env_float("CLAIM_WAIT", 25.0)
     definition_key = os.getenv("DEFINITION_KEY")
     if definition_key is not None and definition_key.strip() == "":
         definition_key = None
@@ -64,6 +66,8 @@ def load_config_from_env() -> WorkerConfig:
         raise ValueError("HEARTBEAT_EVERY must be 1..LEASE_SECONDS")
     if poll_delay <= 0:
         raise ValueError("POLL_DELAY must be > 0")
+    if not (0 <= claim_wait <= 30):
+        raise ValueError("CLAIM_WAIT must be 0..30")
     if definition_key is not None and not (1 <= len(definition_key) <= 96):
         raise ValueError("DEFINITION_KEY must be 1..96 chars")
     if max_runs is not None and max_runs <= 0:
@@ -78,4 +82,5 @@ def load_config_from_env() -> WorkerConfig:
         poll_delay=poll_delay,
         definition_key=definition_key,
         max_runs=max_runs,
+        claim_wait=claim_wait,
     )
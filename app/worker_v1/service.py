@@ -29,6 +29,7 @@ def _claim_payload(config: WorkerConfig) -> dict[str, Any]:
     payload: dict[str, Any] = {
         "worker_id": config.worker_id,
         "lease_seconds": config.lease_seconds,
+        "wait_seconds": config.claim_wait,
     }
     if config.definition_key:
         payload["definition_key"] = config.definition_key
@@ -60,42 +61,28 @@ def _now_iso() -> str:
 async def _heartbeat_loop(
     client: httpx.AsyncClient,
     config: WorkerConfig,
+    held: set[int],
     stop: asyncio.Event,
 ) -> None:
+    """Registry heartbeat; also renews the leases of all held runs in one call."""
     url = f"{config.base_url}/api/v1/executions/workers/heartbeat"
     while not stop.is_set():
         resp = await post_json(
             client,
             url,
             config.token,
-            {"worker_id": config.worker_id},
+            {
+                "worker_id": config.worker_id,
+                "run_ids": sorted(held),
+                "lease_seconds": config.lease_seconds,
+            },
         )
         if resp.status_code != 200:
             _log("worker_heartbeat_failed", status=resp.status_code, body=resp.text)
-        try:
-            await asyncio.wait_for(stop.wait(), timeout=config.heartbeat_every)
-        except asyncio.TimeoutError:
-            continue
-
-
-async def _lease_loop(
-    client: httpx.AsyncClient,
-    config: WorkerConfig,
-    run_id: int,
-    stop: asyncio.Event,
-) -> None:
-    url = f"{config.base_url}/api/v1/executions/runs/{run_id}/lease"
-    while not stop.is_set():
-        resp = await post_json(
-            client,
-            url,
-            config.token,
-            {"worker_id": config.worker_id, "lease_seconds": config.lease_seconds},
-        )
-        if resp.status_code != 200:
-            _log("lease_failed", run_id=run_id, status=resp.status_code, body=resp.text)
-            stop.set()
-            break
+        else:
+            for run_id in (resp.json or {}).get("lost_run_ids") or []:
+                _log("lease_failed", run_id=run_id)
+                held.discard(run_id)
         try:
             await asyncio.wait_for(stop.wait(), timeout=config.heartbeat_every)
         except asyncio.TimeoutError:
@@ -108,16 +95,25 @@ async def run_worker(
 ) -> int:
     _log("worker_start", config=asdict(config))
 
+    held: set[int] = set()
     registry_stop = asyncio.Event()
-    registry_task = asyncio.create_task(_heartbeat_loop(client, config, registry_stop))
+    registry_task = asyncio.create_task(_heartbeat_loop(client, config, held, registry_stop))
 
     runs_completed = 0
     try:
         while True:
             claim_url = f"{config.base_url}/api/v1/executions/runs/claim-next"
-            resp = await post_json(client, claim_url, config.token, _claim_payload(config))
+            resp = await post_json(
+                client,
+                claim_url,
+                config.token,
+                _claim_payload(config),
+                timeout=config.claim_wait + 10,
+            )
             if resp.status_code == 404:
-                await asyncio.sleep(config.poll_delay)
+                # A long-poll already waited server-side for a run
+                if config.claim_wait <= 0 or "no run available" not in resp.text:
+                    await asyncio.sleep(config.poll_delay)
                 continue
             if _is_misconfig(resp):
                 _log("claim_misconfig", status=resp.status_code, body=resp.text)
@@ -139,8 +135,7 @@ async def run_worker(
                 continue
 
             _log("claim_ok", run_id=run_id)
-            stop = asyncio.Event()
-            lease_task = asyncio.create_task(_lease_loop(client, config, run_id, stop))
+            held.add(run_id)
             try:
                 finalize_url = f"{config.base_url}/api/v1/executions/runs/{run_id}/finalize"
                 finalize_payload = _finalize_payload(run, config)
@@ -167,8 +162,7 @@ async def run_worker(
                 else:
                     _log("finalize_ok", run_id=run_id)
             finally:
-                stop.set()
-                await lease_task
+                held.discard(run_id)
 
             runs_completed += 1
             if config.max_runs is not None and runs_completed >= config.max_runs:
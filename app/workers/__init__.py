@@ -0,0 +1,170 @@
+"""Background loop registry and supervisor.
+
+HTTP processes (HUBEX_ROLE=api) start no loops and can be scaled across
+cores with ``uvicorn --workers N``. Loops run under a LoopSupervisor either
+in a dedicated ``python -m app.workers`` process (HUBEX_ROLE=worker) or
+inside the API process (HUBEX_ROLE=all, the single-node default).
+
+The supervisor restarts crashed loops with backoff, runs singleton loops
+only while this process holds their lease (app.core.coordination) and
+starts sharded loops everywhere — they lease their own shards each cycle.
+It drains on shutdown: loops are cancelled — an interrupted cycle rolls
+back its transaction and is redone by the next owner — and given
+HUBEX_WORKER_DRAIN_SECONDS to finish cleanup before leases are released.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from app.core.agent_commands import agent_command_sweeper_loop
+from app.core.alert_worker import alert_worker_loop
+from app.core.automation_engine import automation_engine_loop
+from app.core.config import settings
+from app.core.coordination import LocalCoordinator, make_coordinator, set_coordinator
+from app.core.email import email_outbox_loop
+from app.core.fleet_jobs import fleet_dispatcher_loop
+from app.core.health_worker import health_worker_loop
+from app.core.metrics import LOOP_RESTARTS
+from app.core.history_retention import history_retention_loop
+from app.core.ota_worker import ota_worker_loop
+from app.core.partition_manager import partition_maintenance_loop
+from app.core.presence import presence_tracker_loop
+from app.core.telemetry_worker import telemetry_worker_loop
+from app.core.variable_effects import variable_effects_loop
+from app.core.webhook_dispatcher import webhook_dispatcher_loop
+from app.workers.loops import (
+    api_poll_worker_loop,
+    computed_variables_loop,
+    demo_heartbeat_loop,
+    token_cleanup_loop,
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+ROLES = ("api", "worker", "all")
+
+
+@dataclass(frozen=True)
+class LoopSpec:
+    name: str
+    run: Callable[[], Awaitable[None]]
+    # Singleton loops run on exactly one process cluster-wide; the others run
+    # everywhere and either shard their work (ShardLeases) or claim rows
+    singleton: bool = True
+
+
+LOOPS: list[LoopSpec] = [
+    LoopSpec("token_cleanup", token_cleanup_loop),
+    LoopSpec("webhook_dispatcher", webhook_dispatcher_loop, singleton=False),
+    LoopSpec("alert_worker", alert_worker_loop),
+    LoopSpec("health_worker", health_worker_loop),
+    LoopSpec("ota_worker", ota_worker_loop),
+    LoopSpec("history_retention", history_retention_loop),
+    LoopSpec("automation_engine", automation_engine_loop, singleton=False),
+    LoopSpec("demo_heartbeat", demo_heartbeat_loop),
+    LoopSpec("api_poll_worker", api_poll_worker_loop),
+    LoopSpec("computed_variables", computed_variables_loop),
+    LoopSpec("partition_maintenance", partition_maintenance_loop),
+    LoopSpec("telemetry_worker", telemetry_worker_loop, singleton=False),
+    # Outbox rows are claimed with SKIP LOCKED
+    LoopSpec("email_outbox", email_outbox_loop, singleton=False),
+    LoopSpec("agent_command_sweeper", agent_command_sweeper_loop),
+    LoopSpec("presence_tracker", presence_tracker_loop),
+    LoopSpec("fleet_dispatcher", fleet_dispatcher_loop),
+    # Singleton: per-device ordering assumes one claimer
+    LoopSpec("variable_effects", variable_effects_loop),
+]
+
+
+def enabled_loops(specs: Optional[list[LoopSpec]] = None) -> list[LoopSpec]:
+    """Loops this process should run (HUBEX_WORKER_DISABLED_LOOPS removes some)."""
+    disabled = {n.strip() for n in settings.worker_disabled_loops.split(",") if n.strip()}
+    specs = LOOPS if specs is None else specs
+    unknown = disabled - {spec.name for spec in specs}
+    if unknown:
+        logger.warning("workers: unknown loop names in HUBEX_WORKER_DISABLED_LOOPS: %s",
+                       ", ".join(sorted(unknown)))
+    return [spec for spec in specs if spec.name not in disabled]
+
+
+class LoopSupervisor:
+    """Runs, restarts and drains a set of background loops."""
+
+    def __init__(
+        self,
+        specs: list[LoopSpec],
+        coordinator=None,
+        restart_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ) -> None:
+        self.specs = specs
+        self.coordinator = coordinator or LocalCoordinator()
+        self.restart_backoff = restart_backoff
+        self.max_backoff = max_backoff
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        for spec in self.specs:
+            self._tasks.append(asyncio.create_task(self._supervise(spec), name=f"supervise:{spec.name}"))
+        logger.info("workers: started %d loops (%s)", len(self.specs),
+                    ", ".join(spec.name for spec in self.specs))
+
+    async def _supervise(self, spec: LoopSpec) -> None:
+        backoff = self.restart_backoff
+        while True:
+            if spec.singleton:
+                await self.coordinator.acquire(spec.name)
+
+            loop_task = asyncio.create_task(spec.run(), name=f"loop:{spec.name}")
+            watched = {loop_task}
+            lost: Optional[asyncio.Task] = None
+            if spec.singleton:
+                lost = asyncio.create_task(self.coordinator.wait_lost(spec.name))
+                watched.add(lost)
+            try:
+                await asyncio.wait(watched, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in watched:
+                    task.cancel()
+                await asyncio.gather(*watched, return_exceptions=True)
+                if spec.singleton:
+                    await self.coordinator.release(spec.name)
+
+            if lost is not None and lost.done() and not lost.cancelled():
+                logger.warning("workers: %s stopped — lease lost", spec.name)
+                LOOP_RESTARTS.labels(spec.name).inc()
+                backoff = self.restart_backoff
+                continue
+            if loop_task.cancelled() or loop_task.exception() is None:
+                logger.info("workers: %s finished", spec.name)
+                return
+            logger.error(
+                "workers: %s crashed (%r) — restarting in %.0fs",
+                spec.name, loop_task.exception(), backoff,
+            )
+            LOOP_RESTARTS.labels(spec.name).inc()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """Stop all loops, wait up to `timeout` seconds, release leases."""
+        timeout = settings.worker_drain_seconds if timeout is None else timeout
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                logger.warning("workers: %d loops did not stop within %.0fs",
+                               len(pending), timeout)
+        await self.coordinator.close()
+
+
+def make_supervisor(engine) -> LoopSupervisor:
+    """Supervisor for the enabled loops; also installs the process coordinator."""
+    coordinator = make_coordinator(engine)
+    set_coordinator(coordinator)
+    return LoopSupervisor(enabled_loops(), coordinator)
@@ -0,0 +1,90 @@
+"""Background worker process: ``python -m app.workers``.
+
+Runs the background loops without serving HTTP. Pair with API processes
+started with HUBEX_ROLE=api.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import signal
+
+from app.core import presence, wakeups, write_behind
+from app.core.config import settings
+from app.core.logging_config import configure_logging
+from app.core.metrics import start_flusher, stop_flusher
+from app.core.profiling import start_sync as start_profiling_sync, stop_sync as stop_profiling_sync
+from app.core.redis_client import close_redis, init_redis
+from app.db.session import worker_engine
+from app.workers import LOOPS, enabled_loops, make_supervisor
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="HUBEX background worker")
+    parser.add_argument("--list", action="store_true", help="list loop names and exit")
+    return parser.parse_args()
+
+
+async def _main() -> int:
+    # Redis first: the coordinator may be Redis-backed
+    await init_redis()
+    start_flusher()
+    start_profiling_sync()
+    presence.start_flusher()
+    write_behind.start_flusher()
+    wakeups.start_listener(worker_engine)
+    supervisor = make_supervisor(worker_engine)
+    stop = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows does not support add_signal_handler
+            pass
+
+    supervisor.start()
+    try:
+        await stop.wait()
+        logger.info("workers: shutdown requested, draining")
+    finally:
+        await supervisor.drain()
+        await wakeups.stop_listener()
+        await write_behind.stop_flusher()
+        await presence.stop_flusher()
+        await stop_profiling_sync()
+        await stop_flusher()
+        await close_redis()
+        await worker_engine.dispose()
+    return 0
+
+
+def main() -> int:
+    args = _parse_args()
+    if args.list:
+        enabled = {spec.name for spec in enabled_loops()}
+        for spec in LOOPS:
+            kind = "singleton" if spec.singleton else "every worker"
+            state = "enabled" if spec.name in enabled else "disabled"
+            print(f"{spec.name:24} {kind:13} {state}")
+        return 0
+
+    configure_logging(log_level=settings.log_level, log_format=settings.log_format)
+    if settings.role != "worker":
+        # Only HUBEX_ROLE=worker builds the worker engine (app.db.session)
+        logger.warning(
+            "workers: HUBEX_ROLE=%s set for a worker process — running loops anyway, on the API engine",
+            settings.role,
+        )
+    try:
+        return asyncio.run(_main())
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,133 @@
+"""Small background loops without a home module in app.core.
+
+Registered with the loop supervisor in app.workers next to the app.core
+loops (alerts, automations, webhooks, ...).
+"""
+import asyncio
+import logging
+
+from app.core.metrics import observe_cycle
+from app.core import presence
+from app.core.token_revoke import cleanup_expired_revocations
+from app.db.session import WorkerSessionLocal
+
+logger = logging.getLogger("uvicorn.error")
+
+
+async def demo_heartbeat_loop() -> None:
+    """Keep demo devices online by refreshing last_seen_at every 60s."""
+    from sqlalchemy import text
+    while True:
+        await asyncio.sleep(60)
+        try:
+            with observe_cycle("demo_heartbeat"):
+                async with WorkerSessionLocal() as db:
+                    await db.execute(text(
+                        "UPDATE devices SET last_seen_at = NOW() WHERE device_uid LIKE 'demo-%'"
+                    ))
+                    await db.commit()
+        except Exception:
+            logger.debug("demo_heartbeat: error updating demo devices")
+
+
+async def computed_variables_loop() -> None:
+    """Recompute computed variables every 30 seconds."""
+    from app.core.computed_variables import compute_all
+    while True:
+        await asyncio.sleep(30)
+        try:
+            with observe_cycle("computed_variables"):
+                async with WorkerSessionLocal() as db:
+                    count = await compute_all(db)
+                    if count:
+                        logger.debug("computed_variables: updated %d values", count)
+        except Exception:
+            logger.debug("computed_variables: error in compute cycle")
+
+
+async def api_poll_worker_loop() -> None:
+    """Poll configured API endpoints for service-type devices and write values as telemetry."""
+    import httpx
+    from sqlalchemy import select
+    from app.db.models.device import Device
+    from datetime import datetime, timezone
+
+    while True:
+        await asyncio.sleep(30)  # Check every 30s
+        try:
+            with observe_cycle("api_poll_worker"):
+                async with WorkerSessionLocal() as db:
+                    # Find service devices with endpoint_url configured
+                    res = await db.execute(
+                        select(Device).where(
+                            Device.category == "service",
+                            Device.config.isnot(None),
+                            Device.is_claimed == True,
+                        )
+                    )
+                    devices = res.scalars().all()
+
+                    for device in devices:
+                        cfg = device.config or {}
+                        url = cfg.get("endpoint_url")
+                        if not url:
+                            continue
+
+                        interval = cfg.get("poll_interval_seconds", 60)
+                        # Check if enough time passed since last_seen
+                        if device.last_seen_at:
+                            age = (datetime.now(timezone.utc) - device.last_seen_at.replace(tzinfo=timezone.utc)).total_seconds()
+                            if age < interval * 0.8:  # 80% of interval = not yet due
+                                continue
+
+                        try:
+                            method = cfg.get("method", "GET").upper()
+                            headers = cfg.get("headers") or {}
+                            auth_type = cfg.get("auth_type", "none")
+                            if auth_type == "bearer" and cfg.get("auth_credentials"):
+                                headers["Authorization"] = f"Bearer {cfg['auth_credentials']}"
+                            elif auth_type == "api_key" and cfg.get("auth_credentials"):
+                                headers["X-API-Key"] = cfg["auth_credentials"]
+
+                            async with httpx.AsyncClient(timeout=15) as client:
+                                resp = await client.request(method, url, headers=headers)
+                                if resp.status_code == 200:
+                                    data = resp.json()
+                                    # Extract numeric fields
+                                    payload = {}
+                                    def _extract(obj, prefix=""):
+                                        if isinstance(obj, dict):
+                                            for k, v in obj.items():
+                                                full = f"{prefix}{k}" if not prefix else f"{prefix}.{k}"
+                                                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                                                    payload[k] = float(v)
+                                                elif isinstance(v, dict):
+                                                    _extract(v, full)
+                                    _extract(data)
+
+                                    if payload:
+                                        # Write as telemetry via internal bridge
+                                        from app.api.v1.telemetry import _bridge_telemetry_to_variables
+                                        presence.touch(device.id)
+                                        await _bridge_telemetry_to_variables(device.id, device.device_uid, "api_poll", payload)
+                                        logger.debug("api_poll: %s → %d fields", device.device_uid, len(payload))
+                        except Exception as e:
+                            logger.debug("api_poll: %s failed: %s", device.device_uid, e)
+
+                    await db.commit()
+        except Exception:
+            logger.debug("api_poll_worker: error in poll cycle")
+
+
+async def token_cleanup_loop() -> None:
+    """Periodic cleanup of expired revoked-token entries (every 6h)."""
+    while True:
+        await asyncio.sleep(6 * 3600)
+        try:
+            with observe_cycle("token_cleanup"):
+                async with WorkerSessionLocal() as db:
+                    deleted = await cleanup_expired_revocations(db)
+                    if deleted:
+                        logger.info("token_cleanup: purged %d expired revocations", deleted)
+        except Exception:
+            logger.exception("token_cleanup: error during cleanup")
@@ -37,6 +37,7 @@
 #include <Update.h>
 #include <initializer_list>
 #include <utility>
+#include <vector>
 
 // ---------------------------------------------------------------------------
 // Config
@@ -54,6 +55,10 @@
 #define HUBEX_NVS_NAMESPACE "hubex"
 #endif
 
+#ifndef HUBEX_USE_MSGPACK
+#define HUBEX_USE_MSGPACK 0
+#endif
+
 // ---------------------------------------------------------------------------
 // Result type
 // ---------------------------------------------------------------------------
@@ -119,6 +124,12 @@ public:
         }
     }
 
+    /**
+     * Send telemetry and heartbeats as MessagePack instead of JSON.
+     * The server transcodes application/msgpack bodies, so nothing else changes.
+     */
+    void useMsgPack(bool enabled) { _msgPack = enabled; }
+
     /** Returns true if the device has a stored token (is paired). */
     bool isPaired() const { return _deviceToken.length() > 0; }
 
@@ -174,10 +185,7 @@ public:
 
         JsonDocument doc;
         doc["firmware_version"] = _fwVersion;
-        String body;
-        serializeJson(doc, body);
-
-        return _post("/api/v1/edge/heartbeat", body, true);
+        return _postDoc("/api/v1/edge/heartbeat", doc);
     }
 
     // -----------------------------------------------------------------------
@@ -238,10 +246,7 @@ public:
             payload[f.first] = f.second;
         }
         doc["device_uid"] = _deviceUid;
-
-        String body;
-        serializeJson(doc, body);
-        return _post("/api/v1/telemetry", body, true);
+        return _postDoc("/api/v1/telemetry", doc);
     }
 
     /**
@@ -253,10 +258,7 @@ public:
         JsonDocument doc;
         doc["payload"]    = payloadDoc;
         doc["device_uid"] = _deviceUid;
-
-        String body;
-        serializeJson(doc, body);
-        return _post("/api/v1/telemetry", body, true);
+        return _postDoc("/api/v1/telemetry", doc);
     }
 
     // -----------------------------------------------------------------------
@@ -367,6 +369,7 @@ private:
     String     _deviceToken;
     int        _deviceId   = -1;
     bool       _skipTls    = false;
+    bool       _msgPack    = HUBEX_USE_MSGPACK;
     Preferences _prefs;
 
     // -----------------------------------------------------------------------
@@ -428,8 +431,30 @@ private:
         return {false, code, respBody};
     }
 
+    /** POST a document with the device token, as MessagePack or JSON. */
+    HubexResult _postDoc(const String& path, JsonDocument& doc) {
+        if (!_msgPack) {
+            String body;
+            serializeJson(doc, body);
+            return _post(path, body, true);
+        }
+        std::vector<uint8_t> buf(measureMsgPack(doc));
+        serializeMsgPack(doc, buf.data(), buf.size());
+        String respBody;
+        int code = _postBytes(path, buf.data(), buf.size(), "application/msgpack",
+                              _deviceToken, respBody);
+        if (code >= 200 && code < 300) return {true, code, ""};
+        return {false, code, respBody};
+    }
+
     int _postRaw(const String& path, const String& body,
                  const String& token, String& outBody) {
+        return _postBytes(path, (const uint8_t*)body.c_str(), body.length(),
+                          "application/json", token, outBody);
+    }
+
+    int _postBytes(const String& path, const uint8_t* data, size_t len,
+                   const char* contentType, const String& token, String& outBody) {
         HTTPClient http;
         WiFiClientSecure* sec = nullptr;
         String url = _serverUrl + path;
@@ -443,12 +468,12 @@ private:
         }
 
         http.setTimeout(HUBEX_HTTP_TIMEOUT_MS);
-        http.addHeader("Content-Type", "application/json");
+        http.addHeader("Content-Type", contentType);
         if (token.length() > 0) {
             http.addHeader("X-Device-Token", token);
         }
 
-        int code = http.POST(body);
+        int code = http.POST((uint8_t*)data, len);
         outBody  = (code > 0) ? http.getString() : "";
         http.end();
         if (sec) delete sec;
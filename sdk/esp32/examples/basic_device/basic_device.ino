@@ -62,6 +62,7 @@ void setup() {
 
     // Init HUBEX SDK
     hubex.begin(FIRMWARE_VER, SKIP_TLS);
+    // hubex.useMsgPack(true);  // smaller uploads on metered (cellular) links
 
     // Pair if needed (blocks until dashboard user claims the device)
     if (!hubex.isPaired()) {
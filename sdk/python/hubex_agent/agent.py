@@ -5,8 +5,11 @@ The agent:
   2. Sends periodic heartbeats
   3. Reports system telemetry as variables
   4. Listens for variable-write commands (optional WebSocket)
+  5. Runs queued agent commands registered with on_command()
 """
 
+import gzip
+import json
 import logging
 import platform
 import threading
@@ -18,11 +21,38 @@ try:
 except ImportError:
     requests = None  # type: ignore
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # type: ignore
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None  # type: ignore
+
 logger = logging.getLogger("hubex.agent")
 
+_CONTENT_TYPES = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+    "cbor": "application/cbor",
+}
+
 
 class HubexAgent:
-    """HUBEX Agent SDK — connects a machine/process to HUBEX as an agent device."""
+    """HUBEX Agent SDK — connects a machine/process to HUBEX as an agent device.
+
+    Metered links can opt in to smaller uploads: ``body_format`` "msgpack" or
+    "cbor" (needs the msgpack / cbor2 package) and ``compression`` "gzip" or
+    "zstd" (needs zstandard). Responses are compressed by the server whenever
+    the client accepts it; requests decodes gzip transparently.
+    """
 
     def __init__(
         self,
@@ -32,6 +62,8 @@ class HubexAgent:
         heartbeat_interval: int = 30,
         telemetry_interval: int = 60,
         collectors: Optional[list[Callable[[], dict[str, Any]]]] = None,
+        body_format: str = "json",
+        compression: Optional[str] = None,
     ):
         self.server_url = server_url.rstrip("/")
         self.device_uid = device_uid
@@ -39,18 +71,31 @@ class HubexAgent:
         self.heartbeat_interval = heartbeat_interval
         self.telemetry_interval = telemetry_interval
         self.collectors = collectors or []
+        self.body_format = body_format
+        self.compression = compression
 
         self._running = False
         self._thread: Optional[threading.Thread] = None
         self._variables: dict[str, Any] = {}
+        self._handlers: dict[str, Callable[[dict], Optional[dict]]] = {}
+        self._acks: list[dict] = []
         self._session = requests.Session() if requests else None
 
         if not self._session:
             raise RuntimeError("requests library required: pip install requests")
 
+        if body_format not in _CONTENT_TYPES:
+            raise ValueError(f"body_format must be one of {sorted(_CONTENT_TYPES)}")
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError("compression must be None, 'gzip' or 'zstd'")
+        if (body_format == "msgpack" and msgpack is None) or (body_format == "cbor" and cbor2 is None):
+            raise RuntimeError(f"{body_format} support required: pip install hubex-agent[{body_format}]")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd support required: pip install hubex-agent[zstd]")
+
         self._session.headers.update({
             "X-Device-Token": self.device_token,
-            "Content-Type": "application/json",
+            "Content-Type": _CONTENT_TYPES[body_format],
         })
 
     # ── Public API ────────────────────────────────────────────────────────
@@ -82,14 +127,11 @@ class HubexAgent:
         }
 
         try:
-            resp = self._session.post(
-                f"{self.server_url}/api/v1/telemetry",
-                json={
-                    "device_uid": self.device_uid,
-                    "event_type": "agent.telemetry",
-                    "payload": data,
-                },
-            )
+            resp = self._post("/api/v1/telemetry", {
+                "device_uid": self.device_uid,
+                "event_type": "agent.telemetry",
+                "payload": data,
+            })
             if resp.status_code in (200, 201):
                 logger.debug("Telemetry sent: %d keys", len(data))
                 return True
@@ -100,17 +142,52 @@ class HubexAgent:
             logger.error("Telemetry error: %s", e)
             return False
 
+    def on_command(self, command_type: str, handler: Callable[[dict], Optional[dict]]) -> None:
+        """Run handler(payload) for queued commands of this type.
+
+        The returned dict is reported as the command result; an exception
+        nacks the command. Commands can be delivered more than once, so
+        handlers should be idempotent.
+        """
+        self._handlers[command_type] = handler
+
+    def poll_commands(self, wait_seconds: float = 0) -> int:
+        """Fetch due commands via the agent heartbeat, run them, queue acks.
+
+        Acks ride on the next poll. Returns the number of commands run.
+        """
+        acks, self._acks = self._acks, []
+        try:
+            resp = self._post("/api/v1/agent/heartbeat", {
+                "uptime": self._uptime(), "wait_seconds": wait_seconds, "acks": acks,
+            })
+            resp.raise_for_status()
+            commands = resp.json().get("commands", [])
+        except Exception as e:
+            self._acks = acks + self._acks
+            logger.error("Command poll error: %s", e)
+            return 0
+
+        for cmd in commands:
+            handler = self._handlers.get(cmd["type"])
+            if handler is None:
+                self._acks.append({"id": cmd["id"], "ok": False, "error": f"unknown command: {cmd['type']}"})
+                continue
+            try:
+                self._acks.append({"id": cmd["id"], "ok": True, "result": handler(cmd.get("payload") or {})})
+            except Exception as e:
+                logger.warning("Command %s failed: %s", cmd["type"], e)
+                self._acks.append({"id": cmd["id"], "ok": False, "error": str(e)[:500], "retry": True})
+        return len(commands)
+
     def heartbeat(self) -> bool:
         """Send heartbeat to mark device as online."""
         try:
-            resp = self._session.post(
-                f"{self.server_url}/api/v1/telemetry",
-                json={
-                    "device_uid": self.device_uid,
-                    "event_type": "agent.heartbeat",
-                    "payload": {"status": "alive", "uptime": self._uptime()},
-                },
-            )
+            resp = self._post("/api/v1/telemetry", {
+                "device_uid": self.device_uid,
+                "event_type": "agent.heartbeat",
+                "payload": {"status": "alive", "uptime": self._uptime()},
+            })
             return resp.status_code in (200, 201)
         except Exception as e:
             logger.error("Heartbeat error: %s", e)
@@ -139,6 +216,23 @@ class HubexAgent:
 
     # ── Private ───────────────────────────────────────────────────────────
 
+    def _encode(self, body: dict) -> bytes:
+        if self.body_format == "msgpack":
+            raw = msgpack.packb(body, use_bin_type=True)
+        elif self.body_format == "cbor":
+            raw = cbor2.dumps(body)
+        else:
+            raw = json.dumps(body, separators=(",", ":")).encode()
+        if self.compression == "gzip":
+            return gzip.compress(raw)
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor().compress(raw)
+        return raw
+
+    def _post(self, path: str, body: dict):
+        headers = {"Content-Encoding": self.compression} if self.compression else None
+        return self._session.post(f"{self.server_url}{path}", data=self._encode(body), headers=headers)
+
     def _loop(self) -> None:
         last_heartbeat = 0.0
         last_telemetry = 0.0
@@ -148,6 +242,8 @@ class HubexAgent:
 
             if now - last_heartbeat >= self.heartbeat_interval:
                 self.heartbeat()
+                if self._handlers:
+                    self.poll_commands()
                 last_heartbeat = now
 
             if now - last_telemetry >= self.telemetry_interval:
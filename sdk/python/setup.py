@@ -8,6 +8,9 @@ setup(
     install_requires=["requests>=2.28.0"],
     extras_require={
         "system": ["psutil>=5.9.0"],
+        "msgpack": ["msgpack>=1.0.0"],
+        "cbor": ["cbor2>=5.4.0"],
+        "zstd": ["zstandard>=0.21.0"],
     },
     python_requires=">=3.9",
     entry_points={
@@ -21,7 +21,7 @@ from sqlalchemy.ext.asyncio import (
 )
 from sqlalchemy.pool import StaticPool
 
-from app.api.deps import get_db
+from app.api.deps import get_db, get_read_db
 from app.api.deps_caps import capability_guard
 from app.core.security import ALGORITHM, ISSUER, SECRET_KEY
 from app.db.base import Base
@@ -123,6 +123,7 @@ async def make_test_app(
     deps = [Depends(capability_guard)] if with_cap_guard else []
     app = FastAPI(dependencies=deps)
     app.dependency_overrides[get_db] = _get_test_db
+    app.dependency_overrides[get_read_db] = _get_test_db
 
     for router in routers or []:
         app.include_router(router, prefix=prefix)
@@ -0,0 +1,170 @@
+"""Tests for the agent command queue (app.core.agent_commands) and heartbeat delivery."""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+from app.api.v1.agent_protocol import command_router, router as agent_router
+from app.core import agent_commands, presence
+from app.core.security import hash_device_token
+from app.db.models.agent_commands import AgentCommandEntry
+from app.db.models.device import Device
+from app.db.models.events import EventV1
+from app.db.models.pairing import DeviceToken
+from app.db.models.user import User
+from tests.conftest import auth_header, make_client, make_test_app, make_test_session
+
+
+async def _setup():
+    engine, Session = await make_test_session(tables=[
+        User.__table__, Device.__table__, DeviceToken.__table__, AgentCommandEntry.__table__, EventV1.__table__,
+    ])
+    async with Session() as db:
+        db.add(User(id=1, email="op@example.com", password_hash="x"))
+        device = Device(device_uid="agent-1", is_claimed=True, owner_user_id=1)
+        db.add(device)
+        await db.flush()
+        db.add(DeviceToken(device_id=device.id, token_hash=hash_device_token("raw-agent-1"), is_active=True))
+        await db.commit()
+        device_id = device.id
+    app = await make_test_app(Session, [agent_router, command_router], with_cap_guard=False)
+    return engine, Session, app, device_id
+
+
+_DEVICE = {"X-Device-Token": "raw-agent-1"}
+
+
+async def _make_due(Session) -> None:
+    async with Session() as db:
+        await db.execute(
+            update(AgentCommandEntry).values(next_attempt_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+        )
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_command_delivered_on_heartbeat_and_acked():
+    engine, Session, app, device_id = await _setup()
+    async with make_client(app) as client:
+        resp = await client.post(f"/api/v1/devices/{device_id}/commands",
+                                 json={"type": "reboot", "payload": {"delay": 5}}, headers=auth_header())
+        assert resp.status_code == 201
+        command_id = resp.json()["id"]
+
+        resp = await client.post("/api/v1/agent/heartbeat", json={}, headers=_DEVICE)
+        assert resp.json()["commands"] == [{"id": command_id, "type": "reboot", "payload": {"delay": 5}}]
+
+        # Delivered but not yet acked: not handed out again before the deadline
+        resp = await client.post("/api/v1/agent/heartbeat", json={}, headers=_DEVICE)
+        assert resp.json()["commands"] == []
+
+        resp = await client.post("/api/v1/agent/heartbeat", headers=_DEVICE,
+                                 json={"acks": [{"id": command_id, "result": {"rebooted": True}}]})
+        assert resp.status_code == 200
+
+        resp = await client.get(f"/api/v1/devices/{device_id}/commands", headers=auth_header())
+        [cmd] = resp.json()
+        assert cmd["status"] == "acked" and cmd["attempts"] == 1 and cmd["result"] == {"rebooted": True}
+
+        # Duplicate ack of a finished command is accepted and changes nothing
+        resp = await client.post(f"/api/v1/agent/commands/{command_id}/ack", json={"id": command_id, "ok": False},
+                                 headers=_DEVICE)
+        assert resp.json() == {"id": command_id, "status": "acked"}
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_unacked_and_nacked_commands_are_redelivered_then_fail():
+    engine, Session, app, device_id = await _setup()
+    async with Session() as db:
+        row = await agent_commands.enqueue_command(db, device_id, "sync", max_attempts=2)
+        await db.commit()
+        command_id = row.id
+
+    async with make_client(app) as client:
+        resp = await client.post("/api/v1/agent/heartbeat", json={}, headers=_DEVICE)
+        assert [c["id"] for c in resp.json()["commands"]] == [command_id]
+
+        # Ack lost: redelivered once the ack deadline has passed
+        await _make_due(Session)
+        resp = await client.post("/api/v1/agent/heartbeat", json={}, headers=_DEVICE)
+        assert [c["id"] for c in resp.json()["commands"]] == [command_id]
+
+        # Retryable nack, but the attempts are used up
+        resp = await client.post(f"/api/v1/agent/commands/{command_id}/ack", headers=_DEVICE,
+                                 json={"id": command_id, "ok": False, "error": "busy", "retry": True})
+        assert resp.json()["status"] == "failed"
+
+    async with Session() as db:
+        row = await db.get(AgentCommandEntry, command_id)
+        assert row.attempts == 2 and row.last_error == "busy"
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_expiry_and_cancel():
+    engine, Session, app, device_id = await _setup()
+    async with Session() as db:
+        stale = await agent_commands.enqueue_command(db, device_id, "old", ttl_seconds=60)
+        fresh = await agent_commands.enqueue_command(db, device_id, "new")
+        stale.expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        await db.commit()
+        stale_id, fresh_id = stale.id, fresh.id
+
+        assert await agent_commands.claim_commands(db, device_id, limit=10) != []
+        await db.rollback()
+        assert await agent_commands.expire_commands(db) == 1
+        await db.commit()
+
+    async with make_client(app) as client:
+        resp = await client.post(f"/api/v1/devices/{device_id}/commands/{fresh_id}/cancel", headers=auth_header())
+        assert resp.json()["status"] == "cancelled"
+        resp = await client.post(f"/api/v1/devices/{device_id}/commands/{stale_id}/cancel", headers=auth_header())
+        assert resp.status_code == 409
+        resp = await client.post("/api/v1/agent/heartbeat", json={}, headers=_DEVICE)
+        assert resp.json()["commands"] == []
+        resp = await client.get("/api/v1/devices/999/commands", headers=auth_header())
+        assert resp.status_code == 404
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_long_poll_heartbeat_wakes_on_enqueue():
+    engine, Session, app, device_id = await _setup()
+    async with make_client(app) as client:
+        poll = asyncio.create_task(
+            client.post("/api/v1/agent/heartbeat", json={"wait_seconds": 10}, headers=_DEVICE)
+        )
+        await asyncio.sleep(0.2)
+        assert not poll.done()
+
+        resp = await client.post(f"/api/v1/devices/{device_id}/commands", json={"type": "ping"},
+                                 headers=auth_header())
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        resp = await asyncio.wait_for(poll, 5)
+        assert loop.time() - started < 1.0
+        assert [c["type"] for c in resp.json()["commands"]] == ["ping"]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_last_seen_is_coalesced_into_one_flush():
+    engine, Session, app, device_id = await _setup()
+    presence.reset()
+    async with make_client(app) as client:
+        for _ in range(3):
+            await client.post("/api/v1/agent/heartbeat", json={}, headers=_DEVICE)
+    assert presence.pending_count() == 1
+
+    async with Session() as db:
+        assert (await db.execute(select(Device.last_seen_at))).scalar_one() is None
+    presence.touch(device_id + 1000)  # deleted meanwhile: skipped, not an error
+    assert await presence.flush(Session) == 2
+    assert presence.pending_count() == 0
+    async with Session() as db:
+        assert (await db.execute(select(Device.last_seen_at))).scalar_one() is not None
+    await engine.dispose()
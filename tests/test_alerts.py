@@ -9,12 +9,14 @@ from fastapi import Depends, FastAPI
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.pool import StaticPool
 
-from app.api.deps import get_db
+from app.api.deps import get_db, get_read_db
 from app.api.deps_caps import capability_guard
 from app.api.v1.alerts import router as alerts_router
 from app.api.v1.metrics import router as metrics_router
 from app.core.alert_worker import run_alert_cycle
 from app.core.capabilities import CAPABILITY_MAP
+from app.core.presence import OfflineView
+from app.core.system_events import emit_system_event
 from app.db.base import Base
 from app.db.models.alerts import AlertEvent, AlertRule
 from app.db.models.device import Device
@@ -64,6 +66,7 @@ async def _mk_app(Session, routers=None):
 
     app = FastAPI(dependencies=[Depends(capability_guard)])
     app.dependency_overrides[get_db] = _get_test_db
+    app.dependency_overrides[get_read_db] = _get_test_db
     for r in (routers or [alerts_router]):
         app.include_router(r, prefix="/api/v1")
     return app
@@ -544,6 +547,46 @@ async def test_worker_auto_resolves_when_condition_clears():
     assert events[0].resolved_at is not None
 
 
+@pytest.mark.asyncio
+async def test_worker_follows_presence_transitions():
+    from sqlalchemy import select
+
+    _, Session = await _mk_session()
+    now = datetime.now(timezone.utc)
+
+    async with Session() as db:
+        device = Device(device_uid="dev-tr", is_claimed=True, last_seen_at=now - timedelta(seconds=5))
+        db.add(device)
+        db.add(AlertRule(
+            name="offline-rule",
+            condition_type="device_offline",
+            condition_config={"threshold_seconds": 120},
+            severity="warning",
+            enabled=True,
+            cooldown_seconds=0,
+            created_at=now,
+            updated_at=now,
+        ))
+        await db.commit()
+        device_id = device.id
+
+    view = OfflineView()
+    async with Session() as db:
+        await run_alert_cycle(db, now, view)
+        # The tracker reports the device offline; last_seen_at is not read again
+        await emit_system_event(db, "device.offline", {"device_id": device_id, "offline_after_seconds": 120})
+        await db.commit()
+        await run_alert_cycle(db, now + timedelta(seconds=10), view)
+        res = await db.execute(select(AlertEvent.status))
+        assert res.scalars().all() == ["firing"]
+
+        await emit_system_event(db, "device.online", {"device_id": device_id})
+        await db.commit()
+        await run_alert_cycle(db, now + timedelta(seconds=20), view)
+        res = await db.execute(select(AlertEvent.status))
+        assert res.scalars().all() == ["resolved"]
+
+
 @pytest.mark.asyncio
 async def test_worker_event_lag_condition():
     _, Session = await _mk_session()
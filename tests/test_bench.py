@@ -0,0 +1,39 @@
+"""Tests for the benchmark harness's result handling (app.bench)."""
+from __future__ import annotations
+
+from app.bench import Recorder, compare, percentile
+
+
+def _result(throughput, p99, queries, errors=0):
+    return {"scenarios": {"ingest": {
+        "throughput_per_s": throughput, "errors": errors,
+        "latency_ms": {"p50": 1.0, "p99": p99}, "db_queries_per_op": queries,
+    }}}
+
+
+def test_percentile_and_summary():
+    assert percentile([], 99) == 0.0
+    assert percentile([3.0, 1.0, 2.0, 4.0], 50) == 2.0
+    assert percentile(list(range(1, 101)), 99) == 99
+
+    rec = Recorder()
+    for ms, queries in ((10, 3), (20, 3), (30, 6)):
+        rec.add(ms / 1000, queries, True)
+    rec.add(0.04, None, False, "500")
+    summary = rec.summary(elapsed=2.0, rss_before=None)
+
+    assert summary["ops"] == 4 and summary["errors"] == 1
+    assert summary["error_statuses"] == {"500": 1}
+    assert summary["throughput_per_s"] == 2.0
+    assert summary["latency_ms"]["p50"] == 20.0
+    assert summary["db_queries_per_op"] == 4.0
+
+
+def test_compare_flags_only_regressions_beyond_tolerance():
+    baseline = _result(100.0, 50.0, 4.0)
+
+    assert compare(_result(90.0, 60.0, 4.2), baseline) == []
+    problems = compare(_result(60.0, 80.0, 6.0, errors=2), baseline)
+    assert [p.split(":")[1].split()[0] for p in problems] == ["throughput", "p99", "6.0", "2"]
+    # Scenarios missing from the baseline are not compared
+    assert compare({"scenarios": {"other": _result(1, 1, 1)["scenarios"]["ingest"]}}, baseline) == []
@@ -0,0 +1,97 @@
+"""Tests for compressed / binary request bodies and response compression."""
+from __future__ import annotations
+
+import gzip
+from typing import Any, Dict
+
+import pytest
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from app.core.content_encoding import ContentEncodingMiddleware, choose_encoding
+from app.core.middleware import MAX_BODY_BYTES
+from tests.conftest import make_client
+
+
+class _Reading(BaseModel):
+    device_uid: str
+    payload: Dict[str, Any]
+
+
+def _service() -> FastAPI:
+    service = FastAPI()
+
+    @service.post("/telemetry")
+    async def telemetry(data: _Reading):
+        return {"device_uid": data.device_uid, "keys": sorted(data.payload)}
+
+    @service.get("/config")
+    async def config(n: int = 200):
+        return {"variables": {f"var.{i}": i for i in range(n)}}
+
+    service.add_middleware(ContentEncodingMiddleware)
+    return service
+
+
+@pytest.mark.asyncio
+async def test_gzip_request_body_is_decoded():
+    body = b'{"device_uid":"d1","payload":{"temp":21.5,"hum":40}}'
+    async with make_client(_service()) as client:
+        resp = await client.post("/telemetry", content=gzip.compress(body), headers={
+            "Content-Type": "application/json", "Content-Encoding": "gzip",
+        })
+        assert resp.status_code == 200
+        assert resp.json() == {"device_uid": "d1", "keys": ["hum", "temp"]}
+
+        resp = await client.post("/telemetry", content=gzip.compress(body)[:-8], headers={
+            "Content-Type": "application/json", "Content-Encoding": "gzip",
+        })
+        assert resp.status_code == 400
+
+        resp = await client.post("/telemetry", content=body, headers={
+            "Content-Type": "application/json", "Content-Encoding": "br",
+        })
+        assert resp.status_code == 415
+
+
+@pytest.mark.asyncio
+async def test_decompression_bomb_is_rejected():
+    bomb = gzip.compress(b"0" * (MAX_BODY_BYTES + 1))
+    assert len(bomb) < 4096
+    async with make_client(_service()) as client:
+        resp = await client.post("/telemetry", content=bomb, headers={
+            "Content-Type": "application/json", "Content-Encoding": "gzip",
+        })
+    assert resp.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_msgpack_telemetry_is_transcoded():
+    msgpack = pytest.importorskip("msgpack")
+    body = msgpack.packb({"device_uid": "d1", "payload": {"temp": 21.5}})
+    async with make_client(_service()) as client:
+        resp = await client.post("/telemetry", content=body, headers={"Content-Type": "application/msgpack"})
+    assert resp.status_code == 200
+    assert resp.json() == {"device_uid": "d1", "keys": ["temp"]}
+
+
+@pytest.mark.asyncio
+async def test_responses_compressed_above_threshold():
+    async with make_client(_service()) as client:
+        resp = await client.get("/config", headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in resp.headers["vary"]
+        assert int(resp.headers["content-length"]) < len(resp.content)
+        assert len(resp.json()["variables"]) == 200
+
+        resp = await client.get("/config?n=2", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in resp.headers
+
+        resp = await client.get("/config", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in resp.headers
+
+
+def test_choose_encoding_honours_q_values():
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, deflate") is None
+    assert choose_encoding("") is None
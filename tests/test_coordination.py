@@ -0,0 +1,146 @@
+"""Tests for leases, shard ownership and fenced checkpoints (app.core.coordination)."""
+from __future__ import annotations
+
+import asyncio
+import itertools
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from sqlalchemy import select
+
+from app.core import webhook_dispatcher
+from app.core.coordination import (
+    LocalCoordinator,
+    ShardLeases,
+    load_cursors,
+    save_cursor,
+    shard_of,
+    shard_owner,
+)
+from app.db.models.events import EventV1, EventV1Checkpoint
+from app.db.models.webhooks import WebhookSubscription
+from tests.conftest import make_test_session
+
+
+def _cluster():
+    return SimpleNamespace(members=set(), leases={}, tokens=itertools.count(1))
+
+
+class _Node(LocalCoordinator):
+    """LocalCoordinator sharing leases, membership and fencing tokens with peers."""
+
+    def __init__(self, node_id: str, cluster) -> None:
+        super().__init__(node_id)
+        self.cluster = cluster
+        cluster.members.add(node_id)
+
+    async def try_acquire(self, name: str):
+        if name in self.cluster.leases:
+            return None
+        token = next(self.cluster.tokens)
+        self.cluster.leases[name] = self.node_id
+        self._held[name] = (token, asyncio.Event())
+        return token
+
+    async def release(self, name: str) -> None:
+        if self._held.pop(name, None) is not None:
+            self.cluster.leases.pop(name, None)
+
+    async def members(self) -> list[str]:
+        return sorted(self.cluster.members)
+
+    async def leave(self) -> None:
+        self.cluster.members.discard(self.node_id)
+        for name in list(self._held):
+            await self.release(name)
+
+
+@pytest.mark.asyncio
+async def test_shards_are_partitioned_between_members_and_taken_over():
+    cluster = _cluster()
+    a, b = _Node("a", cluster), _Node("b", cluster)
+    shards_a = ShardLeases("automation_engine", 16, coordinator=a)
+    shards_b = ShardLeases("automation_engine", 16, coordinator=b)
+
+    owned_a = await shards_a.refresh()
+    owned_b = await shards_b.refresh()
+
+    assert owned_a and owned_b
+    assert not owned_a.keys() & owned_b.keys()
+    assert owned_a.keys() | owned_b.keys() == set(range(16))
+
+    await b.leave()
+    owned_a = await shards_a.refresh()
+
+    assert set(owned_a) == set(range(16))
+
+
+def test_rendezvous_only_moves_shards_of_departed_member():
+    names = [f"webhook_dispatcher#{i}" for i in range(64)]
+    before = {name: shard_owner(name, ["a", "b", "c"]) for name in names}
+    after = {name: shard_owner(name, ["a", "b"]) for name in names}
+
+    moved = {name for name in names if before[name] != after[name]}
+
+    assert moved == {name for name in names if before[name] == "c"}
+    assert shard_of("dev-1", 16) == shard_of("dev-1", 16)
+    assert 0 <= shard_of(12345, 16) < 16
+
+
+@pytest.mark.asyncio
+async def test_stale_token_cannot_move_checkpoint():
+    _, Session = await make_test_session(tables=[EventV1.__table__, EventV1Checkpoint.__table__])
+
+    async with Session() as db:
+        db.add(EventV1(stream="system", type="device.online", payload={}))
+        await db.commit()
+        # New subscribers start at the head of the stream
+        assert await load_cursors(db, "system", ["automation_engine#0"]) == {"automation_engine#0": 1}
+
+        assert await save_cursor(db, "system", "automation_engine#0", 10, token=5)
+        await db.commit()
+        assert not await save_cursor(db, "system", "automation_engine#0", 3, token=4)
+        assert await save_cursor(db, "system", "automation_engine#0", 20, token=6)
+        await db.commit()
+
+        row = (await db.execute(select(EventV1Checkpoint))).scalar_one()
+    assert (row.cursor, row.fence) == (20, 6)
+
+
+@pytest.mark.asyncio
+async def test_sharded_webhook_dispatch_delivers_each_event_once():
+    _, Session = await make_test_session(
+        tables=[EventV1.__table__, EventV1Checkpoint.__table__, WebhookSubscription.__table__]
+    )
+    cluster = _cluster()
+    nodes = [
+        ShardLeases("webhook_dispatcher", 4, coordinator=_Node(name, cluster))
+        for name in ("a", "b")
+    ]
+
+    async with Session() as db:
+        db.add(WebhookSubscription(url="http://hook.test", secret="s", event_filter=[]))
+        await db.commit()
+
+    dispatch = AsyncMock()
+    with patch.object(webhook_dispatcher, "WorkerSessionLocal", Session), \
+            patch.object(webhook_dispatcher, "_dispatch_with_retry", dispatch):
+        # First cycle creates the checkpoints at the (empty) head
+        for shards in nodes:
+            await webhook_dispatcher._run_sharded_cycle(shards)
+
+        async with Session() as db:
+            for i in range(12):
+                db.add(EventV1(stream="system", type="device.online", payload={"device_uid": f"dev-{i}"}))
+            await db.commit()
+
+        for _ in range(2):
+            for shards in nodes:
+                await webhook_dispatcher._run_sharded_cycle(shards)
+
+    delivered = sorted(call.args[1].id for call in dispatch.await_args_list)
+    assert delivered == list(range(1, 13))
+    async with Session() as db:
+        cursors = (await db.execute(select(EventV1Checkpoint.cursor))).scalars().all()
+    assert sorted(cursors) == [12] * 4
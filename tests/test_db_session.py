@@ -0,0 +1,61 @@
+"""Tests for the engine factory in app.db.session."""
+from __future__ import annotations
+
+import pytest
+
+from app.db import session as session_mod
+from app.db.session import make_engine
+
+
+@pytest.fixture
+def captured(monkeypatch):
+    calls: list[tuple[str, dict]] = []
+    monkeypatch.setattr(
+        session_mod, "create_async_engine", lambda url, **kw: calls.append((url, kw)) or object()
+    )
+    monkeypatch.setattr(session_mod, "_instrument", lambda engine, workload: None)
+    return calls
+
+
+def test_postgres_engine_applies_pool_and_connection_settings(captured, monkeypatch):
+    monkeypatch.setattr(session_mod.settings, "db_pool_size", 12)
+    monkeypatch.setattr(session_mod.settings, "db_max_overflow", 3)
+    monkeypatch.setattr(session_mod.settings, "db_statement_cache_size", 0)
+    monkeypatch.setitem(session_mod.STATEMENT_TIMEOUTS_MS, "read", 90000)
+
+    make_engine("postgresql+asyncpg://u:p@db/hubex", "read")
+
+    _, kw = captured[0]
+    assert kw["pool_size"] == 12
+    assert kw["max_overflow"] == 3
+    assert kw["pool_recycle"] == session_mod.settings.db_pool_recycle_seconds
+    assert kw["pool_pre_ping"] is False
+    assert kw["poolclass"] is session_mod.InstrumentedQueuePool
+    assert kw["connect_args"]["prepared_statement_cache_size"] == 0
+    assert kw["connect_args"]["server_settings"] == {
+        "application_name": "hubex-read",
+        "statement_timeout": "90000",
+    }
+
+
+def test_zero_timeout_workload_sets_no_statement_timeout(captured, monkeypatch):
+    monkeypatch.setitem(session_mod.STATEMENT_TIMEOUTS_MS, "worker", 0)
+
+    make_engine("postgresql+asyncpg://u:p@db/hubex", "worker")
+
+    server_settings = captured[0][1]["connect_args"]["server_settings"]
+    assert "statement_timeout" not in server_settings
+
+
+def test_sqlite_engine_skips_pool_and_asyncpg_options(captured):
+    make_engine("sqlite+aiosqlite:///:memory:")
+
+    _, kw = captured[0]
+    assert "pool_size" not in kw
+    assert "connect_args" not in kw
+
+
+def test_worker_engine_is_the_api_engine_outside_worker_processes():
+    assert session_mod.settings.role != "worker"
+    assert session_mod.worker_engine is session_mod.engine
+    assert session_mod.WorkerSessionLocal.kw["bind"] is session_mod.engine
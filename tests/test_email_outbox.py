@@ -0,0 +1,188 @@
+"""Tests for the email outbox + pooled SMTP delivery (app.core.email)."""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from app.core import email as email_mod
+from app.core.automation_engine import _action_send_email
+from app.core.email import SmtpPool, enqueue_email, process_outbox_once
+from app.db.models.email_outbox import EmailOutbox
+from app.db.models.email_template import EmailTemplate
+from tests.conftest import make_test_session
+
+
+class SmtpStub:
+    """Minimal local SMTP server: records connections and DATA payloads.
+
+    rcpt_reply lets a test reject every RCPT with a given reply line.
+    """
+
+    def __init__(self, rcpt_reply: str = "250 OK") -> None:
+        self.rcpt_reply = rcpt_reply
+        self.connections = 0
+        self.messages: list[tuple[list[str], bytes]] = []
+        self.server: asyncio.AbstractServer | None = None
+        self.port = 0
+
+    async def start(self) -> "SmtpStub":
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        rcpts: list[str] = []
+
+        async def reply(line: str) -> None:
+            writer.write(line.encode() + b"\r\n")
+            await writer.drain()
+
+        await reply("220 stub ready")
+        while line := await reader.readline():
+            cmd = line.decode().strip()
+            verb = cmd.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                await reply("250-stub\r\n250 8BITMIME")
+            elif verb == "MAIL":
+                rcpts = []
+                await reply("250 OK")
+            elif verb == "RCPT":
+                if self.rcpt_reply.startswith("250"):
+                    rcpts.append(cmd.split(":", 1)[1].strip(" <>"))
+                await reply(self.rcpt_reply)
+            elif verb == "DATA":
+                await reply("354 go ahead")
+                data = b""
+                while (chunk := await reader.readline()) != b".\r\n":
+                    data += chunk
+                self.messages.append((rcpts, data))
+                await reply("250 queued")
+            elif verb == "QUIT":
+                await reply("221 bye")
+                break
+            else:  # RSET, NOOP, ...
+                await reply("250 OK")
+        writer.close()
+
+
+async def _mk_session():
+    return await make_test_session(tables=[EmailOutbox.__table__, EmailTemplate.__table__])
+
+
+@pytest.mark.asyncio
+async def test_outbox_batch_reuses_one_smtp_connection():
+    _, Session = await _mk_session()
+    stub = await SmtpStub().start()
+    pool = SmtpPool("127.0.0.1", stub.port, use_tls=False, size=1)
+
+    async with Session() as db:
+        await enqueue_email(db, ["a@example.com"], "One", "<p>1</p>")
+        await enqueue_email(db, ["b@example.com", "c@example.com", "b@example.com"], "Two", "<p>2</p>")
+        await enqueue_email(db, ["d@example.com"], "Three", "<p>3</p>", body_text="3")
+        await db.commit()
+
+    try:
+        claimed = await process_outbox_once(pool, session_factory=Session)
+    finally:
+        await pool.close()
+        await stub.stop()
+
+    assert claimed == 3
+    assert pool.connects == 1
+    assert stub.connections == 1
+    assert sorted(r for rcpts, _ in stub.messages for r in rcpts) == [
+        "a@example.com", "b@example.com", "c@example.com", "d@example.com",
+    ]
+    multi = next(data for rcpts, data in stub.messages if len(rcpts) == 2)
+    assert b"To: undisclosed-recipients:;" in multi
+
+    async with Session() as db:
+        rows = list((await db.execute(select(EmailOutbox))).scalars().all())
+    assert [r.status for r in rows] == ["sent"] * 3
+    assert all(r.attempts == 1 and r.sent_at is not None for r in rows)
+
+
+@pytest.mark.asyncio
+async def test_transient_rejection_is_retried_later():
+    _, Session = await _mk_session()
+    stub = await SmtpStub(rcpt_reply="451 try again later").start()
+    pool = SmtpPool("127.0.0.1", stub.port, use_tls=False, size=1)
+
+    async with Session() as db:
+        await enqueue_email(db, ["a@example.com"], "Later", "<p>x</p>")
+        await db.commit()
+
+    try:
+        assert await process_outbox_once(pool, session_factory=Session) == 1
+        # Not due yet: the retry is scheduled RETRY_DELAYS[0] seconds out
+        assert await process_outbox_once(pool, session_factory=Session) == 0
+    finally:
+        await pool.close()
+        await stub.stop()
+
+    async with Session() as db:
+        row = (await db.execute(select(EmailOutbox))).scalar_one()
+    assert row.status == "pending"
+    assert row.attempts == 1
+    assert "451" in row.last_error
+    assert row.next_attempt_at > datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@pytest.mark.asyncio
+async def test_permanent_rejection_fails_without_retry():
+    _, Session = await _mk_session()
+    stub = await SmtpStub(rcpt_reply="550 no such user").start()
+    pool = SmtpPool("127.0.0.1", stub.port, use_tls=False, size=1)
+
+    async with Session() as db:
+        await enqueue_email(db, ["nobody@example.com"], "Bounce", "<p>x</p>")
+        await db.commit()
+
+    try:
+        await process_outbox_once(pool, session_factory=Session)
+    finally:
+        await pool.close()
+        await stub.stop()
+
+    async with Session() as db:
+        row = (await db.execute(select(EmailOutbox))).scalar_one()
+    assert row.status == "failed"
+    assert "550" in row.last_error
+
+
+@pytest.mark.asyncio
+async def test_automation_action_only_enqueues(monkeypatch):
+    _, Session = await _mk_session()
+
+    def _no_smtp(*args, **kwargs):
+        raise AssertionError("automation must not talk to SMTP")
+
+    monkeypatch.setattr(email_mod.smtplib, "SMTP", _no_smtp)
+
+    async with Session() as db:
+        tpl = EmailTemplate(name="t", subject="Alert {rule_name}", body_html="<b>{device_uid}</b>")
+        db.add(tpl)
+        await db.flush()
+        rule = SimpleNamespace(id=7, name="Overheat")
+        await _action_send_email(
+            db, rule, {"template_id": tpl.id, "recipients": ["ops@example.com"]},
+            {"device_uid": "dev-1"},
+        )
+        await db.commit()
+
+    async with Session() as db:
+        row = (await db.execute(select(EmailOutbox))).scalar_one()
+    assert row.status == "pending"
+    assert row.recipients == ["ops@example.com"]
+    assert row.subject == "Alert Overheat"
+    assert row.body_html == "<b>dev-1</b>"
+    assert row.source == "automation:7"
@@ -6,6 +6,7 @@ from datetime import datetime, timedelta, timezone
 import httpx
 import pytest
 from fastapi import Depends, FastAPI
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.pool import StaticPool
 
@@ -14,6 +15,9 @@ from app.api.deps_caps import capability_guard
 from app.api.v1.entities import router as entities_router
 from app.api.v1.groups import router as groups_router
 from app.core.capabilities import CAPABILITY_MAP
+from app.core.health_worker import entities_of_devices, run_health_cycle
+from app.core.presence import OfflineView
+from app.core.system_events import emit_system_event
 from app.db.base import Base
 from app.db.models.device import Device
 from app.db.models.entities import Entity, EntityDeviceBinding
@@ -713,6 +717,102 @@ async def test_entity_health_no_devices(monkeypatch):
     assert h["worst_health"] == "unknown"
 
 
+@pytest.mark.asyncio
+async def test_entity_health_many_and_worker_cycle(monkeypatch):
+    monkeypatch.setenv("HUBEX_CAPS_ENFORCE", "0")
+
+    _, Session = await _mk_session()
+    d_ok = await _seed_device(Session, "dev-mh1", last_seen_offset_seconds=5)
+    d_stale = await _seed_device(Session, "dev-mh2", last_seen_offset_seconds=60)
+    app = await _mk_app(Session)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for entity_id, device_id in (("ent-a", d_ok), ("ent-b", d_stale), ("ent-c", None)):
+            await client.post("/api/v1/entities", json={"entity_id": entity_id, "type": "group"}, headers=_auth([]))
+            if device_id is not None:
+                await client.post(f"/api/v1/entities/{entity_id}/devices", json={"device_ids": [device_id]},
+                                  headers=_auth([]))
+        resp = await client.get("/api/v1/entities/health", headers=_auth([]))
+        assert [(h["entity_id"], h["worst_health"]) for h in resp.json()] == [
+            ("ent-a", "ok"), ("ent-b", "stale"), ("ent-c", "unknown"),
+        ]
+        resp = await client.get("/api/v1/entities/health", params={"entity_id": ["ent-b", "nope"]},
+                                headers=_auth([]))
+        assert [h["entity_id"] for h in resp.json()] == ["ent-b"]
+
+    # The worker follows the presence tracker: 60s of silence is still online
+    async with Session() as db:
+        await run_health_cycle(db, datetime.now(timezone.utc))
+        res = await db.execute(select(Entity.entity_id, Entity.health_status).order_by(Entity.entity_id))
+        assert res.all() == [("ent-a", "ok"), ("ent-b", "ok"), ("ent-c", "unknown")]
+
+
+@pytest.mark.asyncio
+async def test_health_worker_follows_presence_transitions():
+    _, Session = await _mk_session()
+    d1 = await _seed_device(Session, "dev-tr1", last_seen_offset_seconds=5)
+    d2 = await _seed_device(Session, "dev-tr2", last_seen_offset_seconds=5)
+    async with Session() as db:
+        db.add_all([Entity(entity_id="ent-1", type="group"), Entity(entity_id="ent-2", type="group")])
+        db.add_all([
+            EntityDeviceBinding(entity_id="ent-1", device_id=d1, enabled=True),
+            EntityDeviceBinding(entity_id="ent-2", device_id=d2, enabled=True),
+        ])
+        await db.commit()
+
+    view = OfflineView()
+    now = datetime.now(timezone.utc)
+    async with Session() as db:
+        await view.refresh(db, now)
+        await run_health_cycle(db, now, view)
+        await emit_system_event(db, "device.offline", {"device_id": d1, "offline_after_seconds": 120})
+        await db.commit()
+        changed = await view.refresh(db, now)
+        assert changed == {d1}
+        await run_health_cycle(db, now, view, await entities_of_devices(db, changed))
+        res = await db.execute(select(Entity.entity_id, Entity.health_status).order_by(Entity.entity_id))
+        assert res.all() == [("ent-1", "offline"), ("ent-2", "ok")]
+
+        await emit_system_event(db, "device.online", {"device_id": d1})
+        await db.commit()
+        assert await view.refresh(db, now) == {d1}
+        await run_health_cycle(db, now, view, ["ent-1"])
+        res = await db.execute(select(Entity.health_status).where(Entity.entity_id == "ent-1"))
+        assert res.scalar_one() == "ok"
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_bindings(monkeypatch):
+    monkeypatch.setenv("HUBEX_CAPS_ENFORCE", "0")
+
+    _, Session = await _mk_session()
+    d1 = await _seed_device(Session, "dev-bu1")
+    d2 = await _seed_device(Session, "dev-bu2")
+    app = await _mk_app(Session)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.post("/api/v1/entities", json={"entity_id": "ent-bu", "type": "group"}, headers=_auth([]))
+        await client.post("/api/v1/entities/ent-bu/devices", json={"device_ids": [d1]}, headers=_auth([]))
+        resp = await client.post(
+            "/api/v1/entities/ent-bu/devices/bulk-update",
+            json={"device_ids": [d1, d2], "priority": 7, "enabled": False},
+            headers=_auth([]),
+        )
+        assert resp.status_code == 200
+        assert [(r["device_id"], r["ok"], r["error"]) for r in resp.json()["results"]] == [
+            (d1, True, None), (d2, False, "not_bound"),
+        ]
+        resp = await client.get("/api/v1/entities/ent-bu/devices", headers=_auth([]))
+        assert [(b["device_id"], b["priority"], b["enabled"]) for b in resp.json()] == [(d1, 7, False)]
+
+        resp = await client.post(
+            "/api/v1/entities/ent-bu/devices/bulk-update", json={"device_ids": [d1]}, headers=_auth([]),
+        )
+        assert resp.status_code == 422
+
+
 # ---------------------------------------------------------------------------
 # Capability enforcement tests
 # ---------------------------------------------------------------------------
@@ -0,0 +1,177 @@
+"""Tests for push delivery of events_v1 (app.core.event_stream, /events/stream, /events/ws)."""
+from __future__ import annotations
+
+import asyncio
+import json
+from urllib.parse import urlencode
+
+import pytest
+from sqlalchemy import select
+
+from app.api.v1.events import router as events_router, ws_router as events_ws_router
+from app.core import event_stream
+from app.db.models.events import EventV1, EventV1Checkpoint
+from tests.conftest import make_test_app, make_test_session, make_token
+
+
+async def _setup():
+    engine, Session = await make_test_session(tables=[EventV1.__table__, EventV1Checkpoint.__table__])
+    app = await make_test_app(Session, [events_router, events_ws_router], with_cap_guard=False)
+    return engine, Session, app
+
+
+async def _parked() -> None:
+    # The in-memory engine shares one connection between sessions; let the
+    # stream finish its read before another session writes.
+    await asyncio.sleep(0.1)
+
+
+async def _emit(Session, *types: str, stream: str = "system") -> int:
+    """Commit one event per type in a single transaction; returns the last id."""
+    async with Session() as db:
+        events = [EventV1(stream=stream, type=type, payload={"t": type}) for type in types]
+        db.add_all(events)
+        await db.commit()
+        return events[-1].id
+
+
+class _AsgiConnection:
+    """Drives one streaming HTTP or WebSocket connection against the app.
+
+    httpx' ASGITransport buffers the whole response body, which never ends
+    for a stream, so the test talks ASGI directly.
+    """
+
+    def __init__(self, app, scope_type: str, path: str, params: dict) -> None:
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        scope = {
+            "type": scope_type,
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "scheme": "http" if scope_type == "http" else "ws",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": urlencode(params, doseq=True).encode(),
+            "headers": [(b"host", b"test")],
+            "client": ("test", 1),
+            "server": ("test", 80),
+        }
+        if scope_type == "http":
+            scope["method"] = "GET"
+            self.inbox.put_nowait({"type": "http.request", "body": b"", "more_body": False})
+        else:
+            scope["subprotocols"] = []
+            self.inbox.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(app(scope, self.inbox.get, self.outbox.put))
+
+    async def next(self, timeout: float = 2.0) -> dict:
+        return await asyncio.wait_for(self.outbox.get(), timeout)
+
+    async def close(self, message: dict) -> None:
+        await self.inbox.put(message)
+        try:
+            await asyncio.wait_for(self.task, 2.0)
+        except asyncio.TimeoutError:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+
+async def _sse_events(conn: _AsgiConnection, count: int) -> list[dict]:
+    """Collect `count` SSE messages (id/event/data) from the body chunks."""
+    events: list[dict] = []
+    while len(events) < count:
+        message = await conn.next()
+        if message["type"] != "http.response.body":
+            continue
+        for block in message["body"].decode().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line and line[0] != ":")
+            if "data" in fields:
+                events.append({"id": int(fields["id"]), "event": fields["event"], "data": json.loads(fields["data"])})
+    return events
+
+
+@pytest.mark.asyncio
+async def test_commit_wakes_subscribers_rollback_does_not():
+    engine, Session, _ = await _setup()
+    with event_stream.subscribe("system") as system, event_stream.subscribe("other") as other:
+        async with Session() as db:
+            db.add(EventV1(stream="system", type="x", payload={}))
+            await db.flush()
+            await db.rollback()
+        assert await system.wait(0.05) is False
+
+        await _emit(Session, "x")
+        assert await system.wait(0.05) is True
+        assert await other.wait(0.05) is False
+    assert event_stream.waiter_count() == 0
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_sse_resumes_from_checkpoint_filters_types_and_pushes_live():
+    engine, Session, app = await _setup()
+    first = await _emit(Session, "device.online")
+    await _emit(Session, "device.online", "rule.fired")
+    async with Session() as db:
+        db.add(EventV1Checkpoint(stream="system", subscriber_id="s1", cursor=first))
+        await db.commit()
+
+    conn = _AsgiConnection(app, "http", "/api/v1/events/stream",
+                           {"stream": "system", "subscriber_id": "s1", "type": ["device.online"]})
+    start = await conn.next()
+    assert start["status"] == 200
+    assert dict(start["headers"])[b"content-type"].startswith(b"text/event-stream")
+
+    [backlog] = await _sse_events(conn, 1)
+    assert backlog["id"] == first + 1 and backlog["event"] == "device.online"
+
+    loop = asyncio.get_running_loop()
+    await _parked()
+    live_id = await _emit(Session, "rule.fired", "device.online")  # rule.fired is filtered out
+    sent = loop.time()
+    [live] = await _sse_events(conn, 1)
+    assert live["id"] == live_id and live["data"]["payload"] == {"t": "device.online"}
+    assert loop.time() - sent < 1.0
+
+    await conn.close({"type": "http.disconnect"})
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_websocket_pushes_events_and_stores_acks():
+    engine, Session, app = await _setup()
+    first = await _emit(Session, "device.online")
+
+    conn = _AsgiConnection(app, "websocket", "/api/v1/events/ws", {
+        "token": make_token(caps=["events.read"]), "stream": "system", "subscriber_id": "w1",
+    })
+    assert (await conn.next())["type"] == "websocket.accept"
+    message = json.loads((await conn.next())["text"])
+    assert message["type"] == "events" and message["next_cursor"] == first
+
+    await _parked()
+    second = await _emit(Session, "device.offline")
+    message = json.loads((await conn.next())["text"])
+    assert [i["cursor"] for i in message["items"]] == [second]
+
+    await conn.inbox.put({"type": "websocket.receive", "text": json.dumps({"ack": second})})
+    assert json.loads((await conn.next())["text"]) == {"type": "ack", "stored_cursor": second, "status": "OK"}
+    await conn.close({"type": "websocket.disconnect", "code": 1000})
+
+    async with Session() as db:
+        stored = await db.scalar(select(EventV1Checkpoint.cursor).where(EventV1Checkpoint.subscriber_id == "w1"))
+        assert stored == second
+    assert event_stream.waiter_count() == 0
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_websocket_rejects_bad_token():
+    engine, Session, app = await _setup()
+    conn = _AsgiConnection(app, "websocket", "/api/v1/events/ws", {"token": "nope", "stream": "system"})
+    message = await conn.next()
+    assert message["type"] == "websocket.close" and message["code"] == 1008
+    await conn.close({"type": "websocket.disconnect", "code": 1000})
+    await engine.dispose()
@@ -0,0 +1,165 @@
+"""Tests for long-polling claim-next and batched lease renewal (app.core.execution_dispatch)."""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import select
+
+from app.api.v1.executions import router as executions_router
+from app.core import execution_dispatch
+from app.core.execution_workers import set_worker_definitions, upsert_worker_heartbeat
+from app.core.executions import create_definition, create_run_idempotent
+from app.db.models.executions import (
+    ExecutionDefinition,
+    ExecutionRun,
+    ExecutionWorker,
+    ExecutionWorkerDefinition,
+)
+from tests.conftest import make_client, make_test_app, make_test_session
+
+_CLAIM = "/api/v1/executions/runs/claim-next"
+_HEARTBEAT = "/api/v1/executions/workers/heartbeat"
+
+
+async def _setup():
+    engine, Session = await make_test_session(
+        tables=[
+            ExecutionDefinition.__table__,
+            ExecutionRun.__table__,
+            ExecutionWorker.__table__,
+            ExecutionWorkerDefinition.__table__,
+        ],
+    )
+    async with Session() as db:
+        d1 = await create_definition(db, key="d1", name="n1", version="v1", enabled=True)
+        d2 = await create_definition(db, key="d2", name="n2", version="v1", enabled=True)
+    app = await make_test_app(Session, [executions_router], with_cap_guard=False)
+    return engine, Session, app, d1.id, d2.id
+
+
+async def _run(Session, definition_id: int, key: str) -> int:
+    async with Session() as db:
+        run = await create_run_idempotent(
+            db, definition_id=definition_id, idempotency_key=key, requested_by=None, input_json={}
+        )
+    return run.id
+
+
+async def _leases(Session) -> dict[int, object]:
+    async with Session() as db:
+        res = await db.execute(select(ExecutionRun.id, ExecutionRun.lease_expires_at))
+        return dict(res.all())
+
+
+async def _parked() -> None:
+    while execution_dispatch.waiter_count() == 0:
+        await asyncio.sleep(0.01)
+    # The subscription precedes the first claim, and the in-memory engine
+    # shares one connection between sessions: let that claim finish first.
+    await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def test_claim_next_long_poll_wakes_on_new_run():
+    engine, Session, app, d1, d2 = await _setup()
+    async with make_client(app) as client:
+        body = {"definition_key": "d1", "worker_id": "w1", "wait_seconds": 10}
+        claim = asyncio.create_task(client.post(_CLAIM, json=body))
+        await _parked()
+        started = time.monotonic()
+        await _run(Session, d2, "other")  # another definition: stays parked
+        await asyncio.sleep(0.05)
+        assert not claim.done()
+        run_id = await _run(Session, d1, "r1")
+        resp = await asyncio.wait_for(claim, 2.0)
+        assert resp.status_code == 200
+        run = resp.json()
+        assert run["id"] == run_id and run["claimed_by"] == "w1"
+        assert run["lease_expires_at"] is not None
+        assert time.monotonic() - started < 1.0
+    assert execution_dispatch.waiter_count() == 0
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_claim_next_long_poll_times_out_and_release_wakes_subscribers():
+    engine, Session, app, d1, d2 = await _setup()
+    async with Session() as db:
+        await upsert_worker_heartbeat(db, worker_id="w2", meta_json=None)
+        await set_worker_definitions(db, worker_id="w2", definition_ids=[d1, d2])
+    async with make_client(app) as client:
+        started = time.monotonic()
+        resp = await client.post(_CLAIM, json={"definition_key": "d1", "worker_id": "w1", "wait_seconds": 0.2})
+        assert resp.status_code == 404 and time.monotonic() - started >= 0.2
+
+        run_id = await _run(Session, d2, "r1")
+        resp = await client.post(_CLAIM, json={"definition_key": "d2", "worker_id": "w1"})
+        assert resp.json()["id"] == run_id
+
+        # w2 claims from its subscriptions; the release by w1 wakes it
+        claim = asyncio.create_task(client.post(_CLAIM, json={"worker_id": "w2", "wait_seconds": 10}))
+        await _parked()
+        resp = await client.post(f"/api/v1/executions/runs/{run_id}/release", json={"worker_id": "w1"})
+        assert resp.status_code == 200
+        resp = await asyncio.wait_for(claim, 2.0)
+        assert resp.json()["id"] == run_id and resp.json()["claimed_by"] == "w2"
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_renews_leases_in_batch():
+    engine, Session, app, d1, d2 = await _setup()
+    a = await _run(Session, d1, "a")
+    b = await _run(Session, d1, "b")
+    c = await _run(Session, d1, "c")
+    async with make_client(app) as client:
+        for worker_id in ("w1", "w1", "w2"):
+            resp = await client.post(_CLAIM, json={"definition_key": "d1", "worker_id": worker_id})
+            assert resp.status_code == 200
+        first = await _leases(Session)
+
+        resp = await client.post(
+            _HEARTBEAT, json={"worker_id": "w1", "run_ids": [a, b, c, 999], "lease_seconds": 600}
+        )
+        assert resp.status_code == 200
+        out = resp.json()
+        assert out["id"] == "w1"
+        assert [lease["id"] for lease in out["leases"]] == [a, b]
+        assert out["lost_run_ids"] == [c, 999]
+
+        renewed = await _leases(Session)
+        assert renewed[a] > first[a] and renewed[b] > first[b]
+        assert renewed[c] == first[c]
+
+        resp = await client.post(_HEARTBEAT, json={"worker_id": "w1"})
+        assert resp.json()["leases"] == [] and resp.json()["lost_run_ids"] == []
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_run_created_right_after_an_empty_claim_wakes_the_worker(monkeypatch):
+    import app.api.v1.executions as executions_api
+
+    engine, Session, app, d1, d2 = await _setup()
+    claim = executions_api.claim_next_run_for_definitions
+    calls = 0
+
+    async def claim_then_create(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        try:
+            return await claim(*args, **kwargs)
+        finally:
+            if calls == 1:
+                await _run(Session, d1, "late")  # lands before the worker parks
+
+    monkeypatch.setattr(executions_api, "claim_next_run_for_definitions", claim_then_create)
+    monkeypatch.setattr(execution_dispatch, "recheck_interval", lambda: 30.0)
+    async with make_client(app) as client:
+        started = time.monotonic()
+        resp = await client.post(_CLAIM, json={"definition_key": "d1", "worker_id": "w1", "wait_seconds": 10})
+        assert resp.status_code == 200 and resp.json()["claimed_by"] == "w1"
+        assert time.monotonic() - started < 1.0
+    await engine.dispose()
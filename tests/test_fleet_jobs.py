@@ -0,0 +1,201 @@
+"""Tests for fleet job fan-out (app.core.fleet_jobs, /fleet-jobs)."""
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app.api.v1.fleet_jobs import router as fleet_router
+from app.core import fleet_jobs
+from app.db.models.device import Device
+from app.db.models.entities import Entity, EntityDeviceBinding
+from app.db.models.events import EventV1
+from app.db.models.fleet_jobs import FleetJob
+from app.db.models.tasks import Task
+from tests.conftest import auth_header, make_client, make_test_app, make_test_session
+
+
+# sqlite cannot render the JSONB columns of tasks
+_TASK_DDL = [
+    """
+    CREATE TABLE tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        client_id INTEGER NOT NULL,
+        execution_context_id INTEGER,
+        type TEXT NOT NULL,
+        payload TEXT NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        idempotency_key TEXT,
+        claimed_at DATETIME,
+        lease_expires_at DATETIME,
+        lease_token TEXT,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        completed_at DATETIME,
+        result TEXT,
+        error TEXT,
+        fleet_job_id INTEGER
+    )
+    """,
+]
+
+
+async def _setup(devices: int = 5):
+    engine, Session = await make_test_session(
+        tables=[
+            Device.__table__, Entity.__table__, EntityDeviceBinding.__table__,
+            FleetJob.__table__, EventV1.__table__,
+        ],
+        extra_ddl=_TASK_DDL,
+    )
+    async with Session() as db:
+        db.add_all([
+            Entity(entity_id="g1", type="group"),
+            Entity(entity_id="site-a", type="site", tags=["edge", "eu"]),
+            Entity(entity_id="site-b", type="site", tags={"tier": "gold"}),
+        ])
+        for n in range(1, devices + 1):
+            db.add(Device(id=n, device_uid=f"dev-{n}", is_claimed=True))
+            db.add(EntityDeviceBinding(entity_id="g1", device_id=n, enabled=n != devices))
+        db.add_all([
+            EntityDeviceBinding(entity_id="site-a", device_id=1),
+            EntityDeviceBinding(entity_id="site-b", device_id=1),
+            EntityDeviceBinding(entity_id="site-b", device_id=2),
+        ])
+        await db.commit()
+    app = await make_test_app(Session, [fleet_router], with_cap_guard=False)
+    return engine, Session, app
+
+
+async def _cycle(Session) -> int:
+    async with Session() as db:
+        return await fleet_jobs.run_fleet_cycle(db)
+
+
+async def _job_tasks(Session, job_id: int) -> list[tuple[int, str]]:
+    async with Session() as db:
+        res = await db.execute(
+            select(Task.client_id, Task.status).where(Task.fleet_job_id == job_id).order_by(Task.client_id)
+        )
+        return [tuple(row) for row in res.all()]
+
+
+async def _finish(Session, device_id: int, status: str) -> None:
+    """What POST /tasks/{id}/complete does to a fleet task."""
+    async with Session() as db:
+        task = await db.scalar(select(Task).where(Task.client_id == device_id, Task.status == "queued"))
+        task.status = status
+        await fleet_jobs.record_task_result(db, task.fleet_job_id, status)
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_group_job_respects_in_flight_window_and_tracks_progress():
+    engine, Session, app = await _setup()
+    async with make_client(app) as client:
+        resp = await client.post("/api/v1/fleet-jobs", headers=auth_header(), json={
+            "name": "reboot g1", "task_type": "reboot", "payload": {"delay": 5},
+            "target": {"group": "g1"}, "max_in_flight": 2,
+        })
+        assert resp.status_code == 201
+        job = resp.json()
+        assert job["status"] == "running" and job["total"] == 4  # the disabled binding is skipped
+
+        assert await _cycle(Session) == 2
+        assert await _cycle(Session) == 0  # window full
+        assert await _job_tasks(Session, job["id"]) == [(1, "queued"), (2, "queued")]
+
+        await _finish(Session, 1, "done")
+        await _finish(Session, 2, "failed")
+        progress = (await client.get(f"/api/v1/fleet-jobs/{job['id']}", headers=auth_header())).json()
+        assert (progress["dispatched"], progress["succeeded"], progress["failed"], progress["in_flight"]) == (2, 1, 1, 0)
+
+        assert await _cycle(Session) == 2
+        await _finish(Session, 3, "done")
+        await _finish(Session, 4, "done")
+        assert await _cycle(Session) == 0
+
+        progress = (await client.get(f"/api/v1/fleet-jobs/{job['id']}", headers=auth_header())).json()
+        assert progress["status"] == "completed"
+        assert (progress["total"], progress["succeeded"], progress["failed"], progress["progress_percent"]) == (4, 3, 1, 100)
+
+    async with Session() as db:
+        task = await db.scalar(select(Task).where(Task.client_id == 3))
+        assert (task.type, task.payload, task.idempotency_key) == ("reboot", {"delay": 5}, f"fleet-job:{job['id']}")
+        types = (await db.execute(select(EventV1.type).order_by(EventV1.id))).scalars().all()
+        assert types[0] == "fleet_job.created" and types[-1] == "fleet_job.completed"
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_rate_window_limits_dispatch_per_minute():
+    engine, Session, _ = await _setup(devices=8)
+    async with Session() as db:
+        job = await fleet_jobs.create_job(
+            db, name="r", task_type="ping", target={"group": "g1"}, entity_ids=["g1"], rate_per_minute=3,
+        )
+        now = datetime.now(timezone.utc)
+        assert await fleet_jobs.process_job(db, job, now) == 3
+        assert await fleet_jobs.process_job(db, job, now + timedelta(seconds=30)) == 0
+        assert await fleet_jobs.process_job(db, job, now + timedelta(seconds=61)) == 3
+        assert await fleet_jobs.process_job(db, job, now + timedelta(seconds=122)) == 1
+        assert job.exhausted and job.total == job.dispatched == 7
+        await db.commit()
+    assert [device for device, _ in await _job_tasks(Session, job.id)] == list(range(1, 8))
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_failure_threshold_aborts_and_cancels_queued_tasks():
+    engine, Session, app = await _setup(devices=13)
+    async with make_client(app) as client:
+        job = (await client.post("/api/v1/fleet-jobs", headers=auth_header(), json={
+            "name": "risky", "task_type": "flash", "target": {"group": "g1"}, "abort_failure_percent": 40,
+        })).json()
+        assert await _cycle(Session) == 12
+
+        for device_id in range(1, 10):
+            await _finish(Session, device_id, "failed" if device_id % 2 else "done")
+        await _cycle(Session)  # 5 of 9 failed, but fewer than ABORT_MIN_FINISHED finished
+        assert (await client.get(f"/api/v1/fleet-jobs/{job['id']}", headers=auth_header())).json()["status"] == "running"
+
+        await _finish(Session, 10, "done")
+        await _cycle(Session)
+        job = (await client.get(f"/api/v1/fleet-jobs/{job['id']}", headers=auth_header())).json()
+        assert job["status"] == "aborted" and "threshold 40%" in job["error"]
+        assert (job["succeeded"], job["failed"], job["canceled"], job["in_flight"]) == (5, 5, 2, 0)
+    assert (await _job_tasks(Session, job["id"]))[-2:] == [(11, "canceled"), (12, "canceled")]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_tag_target_pause_resume_and_cancel():
+    engine, Session, app = await _setup()
+    async with make_client(app) as client:
+        resp = await client.post("/api/v1/fleet-jobs", headers=auth_header(), json={
+            "name": "gold", "task_type": "sync", "target": {"tag": "tier=gold"},
+        })
+        job = resp.json()
+        assert job["target"]["entity_ids"] == ["site-b"] and job["total"] == 2
+
+        resp = await client.post(f"/api/v1/fleet-jobs/{job['id']}/pause", headers=auth_header())
+        assert resp.json()["status"] == "paused"
+        assert await _cycle(Session) == 0
+        await client.post(f"/api/v1/fleet-jobs/{job['id']}/resume", headers=auth_header())
+        assert await _cycle(Session) == 2
+
+        resp = await client.post(f"/api/v1/fleet-jobs/{job['id']}/cancel", headers=auth_header())
+        assert (resp.json()["status"], resp.json()["canceled"]) == ("canceled", 2)
+        resp = await client.post(f"/api/v1/fleet-jobs/{job['id']}/cancel", headers=auth_header())
+        assert resp.status_code == 409
+
+        resp = await client.post("/api/v1/fleet-jobs", headers=auth_header(), json={
+            "name": "bad", "task_type": "sync", "target": {"group": "g1", "tag": "edge"},
+        })
+        assert resp.status_code == 422
+        resp = await client.post("/api/v1/fleet-jobs", headers=auth_header(), json={
+            "name": "bad", "task_type": "sync", "target": {"group": "site-a"},
+        })
+        assert resp.status_code == 404
+    await engine.dispose()
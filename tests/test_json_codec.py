@@ -0,0 +1,84 @@
+"""Tests for the shared JSON codec (app.core.json_codec) and payload size checks."""
+from __future__ import annotations
+
+import json
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.v1.telemetry import MAX_PAYLOAD_BYTES, _validate_payload
+from app.core import json_codec
+
+
+def _stdlib_size(obj) -> int:
+    return len(json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+@pytest.mark.parametrize("obj", [
+    {},
+    [],
+    {"temperature": 21.5, "humidity": 40, "ok": True, "error": None, "stale": False},
+    {"nested": {"a": [1, -2, 3.25, [], {}], "b": {"c": "x"}}},
+    {"text": 'quote " backslash \\ newline \n tab \t bell \x07'},
+    {"unicode": "Küche €  😀", "ключ": "значение"},
+    [1, [2, [3, {"deep": ["x"]}]], "tail"],
+])
+def test_encoded_size_matches_stdlib(obj):
+    assert json_codec.encoded_size(obj) == _stdlib_size(obj)
+    assert json_codec.loads(json_codec.dumps(obj)) == obj
+
+
+def test_encoded_size_stops_at_limit():
+    payload = {f"k{i}": "v" * 100 for i in range(1000)}
+    size = json_codec.encoded_size(payload, limit=1000)
+    assert 1000 < size < _stdlib_size(payload)
+
+
+def test_dumps_options():
+    assert json_codec.dumps({"b": 1, "a": 2}, sort_keys=True) == b'{"a":2,"b":1}'
+    assert json_codec.dumps({1: "x"}) == b'{"1":"x"}'
+    ts = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert json_codec.dumps_str({"ts": ts}) == '{"ts":"2024-01-02T03:04:05+00:00"}'
+
+
+def test_validate_payload_checks_keys_and_size_in_one_walk():
+    _validate_payload({"sensors": {"temp": 21.5}, "tags": ["a", "b"]})
+
+    with pytest.raises(HTTPException) as exc:
+        _validate_payload({"sensors": {"k" * 65: 1}})
+    assert exc.value.status_code == 422
+
+    with pytest.raises(HTTPException) as exc:
+        _validate_payload({"blob": "x" * MAX_PAYLOAD_BYTES})
+    assert exc.value.status_code == 413
+
+    # Exactly at the limit is still accepted
+    filler = "x" * (MAX_PAYLOAD_BYTES - len('{"blob":""}'))
+    _validate_payload({"blob": filler})
+
+
+def test_dumps_falls_back_to_stdlib_for_big_integers():
+    payload = {"counter": 18446744073709551616, "ts": datetime(2024, 1, 2, tzinfo=timezone.utc)}
+    assert json_codec.dumps(payload) == b'{"counter":18446744073709551616,"ts":"2024-01-02T00:00:00+00:00"}'
+    assert json_codec.loads(json_codec.dumps_str(payload))["counter"] == 2**64
+
+
+@pytest.mark.asyncio
+async def test_engine_reads_numeric_json_values_on_sqlite(tmp_path):
+    from sqlalchemy import select, text
+
+    from app.db.models.variables import VariableValue
+    from app.db.session import make_engine
+
+    engine = make_engine(f"sqlite+aiosqlite:///{tmp_path / 'codec.db'}", "api")
+    async with engine.begin() as conn:
+        # JSON affinity: SQLite returns the numeric values as int/float, not str
+        await conn.execute(text("CREATE TABLE variable_values (id INTEGER PRIMARY KEY, value_json JSON)"))
+        await conn.execute(
+            text("INSERT INTO variable_values VALUES (1, 42), (2, 21.5), (3, :obj)"), {"obj": '{"a":1}'}
+        )
+    async with engine.connect() as conn:
+        res = await conn.execute(select(VariableValue.value_json).order_by(VariableValue.id))
+        assert res.scalars().all() == [42, 21.5, {"a": 1}]
+    await engine.dispose()
@@ -0,0 +1,142 @@
+"""Tests for the Prometheus registry and exposition (app.core.metrics)."""
+from __future__ import annotations
+
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import text
+
+from app.core import metrics
+from app.core.middleware import SecurityMiddleware
+from app.db.session import make_engine
+
+
+def _histogram(buckets, samples):
+    return {
+        "type": "histogram", "help": "h", "labelnames": ["route"],
+        "buckets": list(buckets), "samples": samples,
+    }
+
+
+def test_render_histogram_is_cumulative_with_escaped_labels():
+    snapshot = {
+        "hubex_test_seconds": _histogram((0.1, 1.0), [[['/a"b'], [1, 2, 1, 3.5, 4]]]),
+        "hubex_test_total": {"type": "counter", "help": "c", "labelnames": [], "samples": [[[], 7.0]]},
+    }
+
+    text_out = metrics.render(snapshot)
+
+    assert '# TYPE hubex_test_seconds histogram' in text_out
+    assert 'hubex_test_seconds_bucket{route="/a\\"b",le="0.1"} 1' in text_out
+    assert 'hubex_test_seconds_bucket{route="/a\\"b",le="1"} 3' in text_out
+    assert 'hubex_test_seconds_bucket{route="/a\\"b",le="+Inf"} 4' in text_out
+    assert 'hubex_test_seconds_count{route="/a\\"b"} 4' in text_out
+    assert "hubex_test_total 7" in text_out
+
+
+def test_merge_sums_counters_and_histograms_and_drops_dead_gauges():
+    def snap(counter, hist, gauge_sum, gauge_max):
+        return {
+            "c_total": {"type": "counter", "help": "", "labelnames": [], "samples": [[[], counter]]},
+            "h": _histogram((1.0,), [[["/x"], hist]]),
+            "g_sum": {"type": "gauge", "help": "", "labelnames": [], "mode": "sum", "samples": [[[], gauge_sum]]},
+            "g_max": {"type": "gauge", "help": "", "labelnames": [], "mode": "max", "samples": [[[], gauge_max]]},
+        }
+
+    merged = metrics.merge_snapshots([
+        (True, snap(2.0, [1, 0, 0.5, 1], 3.0, 10.0)),
+        (True, snap(5.0, [0, 2, 4.0, 2], 4.0, 7.0)),
+        (False, snap(1.0, [1, 0, 0.1, 1], 100.0, 100.0)),  # exited process
+    ])
+
+    value = {name: entry["samples"][0][1] for name, entry in merged.items()}
+    assert value["c_total"] == 8.0
+    assert value["h"] == [2, 2, 4.6, 4]
+    assert value["g_sum"] == 7.0
+    assert value["g_max"] == 10.0
+
+
+def test_snapshot_files_are_merged(tmp_path, monkeypatch):
+    counter = metrics.Counter("hubex_test_snapshot_total", "test counter")
+    counter.inc(3)
+    other = metrics.REGISTRY.snapshot()
+    other["hubex_test_snapshot_total"]["samples"] = [[[], 4.0]]
+    (tmp_path / "999999999.json").write_text(json.dumps(other))
+    monkeypatch.setattr(metrics.settings, "metrics_dir", str(tmp_path))
+
+    metrics.write_snapshot()
+    merged = metrics.collect()
+
+    assert merged["hubex_test_snapshot_total"]["samples"] == [[[], 7.0]]
+
+
+@pytest.mark.asyncio
+async def test_request_metrics_use_route_template_and_count_queries():
+    engine = make_engine("sqlite+aiosqlite:///:memory:", "metrics-test")
+    app = FastAPI()
+
+    @app.get("/things/{thing_id}")
+    async def read_thing(thing_id: int):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await conn.execute(text("SELECT 2"))
+        return {"id": thing_id}
+
+    app.add_middleware(SecurityMiddleware)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        assert (await client.get("/things/1")).status_code == 200
+        assert (await client.get("/things/2")).status_code == 200
+    await engine.dispose()
+
+    latency = metrics.HTTP_REQUEST_SECONDS.labels("GET", "/things/{thing_id}", 200)
+    queries = metrics.DB_QUERIES_PER_REQUEST.labels("/things/{thing_id}")
+    assert latency.count == 2
+    assert queries.count == 2
+    assert queries.sum == 4
+    assert metrics.DB_QUERY_SECONDS.labels("metrics-test", "SELECT").count >= 4
+
+
+async def _scrape(client_host: str, headers: dict | None = None) -> int:
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app, client=(client_host, 40000))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return (await client.get("/metrics", headers=headers)).status_code
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_without_token_serves_loopback_and_allowlist_only(monkeypatch):
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "metrics_enabled", True)
+    monkeypatch.setattr(settings, "metrics_token", "")
+    monkeypatch.setattr(settings, "metrics_allowed_ips", "")
+    assert await _scrape("127.0.0.1") == 200
+    assert await _scrape("203.0.113.7") == 404
+
+    monkeypatch.setattr(settings, "metrics_allowed_ips", "10.0.0.0/8, 203.0.113.7")
+    assert await _scrape("203.0.113.7") == 200
+    assert await _scrape("10.1.2.3") == 200
+    assert await _scrape("198.51.100.1") == 404
+
+    # with a token, the token decides wherever the scrape comes from
+    monkeypatch.setattr(settings, "metrics_token", "s3cret")
+    assert await _scrape("127.0.0.1") == 401
+    assert await _scrape("198.51.100.1", {"Authorization": "Bearer s3cret"}) == 200
+
+
+@pytest.mark.asyncio
+async def test_timed_observes_each_awaited_call():
+    histogram = metrics.TELEMETRY_BRIDGE_SECONDS
+    before = histogram.labels().count
+
+    @metrics.timed(histogram)
+    async def work(value):
+        return value * 2
+
+    assert work.__name__ == "work"
+    assert await work(2) == 4 and await work(3) == 6
+    assert histogram.labels().count == before + 2
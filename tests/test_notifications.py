@@ -0,0 +1,111 @@
+"""Tests for the bulk notification fan-out in notification_service."""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from app.core import notification_service
+from app.core.notification_service import (
+    create_notification_all_users,
+    dispatch_notifications,
+)
+from app.db.models.notifications import Notification
+from app.db.models.orgs import Organization, OrganizationUser
+from app.db.models.user import User
+from app.realtime import user_hub
+from tests.conftest import make_test_session
+
+
+async def _mk_session():
+    return await make_test_session(
+        tables=[
+            User.__table__,
+            Organization.__table__,
+            OrganizationUser.__table__,
+            Notification.__table__,
+        ]
+    )
+
+
+async def _seed(Session) -> int:
+    async with Session() as db:
+        users = [User(email=f"u{i}@example.com", password_hash="x") for i in range(5)]
+        org = Organization(name="Acme", slug="acme")
+        db.add_all(users + [org])
+        await db.flush()
+        for user in users[:3]:
+            db.add(OrganizationUser(org_id=org.id, user_id=user.id, role="member"))
+        await db.commit()
+        return org.id
+
+
+@pytest.mark.asyncio
+async def test_all_users_bulk_creates_one_row_per_user():
+    _, Session = await _mk_session()
+    await _seed(Session)
+
+    async with Session() as db:
+        pending = await create_notification_all_users(
+            db, type="alert_fired", title="Alert: x", severity="warning"
+        )
+        await db.commit()
+
+    async with Session() as db:
+        rows = list((await db.execute(select(Notification))).scalars().all())
+
+    assert len(rows) == 5
+    assert len(pending) == 5
+    assert {uid for uid, _ in pending} == {r.user_id for r in rows}
+    assert {p["id"] for _, p in pending} == {r.id for r in rows}
+    assert all(p["title"] == "Alert: x" and p["read_at"] is None for _, p in pending)
+
+
+@pytest.mark.asyncio
+async def test_org_scoped_fan_out_only_reaches_members():
+    _, Session = await _mk_session()
+    org_id = await _seed(Session)
+
+    async with Session() as db:
+        pending = await create_notification_all_users(
+            db, type="alert_fired", title="Org alert", org_id=org_id
+        )
+        await db.commit()
+
+    async with Session() as db:
+        member_ids = set(
+            (await db.execute(
+                select(OrganizationUser.user_id).where(OrganizationUser.org_id == org_id)
+            )).scalars().all()
+        )
+        rows = list((await db.execute(select(Notification))).scalars().all())
+
+    assert len(rows) == 3
+    assert {r.user_id for r in rows} == member_ids
+    assert {uid for uid, _ in pending} == member_ids
+
+
+@pytest.mark.asyncio
+async def test_fan_out_does_not_push_until_dispatched(monkeypatch):
+    _, Session = await _mk_session()
+    await _seed(Session)
+
+    pushed: list[int] = []
+
+    async def _fake_push(user_id, payload):
+        pushed.append(user_id)
+
+    monkeypatch.setattr(user_hub, "push_notification", _fake_push)
+    monkeypatch.setattr(user_hub, "clients", {1: set(), 2: set()})
+
+    async with Session() as db:
+        pending = await create_notification_all_users(db, type="t", title="T")
+        assert pushed == []
+        await db.commit()
+
+    dispatch_notifications(pending)
+    await asyncio.gather(*notification_service._push_tasks)
+
+    # Only users with a live connection are pushed to
+    assert sorted(pushed) == [1, 2]
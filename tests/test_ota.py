@@ -15,6 +15,7 @@ from app.api.deps_caps import capability_guard
 from app.api.v1.edge import router as edge_router
 from app.api.v1.ota import router as ota_router
 from app.core.capabilities import CAPABILITY_MAP
+from app.core import presence
 from app.core.ota_worker import run_ota_cycle
 from app.core.security import hash_device_token
 from app.db.base import Base
@@ -114,7 +115,8 @@ _EXTRA_DDL = [
         created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
         completed_at DATETIME,
         result TEXT,
-        error TEXT
+        error TEXT,
+        fleet_job_id INTEGER
     )
     """,
 ]
@@ -664,6 +666,7 @@ async def test_edge_config_returns_variables_and_tasks():
 @pytest.mark.asyncio
 async def test_edge_heartbeat_updates_last_seen():
     _, Session = await _mk_session()
+    presence.reset()
     app = await _mk_app(Session, routers=[edge_router])
     device_id, raw_token = await _seed_device(Session)
 
@@ -679,6 +682,8 @@ async def test_edge_heartbeat_updates_last_seen():
     assert data["device_id"] == device_id
     assert data["last_seen_at"] is not None
 
+    # last_seen_at is coalesced and written by the presence flush
+    await presence.flush(Session)
     async with Session() as db:
         dev = await db.get(Device, device_id)
         assert dev.last_seen_at is not None
@@ -688,6 +693,7 @@ async def test_edge_heartbeat_updates_last_seen():
 @pytest.mark.asyncio
 async def test_edge_heartbeat_no_firmware_version():
     _, Session = await _mk_session()
+    presence.reset()
     app = await _mk_app(Session, routers=[edge_router])
     device_id, raw_token = await _seed_device(Session)
 
@@ -696,6 +702,7 @@ async def test_edge_heartbeat_no_firmware_version():
 
     assert resp.status_code == 200
 
+    await presence.flush(Session)
     async with Session() as db:
         dev = await db.get(Device, device_id)
         assert dev.last_seen_at is not None
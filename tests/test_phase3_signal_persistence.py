@@ -1,11 +1,15 @@
 from __future__ import annotations
 
 import pytest
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 
+from app.api.v1.signals import router as signals_router
 from app.core.capabilities import CAPABILITY_REGISTRY
-from app.core.signals import persist_signal
+from app.core.signals import persist_signal, persist_signals
+from app.db.models.providers import ProviderInstance, ProviderType
 from app.db.models.signals import SignalV1
+from tests.conftest import auth_header, make_client, make_test_app, make_test_session
 
 
 class _FakeAsyncSession:
@@ -128,5 +132,64 @@ async def test_persist_signal_cursor_is_monotonic():
     assert [row.id for row in db._rows] == [one.cursor, two.cursor, three.cursor]
 
 
+async def _signal_session():
+    return await make_test_session(tables=[ProviderType.__table__, ProviderInstance.__table__, SignalV1.__table__])
+
+
+def _item(key: str, n: int = 0) -> dict:
+    return {"signal_type": "device.ping", "payload": {"n": n}, "idempotency_key": key}
+
+
+@pytest.mark.asyncio
+async def test_persist_signals_batch_dedupes_against_table_and_batch():
+    engine, Session = await _signal_session()
+    async with Session() as db:
+        first = await persist_signals(db, stream="tenant.system", items=[_item("a"), _item("b")])
+        assert [r.created for r in first.results] == [True, True]
+
+        second = await persist_signals(
+            db, stream="tenant.system", items=[_item("b", 9), _item("c"), _item("c", 9)],
+        )
+        by = [(r.idempotency_key, r.created) for r in second.results]
+        assert by == [("b", False), ("c", True), ("c", False)]
+        assert second.results[0].cursor == first.results[1].cursor
+        assert second.results[1].cursor == second.results[2].cursor
+        assert second.cursor == second.results[1].cursor > first.cursor
+
+        other = await persist_signals(db, stream="tenant.other", items=[_item("a")])
+        assert other.results[0].created is True
+
+    async with Session() as db:
+        rows = (await db.execute(select(SignalV1).order_by(SignalV1.id))).scalars().all()
+        assert [(r.stream, r.idempotency_key, r.payload) for r in rows] == [
+            ("tenant.system", "a", {"n": 0}),
+            ("tenant.system", "b", {"n": 0}),
+            ("tenant.system", "c", {"n": 0}),
+            ("tenant.other", "a", {"n": 0}),
+        ]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_signals_batch_endpoint():
+    engine, Session = await _signal_session()
+    app = await make_test_app(Session, [signals_router], with_cap_guard=False)
+    async with make_client(app) as client:
+        body = {"stream": "tenant.system", "items": [_item("k1"), _item("k2"), _item("k1")]}
+        resp = await client.post("/api/v1/signals/batch", json=body, headers=auth_header())
+        assert resp.status_code == 200
+        out = resp.json()
+        assert [r["created"] for r in out["results"]] == [True, True, False]
+        assert out["cursor"] == out["results"][1]["cursor"]
+
+        resp = await client.get("/api/v1/signals", params={"stream": "tenant.system"}, headers=auth_header())
+        assert [s["payload"] for s in resp.json()["items"]] == [{"n": 0}, {"n": 0}]
+
+        resp = await client.post("/api/v1/signals/batch", headers=auth_header(),
+                                 json={**body, "provider_instance_id": 42})
+        assert resp.status_code == 404
+    await engine.dispose()
+
+
 def test_signals_ingest_capability_placeholder_present():
     assert "signals.ingest" in CAPABILITY_REGISTRY
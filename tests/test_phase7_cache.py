@@ -4,11 +4,15 @@ All tests mock Redis so no real Redis instance is required.
 """
 from __future__ import annotations
 
-import json
+import asyncio
+import time
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
+import app.api.v1.router  # noqa: F401 — registers the routers' cache rules
+from app.core.cache import CacheEntry, _decode_entry, _encode_entry
+
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -25,6 +29,22 @@ def _make_scope(path: str = "/api/v1/devices", method: str = "GET") -> dict:
     }
 
 
+def _configure(mock_settings, distributed: bool = False) -> None:
+    mock_settings.cache_enabled = True
+    mock_settings.cache_stale_seconds = 30
+    mock_settings.cache_single_flight_distributed = distributed
+
+
+def _entry(generation: bytes, body: bytes, headers=None, fresh_for: float = 60.0) -> bytes:
+    return _encode_entry(CacheEntry(
+        generation=generation,
+        fresh_until=time.time() + fresh_for,
+        status=200,
+        headers=headers or [(b"content-type", b"application/json")],
+        body=body,
+    ))
+
+
 # ---------------------------------------------------------------------------
 # Tests
 # ---------------------------------------------------------------------------
@@ -60,9 +80,8 @@ async def test_cache_miss_stores_response():
 
     body_bytes = b'{"devices": []}'
     mock_redis = AsyncMock()
-    mock_redis.get = AsyncMock(return_value=None)  # cache miss
+    mock_redis.mget = AsyncMock(return_value=[None, None])  # cache miss
     mock_redis.setex = AsyncMock()
-    mock_redis.keys = AsyncMock(return_value=[])
 
     async def app(scope, receive, send):
         await send({
@@ -81,10 +100,10 @@ async def test_cache_miss_stores_response():
 
     with (
         patch("app.core.cache.settings") as mock_settings,
-        patch("app.core.cache.get_redis", return_value=mock_redis),
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
         patch("app.core.cache._org_id_from_request", return_value="99"),
     ):
-        mock_settings.cache_enabled = True
+        _configure(mock_settings)
         scope = _make_scope("/api/v1/devices")
         receive = AsyncMock(return_value={"type": "http.disconnect"})
         await middleware(scope, receive, capture_send)
@@ -94,6 +113,53 @@ async def test_cache_miss_stores_response():
     start = next(e for e in responses if e.get("type") == "http.response.start")
     headers = dict(start["headers"])
     assert headers.get(b"x-cache") == b"MISS"
+    assert headers.get(b"etag")
+
+    # Stored as raw headers + raw body (no JSON / latin-1 wrapping)
+    stored = _decode_entry(mock_redis.setex.call_args.args[2])
+    generation, status, stored_headers, stored_body = stored.generation, stored.status, stored.headers, stored.body
+    assert (generation, status, stored_body) == (b"0", 200, body_bytes)
+    # Physical TTL covers the stale window
+    assert mock_redis.setex.call_args.args[1] == 5 + 30
+    assert (b"content-type", b"application/json") in stored_headers
+    assert dict(stored_headers)[b"etag"] == headers[b"etag"]
+    assert b"x-cache" not in dict(stored_headers)
+
+
+@pytest.mark.asyncio
+async def test_cache_miss_streams_chunks_through():
+    """A multi-chunk MISS is forwarded chunk by chunk and stored once complete."""
+    from app.core.cache import CacheMiddleware
+
+    mock_redis = AsyncMock()
+    mock_redis.mget = AsyncMock(return_value=[None, b"4"])
+    mock_redis.setex = AsyncMock()
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b'{"a":', "more_body": True})
+        await send({"type": "http.response.body", "body": b"1}", "more_body": False})
+
+    middleware = CacheMiddleware(app)
+    responses: list[dict] = []
+
+    async def capture_send(event):
+        responses.append(event)
+
+    with (
+        patch("app.core.cache.settings") as mock_settings,
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
+        patch("app.core.cache._org_id_from_request", return_value="99"),
+    ):
+        _configure(mock_settings)
+        receive = AsyncMock(return_value={"type": "http.disconnect"})
+        await middleware(_make_scope("/api/v1/devices"), receive, capture_send)
+
+    bodies = [e["body"] for e in responses if e["type"] == "http.response.body"]
+    assert bodies == [b'{"a":', b"1}"]
+    stored = _decode_entry(mock_redis.setex.call_args.args[2])
+    assert stored.generation == b"4"
+    assert stored.body == b'{"a":1}'
 
 
 @pytest.mark.asyncio
@@ -104,16 +170,12 @@ async def test_cache_hit_returns_cached():
     cached_body = b'{"devices": [{"id":1}]}'
     import hashlib
     etag = '"' + hashlib.md5(cached_body).hexdigest() + '"'
-    cache_payload = json.dumps({
-        "body": cached_body.decode("latin-1"),
-        "status_code": 200,
-        "headers": {"content-type": "application/json"},
-        "media_type": "application/json",
-    })
+    cache_payload = _entry(
+        b"3", cached_body, [(b"content-type", b"application/json"), (b"etag", etag.encode())]
+    )
 
     mock_redis = AsyncMock()
-    mock_redis.get = AsyncMock(return_value=cache_payload)
-    mock_redis.keys = AsyncMock(return_value=[])
+    mock_redis.mget = AsyncMock(return_value=[cache_payload, b"3"])
 
     handler_called = []
 
@@ -130,10 +192,10 @@ async def test_cache_hit_returns_cached():
 
     with (
         patch("app.core.cache.settings") as mock_settings,
-        patch("app.core.cache.get_redis", return_value=mock_redis),
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
         patch("app.core.cache._org_id_from_request", return_value="99"),
     ):
-        mock_settings.cache_enabled = True
+        _configure(mock_settings)
         scope = _make_scope("/api/v1/devices")
         receive = AsyncMock(return_value={"type": "http.disconnect"})
         await middleware(scope, receive, capture_send)
@@ -153,15 +215,12 @@ async def test_cache_etag_304():
     cached_body = b'{"devices": []}'
     import hashlib
     etag = '"' + hashlib.md5(cached_body).hexdigest() + '"'
-    cache_payload = json.dumps({
-        "body": cached_body.decode("latin-1"),
-        "status_code": 200,
-        "headers": {"content-type": "application/json"},
-        "media_type": "application/json",
-    })
+    cache_payload = _entry(
+        b"0", cached_body, [(b"content-type", b"application/json"), (b"etag", etag.encode())]
+    )
 
     mock_redis = AsyncMock()
-    mock_redis.get = AsyncMock(return_value=cache_payload)
+    mock_redis.mget = AsyncMock(return_value=[cache_payload, None])
 
     async def app(scope, receive, send):
         pass  # should not be called
@@ -179,10 +238,10 @@ async def test_cache_etag_304():
 
     with (
         patch("app.core.cache.settings") as mock_settings,
-        patch("app.core.cache.get_redis", return_value=mock_redis),
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
         patch("app.core.cache._org_id_from_request", return_value="99"),
     ):
-        mock_settings.cache_enabled = True
+        _configure(mock_settings)
         scope = {
             "type": "http",
             "method": "GET",
@@ -198,14 +257,20 @@ async def test_cache_etag_304():
     assert start["status"] == 304
 
 
+def _make_pipeline_redis():
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=[])
+    mock_redis = AsyncMock()
+    mock_redis.pipeline = MagicMock(return_value=pipe)
+    return mock_redis, pipe
+
+
 @pytest.mark.asyncio
 async def test_cache_invalidation_on_post():
-    """POST to a cached prefix flushes matching cache keys."""
+    """POST to a cached prefix bumps the org's generation counters — no KEYS scan."""
     from app.core.cache import CacheMiddleware
 
-    mock_redis = AsyncMock()
-    mock_redis.keys = AsyncMock(return_value=[b"hubex:cache:99:/api/v1/devices:abc123"])
-    mock_redis.delete = AsyncMock()
+    mock_redis, pipe = _make_pipeline_redis()
 
     async def app(scope, receive, send):
         await send({"type": "http.response.start", "status": 201, "headers": []})
@@ -215,15 +280,85 @@ async def test_cache_invalidation_on_post():
 
     with (
         patch("app.core.cache.settings") as mock_settings,
-        patch("app.core.cache.get_redis", return_value=mock_redis),
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
+        patch("app.core.cache._org_id_from_request", return_value="99"),
     ):
-        mock_settings.cache_enabled = True
+        _configure(mock_settings)
         scope = _make_scope("/api/v1/devices", method="POST")
         receive = AsyncMock(return_value={"type": "http.disconnect"})
         send = AsyncMock()
         await middleware(scope, receive, send)
 
-    mock_redis.delete.assert_called_once()
+    incremented = [c.args[0] for c in pipe.incr.call_args_list]
+    assert incremented == ["hubex:cache:gen:99:devices", "hubex:cache:gen:99:metrics"]
+    pipe.execute.assert_awaited_once()
+    mock_redis.keys.assert_not_called()
+    mock_redis.delete.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_cache_invalidation_nested_ota_path():
+    """Writes below /ota invalidate the cached /ota/firmware resource."""
+    from app.core.cache import CacheMiddleware
+
+    mock_redis, pipe = _make_pipeline_redis()
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    middleware = CacheMiddleware(app)
+
+    with (
+        patch("app.core.cache.settings") as mock_settings,
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
+        patch("app.core.cache._org_id_from_request", return_value="7"),
+    ):
+        _configure(mock_settings)
+        scope = _make_scope("/api/v1/ota/rollouts/1/start", method="POST")
+        receive = AsyncMock(return_value={"type": "http.disconnect"})
+        await middleware(scope, receive, AsyncMock())
+
+    assert [c.args[0] for c in pipe.incr.call_args_list] == ["hubex:cache:gen:7:ota"]
+
+
+@pytest.mark.asyncio
+async def test_cache_stale_generation_is_a_miss():
+    """An entry written under an older generation is ignored and refreshed."""
+    from app.core.cache import CacheMiddleware
+
+    stale_payload = _entry(b"1", b'{"devices": []}')
+    mock_redis = AsyncMock()
+    mock_redis.mget = AsyncMock(return_value=[stale_payload, b"2"])
+    mock_redis.setex = AsyncMock()
+
+    handler_called = []
+
+    async def app(scope, receive, send):
+        handler_called.append(True)
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": b'{"devices": [1]}'})
+
+    middleware = CacheMiddleware(app)
+
+    with (
+        patch("app.core.cache.settings") as mock_settings,
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
+        patch("app.core.cache._org_id_from_request", return_value="99"),
+    ):
+        _configure(mock_settings)
+        receive = AsyncMock(return_value={"type": "http.disconnect"})
+        await middleware(_make_scope("/api/v1/devices"), receive, AsyncMock())
+
+    assert handler_called
+    stored = _decode_entry(mock_redis.setex.call_args.args[2])
+    assert stored.generation == b"2"
+    assert stored.body == b'{"devices": [1]}'
+
 
 
 @pytest.mark.asyncio
@@ -232,9 +367,8 @@ async def test_cache_non_cacheable_path_no_store():
     from app.core.cache import CacheMiddleware
 
     mock_redis = AsyncMock()
-    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.mget = AsyncMock(return_value=[None, None])
     mock_redis.setex = AsyncMock()
-    mock_redis.keys = AsyncMock(return_value=[])
 
     called = []
 
@@ -247,9 +381,9 @@ async def test_cache_non_cacheable_path_no_store():
 
     with (
         patch("app.core.cache.settings") as mock_settings,
-        patch("app.core.cache.get_redis", return_value=mock_redis),
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
     ):
-        mock_settings.cache_enabled = True
+        _configure(mock_settings)
         scope = _make_scope("/api/v1/users")  # not in cache rules
         receive = AsyncMock(return_value={"type": "http.disconnect"})
         send = AsyncMock()
@@ -259,3 +393,208 @@ async def test_cache_non_cacheable_path_no_store():
     assert called
     # setex should NOT have been called
     mock_redis.setex.assert_not_called()
+    mock_redis.mget.assert_not_called()
+
+
+# ---------------------------------------------------------------------------
+# Single-flight / stale-while-revalidate
+# ---------------------------------------------------------------------------
+
+def _slow_app(calls: list, release: asyncio.Event, body: bytes = b'{"n":1}'):
+    async def app(scope, receive, send):
+        calls.append(True)
+        await release.wait()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+async def _get(middleware, path="/api/v1/metrics"):
+    events: list[dict] = []
+
+    async def capture(event):
+        events.append(event)
+
+    receive = AsyncMock(return_value={"type": "http.disconnect"})
+    await middleware(_make_scope(path), receive, capture)
+    start = next(e for e in events if e["type"] == "http.response.start")
+    body = b"".join(e.get("body", b"") for e in events if e["type"] == "http.response.body")
+    return dict(start["headers"]).get(b"x-cache"), body
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_run_handler_once():
+    """A thundering herd of misses coalesces onto one handler run per process."""
+    from app.core.cache import CacheMiddleware
+
+    mock_redis = AsyncMock()
+    mock_redis.mget = AsyncMock(return_value=[None, None])
+    mock_redis.setex = AsyncMock()
+
+    calls: list = []
+    release = asyncio.Event()
+    middleware = CacheMiddleware(_slow_app(calls, release))
+
+    with (
+        patch("app.core.cache.settings") as mock_settings,
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
+        patch("app.core.cache._org_id_from_request", return_value="99"),
+    ):
+        _configure(mock_settings)
+        tasks = [asyncio.create_task(_get(middleware)) for _ in range(10)]
+        await asyncio.sleep(0.01)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+    assert len(calls) == 1
+    assert sorted(r[0] for r in results) == [b"COALESCED"] * 9 + [b"MISS"]
+    assert all(body == b'{"n":1}' for _, body in results)
+    mock_redis.setex.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_expired_entry_served_stale_during_refresh():
+    """While one request refreshes an expired entry, others get the stale copy."""
+    from app.core.cache import CacheMiddleware
+
+    stale = _entry(b"0", b'{"n":0}', fresh_for=-1.0)
+    mock_redis = AsyncMock()
+    mock_redis.mget = AsyncMock(return_value=[stale, None])
+    mock_redis.setex = AsyncMock()
+
+    calls: list = []
+    release = asyncio.Event()
+    middleware = CacheMiddleware(_slow_app(calls, release))
+
+    with (
+        patch("app.core.cache.settings") as mock_settings,
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
+        patch("app.core.cache._org_id_from_request", return_value="99"),
+    ):
+        _configure(mock_settings)
+        refresher = asyncio.create_task(_get(middleware))
+        await asyncio.sleep(0.01)
+        others = await asyncio.gather(*[_get(middleware) for _ in range(3)])
+        release.set()
+        refreshed = await refresher
+
+    assert len(calls) == 1
+    assert others == [(b"STALE", b'{"n":0}')] * 3
+    assert refreshed == (b"MISS", b'{"n":1}')
+
+
+@pytest.mark.asyncio
+async def test_peer_process_fill_is_awaited_not_recomputed():
+    """If another process holds the fill lock, the entry it writes is served."""
+    from app.core.cache import CacheMiddleware
+
+    filled = _entry(b"0", b'{"n":7}')
+    mock_redis = AsyncMock()
+    mock_redis.mget = AsyncMock(return_value=[None, None])
+    mock_redis.set = AsyncMock(return_value=None)  # lock held elsewhere
+    mock_redis.get = AsyncMock(side_effect=[None, filled])
+    mock_redis.setex = AsyncMock()
+
+    calls: list = []
+    release = asyncio.Event()
+    release.set()
+    middleware = CacheMiddleware(_slow_app(calls, release))
+
+    with (
+        patch("app.core.cache.settings") as mock_settings,
+        patch("app.core.cache.get_redis_binary", return_value=mock_redis),
+        patch("app.core.cache._org_id_from_request", return_value="99"),
+        patch("app.core.cache._PEER_POLL", 0.001),
+    ):
+        _configure(mock_settings, distributed=True)
+        result = await _get(middleware)
+
+    assert calls == []
+    assert result == (b"COALESCED", b'{"n":7}')
+    mock_redis.setex.assert_not_called()
+
+
+class _GenerationRedis:
+    """Just enough of the binary Redis client for reads, fills and invalidations."""
+
+    def __init__(self) -> None:
+        self.data: dict[str, bytes] = {}
+
+    async def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    async def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, b"0")) + 1).encode()
+
+    def expire(self, key, ttl):
+        pass
+
+    async def execute(self):
+        return []
+
+
+@pytest.mark.asyncio
+async def test_device_token_write_invalidates_the_device_orgs_cached_reads():
+    """Device tokens carry no org claim: the device's org is invalidated, not 'anon'."""
+    from fastapi import Depends, FastAPI
+
+    from app.api.deps import get_db
+    from app.api.deps_auth import get_current_device
+    from app.core.cache import CacheMiddleware
+    from app.core.security import hash_device_token
+    from app.db.models.device import Device
+    from app.db.models.pairing import DeviceToken
+    from tests.conftest import make_client, make_test_session, make_token
+
+    engine, Session = await make_test_session(tables=[Device.__table__, DeviceToken.__table__])
+    async with Session() as db:
+        db.add(Device(id=1, device_uid="dev-1", owner_user_id=1, org_id=5))
+        db.add(DeviceToken(device_id=1, token_hash=hash_device_token("tok"), is_active=True))
+        await db.commit()
+
+    async def _get_test_db():
+        async with Session() as s:
+            yield s
+
+    names = ["before"]
+    app = FastAPI()
+    app.dependency_overrides[get_db] = _get_test_db
+
+    @app.get("/api/v1/devices")
+    async def list_devices():
+        return {"name": names[-1]}
+
+    @app.post("/api/v1/devices/rename")
+    async def rename(device: Device = Depends(get_current_device)):
+        names.append("after")
+        return {"ok": True}
+
+    app.add_middleware(CacheMiddleware)
+    redis = _GenerationRedis()
+    user = {"Authorization": f"Bearer {make_token(org_id=5)}"}
+    with (
+        patch("app.core.cache.settings") as mock_settings,
+        patch("app.core.cache.get_redis_binary", return_value=redis),
+    ):
+        _configure(mock_settings)
+        async with make_client(app) as client:
+            assert (await client.get("/api/v1/devices", headers=user)).headers["X-Cache"] == "MISS"
+            assert (await client.get("/api/v1/devices", headers=user)).headers["X-Cache"] == "HIT"
+            resp = await client.post("/api/v1/devices/rename", headers={"X-Device-Token": "tok"})
+            assert resp.status_code == 200
+            fresh = await client.get("/api/v1/devices", headers=user)
+
+    assert fresh.headers["X-Cache"] == "MISS" and fresh.json() == {"name": "after"}
+    assert redis.data["hubex:cache:gen:5:devices"] == b"1"
+    assert "hubex:cache:gen:anon:devices" not in redis.data
+    await engine.dispose()
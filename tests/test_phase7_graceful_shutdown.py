@@ -10,13 +10,29 @@ from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
+from app.workers import LoopSpec, LoopSupervisor
+
+
+def _supervisor_factory(loop_fn, names=("token_cleanup", "webhook_dispatcher", "alert_worker")):
+    """make_supervisor stand-in running `loop_fn` under each loop name."""
+    def _make(engine):
+        return LoopSupervisor([LoopSpec(name, loop_fn) for name in names])
+    return _make
+
 
 @pytest.mark.asyncio
 async def test_background_tasks_cancelled_on_shutdown():
     """All background tasks receive CancelledError during lifespan exit."""
+    started: list[int] = []
+    cancelled: list[int] = []
 
     async def _long_loop():
-        await asyncio.sleep(9999)
+        started.append(1)
+        try:
+            await asyncio.sleep(9999)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
 
     with (
         patch("app.main.init_redis", new=AsyncMock()),
@@ -24,11 +40,7 @@ async def test_background_tasks_cancelled_on_shutdown():
         patch("app.main.engine") as mock_engine,
         patch("app.main.sync_module_registry", new=AsyncMock()),
         patch("app.main.AsyncSessionLocal") as mock_session_cls,
-        patch("app.main._token_cleanup_loop", side_effect=_long_loop),
-        patch("app.main.webhook_dispatcher_loop", side_effect=_long_loop),
-        patch("app.main.alert_worker_loop", side_effect=_long_loop),
-        patch("app.main.health_worker_loop", side_effect=_long_loop),
-        patch("app.main.ota_worker_loop", side_effect=_long_loop),
+        patch("app.main.make_supervisor", new=_supervisor_factory(_long_loop)),
     ):
         mock_engine.dispose = AsyncMock()
         mock_session = AsyncMock()
@@ -39,14 +51,11 @@ async def test_background_tasks_cancelled_on_shutdown():
         from app.main import lifespan, app
 
         async with lifespan(app):
-            pass  # immediately exit → triggers shutdown
+            await asyncio.sleep(0.01)  # let the supervised loops start
 
-    # All tasks should have been cancelled (received CancelledError)
-    # Since we patched the loop functions to return coroutines directly,
-    # they are wrapped in create_task. The exact names depend on whether
-    # the mocked coroutines ran. Let's just verify no uncaught exceptions.
-    # The real test is that the lifespan completes without hanging.
-    assert True  # lifespan exited cleanly
+    # Every started loop was cancelled and the lifespan exited without hanging
+    assert len(started) == 3
+    assert len(cancelled) == 3
 
 
 @pytest.mark.asyncio
@@ -63,11 +72,7 @@ async def test_redis_closed_on_shutdown():
         patch("app.main.engine") as mock_engine,
         patch("app.main.sync_module_registry", new=AsyncMock()),
         patch("app.main.AsyncSessionLocal") as mock_session_cls,
-        patch("app.main._token_cleanup_loop", side_effect=_fast_loop),
-        patch("app.main.webhook_dispatcher_loop", side_effect=_fast_loop),
-        patch("app.main.alert_worker_loop", side_effect=_fast_loop),
-        patch("app.main.health_worker_loop", side_effect=_fast_loop),
-        patch("app.main.ota_worker_loop", side_effect=_fast_loop),
+        patch("app.main.make_supervisor", new=_supervisor_factory(_fast_loop)),
     ):
         mock_engine.dispose = AsyncMock()
         mock_session = AsyncMock()
@@ -97,11 +102,7 @@ async def test_db_engine_disposed_on_shutdown():
         patch("app.main.engine") as mock_engine,
         patch("app.main.sync_module_registry", new=AsyncMock()),
         patch("app.main.AsyncSessionLocal") as mock_session_cls,
-        patch("app.main._token_cleanup_loop", side_effect=_fast_loop),
-        patch("app.main.webhook_dispatcher_loop", side_effect=_fast_loop),
-        patch("app.main.alert_worker_loop", side_effect=_fast_loop),
-        patch("app.main.health_worker_loop", side_effect=_fast_loop),
-        patch("app.main.ota_worker_loop", side_effect=_fast_loop),
+        patch("app.main.make_supervisor", new=_supervisor_factory(_fast_loop)),
     ):
         mock_engine.dispose = dispose_mock
         mock_session = AsyncMock()
@@ -9,42 +9,88 @@ from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
-from app.core.rate_limit import RateLimitMiddleware, _sliding_window
+from app.core import rate_limit as rl
+from app.core.rate_limit import RateLimitMiddleware, check_rate_limit
 
 
 # ---------------------------------------------------------------------------
-# Unit: sliding window algorithm
+# Unit: GCRA script wrapper
 # ---------------------------------------------------------------------------
 
-def _make_pipe(count: int):
-    """Build a synchronous MagicMock pipeline with async execute()."""
-    pipe = MagicMock()
-    pipe.zremrangebyscore = MagicMock()
-    pipe.zcard = MagicMock()
-    pipe.expire = MagicMock()
-    pipe.execute = AsyncMock(return_value=[0, count, 1])
-    return pipe
+def _make_redis(granted: int = 1, remaining: int = 5, retry_ms: int = 0, reset_ms: int = 500):
+    """MagicMock Redis whose registered script returns a fixed GCRA result."""
+    script = AsyncMock(return_value=[granted, remaining, retry_ms, reset_ms])
+    redis = MagicMock()
+    redis.register_script.return_value = script
+    return redis, script
+
+
+@pytest.fixture(autouse=True)
+def _reset_rate_limit_state():
+    rl._script = None
+    rl._script_client = None
+    rl._leases.clear()
+    yield
+    rl._leases.clear()
 
 
 @pytest.mark.asyncio
-async def test_sliding_window_allows_within_limit():
-    redis = MagicMock()
-    redis.pipeline.return_value = _make_pipe(count=5)
-    redis.zadd = AsyncMock()
+async def test_gcra_allows_within_limit():
+    redis, script = _make_redis(granted=1, remaining=5)
+
+    with patch("app.core.rate_limit.settings") as mock_settings:
+        mock_settings.rate_limit_local_batch = 0
+        result = await check_rate_limit(redis, "hubex:rl:user_id:42", limit=10)
 
-    allowed, retry_after = await _sliding_window(redis, "hubex:rl:user_id:42", limit=10)
-    assert allowed is True
-    assert retry_after == 0
+    assert result.allowed is True
+    assert result.remaining == 5
+    assert result.retry_after == 0
+    script.assert_awaited_once_with(keys=["hubex:rl:user_id:42"], args=[10, 60000, 1])
 
 
 @pytest.mark.asyncio
-async def test_sliding_window_blocks_at_limit():
-    redis = MagicMock()
-    redis.pipeline.return_value = _make_pipe(count=10)  # count == limit
+async def test_gcra_blocks_at_limit():
+    redis, _ = _make_redis(granted=0, remaining=0, retry_ms=5500, reset_ms=60000)
+
+    with patch("app.core.rate_limit.settings") as mock_settings:
+        mock_settings.rate_limit_local_batch = 0
+        result = await check_rate_limit(redis, "hubex:rl:user_id:42", limit=10)
 
-    allowed, retry_after = await _sliding_window(redis, "hubex:rl:user_id:42", limit=10)
-    assert allowed is False
-    assert retry_after >= 1
+    assert result.allowed is False
+    assert result.retry_after == 6
+
+
+@pytest.mark.asyncio
+async def test_script_registered_once_per_client():
+    redis, script = _make_redis()
+
+    with patch("app.core.rate_limit.settings") as mock_settings:
+        mock_settings.rate_limit_local_batch = 0
+        for _ in range(3):
+            await check_rate_limit(redis, "k", limit=10)
+
+    assert redis.register_script.call_count == 1
+    assert script.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_local_batch_serves_leased_tokens_without_redis():
+    redis, script = _make_redis(granted=5, remaining=100)
+
+    with patch("app.core.rate_limit.settings") as mock_settings:
+        mock_settings.rate_limit_local_batch = 5
+        results = [await check_rate_limit(redis, "k", limit=120) for _ in range(5)]
+
+    # One Redis round trip leased 5 tokens: the next 4 requests stay local
+    assert script.await_count == 1
+    script.assert_awaited_with(keys=["k"], args=[120, 60000, 5])
+    assert all(r.allowed for r in results)
+    assert [r.remaining for r in results] == [104, 103, 102, 101, 100]
+
+    with patch("app.core.rate_limit.settings") as mock_settings:
+        mock_settings.rate_limit_local_batch = 5
+        await check_rate_limit(redis, "k", limit=120)
+    assert script.await_count == 2
 
 
 # ---------------------------------------------------------------------------
@@ -118,8 +164,7 @@ async def test_rate_limit_429_with_retry_after():
 
     middleware = RateLimitMiddleware(app)
 
-    mock_redis = MagicMock()
-    mock_redis.pipeline.return_value = _make_pipe(count=120)  # count >= default limit 120
+    mock_redis, _ = _make_redis(granted=0, remaining=0, retry_ms=1000, reset_ms=60000)
 
     responses: list[dict] = []
 
@@ -132,6 +177,7 @@ async def test_rate_limit_429_with_retry_after():
         patch("app.core.rate_limit._jwt_sub", return_value="user-42"),
     ):
         mock_settings.rate_limit_enabled = True
+        mock_settings.rate_limit_local_batch = 0
         scope = _make_scope("/api/v1/devices")
         receive = AsyncMock(return_value={"type": "http.disconnect"})
         await middleware(scope, receive, capture_send)
@@ -140,6 +186,41 @@ async def test_rate_limit_429_with_retry_after():
     assert start_event["status"] == 429
     headers = dict(start_event["headers"])
     assert b"retry-after" in headers
+    assert headers[b"ratelimit-limit"] == b"120"
+    assert headers[b"ratelimit-remaining"] == b"0"
+    assert headers[b"ratelimit-reset"] == b"60"
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_headers_on_allowed_response():
+    """Allowed responses carry the RateLimit-* headers."""
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = RateLimitMiddleware(app)
+    mock_redis, _ = _make_redis(granted=1, remaining=119, reset_ms=500)
+
+    responses: list[dict] = []
+
+    async def capture_send(event):
+        responses.append(event)
+
+    with (
+        patch("app.core.rate_limit.settings") as mock_settings,
+        patch("app.core.rate_limit.get_redis", return_value=mock_redis),
+        patch("app.core.rate_limit._jwt_sub", return_value="user-42"),
+    ):
+        mock_settings.rate_limit_enabled = True
+        mock_settings.rate_limit_local_batch = 0
+        await middleware(_make_scope("/api/v1/devices"), AsyncMock(return_value={"type": "http.disconnect"}), capture_send)
+
+    start_event = next(e for e in responses if e.get("type") == "http.response.start")
+    assert start_event["status"] == 200
+    headers = dict(start_event["headers"])
+    assert headers[b"ratelimit-remaining"] == b"119"
+    assert headers[b"ratelimit-reset"] == b"1"
+    assert headers[b"ratelimit-policy"] == b"120;w=60"
 
 
 @pytest.mark.asyncio
@@ -154,8 +235,7 @@ async def test_rate_limit_whitelist_skips_health():
 
     middleware = RateLimitMiddleware(app)
 
-    mock_redis = MagicMock()
-    mock_redis.pipeline.return_value = _make_pipe(count=9999)  # way over limit
+    mock_redis, _ = _make_redis(granted=0, remaining=0, retry_ms=1000, reset_ms=60000)
 
     with (
         patch("app.core.rate_limit.settings") as mock_settings,
@@ -0,0 +1,215 @@
+"""Tests for device presence: coalesced last-seen writes and transitions (app.core.presence)."""
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app.core import presence
+from app.core.config import settings
+from app.core.presence import TimerWheel
+from app.db.models.device import Device
+from app.db.models.events import EventV1
+from tests.conftest import make_test_session
+
+
+def test_timer_wheel_expires_only_current_deadlines():
+    wheel = TimerWheel(now=1000.0)
+    wheel.schedule("a", 1005.0)
+    wheel.schedule("b", 1010.5)
+    wheel.schedule("b", 1020.0)  # re-scheduled: the 1010.5 entry is stale
+
+    assert wheel.advance(1004.9) == []
+    assert wheel.advance(1005.0) == ["a"]
+    assert wheel.advance(1015.0) == []
+    assert "b" in wheel
+    assert wheel.advance(1020.0) == ["b"]
+    assert len(wheel) == 0
+
+    # Deadlines already in the past fire on the next tick
+    wheel.schedule("c", 900.0)
+    assert wheel.advance(1021.0) == ["c"]
+
+
+def test_timer_wheel_long_gap_and_later_revolutions():
+    wheel = TimerWheel(now=0.0, slots=8)
+    wheel.schedule("near", 3.0)
+    wheel.schedule("far", 20.0)  # same slot as 4.0, two revolutions later
+    assert wheel.advance(5.0) == ["near"]
+    assert "far" in wheel
+    assert sorted(wheel.advance(100.0)) == ["far"]
+
+
+async def _setup(*last_seen: datetime | None):
+    engine, Session = await make_test_session(tables=[Device.__table__, EventV1.__table__])
+    async with Session() as db:
+        for i, at in enumerate(last_seen):
+            db.add(Device(device_uid=f"dev-{i}", last_seen_at=at))
+        await db.commit()
+    presence.reset()
+    return engine, Session
+
+
+async def _events(Session) -> list[tuple[str, str]]:
+    async with Session() as db:
+        res = await db.execute(select(EventV1.type, EventV1.payload).order_by(EventV1.id))
+        return [(t, p["device_uid"]) for t, p in res.all()]
+
+
+async def _cycle(Session, now: datetime | None = None) -> tuple[list[int], list[int]]:
+    async with Session() as db:
+        return await presence.run_tracker_cycle(db, now)
+
+
+@pytest.mark.asyncio
+async def test_transitions_are_emitted_once():
+    engine, Session = await _setup(None, None)
+    await _cycle(Session)  # the tracker starts
+    presence.touch(1)
+    presence.touch(2)
+    presence.touch(1)
+    assert presence.pending_count() == 2
+    assert await presence.flush(Session) == 2
+    assert await _events(Session) == []  # only the tracker emits transitions
+    came_online, _ = await _cycle(Session)
+    assert sorted(came_online) == [1, 2]
+    assert await _events(Session) == [("device.online", "dev-0"), ("device.online", "dev-1")]
+
+    # Further reports of online devices only move the deadline
+    presence.touch(1)
+    await presence.flush(Session)
+    await _cycle(Session)
+    assert len(await _events(Session)) == 2
+
+    later = datetime.now(timezone.utc) + timedelta(seconds=settings.presence_offline_seconds + 1)
+    async with Session() as db:
+        assert sorted(await presence.expire(db, later)) == [1, 2]
+        await db.commit()
+        assert await presence.expire(db, later) == []
+    assert await _events(Session) == [
+        ("device.online", "dev-0"), ("device.online", "dev-1"),
+        ("device.offline", "dev-0"), ("device.offline", "dev-1"),
+    ]
+    assert presence.is_online(1) is False
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_tracker_seeds_from_table_and_never_moves_last_seen_back():
+    now = datetime.now(timezone.utc)
+    engine, Session = await _setup(now - timedelta(seconds=10), now - timedelta(days=1))
+    await _cycle(Session, now)
+
+    # dev-0 was online before the tracker started: no new online event
+    presence.touch(1)
+    presence.touch(2)
+    await presence.flush(Session)
+    await _cycle(Session)
+    assert await _events(Session) == [("device.online", "dev-1")]
+
+    async with Session() as db:
+        fresh = (await db.execute(select(Device.last_seen_at).where(Device.id == 1))).scalar_one()
+        await presence.write_last_seen(db, {1: now - timedelta(hours=1), 99: now})
+        await db.commit()
+        assert (await db.execute(select(Device.last_seen_at).where(Device.id == 1))).scalar_one() == fresh
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_split_roles_without_redis_report_through_the_table():
+    engine, Session = await _setup(None)
+    start = datetime.now(timezone.utc)
+    offline_after = settings.presence_offline_seconds
+    assert await _cycle(Session, start) == ([], [])  # worker process: the tracker starts
+
+    # API process: touches are flushed to the table, no tracker runs here
+    presence.touch(1, start)
+    await presence.flush(Session)
+    assert presence.is_online(1) is False
+    async with Session() as db:
+        assert (await db.execute(select(Device.last_seen_at))).scalar_one() is not None
+
+    # Worker process: the tracker finds the report in the table
+    assert await _cycle(Session, start) == ([1], [])
+
+    # The device keeps reporting through the API process only: past the
+    # first deadline the tracker reads the newer time instead of expiring it
+    presence.touch(1, start + timedelta(seconds=offline_after - 1))
+    await presence.flush(Session)
+    assert await _cycle(Session, start + timedelta(seconds=offline_after - 1)) == ([], [])
+    assert await _cycle(Session, start + timedelta(seconds=offline_after + 1)) == ([], [])
+    assert presence.is_online(1) is True
+
+    # Silence: offline once, back online with the next report
+    silent = start + timedelta(seconds=2 * offline_after)
+    assert await _cycle(Session, silent) == ([], [1])
+    presence.touch(1, silent)
+    await presence.flush(Session)
+    assert await _cycle(Session, silent) == ([1], [])
+    assert await _events(Session) == [
+        ("device.online", "dev-0"), ("device.offline", "dev-0"), ("device.online", "dev-0"),
+    ]
+    await engine.dispose()
+
+
+class _LuaHashRedis:
+    """Just enough Redis for flush(): runs its script against a dict hash."""
+
+    def __init__(self):
+        lupa = pytest.importorskip("lupa")
+        self.hashes: dict[str, dict[str, str]] = {}
+        self._lua = lupa.LuaRuntime()
+
+    def _call(self, command, key, field, value=None):
+        fields = self.hashes.setdefault(key, {})
+        if command == "HGET":
+            return fields.get(field)
+        fields[field] = value
+        return 1
+
+    async def eval(self, script, numkeys, *args):
+        lua_globals = self._lua.globals()
+        lua_globals.KEYS = self._lua.table(*args[:numkeys])
+        lua_globals.ARGV = self._lua.table(*args[numkeys:])
+        lua_globals.redis = self._lua.table_from({"call": self._call})
+        return self._lua.execute(script)
+
+
+@pytest.mark.asyncio
+async def test_flush_keeps_the_newest_time_across_processes(monkeypatch):
+    redis = _LuaHashRedis()
+    monkeypatch.setattr("app.core.redis_client.get_redis", lambda: redis)
+    presence.reset()
+    now = datetime.now(timezone.utc)
+
+    presence.touch(1, now)
+    presence.touch(2, now - timedelta(seconds=5))
+    assert await presence.flush() == 2
+    # another process flushing older reports must not move the times back
+    presence.touch(1, now - timedelta(seconds=30))
+    presence.touch(2, now)
+    await presence.flush()
+
+    assert redis.hashes[presence.PENDING_KEY] == {
+        "1": f"{now.timestamp():.3f}", "2": f"{now.timestamp():.3f}",
+    }
+
+
+class _SetRedis:
+    def __init__(self, *members: str):
+        self.members = set(members)
+
+    async def smismember(self, key, values):
+        assert key == presence.ONLINE_KEY
+        return [int(value in self.members) for value in values]
+
+
+@pytest.mark.asyncio
+async def test_online_devices_reads_the_trackers_online_set(monkeypatch):
+    monkeypatch.setattr("app.core.redis_client.get_redis", lambda: None)
+    assert await presence.online_devices([1, 2]) is None
+
+    monkeypatch.setattr("app.core.redis_client.get_redis", lambda: _SetRedis("1", "3"))
+    assert await presence.online_devices([1, 2, 3]) == {1, 3}
+    assert await presence.online_devices([]) == set()
@@ -0,0 +1,96 @@
+"""Tests for opt-in wall-clock profiling (app.core.profiling)."""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI
+
+from app.api.v1.observability import router as observability_router
+from app.core import middleware, profiling
+from app.core.metrics import observe_cycle
+from app.db.models.user import User
+from tests.conftest import auth_header, make_client, make_test_app, make_test_session
+
+
+@pytest.fixture
+def profiling_on():
+    before = profiling.get_config()
+    profiling.configure(enabled=True, interval_ms=1, loop_threshold_ms=0, request_threshold_ms=30)
+    yield
+    profiling.configure(**vars(before))
+    profiling._buffer.clear()
+    profiling._unpublished.clear()
+
+
+def _busy(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def _slow_cycle() -> None:
+    _busy(0.03)
+    await asyncio.sleep(0.03)
+
+
+@pytest.mark.asyncio
+async def test_loop_cycle_profile_has_running_and_waiting_stacks(profiling_on):
+    with observe_cycle("profiled_loop"):
+        await _slow_cycle()
+
+    [record] = await profiling.list_profiles()
+    assert record["kind"] == "loop" and record["name"] == "profiled_loop"
+    stacks = record["stacks"]
+    assert any("_slow_cycle" in s and "_busy (tests/test_profiling.py:" in s for s in stacks)
+    assert any("_slow_cycle" in s and "sleep (asyncio/tasks.py:" in s and s.endswith("(waiting)") for s in stacks)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in profiling.to_collapsed(stacks).splitlines())
+
+
+@pytest.mark.asyncio
+async def test_disabled_profiling_records_nothing():
+    assert not profiling.get_config().enabled
+    with profiling.profile("loop", "idle") as unit:
+        await _slow_cycle()
+    assert unit is None
+    assert await profiling.list_profiles() == []
+
+
+@pytest.mark.asyncio
+async def test_slow_requests_are_kept_and_downloadable(profiling_on):
+    _, Session = await make_test_session(tables=[User.__table__])
+    async with Session() as db:
+        db.add(User(id=1, email="admin@example.com", password_hash="x"))
+        await db.commit()
+
+    service = FastAPI()
+
+    @service.get("/slow/{n}")
+    async def slow(n: int):
+        await _slow_cycle()
+        return {"n": n}
+
+    @service.get("/fast")
+    async def fast():
+        return {}
+
+    service.add_middleware(middleware.SecurityMiddleware)
+    async with make_client(service) as client:
+        assert (await client.get("/slow/1")).status_code == 200
+        assert (await client.get("/fast")).status_code == 200
+
+    admin_app = await make_test_app(Session, routers=[observability_router], with_cap_guard=False)
+    admin = auth_header(caps=["config.write"])
+    async with make_client(admin_app) as client:
+        listed = (await client.get("/api/v1/observability/profiles", headers=admin)).json()
+        assert [p["name"] for p in listed] == ["GET /slow/{n}"]
+
+        resp = await client.get(f"/api/v1/observability/profiles/{listed[0]['id']}", headers=admin)
+        assert resp.status_code == 200
+        assert "attachment" in resp.headers["content-disposition"]
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in resp.text.splitlines())
+
+        resp = await client.put("/api/v1/observability/profiling", json={"enabled": False}, headers=admin)
+        assert resp.json()["enabled"] is False and resp.json()["stored"] == 1
+        assert not profiling.get_config().enabled
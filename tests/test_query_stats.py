@@ -0,0 +1,73 @@
+"""Tests for per-request SQL accounting and N+1 detection (app.db.query_stats)."""
+from __future__ import annotations
+
+import logging
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import select
+
+from app.core import metrics, middleware
+from app.core.metrics import observe_cycle
+from app.db.models.events import EventV1
+from app.db.query_stats import statement_shape, track_queries
+from tests.conftest import make_test_session
+
+
+def test_shape_collapses_in_lists_and_whitespace():
+    a = statement_shape("SELECT id FROM t\n  WHERE id IN (?, ?, ?)")
+    b = statement_shape("SELECT id FROM t WHERE id IN ($1, $2)")
+    assert a == "SELECT id FROM t WHERE id IN (?…)"
+    assert b == a
+
+
+@pytest.mark.asyncio
+async def test_repeated_statement_is_flagged_as_n_plus_one(caplog):
+    _, Session = await make_test_session(tables=[EventV1.__table__])
+
+    with track_queries("test") as stats:
+        async with Session() as db:
+            for i in range(12):
+                await db.execute(select(EventV1).where(EventV1.id == i))
+            await db.execute(select(EventV1.id).where(EventV1.id.in_([1, 2, 3])))
+
+    assert stats.count == 13
+    [(shape, count, _)] = stats.repeated(threshold=10)
+    assert count == 12
+    assert "WHERE events_v1.id = ?" in shape
+
+    with caplog.at_level(logging.WARNING, logger="uvicorn.error"):
+        with observe_cycle("n_plus_one_test"):
+            async with Session() as db:
+                for i in range(10):
+                    await db.execute(select(EventV1).where(EventV1.id == i))
+
+    assert metrics.DB_N_PLUS_ONE.labels("loop:n_plus_one_test").value == 1
+    assert any("likely N+1 in loop:n_plus_one_test" in r.getMessage() for r in caplog.records)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("enabled", [True, False])
+async def test_query_headers_report_handler_statements(monkeypatch, enabled):
+    _, Session = await make_test_session(tables=[EventV1.__table__])
+    monkeypatch.setattr(middleware, "_QUERY_HEADERS", enabled)
+    app = FastAPI()
+
+    @app.get("/events/count")
+    async def count_events():
+        async with Session() as db:
+            for _ in range(3):
+                await db.execute(select(EventV1.id))
+        return {"ok": True}
+
+    app.add_middleware(middleware.SecurityMiddleware)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        resp = await client.get("/events/count")
+
+    if not enabled:
+        assert "X-DB-Queries" not in resp.headers and "X-DB-Time-ms" not in resp.headers
+        return
+    assert resp.headers["X-DB-Queries"] == "3"
+    assert float(resp.headers["X-DB-Time-ms"]) >= 0
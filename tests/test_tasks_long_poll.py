@@ -0,0 +1,165 @@
+"""Tests for long-polling and batch claims on POST /tasks/poll (app.core.task_queue)."""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from app.api.v1.tasks import router as tasks_router
+from app.core import fleet_jobs, task_queue
+from app.core.security import hash_device_token
+from app.db.models.device import Device
+from app.db.models.entities import Entity, EntityDeviceBinding
+from app.db.models.events import EventV1
+from app.db.models.fleet_jobs import FleetJob
+from app.db.models.pairing import DeviceToken
+from app.db.models.tasks import Task
+from tests.conftest import make_client, make_test_app, make_test_session
+
+# sqlite cannot render the JSONB columns of tasks / execution_contexts
+_TASK_DDL = [
+    """
+    CREATE TABLE execution_contexts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        client_id INTEGER NOT NULL,
+        context_key TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        client_id INTEGER NOT NULL,
+        execution_context_id INTEGER,
+        type TEXT NOT NULL,
+        payload TEXT NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        idempotency_key TEXT,
+        claimed_at DATETIME,
+        lease_expires_at DATETIME,
+        lease_token TEXT,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        completed_at DATETIME,
+        result TEXT,
+        error TEXT,
+        fleet_job_id INTEGER
+    )
+    """,
+]
+
+_DEVICE = {"X-Device-Token": "raw-1"}
+
+
+async def _setup():
+    engine, Session = await make_test_session(
+        tables=[
+            Device.__table__, DeviceToken.__table__, Entity.__table__, EntityDeviceBinding.__table__,
+            FleetJob.__table__, EventV1.__table__,
+        ],
+        extra_ddl=_TASK_DDL,
+    )
+    async with Session() as db:
+        db.add(Device(id=1, device_uid="dev-1", is_claimed=True, owner_user_id=1))
+        db.add(DeviceToken(device_id=1, token_hash=hash_device_token("raw-1"), is_active=True))
+        await db.commit()
+    app = await make_test_app(Session, [tasks_router], with_cap_guard=False)
+    return engine, Session, app
+
+
+async def _queue(Session, *priorities: int, device_id: int = 1) -> None:
+    async with Session() as db:
+        db.add_all([
+            Task(client_id=device_id, type=f"t{p}", payload={}, status="queued", priority=p) for p in priorities
+        ])
+        await db.commit()
+
+
+async def _parked() -> None:
+    while task_queue.waiter_count() == 0:
+        await asyncio.sleep(0.01)
+    # The subscription precedes the first claim, and the in-memory engine
+    # shares one connection between sessions: let that claim finish first.
+    await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def test_max_tasks_claims_a_batch_in_priority_order():
+    engine, Session, app = await _setup()
+    await _queue(Session, 0, 5, 1, 9)
+    async with make_client(app) as client:
+        resp = await client.post("/api/v1/tasks/poll", params={"max_tasks": 3}, headers=_DEVICE)
+        tasks = resp.json()
+        assert [t["type"] for t in tasks] == ["t9", "t5", "t1"]
+        assert len({t["lease_token"] for t in tasks}) == 3
+
+        resp = await client.post("/api/v1/tasks/poll", params={"max_tasks": 3}, headers=_DEVICE)
+        assert [t["type"] for t in resp.json()] == ["t0"]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_long_poll_returns_when_a_task_is_queued():
+    engine, Session, app = await _setup()
+    async with make_client(app) as client:
+        poll = asyncio.create_task(client.post("/api/v1/tasks/poll", params={"wait_s": 10}, headers=_DEVICE))
+        await _parked()
+        started = time.monotonic()
+        await _queue(Session, 0, device_id=2)  # another device: stays parked
+        await asyncio.sleep(0.05)
+        assert not poll.done()
+        await _queue(Session, 3)
+        resp = await asyncio.wait_for(poll, 2.0)
+        assert [t["type"] for t in resp.json()] == ["t3"]
+        assert time.monotonic() - started < 1.0
+    assert task_queue.waiter_count() == 0
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_long_poll_times_out_empty_and_fleet_dispatch_wakes():
+    engine, Session, app = await _setup()
+    async with make_client(app) as client:
+        started = time.monotonic()
+        resp = await client.post("/api/v1/tasks/poll", params={"wait_s": 0.2}, headers=_DEVICE)
+        assert resp.json() == [] and time.monotonic() - started >= 0.2
+
+        async with Session() as db:
+            db.add_all([Entity(entity_id="g1", type="group"), EntityDeviceBinding(entity_id="g1", device_id=1)])
+            await db.commit()
+        poll = asyncio.create_task(client.post("/api/v1/tasks/poll", params={"wait_s": 10}, headers=_DEVICE))
+        await _parked()
+        async with Session() as db:
+            await fleet_jobs.create_job(db, name="j", task_type="reboot", target={"group": "g1"}, entity_ids=["g1"])
+            await db.commit()
+        async with Session() as db:
+            assert await fleet_jobs.run_fleet_cycle(db) == 1
+        resp = await asyncio.wait_for(poll, 2.0)
+        assert [t["type"] for t in resp.json()] == ["reboot"]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_task_queued_right_after_an_empty_claim_wakes_the_poll(monkeypatch):
+    import app.api.v1.tasks as tasks_api
+
+    engine, Session, app = await _setup()
+    claim = tasks_api._claim
+    calls = 0
+
+    async def claim_then_queue(*args):
+        nonlocal calls
+        calls += 1
+        tasks = await claim(*args)
+        if calls == 1:
+            await _queue(Session, 4)  # lands before the poll parks
+        return tasks
+
+    monkeypatch.setattr(tasks_api, "_claim", claim_then_queue)
+    monkeypatch.setattr(task_queue, "recheck_interval", lambda: 30.0)
+    async with make_client(app) as client:
+        started = time.monotonic()
+        resp = await client.post("/api/v1/tasks/poll", params={"wait_s": 10}, headers=_DEVICE)
+        assert [t["type"] for t in resp.json()] == ["t4"]
+        assert time.monotonic() - started < 1.0
+    await engine.dispose()
@@ -0,0 +1,160 @@
+"""Tests for the concurrent variable effects runner (app.core.variable_effects)."""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+from app.core import variable_effects
+from app.core.config import settings
+from app.core.metrics import VARIABLE_EFFECT_ATTEMPTS, VARIABLE_EFFECT_BACKLOG_AGE
+from app.db.models.device import Device
+from app.db.models.events import EventV1
+from app.db.models.variables import VariableEffect
+from tests.conftest import make_test_session
+
+_T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+# sqlite cannot render the JSONB columns of variable_effects
+_EFFECTS_DDL = [
+    """
+    CREATE TABLE variable_effects (
+        id TEXT PRIMARY KEY,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        status TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        device_id INTEGER,
+        device_uid TEXT,
+        trigger_audit_id INTEGER,
+        payload TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at DATETIME,
+        locked_until DATETIME,
+        locked_by TEXT,
+        correlation_id TEXT
+    )
+    """,
+]
+
+
+async def _setup(*effects: tuple[str, int | None]):
+    """Effects (id, device_id) in creation order, all due."""
+    engine, Session = await make_test_session(
+        tables=[Device.__table__, EventV1.__table__],
+        extra_ddl=_EFFECTS_DDL,
+    )
+    async with Session() as db:
+        db.add_all([Device(id=1, device_uid="dev-1"), Device(id=2, device_uid="dev-2")])
+        for index, (effect_id, device_id) in enumerate(effects):
+            db.add(VariableEffect(
+                id=effect_id, status="pending", kind="test", scope="device", device_id=device_id,
+                attempts=0, created_at=_T0 + timedelta(seconds=index), next_attempt_at=_T0,
+            ))
+        await db.commit()
+    return engine, Session
+
+
+@pytest.fixture
+def applied(monkeypatch):
+    """Replace the effect handlers: records order, sleeps / fails per effect id."""
+    log: list[str] = []
+    delays: dict[str, float] = {}
+    failing: set[str] = set()
+
+    async def fake_apply(db, effect):
+        await asyncio.sleep(delays.get(effect.id, 0))
+        if effect.id in failing:
+            raise RuntimeError(f"{effect.id} broke")
+        log.append(effect.id)
+
+    monkeypatch.setattr(variable_effects, "_apply_effect", fake_apply)
+    monkeypatch.setattr(settings, "effects_max_attempts", 2)
+    return log, delays, failing
+
+
+async def _run(Session, concurrency: int = 4) -> dict[str, int]:
+    return await variable_effects.run_effects_concurrently(
+        Session, limit=100, locked_by="test", concurrency=concurrency
+    )
+
+
+async def _statuses(Session) -> dict[str, str]:
+    async with Session() as db:
+        return dict((await db.execute(select(VariableEffect.id, VariableEffect.status))).all())
+
+
+@pytest.mark.asyncio
+async def test_devices_run_in_parallel_and_each_device_in_order(applied):
+    log, delays, _ = applied
+    engine, Session = await _setup(("a1", 1), ("b1", 2), ("a2", 1), ("b2", 2), ("x", None))
+    delays["a1"] = 0.3
+    result = await asyncio.wait_for(_run(Session), 0.6)
+    assert result == {"processed": 5, "done": 5, "failed": 0}
+    # the slow effect held up only its own device
+    assert log.index("b2") < log.index("a1")
+    assert log.index("x") < log.index("a1")
+    assert log.index("a1") < log.index("a2")
+    assert set((await _statuses(Session)).values()) == {"done"}
+    assert VARIABLE_EFFECT_BACKLOG_AGE.samples()[()] > 0
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_failure_blocks_device_then_dead_letters(applied):
+    log, _, failing = applied
+    engine, Session = await _setup(("a1", 1), ("a2", 1), ("b1", 2))
+    failing.add("a1")
+    dead_before = VARIABLE_EFFECT_ATTEMPTS.labels("test", "dead").value
+
+    assert await _run(Session) == {"processed": 2, "done": 1, "failed": 1}
+    assert log == ["b1"]
+    statuses = await _statuses(Session)
+    assert statuses == {"a1": "failed", "a2": "pending", "b1": "done"}
+
+    # a1 backs off; a2 must not overtake it
+    assert await _run(Session) == {"processed": 0, "done": 0, "failed": 0}
+
+    async with Session() as db:
+        await db.execute(update(VariableEffect).where(VariableEffect.id == "a1").values(next_attempt_at=_T0))
+        await db.commit()
+    # a1 is dead-lettered and the device moves on in the same cycle
+    assert await _run(Session) == {"processed": 2, "done": 1, "failed": 1}
+    assert log == ["b1", "a2"]
+    async with Session() as db:
+        a1 = await db.get(VariableEffect, "a1")
+        assert (a1.status, a1.attempts, a1.error) == ("dead", 2, {"message": "a1 broke"})
+        event = await db.scalar(select(EventV1).where(EventV1.type == "variable_effect.dead"))
+        assert event.payload["effect_id"] == "a1"
+    assert VARIABLE_EFFECT_ATTEMPTS.labels("test", "dead").value == dead_before + 1
+
+    failing.clear()
+    async with Session() as db:
+        variable_effects.requeue_dead_effect(await db.get(VariableEffect, "a1"))
+        await db.commit()
+    await _run(Session)
+    assert log == ["b1", "a2", "a1"]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_crashed_in_flight_effects_are_reclaimed_after_their_lock(applied):
+    log, _, _ = applied
+    engine, Session = await _setup(("a1", 1), ("a2", 1))
+    async with Session() as db:
+        await variable_effects.claim_effects(db, limit=1, locked_by="crashed")
+        await db.commit()
+    # a1 is in flight elsewhere: a2 waits behind it
+    assert await _run(Session) == {"processed": 0, "done": 0, "failed": 0}
+
+    async with Session() as db:
+        past = datetime.now(timezone.utc) - timedelta(seconds=1)
+        await db.execute(update(VariableEffect).where(VariableEffect.id == "a1").values(locked_until=past))
+        await db.commit()
+    assert await _run(Session) == {"processed": 2, "done": 2, "failed": 0}
+    assert log == ["a1", "a2"]
+    await engine.dispose()
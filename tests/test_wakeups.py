@@ -0,0 +1,40 @@
+"""Tests for keyed long-poll wake-ups (app.core.wakeups)."""
+from __future__ import annotations
+
+import pytest
+
+from app.core import wakeups
+from app.db.models.events import EventV1
+from tests.conftest import make_test_session
+
+
+@pytest.mark.asyncio
+async def test_staged_keys_wake_on_commit_only():
+    engine, Session = await make_test_session(tables=[EventV1.__table__])
+    with wakeups.subscribe("test_channel", (1, 2)) as sub, wakeups.subscribe("test_channel", (3,)) as other:
+        assert wakeups.waiter_count("test_channel") == 2
+
+        async with Session() as db:
+            wakeups.stage(db, "test_channel", [2])
+            await db.rollback()
+        assert await sub.wait(0.05) is False
+
+        async with Session() as db:
+            wakeups.stage(db, "test_channel", [2])
+            wakeups.stage(db, "other_channel", [3])
+            await db.commit()
+        assert await sub.wait(0.05) is True
+        assert await other.wait(0.05) is False
+    assert wakeups.waiter_count("test_channel") == 0
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_wake_before_wait_is_not_lost_and_notify_payloads_are_parsed(monkeypatch):
+    monkeypatch.setitem(wakeups._channels, "test_numbers", int)
+    with wakeups.subscribe("test_numbers", (7,)) as sub:
+        wakeups._on_notify(None, 0, "test_numbers", "not a number")
+        wakeups._on_notify(None, 0, "test_numbers", "7")
+        # woken before anyone waited: the next wait returns at once
+        assert await sub.wait(0.05) is True
+        assert await sub.wait(0.05) is False
@@ -212,7 +212,7 @@ def test_signature_verification_tampered_body():
 # ---------------------------------------------------------------------------
 
 def _make_fake_db(deliveries: list):
-    """Return a callable (like AsyncSessionLocal) that yields a fake async db session."""
+    """Return a callable (like WorkerSessionLocal) that yields a fake async db session."""
     db = AsyncMock()
     db.add = lambda obj: deliveries.append(obj)
     db.commit = AsyncMock()
@@ -245,7 +245,7 @@ async def test_dispatcher_succeeds_on_first_attempt():
     mock_client = AsyncMock()
     mock_client.post = AsyncMock(return_value=mock_response)
 
-    with patch("app.core.webhook_dispatcher.AsyncSessionLocal", _make_fake_db(deliveries)):
+    with patch("app.core.webhook_dispatcher.WorkerSessionLocal", _make_fake_db(deliveries)):
         await _dispatch_with_retry(webhook, event, mock_client)
 
     assert mock_client.post.call_count == 1
@@ -254,6 +254,44 @@ async def test_dispatcher_succeeds_on_first_attempt():
     assert deliveries[0].attempt == 1
 
 
+@pytest.mark.asyncio
+async def test_dispatcher_signature_keeps_canonical_form():
+    """Receivers rebuild json.dumps(payload, sort_keys=True) or strip the trailing member."""
+    import json
+
+    from app.core.webhook_dispatcher import _dispatch_with_retry
+
+    webhook = MagicMock()
+    webhook.id = 1
+    webhook.secret = "secret"
+    webhook.url = "http://example.com/hook"
+
+    event = MagicMock()
+    event.id = 7
+    event.type = "variable.changed"
+    event.stream = "system"
+    event.ts = None
+    event.payload = {"key": "temp", "value": 21.5, "label": "Küche \"north\""}
+
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_client = AsyncMock()
+    mock_client.post = AsyncMock(return_value=mock_response)
+
+    with patch("app.core.webhook_dispatcher.WorkerSessionLocal", _make_fake_db([])):
+        await _dispatch_with_retry(webhook, event, mock_client)
+
+    kwargs = mock_client.post.call_args.kwargs
+    body, signature = kwargs["content"], kwargs["headers"]["X-Hubex-Signature"]
+
+    delivered = json.loads(body)
+    assert delivered.pop("hubex_signature") == signature
+    assert delivered["data"] == event.payload
+    rebuilt = json.dumps(delivered, sort_keys=True).encode()
+    assert _verify_signature("secret", rebuilt, signature)
+    assert body.startswith(rebuilt[:-1])
+
+
 @pytest.mark.asyncio
 async def test_dispatcher_retries_on_failure():
     """Dispatcher tries 4 times total (initial + 3 retries) on persistent failure."""
@@ -277,7 +315,7 @@ async def test_dispatcher_retries_on_failure():
     mock_client = AsyncMock()
     mock_client.post = AsyncMock(return_value=mock_response)
 
-    with patch("app.core.webhook_dispatcher.AsyncSessionLocal", _make_fake_db(deliveries)):
+    with patch("app.core.webhook_dispatcher.WorkerSessionLocal", _make_fake_db(deliveries)):
         with patch("asyncio.sleep", new_callable=AsyncMock):
             await _dispatch_with_retry(webhook, event, mock_client)
 
@@ -318,7 +356,7 @@ async def test_dispatcher_succeeds_on_second_attempt():
     mock_client = AsyncMock()
     mock_client.post = mock_post
 
-    with patch("app.core.webhook_dispatcher.AsyncSessionLocal", _make_fake_db(deliveries)):
+    with patch("app.core.webhook_dispatcher.WorkerSessionLocal", _make_fake_db(deliveries)):
         with patch("asyncio.sleep", new_callable=AsyncMock):
             await _dispatch_with_retry(webhook, event, mock_client)
 
@@ -367,7 +405,7 @@ async def test_dispatcher_skips_non_matching_filter():
     db.__aexit__ = AsyncMock(return_value=False)
     db.execute = fake_execute
 
-    with patch("app.core.webhook_dispatcher.AsyncSessionLocal", return_value=db):
+    with patch("app.core.webhook_dispatcher.WorkerSessionLocal", return_value=db):
         with patch("app.core.webhook_dispatcher._dispatch_with_retry", new_callable=AsyncMock) as mock_dispatch:
             with patch("httpx.AsyncClient") as mock_hx:
                 hx_instance = AsyncMock()
@@ -412,7 +450,7 @@ async def test_dispatcher_matches_empty_filter():
     db.__aexit__ = AsyncMock(return_value=False)
     db.execute = fake_execute
 
-    with patch("app.core.webhook_dispatcher.AsyncSessionLocal", return_value=db):
+    with patch("app.core.webhook_dispatcher.WorkerSessionLocal", return_value=db):
         with patch("app.core.webhook_dispatcher._dispatch_with_retry", new_callable=AsyncMock) as mock_dispatch:
             with patch("httpx.AsyncClient") as mock_hx:
                 hx_instance = AsyncMock()
@@ -0,0 +1,112 @@
+"""Tests for the background loop supervisor (app.workers)."""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from app import workers
+from app.core.coordination import LocalCoordinator, lock_key
+from app.workers import LoopSpec, LoopSupervisor, enabled_loops
+
+
+class _ToggleCoordinator(LocalCoordinator):
+    """Coordinator whose leases the test can revoke."""
+
+    def __init__(self) -> None:
+        super().__init__("test-node")
+        self.acquired: list[str] = []
+        self.released: list[str] = []
+        self._lost: dict[str, asyncio.Event] = {}
+
+    async def acquire(self, name: str) -> None:
+        self._lost[name] = asyncio.Event()
+        self.acquired.append(name)
+
+    async def wait_lost(self, name: str) -> None:
+        await self._lost[name].wait()
+
+    async def release(self, name: str) -> None:
+        self.released.append(name)
+
+    def revoke(self, name: str) -> None:
+        self._lost[name].set()
+
+
+@pytest.mark.asyncio
+async def test_crashed_loop_is_restarted():
+    runs: list[int] = []
+
+    async def _flaky():
+        runs.append(1)
+        if len(runs) < 3:
+            raise RuntimeError("boom")
+        await asyncio.sleep(9999)
+
+    supervisor = LoopSupervisor([LoopSpec("flaky", _flaky)], restart_backoff=0.001)
+    supervisor.start()
+    for _ in range(100):
+        if len(runs) >= 3:
+            break
+        await asyncio.sleep(0.01)
+    await supervisor.drain(timeout=1)
+
+    assert len(runs) == 3
+
+
+@pytest.mark.asyncio
+async def test_singleton_stops_when_lease_is_lost_and_reacquires():
+    coordinator = _ToggleCoordinator()
+    runs: list[int] = []
+    cancelled: list[int] = []
+
+    async def _loop():
+        runs.append(1)
+        try:
+            await asyncio.sleep(9999)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    supervisor = LoopSupervisor([LoopSpec("ota_worker", _loop)], coordinator=coordinator)
+    supervisor.start()
+    await asyncio.sleep(0.01)
+    coordinator.revoke("ota_worker")
+    await asyncio.sleep(0.01)
+    await supervisor.drain(timeout=1)
+
+    assert runs == [1, 1]
+    assert cancelled == [1, 1]
+    assert coordinator.acquired == ["ota_worker", "ota_worker"]
+    assert coordinator.released == ["ota_worker", "ota_worker"]
+
+
+@pytest.mark.asyncio
+async def test_non_singleton_loops_skip_leases():
+    coordinator = _ToggleCoordinator()
+
+    async def _loop():
+        await asyncio.sleep(9999)
+
+    supervisor = LoopSupervisor([LoopSpec("email_outbox", _loop, singleton=False)], coordinator=coordinator)
+    supervisor.start()
+    await asyncio.sleep(0.01)
+    await supervisor.drain(timeout=1)
+
+    assert coordinator.acquired == []
+
+
+def test_disabled_loops_are_filtered(monkeypatch):
+    monkeypatch.setattr(workers.settings, "worker_disabled_loops", "ota_worker, demo_heartbeat")
+
+    names = {spec.name for spec in enabled_loops()}
+
+    assert "ota_worker" not in names
+    assert "demo_heartbeat" not in names
+    assert "alert_worker" in names
+
+
+def test_lock_keys_are_stable_and_distinct():
+    assert lock_key("ota_worker") == lock_key("ota_worker")
+    assert lock_key("ota_worker") != lock_key("alert_worker")
+    assert -(2 ** 63) <= lock_key("ota_worker") < 2 ** 63
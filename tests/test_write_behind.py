@@ -0,0 +1,204 @@
+"""Tests for the write-behind buffer (app.core.write_behind)."""
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import func, select
+
+from app.core import write_behind
+from app.core.config import settings
+from app.core.system_events import emit_system_event
+from app.db.models.events import EventV1
+from app.db.models.variables import VariableAudit
+from tests.conftest import make_test_session
+
+
+async def _setup():
+    # variable_audits has JSONB columns, which SQLite cannot create
+    return await make_test_session(
+        tables=[EventV1.__table__],
+        extra_ddl=[
+            "CREATE TABLE variable_audits (id INTEGER PRIMARY KEY, created_at DATETIME NOT NULL, "
+            "variable_key VARCHAR(128) NOT NULL, scope VARCHAR(16) NOT NULL, device_id INTEGER, "
+            "old_value_json JSON, new_value_json JSON, old_version INTEGER, new_version INTEGER, "
+            "actor_type VARCHAR(16) NOT NULL, actor_user_id INTEGER, actor_device_id INTEGER, "
+            "request_id VARCHAR(64), note TEXT)",
+        ],
+    )
+
+
+def _stage(db, key: str, n: int, actor_type: str | None = "device") -> None:
+    write_behind.stage(db, VariableAudit, {
+        "variable_key": key,
+        "scope": "device",
+        "new_value_json": n,
+        "actor_type": actor_type,
+        "created_at": datetime.now(timezone.utc),
+    })
+
+
+async def _audits(Session) -> list[tuple[str, int]]:
+    async with Session() as db:
+        rows = await db.execute(
+            select(VariableAudit.variable_key, VariableAudit.new_value_json).order_by(VariableAudit.id)
+        )
+        return [tuple(row) for row in rows]
+
+
+async def _events(Session) -> list[tuple[str, int]]:
+    async with Session() as db:
+        rows = (await db.execute(select(EventV1).order_by(EventV1.id))).scalars().all()
+        return [(r.type, r.payload.get("n")) for r in rows]
+
+
+@pytest.fixture
+def settings_patch(monkeypatch):
+    # Flushes are driven by the tests unless a full batch wakes the flusher
+    monkeypatch.setattr(settings, "write_behind_flush_ms", 60_000)
+    monkeypatch.setattr(settings, "write_behind_batch", 1000)
+    return monkeypatch
+
+
+@asynccontextmanager
+async def _flusher(Session):
+    write_behind.start_flusher(Session)
+    try:
+        yield write_behind
+    finally:
+        await write_behind.stop_flusher()
+        write_behind._buffer.clear()
+
+
+@pytest.mark.asyncio
+async def test_stage_writes_inline_without_flusher():
+    engine, Session = await _setup()
+    assert not write_behind.running()
+    async with Session() as db:
+        _stage(db, "a", 1)
+        await db.commit()
+    assert write_behind.pending_count() == 0
+    assert await _audits(Session) == [("a", 1)]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_committed_rows_are_flushed_in_commit_order_rolled_back_dropped(settings_patch):
+    engine, Session = await _setup()
+    async with _flusher(Session) as flusher:
+        async with Session() as db:
+            _stage(db, "a", 1)
+            _stage(db, "a", 2)
+            await db.commit()
+        async with Session() as db:
+            _stage(db, "lost", 0)
+            await db.rollback()
+        async with Session() as db:
+            _stage(db, "b", 3)
+            await db.commit()
+
+        assert flusher.pending_count() == 3
+        assert await _audits(Session) == []
+
+        assert await flusher.flush(Session) == 3
+        assert flusher.pending_count() == 0
+        assert await _audits(Session) == [("a", 1), ("a", 2), ("b", 3)]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_flusher_writes_full_batch_without_waiting_for_interval(settings_patch):
+    settings_patch.setattr(settings, "write_behind_batch", 2)
+    engine, Session = await _setup()
+    async with _flusher(Session) as flusher:
+        async with Session() as db:
+            for n in range(4):
+                _stage(db, "x", n)
+            await db.commit()
+        for _ in range(50):
+            if flusher.pending_count() == 0:
+                break
+            await asyncio.sleep(0.02)
+        assert await _audits(Session) == [("x", n) for n in range(4)]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_falls_back_to_inline_writes(settings_patch):
+    settings_patch.setattr(settings, "write_behind_max_pending", 1)
+    engine, Session = await _setup()
+    async with _flusher(Session) as flusher:
+        async with Session() as db:
+            _stage(db, "buffered", 1)
+            await db.commit()
+        async with Session() as db:
+            _stage(db, "inline", 2)
+            await db.commit()
+
+        assert flusher.pending_count() == 1
+        assert await _audits(Session) == [("inline", 2)]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_failing_batch_is_retried_then_bad_rows_dropped(settings_patch):
+    engine, Session = await _setup()
+    async with _flusher(Session) as flusher:
+        async with Session() as db:
+            _stage(db, "ok", 1)
+            _stage(db, "bad", 2, actor_type=None)
+            await db.commit()
+
+        for _ in range(write_behind.POISON_ATTEMPTS):
+            with pytest.raises(Exception):
+                await flusher.flush(Session)
+            assert flusher.pending_count() == 2
+
+        assert await flusher.flush(Session) == 2
+        assert flusher.pending_count() == 0
+        assert await _audits(Session) == [("ok", 1)]
+        async with Session() as db:
+            assert await db.scalar(select(func.count()).select_from(VariableAudit)) == 1
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_events_keep_emit_order_when_interleaved_with_staged_rows(settings_patch, monkeypatch):
+    from app.core import automation_engine
+
+    engine, Session = await _setup()
+    async with _flusher(Session) as flusher:
+        # a hot-path request: staged audit row plus its event
+        async with Session() as db:
+            _stage(db, "temp", 1)
+            await emit_system_event(db, "variable.changed", {"n": 1})
+            await db.commit()
+        async with Session() as db:
+            await emit_system_event(db, "device.offline", {"n": 2})
+            await db.commit()
+        async with Session() as db:
+            _stage(db, "temp", 3)
+            await emit_system_event(db, "variable.changed", {"n": 3})
+            await db.commit()
+
+        # events are readable by cursor at commit, before any flush
+        assert flusher.pending_count() == 2
+        assert await _events(Session) == [("variable.changed", 1), ("device.offline", 2), ("variable.changed", 3)]
+        assert await flusher.flush(Session) == 2
+    assert await _audits(Session) == [("temp", 1), ("temp", 3)]
+    assert await _events(Session) == [("variable.changed", 1), ("device.offline", 2), ("variable.changed", 3)]
+
+    evaluated = []
+
+    async def record(db, event):
+        evaluated.append(event.payload["n"])
+
+    monkeypatch.setattr(automation_engine, "_evaluate_event", record)
+    async with Session() as db:
+        last_id = await automation_engine._process_new_events(db, 0)
+        assert evaluated == [1, 2, 3]
+        assert await automation_engine._process_new_events(db, last_id) == last_id
+    assert evaluated == [1, 2, 3]
+    await engine.dispose()